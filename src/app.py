@@ -1,27 +1,326 @@
 """SmartQ FastAPIアプリケーション"""
 
-from fastapi import FastAPI, HTTPException, Depends
-from fastapi.staticfiles import StaticFiles
-from fastapi.templating import Jinja2Templates
-from fastapi.responses import HTMLResponse
+from fastapi import FastAPI, HTTPException, Depends, WebSocket
+from fastapi.responses import HTMLResponse, ORJSONResponse, PlainTextResponse, Response, StreamingResponse
 from fastapi.requests import Request
-from typing import List, Optional, Union, Annotated
-from pydantic import BaseModel, Field, field_validator, model_validator
+from typing import Any, AsyncIterator, List, Literal, Optional, Sequence, Type, TypeVar, Union, Annotated
+from pydantic import BaseModel, Field, TypeAdapter, ValidationError, field_validator, model_validator
+from contextlib import AsyncExitStack, asynccontextmanager
 from enum import Enum
+import functools
+import itertools
 import json
+import logging
 import os
+import random
+import time
 import uuid
 import asyncio
+import httpx
+import orjson
 
 # OllamaClientとJSONスキーマをインポート
-from ollama.ollama_client import OllamaClient
-from ollama.json_schemas import QUIZ_SCHEMA, EVALUATION_SCHEMA
+from ollama.ollama_client import DeadlineExceededError, create_http_client, parse_keep_alive
+from ollama.backend_pool import OllamaBackendPool, OllamaUnavailableError
+from ollama.scheduler import ConcurrencyLimit, OllamaOverloadedError, OllamaScheduler, Priority
+from ollama.model_router import ModelRouter
+from ollama.json_repair import close_truncated_json
+from ollama.json_schemas import build_list_schema, ollama_schema
+from ollama.json_stream import IncrementalJSONParser
+from smartq.question_bank import QuestionBank
+from smartq.dedup import NearDuplicateIndex
+from smartq.session_history import SessionHistory
+from smartq.quiz_session import QuizSession, QuizSessionStats
+from smartq.shared_state import WorkerSync, open_shared_state
+from smartq.static_assets import StaticAssets
+from smartq.question_pool import QuestionPool
+from smartq.question_store import QuestionStore
+from smartq.evaluation_cache import EvaluationCache, EvaluationKey, evaluation_key
+from smartq.knowledge_base import KnowledgeBaseCache
+from smartq.cancellation import CancelOnDisconnectMiddleware
+from smartq.logging_config import configure_logging, shutdown_logging
+from smartq.metrics import CONTENT_TYPE as METRICS_CONTENT_TYPE, MetricsMiddleware, SmartQMetrics
+
+# static/ と templates/ を置くディレクトリ（実行時のカレントディレクトリによらない）
+PROJECT_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
 
 # 環境変数から設定を読み込み
 OLLAMA_HOST = os.getenv("OLLAMA_HOST", "http://localhost:11434")
+# 複数のOllamaサーバーに振り分ける場合はカンマ区切りで指定（未指定の場合は OLLAMA_HOST のみ）
+OLLAMA_HOSTS = [host.strip() for host in os.getenv("OLLAMA_HOSTS", OLLAMA_HOST).split(",") if host.strip()]
 OLLAMA_MODEL = os.getenv("OLLAMA_MODEL", "gemma3:27b")
 API_TIMEOUT = float(os.getenv("API_TIMEOUT", "60"))
 
+# ワーカープロセス数（2以上の場合は SHARED_STATE_DB を介して問題・評価結果・セッションの記録・メトリクスを共有する）
+APP_WORKERS = max(1, int(os.getenv("APP_WORKERS", "1")))
+SHARED_STATE_DB = os.getenv("SHARED_STATE_DB") or ("data/smartq-shared.db" if APP_WORKERS > 1 else None)
+SHARED_STATE_SYNC_INTERVAL = float(os.getenv("SHARED_STATE_SYNC_INTERVAL", "5"))  # メトリクスと統計情報を共有する間隔（秒）
+WORKER_ID = str(os.getpid())
+
+# 用途ごとのモデル（例: 回答評価は小さく速いモデル、問題生成は大きなモデル）
+OLLAMA_GENERATE_MODEL = os.getenv("OLLAMA_GENERATE_MODEL") or OLLAMA_MODEL
+OLLAMA_EVALUATE_MODEL = os.getenv("OLLAMA_EVALUATE_MODEL") or OLLAMA_MODEL
+# 混雑時に切り替えるモデル（未指定の場合は切り替えない）と切り替えのしきい値（0 で判断に使用しない）
+OLLAMA_FALLBACK_MODEL = os.getenv("OLLAMA_FALLBACK_MODEL") or None
+OLLAMA_FALLBACK_QUEUE_DEPTH = int(os.getenv("OLLAMA_FALLBACK_QUEUE_DEPTH", "4"))
+OLLAMA_FALLBACK_LATENCY = float(os.getenv("OLLAMA_FALLBACK_LATENCY", "0"))
+
+# 知識ベースの検索設定（長い知識ベースは関連する部分だけをプロンプトに含める）
+KB_CHUNK_CHARS = int(os.getenv("KB_CHUNK_CHARS", "400"))
+KB_TOP_K = int(os.getenv("KB_TOP_K", "4"))
+KB_TOKEN_BUDGET = int(os.getenv("KB_TOKEN_BUDGET", "1500"))
+KB_CACHE_SIZE = int(os.getenv("KB_CACHE_SIZE", "16"))
+
+# 一括生成の設定
+BATCH_MAX_COUNT = int(os.getenv("BATCH_MAX_COUNT", "50"))
+BATCH_CHUNK_SIZE = int(os.getenv("BATCH_CHUNK_SIZE", "5"))  # 1回のOllama呼び出しで生成する問題数
+BATCH_MAX_ATTEMPTS = int(os.getenv("BATCH_MAX_ATTEMPTS", "3"))  # 検証に失敗した問題を再生成する回数の上限
+
+# Ollamaへの接続プール設定
+OLLAMA_MAX_CONNECTIONS = int(os.getenv("OLLAMA_MAX_CONNECTIONS", "10"))
+OLLAMA_MAX_KEEPALIVE = int(os.getenv("OLLAMA_MAX_KEEPALIVE", "10"))
+OLLAMA_KEEPALIVE_EXPIRY = float(os.getenv("OLLAMA_KEEPALIVE_EXPIRY", "30"))
+OLLAMA_HTTP2 = os.getenv("OLLAMA_HTTP2", "false").lower() in ("1", "true", "yes")
+
+# Ollamaへの同時実行数と待ち行列の設定（OLLAMA_MAX_CONCURRENCY は Ollama の並列数に合わせる）
+OLLAMA_MAX_CONCURRENCY = int(os.getenv("OLLAMA_MAX_CONCURRENCY", "2"))
+OLLAMA_MAX_QUEUE = int(os.getenv("OLLAMA_MAX_QUEUE", "16"))
+OLLAMA_MAX_QUEUE_WAIT = float(os.getenv("OLLAMA_MAX_QUEUE_WAIT", str(API_TIMEOUT)))
+
+# バックエンドのヘルスチェックと障害時の切り離しの設定
+OLLAMA_HEALTH_INTERVAL = float(os.getenv("OLLAMA_HEALTH_INTERVAL", "10"))
+OLLAMA_EJECT_THRESHOLD = int(os.getenv("OLLAMA_EJECT_THRESHOLD", "2"))
+OLLAMA_EJECT_SECONDS = float(os.getenv("OLLAMA_EJECT_SECONDS", "30"))
+# 応答がこの秒数を超えたら別のバックエンドにも同じリクエストを送る（0 で無効。バックエンドが2台以上の場合のみ）
+OLLAMA_HEDGE_DELAY = float(os.getenv("OLLAMA_HEDGE_DELAY", "0"))
+
+# モデルの読み込み（ウォームアップ）と保持の設定
+OLLAMA_KEEP_ALIVE = parse_keep_alive(os.getenv("OLLAMA_KEEP_ALIVE", "30m"))  # 数値のみは秒数、-1 で無期限
+OLLAMA_WARMUP = os.getenv("OLLAMA_WARMUP", "true").lower() in ("1", "true", "yes")
+OLLAMA_KEEP_WARM_INTERVAL = float(os.getenv("OLLAMA_KEEP_WARM_INTERVAL", "0"))  # 0 で定期的な読み込みを行わない
+OLLAMA_WARMUP_TIMEOUT = float(os.getenv("OLLAMA_WARMUP_TIMEOUT", "300"))
+
+# 事前生成プールの設定（QUESTION_POOL_SIZE=0 で無効）
+QUESTION_POOL_SIZE = int(os.getenv("QUESTION_POOL_SIZE", "3"))
+QUESTION_POOL_LOW_WATERMARK = int(os.getenv("QUESTION_POOL_LOW_WATERMARK", "1"))
+QUESTION_POOL_MAX_PROFILES = int(os.getenv("QUESTION_POOL_MAX_PROFILES", "32"))
+QUESTION_POOL_MAX_BYTES = int(os.getenv("QUESTION_POOL_MAX_BYTES", str(16 * 1024 * 1024)))
+QUESTION_POOL_IDLE_TTL = float(os.getenv("QUESTION_POOL_IDLE_TTL", "1800"))
+QUESTION_POOL_CONCURRENCY = int(os.getenv("QUESTION_POOL_CONCURRENCY", "1"))
+
+# 生成した問題を保持するストアの設定（QUESTION_STORE_DB を指定するとSQLiteにも保存）
+QUESTION_STORE_MAX_ITEMS = int(os.getenv("QUESTION_STORE_MAX_ITEMS", "10000"))
+QUESTION_STORE_TTL = float(os.getenv("QUESTION_STORE_TTL", "86400"))
+QUESTION_STORE_DB = os.getenv("QUESTION_STORE_DB") or SHARED_STATE_DB  # 共有状態がある場合は同じファイルに保存する
+
+# 事前に生成した問題バンク（smartq.bulk の出力。未指定の場合は使用しない）から出題する設定
+QUESTION_BANK_PATH = os.getenv("QUESTION_BANK_PATH") or None
+QUESTION_BANK_RATIO = float(os.getenv("QUESTION_BANK_RATIO", "0"))  # 平常時にバンクから出題する割合（0〜1）
+QUESTION_BANK_QUEUE_DEPTH = int(os.getenv("QUESTION_BANK_QUEUE_DEPTH", "4"))  # 問題生成の待ち行列がこの長さ以上ならバンクから出題（0 で無効）
+
+# トピックごとに似た問題（言い換えや選択肢の並べ替え）を検出して生成し直す設定（DEDUP_THRESHOLD=0 で無効）
+DEDUP_THRESHOLD = float(os.getenv("DEDUP_THRESHOLD", "0.6"))  # 重複とみなす類似度（文字3-gramの推定Jaccard係数）
+DEDUP_MAX_RETRIES = int(os.getenv("DEDUP_MAX_RETRIES", "1"))  # 重複した場合に生成し直す回数の上限
+DEDUP_MAX_PER_TOPIC = int(os.getenv("DEDUP_MAX_PER_TOPIC", "1000"))
+DEDUP_MAX_TOPICS = int(os.getenv("DEDUP_MAX_TOPICS", "128"))
+
+# セッションごとの出題済みの問題の記録（問題バンクから出題済みの問題を避ける）
+SESSION_MAX = int(os.getenv("SESSION_MAX", "10000"))
+SESSION_TTL = float(os.getenv("SESSION_TTL", "86400"))
+
+# WebSocketのクイズセッション（/ws/quiz）の設定
+WS_SPECULATE = os.getenv("WS_SPECULATE", "true").lower() in ("1", "true", "yes")  # 出題後に次の問題を先行して生成する
+WS_MAX_IN_FLIGHT = int(os.getenv("WS_MAX_IN_FLIGHT", "8"))  # 1つの接続で同時に処理するメッセージ数の上限
+
+# 自由記述の回答がない場合にAIを呼ばずにテンプレートで評価する
+EVALUATION_FAST_PATH = os.getenv("EVALUATION_FAST_PATH", "true").lower() in ("1", "true", "yes")
+
+# AIの出力が検証に通らない場合の補修と再生成の設定
+OUTPUT_REPAIR = os.getenv("OUTPUT_REPAIR", "true").lower() in ("1", "true", "yes")
+GENERATION_MAX_RETRIES = int(os.getenv("GENERATION_MAX_RETRIES", "1"))  # 補修できなかった場合に再生成する回数の上限
+RETRY_TEMPERATURE = float(os.getenv("RETRY_TEMPERATURE", "0.3"))  # 再生成時の温度（低いほど形式が崩れにくい）
+
+# AIによる評価結果のキャッシュ（EVALUATION_CACHE_SIZE=0 でキャッシュせず、同時リクエストのまとめのみ行う）
+EVALUATION_CACHE_SIZE = int(os.getenv("EVALUATION_CACHE_SIZE", "1000"))
+EVALUATION_CACHE_TTL = float(os.getenv("EVALUATION_CACHE_TTL", "3600"))
+
+# ログの設定（ファイルへの書き込みは別スレッドで行う）
+LOG_FILE = os.getenv("LOG_FILE", "logs/smartq.log")
+if APP_WORKERS > 1:
+    # ローテーションが競合しないよう、ワーカーごとに別のファイル（smartq.<pid>.log）に出力する
+    LOG_FILE = "{0}.{2}{1}".format(*os.path.splitext(LOG_FILE), WORKER_ID)
+LOG_LEVEL = os.getenv("LOG_LEVEL", "INFO")
+LOG_MAX_BYTES = int(os.getenv("LOG_MAX_BYTES", str(10 * 1024 * 1024)))
+LOG_BACKUP_COUNT = int(os.getenv("LOG_BACKUP_COUNT", "5"))
+LOG_ROTATE_WHEN = os.getenv("LOG_ROTATE_WHEN") or None  # "midnight" などを指定するとサイズではなく時刻でローテーション
+LOG_MAX_FIELD_CHARS = int(os.getenv("LOG_MAX_FIELD_CHARS", "500"))  # プロンプトなどの長い文字列を切り詰める文字数
+LOG_DEBUG_SAMPLE_RATE = float(os.getenv("LOG_DEBUG_SAMPLE_RATE", "0.1"))  # DEBUGログを出力する割合
+LOGGER_NAMES = ["ollama", "smartq"]
+
+logger = logging.getLogger("smartq.app")
+
+def per_worker(total: int) -> int:
+    """
+    アプリ全体の上限を1ワーカーあたりの上限に分ける（0 は無効のまま、それ以外は1以上）。
+
+    上限がワーカー数より小さい場合も各ワーカーに1を割り当てるため、全ワーカーの合計は上限を超える
+    （起動時に warn_oversubscribed_limits で警告する）。
+    """
+    return max(1, total // APP_WORKERS) if total > 0 else 0
+
+def warn_oversubscribed_limits() -> None:
+    """ワーカー数で分けると全ワーカーの合計がアプリ全体の上限を超える設定を警告する"""
+    limits = {
+        "OLLAMA_MAX_CONCURRENCY": OLLAMA_MAX_CONCURRENCY,
+        "OLLAMA_MAX_QUEUE": OLLAMA_MAX_QUEUE,
+        "QUESTION_POOL_SIZE": QUESTION_POOL_SIZE,
+    }
+    for name, total in limits.items():
+        if 0 < total < APP_WORKERS:
+            logger.warning(
+                "Limit is lower than APP_WORKERS; each worker gets 1, so the total exceeds the limit",
+                extra={"setting": name, "limit": total, "workers": APP_WORKERS, "total": per_worker(total) * APP_WORKERS}
+            )
+
+@asynccontextmanager
+async def open_ollama_router() -> AsyncIterator[ModelRouter]:
+    """
+    Ollamaへの接続（HTTPクライアント、バックエンドプール、待ち行列、モデルの振り分け）を作成し、終了時に閉じる。
+
+    アプリの起動時のほか、アプリを起動せずにOllamaを呼び出すツール（smartq.bulk）も使用する。
+    """
+    http_client = create_http_client(
+        max_connections=OLLAMA_MAX_CONNECTIONS,
+        max_keepalive_connections=OLLAMA_MAX_KEEPALIVE,
+        keepalive_expiry=OLLAMA_KEEPALIVE_EXPIRY,
+        http2=OLLAMA_HTTP2,
+        timeout=API_TIMEOUT
+    )
+    # モデルごとにバックエンドプールと待ち行列を用意する（同じモデルは共有する）
+    models = dict.fromkeys(
+        [OLLAMA_GENERATE_MODEL, OLLAMA_EVALUATE_MODEL] + ([OLLAMA_FALLBACK_MODEL] if OLLAMA_FALLBACK_MODEL else [])
+    )
+    # すべてのモデルが同じOllamaサーバーに送るため、同時実行数の上限はモデルをまたいで共有する
+    concurrency_limit = ConcurrencyLimit(per_worker(OLLAMA_MAX_CONCURRENCY))
+    backend_pools = []
+    schedulers = {}
+    try:
+        for model in models:
+            backend_pool = OllamaBackendPool(
+                api_urls=OLLAMA_HOSTS,
+                model_name=model,
+                temperature=1.0,
+                http_client=http_client,
+                health_interval=OLLAMA_HEALTH_INTERVAL,
+                eject_threshold=OLLAMA_EJECT_THRESHOLD,
+                eject_seconds=OLLAMA_EJECT_SECONDS,
+                keep_alive=OLLAMA_KEEP_ALIVE,
+                keep_warm_interval=OLLAMA_KEEP_WARM_INTERVAL,
+                warm_up_timeout=OLLAMA_WARMUP_TIMEOUT,
+                on_response=metrics.observe_ollama,
+                hedge_delay=OLLAMA_HEDGE_DELAY,
+                request_timeout=API_TIMEOUT
+            )
+            backend_pools.append(backend_pool)
+            await backend_pool.start(warm_up=OLLAMA_WARMUP)
+            schedulers[model] = OllamaScheduler(
+                backend_pool,
+                max_queue=per_worker(OLLAMA_MAX_QUEUE),
+                max_wait=OLLAMA_MAX_QUEUE_WAIT,
+                limit=concurrency_limit
+            )
+        yield ModelRouter(
+            schedulers,
+            routes={
+                Priority.EVALUATE: OLLAMA_EVALUATE_MODEL,
+                Priority.GENERATE: OLLAMA_GENERATE_MODEL,
+                Priority.BACKGROUND: OLLAMA_GENERATE_MODEL,
+            },
+            fallback_model=OLLAMA_FALLBACK_MODEL,
+            fallback_queue_depth=OLLAMA_FALLBACK_QUEUE_DEPTH,
+            fallback_latency=OLLAMA_FALLBACK_LATENCY
+        )
+    finally:
+        for backend_pool in backend_pools:
+            await backend_pool.close()
+        await http_client.aclose()
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    """アプリケーション全体で共有するOllamaクライアントを起動時に作成し、終了時に接続を閉じる"""
+    log_listener = configure_logging(
+        LOGGER_NAMES,
+        path=LOG_FILE,
+        level=LOG_LEVEL,
+        max_bytes=LOG_MAX_BYTES,
+        backup_count=LOG_BACKUP_COUNT,
+        rotate_when=LOG_ROTATE_WHEN,
+        max_field_chars=LOG_MAX_FIELD_CHARS,
+        debug_sample_rate=LOG_DEBUG_SAMPLE_RATE
+    )
+    warn_oversubscribed_limits()
+    # ログの設定の後に行い、ビルド結果（brotli を使わない場合の通知を含む）をログに出力する
+    static_assets.build()
+    ollama_stack = AsyncExitStack()
+    app.state.ollama_client = await ollama_stack.enter_async_context(open_ollama_router())
+    app.state.question_pool = QuestionPool(
+        generate=lambda spec: generate_question(
+            spec, app.state.ollama_client, priority=Priority.BACKGROUND
+        ),
+        target_size=per_worker(QUESTION_POOL_SIZE),
+        low_watermark=QUESTION_POOL_LOW_WATERMARK,
+        max_profiles=QUESTION_POOL_MAX_PROFILES,
+        max_bytes=QUESTION_POOL_MAX_BYTES,
+        idle_ttl=QUESTION_POOL_IDLE_TTL,
+        refill_concurrency=QUESTION_POOL_CONCURRENCY
+    )
+    # 複数ワーカーの場合に共有する状態（セッションの記録はモジュール全体で1つのため、ここで共有状態を設定する）
+    app.state.shared_state = open_shared_state(SHARED_STATE_DB)
+    session_history.shared = app.state.shared_state
+    app.state.question_store = QuestionStore(
+        model=QuizQuestion,
+        max_items=QUESTION_STORE_MAX_ITEMS,
+        ttl=QUESTION_STORE_TTL,
+        db_path=QUESTION_STORE_DB
+    )
+    app.state.evaluation_cache = EvaluationCache(
+        max_items=EVALUATION_CACHE_SIZE,
+        ttl=EVALUATION_CACHE_TTL,
+        model=FeedbackResponse,
+        shared=app.state.shared_state
+    )
+    app.state.question_bank = QuestionBank(model=QuizQuestion, path=QUESTION_BANK_PATH)
+    # 待ち行列・モデルの選択・評価キャッシュの値は /metrics の出力時（と他のワーカーとの共有時）に取り込む
+    metrics.collectors = [
+        lambda: metrics.collect_routing(
+            app.state.ollama_client.get_stats(), app.state.ollama_client.get_scheduler_stats()
+        ),
+        lambda: metrics.collect_evaluation_cache(app.state.evaluation_cache.get_stats()),
+    ]
+    app.state.worker_sync = None
+    if app.state.shared_state is not None:
+        app.state.worker_sync = WorkerSync(
+            app.state.shared_state,
+            WORKER_ID,
+            snapshot=lambda: worker_snapshot(app.state),
+            interval=SHARED_STATE_SYNC_INTERVAL
+        )
+        await app.state.worker_sync.start()
+    try:
+        yield
+    finally:
+        if app.state.worker_sync is not None:
+            await app.state.worker_sync.close()
+        metrics.collectors = []
+        await app.state.question_pool.close()
+        await app.state.evaluation_cache.close()
+        app.state.question_store.close()
+        app.state.question_bank.close()
+        if app.state.shared_state is not None:
+            app.state.shared_state.close()
+        await ollama_stack.aclose()
+        shutdown_logging(log_listener, LOGGER_NAMES)
+
 # FastAPIアプリケーションの初期化
 app = FastAPI(
     title="SmartQ API",
@@ -29,17 +328,48 @@ app = FastAPI(
     version="0.2.0",
     docs_url="/api/docs",  # Swagger UIのURL
     redoc_url="/api/redoc",  # ReDocのURL
+    lifespan=lifespan,
+    default_response_class=ORJSONResponse,
     openapi_tags=[
         {
             "name": "クイズ",
             "description": "クイズの生成と回答評価に関連するエンドポイント"
+        },
+        {
+            "name": "運用",
+            "description": "稼働状況の確認に関連するエンドポイント"
         }
     ]
 )
 
-# 静的ファイルとテンプレートの設定
-app.mount("/static", StaticFiles(directory="static", html=True), name="static")
-templates = Jinja2Templates(directory="templates")
+# Prometheus形式のメトリクス（Ollamaの所要時間・トークン数、エンドポイントごとの所要時間など）
+metrics = SmartQMetrics()
+app.add_middleware(MetricsMiddleware, metrics=metrics)
+# クライアントが切断したリクエストはキャンセルし、Ollamaでの生成も中止する（MetricsMiddlewareの外側に置く）
+app.add_middleware(CancelOnDisconnectMiddleware, metrics=metrics)
+
+# 静的ファイルとメインページ（起動時に読み込み・圧縮し、ファイル名に内容のハッシュ値を含めて配信する）
+static_assets = StaticAssets(
+    directory=os.path.join(PROJECT_ROOT, "static"), templates_directory=os.path.join(PROJECT_ROOT, "templates")
+)
+
+# 知識ベースの検索インデックス（内容のハッシュ値ごとにキャッシュ）
+knowledge_base_cache = KnowledgeBaseCache(
+    max_items=KB_CACHE_SIZE,
+    chunk_chars=KB_CHUNK_CHARS,
+    top_k=KB_TOP_K,
+    token_budget=KB_TOKEN_BUDGET
+)
+
+# トピックごとの生成済みの問題の類似度インデックスと、セッションごとの出題済みの問題
+near_duplicates = NearDuplicateIndex(
+    threshold=DEDUP_THRESHOLD,
+    max_per_topic=DEDUP_MAX_PER_TOPIC,
+    max_topics=DEDUP_MAX_TOPICS
+)
+session_history = SessionHistory(max_sessions=SESSION_MAX, ttl=SESSION_TTL)
+# WebSocketのクイズセッションの統計情報
+quiz_session_stats = QuizSessionStats()
 
 # 共通の制約条件付き型を定義
 NonEmptyStr = Annotated[str, Field(min_length=1)]
@@ -66,13 +396,30 @@ class Option(BaseModel):
         }
     }
 
-class QuizQuestion(BaseModel):
-    """問題のモデル"""
-    id: str = Field(..., description="問題の一意の識別子")
+class GeneratedQuiz(BaseModel):
+    """AIが生成する問題の内容のモデル（OllamaのJSONスキーマもこのモデルから作成する）"""
     question: NonEmptyStr = Field(..., description="問題文")
-    options: List[Option] = Field(..., description="選択肢のリスト", min_length=2)
+    options: List[Option] = Field(..., description="選択肢のリスト", min_length=2, max_length=5)
     explanation: str = Field(..., description="問題の解説文（回答後に表示）")
 
+    @model_validator(mode='after')
+    def validate_options(self):
+        """少なくとも1つの正解選択肢があることを確認"""
+        if not any(opt.isCorrect for opt in self.options):
+            raise ValueError("少なくとも1つの選択肢は正解としてマークされている必要があります")
+        
+        # ラジオボタンの場合は正解が1つだけであることを確認
+        if all(opt.type == OptionType.RADIO for opt in self.options):
+            correct_count = sum(1 for opt in self.options if opt.isCorrect)
+            if correct_count != 1:
+                raise ValueError("ラジオボタン選択式の場合、正解は1つだけである必要があります")
+        
+        return self
+
+class QuizQuestion(GeneratedQuiz):
+    """問題のモデル"""
+    id: str = Field(..., description="問題の一意の識別子")
+
     model_config = {
         "json_schema_extra": {
             "example": {
@@ -88,26 +435,15 @@ class QuizQuestion(BaseModel):
             }
         }
     }
-    
-    @model_validator(mode='after')
-    def validate_options(self):
-        """少なくとも1つの正解選択肢があることを確認"""
-        if not any(opt.isCorrect for opt in self.options):
-            raise ValueError("少なくとも1つの選択肢は正解としてマークされている必要があります")
-        
-        # ラジオボタンの場合は正解が1つだけであることを確認
-        if all(opt.type == OptionType.RADIO for opt in self.options):
-            correct_count = sum(1 for opt in self.options if opt.isCorrect)
-            if correct_count != 1:
-                raise ValueError("ラジオボタン選択式の場合、正解は1つだけである必要があります")
-        
-        return self
 
 class GenerateQuizRequest(BaseModel):
     """問題生成リクエストのモデル"""
     topic: NonEmptyStr = Field(..., description="問題のトピック（例: 'programming', 'science'）")
     system_prompt: str = Field(..., description="問題生成のためのシステムプロンプト")
-    knowledge_base: Optional[str] = Field(None, description="追加の知識ベース情報（オプション）")
+    knowledge_base: Optional[str] = Field(default=None, description="追加の知識ベース情報（オプション）")
+    session_id: Optional[str] = Field(
+        default=None, max_length=128, description="セッションID（同じセッションに出題済みの問題を避ける。オプション）"
+    )
 
     model_config = {
         "json_schema_extra": {
@@ -119,34 +455,49 @@ class GenerateQuizRequest(BaseModel):
         }
     }
 
+class GenerateQuizBatchRequest(GenerateQuizRequest):
+    """問題一括生成リクエストのモデル"""
+    count: int = Field(..., description="生成する問題数", ge=1, le=BATCH_MAX_COUNT)
+
+    model_config = {
+        "json_schema_extra": {
+            "example": {
+                "topic": "programming",
+                "system_prompt": "初心者向けのPythonプログラミングに関する問題を作成してください。",
+                "knowledge_base": "Pythonはインタープリタ型の高水準プログラミング言語です。",
+                "count": 10
+            }
+        }
+    }
+
+class QuizBatchResponse(BaseModel):
+    """問題一括生成レスポンスのモデル"""
+    questions: List[QuizQuestion] = Field(..., description="生成された問題のリスト")
+    requested: int = Field(..., description="要求された問題数")
+    failed: int = Field(..., description="再生成しても検証に通らなかった問題数")
+
 class SelectedOption(BaseModel):
     """選択された選択肢のモデル"""
     index: int = Field(..., description="選択肢のインデックス", ge=0)
-    text: NonEmptyStr = Field(..., description="選択肢のテキスト")
+    text: Optional[str] = Field(None, description="選択肢のテキスト（省略時はサーバー側の問題から補完）")
 
 class EvaluateAnswerRequest(BaseModel):
     """回答評価リクエストのモデル"""
     question_id: str = Field(..., description="問題の識別子")
     selected_options: List[SelectedOption] = Field(..., description="選択された選択肢のリスト")
     additional_answer: Optional[str] = Field(None, description="追加の回答や説明（オプション）")
-    question: NonEmptyStr = Field(..., description="問題文")
-    options: List[Option] = Field(..., description="問題の全選択肢")
+    detailed: bool = Field(
+        False, description="自由記述の回答がなくてもAIによる詳しいフィードバックを生成するかどうか"
+    )
 
     model_config = {
         "json_schema_extra": {
             "example": {
                 "question_id": "q123e4567-e89b-12d3-a456-426614174000",
                 "selected_options": [
-                    {"index": 1, "text": "動的型付け言語である"}
+                    {"index": 1}
                 ],
-                "additional_answer": "動的型付けとは、変数の型が実行時に決定されることです。",
-                "question": "Pythonの特徴として正しいものはどれですか？",
-                "options": [
-                    {"text": "コンパイル言語である", "isCorrect": False, "type": "radio"},
-                    {"text": "動的型付け言語である", "isCorrect": True, "type": "radio"},
-                    {"text": "メモリ管理を手動で行う必要がある", "isCorrect": False, "type": "radio"},
-                    {"text": "C言語の派生言語である", "isCorrect": False, "type": "radio"}
-                ]
+                "additional_answer": "動的型付けとは、変数の型が実行時に決定されることです。"
             }
         }
     }
@@ -173,12 +524,18 @@ class AdditionalResource(BaseModel):
         }
     }
 
-class FeedbackResponse(BaseModel):
-    """フィードバックのモデル"""
+class GeneratedFeedback(BaseModel):
+    """AIが生成するフィードバックの内容のモデル（OllamaのJSONスキーマもこのモデルから作成する）"""
     isCorrect: bool = Field(..., description="回答が正解かどうか")
     feedback: str = Field(..., description="フィードバックメッセージ")
     detailedExplanation: str = Field(..., description="詳細な解説")
-    additionalResources: Optional[List[AdditionalResource]] = None
+    additionalResources: Optional[List[AdditionalResource]] = Field(default=None, description="追加の学習リソース（オプション）")
+
+class FeedbackResponse(GeneratedFeedback):
+    """フィードバックのモデル"""
+    source: Literal["llm", "template"] = Field(
+        default="llm", description="フィードバックの生成元（AIかテンプレートか）"
+    )
 
     model_config = {
         "json_schema_extra": {
@@ -196,135 +553,510 @@ class FeedbackResponse(BaseModel):
         }
     }
 
+class GeneratedQuizBatch(BaseModel):
+    """AIが一括生成する問題のリスト（各問題は個別に検証する）"""
+    questions: List[Any] = Field(..., description="問題のリスト")
+
+# OllamaのJSONスキーマはモデルから作成し、応答の検証には再利用できるTypeAdapterを使う
+QUIZ_SCHEMA = ollama_schema(GeneratedQuiz)
+EVALUATION_SCHEMA = ollama_schema(GeneratedFeedback)
+QUIZ_ADAPTER = TypeAdapter(GeneratedQuiz)
+QUIZ_BATCH_ADAPTER = TypeAdapter(GeneratedQuizBatch)
+FEEDBACK_ADAPTER = TypeAdapter(GeneratedFeedback)
+
+@functools.lru_cache(maxsize=None)
+def build_quiz_batch_schema(count: int) -> dict:
+    """指定した問題数を要求する一括生成用のスキーマを作成する（問題数ごとにキャッシュ）"""
+    return build_list_schema(QUIZ_SCHEMA, "questions", count, "互いに異なるクイズ問題のリスト")
+
 # OllamaClientのインスタンスを取得する依存関係
-def get_ollama_client():
-    """OllamaClientのインスタンスを取得する"""
-    return OllamaClient(
-        model_name=OLLAMA_MODEL,
-        api_url=OLLAMA_HOST,
-        temperature=1.0
-    )
+def get_ollama_client(request: Request) -> ModelRouter:
+    """アプリケーション全体で共有するOllamaClient（モデルのルーターとスケジューラー経由）を取得する"""
+    return request.app.state.ollama_client
 
-# ルート
-@app.get("/", response_class=HTMLResponse)
-async def root(request: Request):
-    """メインページを表示"""
-    return templates.TemplateResponse("index.html", {"request": request})
+def get_question_pool(request: Request) -> QuestionPool:
+    """事前生成した問題のプールを取得する"""
+    return request.app.state.question_pool
 
-@app.post("/api/generate", response_model=QuizQuestion, tags=["クイズ"])
-async def generate_quiz(
-    request: GenerateQuizRequest,
-    ollama_client: OllamaClient = Depends(get_ollama_client)
-):
-    """
-    問題を生成する
+def get_question_store(request: Request) -> QuestionStore[QuizQuestion]:
+    """生成した問題のストアを取得する"""
+    return request.app.state.question_store
 
-    トピックとシステムプロンプトを受け取り、Ollama AIを使用して問題を生成します。
-    """
-    # システムプロンプトの構築
-    prompt = f"""あなたは教育目的のクイズ作成AIです。
-トピック「{request.topic}」に関する問題を1つ作成してください。
+def get_evaluation_cache(request: Request) -> EvaluationCache:
+    """評価結果のキャッシュを取得する"""
+    return request.app.state.evaluation_cache
 
-{request.system_prompt}
+def get_question_bank(request: Request) -> QuestionBank[QuizQuestion]:
+    """事前に生成した問題バンクを取得する"""
+    return request.app.state.question_bank
 
-知識ベース:
-{request.knowledge_base or '特になし'}
+def request_deadline() -> float:
+    """リクエスト全体の期限（time.monotonic() の値）。待ち行列での待機とOllamaの呼び出しはこの期限までに終える"""
+    return time.monotonic() + API_TIMEOUT
+
+# プロンプト構築・応答検証の共通処理
+async def select_knowledge(request: GenerateQuizRequest) -> Optional[str]:
+    """知識ベースからトピックとシステムプロンプトに関連する部分を選択する（インデックスの構築は別スレッドで行う）"""
+    if not request.knowledge_base:
+        return request.knowledge_base
+    return await asyncio.to_thread(
+        knowledge_base_cache.select,
+        request.knowledge_base,
+        f"{request.topic} {request.system_prompt}"
+    )
+
+# プロンプトは固定の指示を先頭に、リクエストごとに変わる内容を末尾に置く。
+# 先頭が共通のプロンプトはOllamaのKVキャッシュ（プレフィックス）が再利用され、評価済みの部分の計算が省かれる。
+QUIZ_PROMPT_PREFIX = """あなたは教育目的のクイズ作成AIです。
+末尾に示すトピック・作成方針・知識ベースに基づいて問題を作成してください。
 
 問題はシングルチョイス（ラジオボタン選択式）で作成してください。
-選択肢の1つだけを正解としてマークしてください。
+各問題で選択肢の1つだけを正解としてマークしてください。
 すべての選択肢のタイプは "radio" としてください。
+"""
 
+QUIZ_PROMPT_FORMAT = """
+問題を1つ作成してください。
 出力は以下の形式に厳密に従ってください:
 - question: 問題文
 - options: 選択肢のリスト（各選択肢はtextとisCorrectとtypeを持つ）
 - explanation: 問題の詳細な解説
 """
 
+QUIZ_BATCH_PROMPT_FORMAT = """
+指定された数の問題を作成してください。
+それぞれの問題は互いに異なる内容・観点にしてください。
+出力は以下の形式に厳密に従ってください:
+- questions: 問題のリスト。各問題は以下を持つ
+  - question: 問題文
+  - options: 選択肢のリスト（各選択肢はtextとisCorrectとtypeを持つ）
+  - explanation: 問題の詳細な解説
+"""
+
+def build_quiz_request_section(request: GenerateQuizRequest, knowledge: Optional[str]) -> str:
+    """プロンプト末尾のリクエストごとの部分を構築する（変わりにくい順に並べる）"""
+    return f"""
+作成方針:
+{request.system_prompt}
+
+知識ベース:
+{knowledge or '特になし'}
+
+トピック: {request.topic}
+"""
+
+def build_avoid_section(avoid: Sequence[str]) -> str:
+    """生成済みの問題とよく似ていたため避ける問題の一覧（プロンプトの末尾に置く）"""
+    if not avoid:
+        return ""
+    return "\n次の問題と似た問題は作成しないでください（別の観点から出題してください）:\n" + "".join(
+        f"- {text[:200]}\n" for text in avoid[-10:]
+    )
+
+def build_quiz_prompt(request: GenerateQuizRequest, knowledge: Optional[str], avoid: Sequence[str] = ()) -> str:
+    """問題生成用のプロンプトを構築する"""
+    return (
+        QUIZ_PROMPT_PREFIX
+        + QUIZ_PROMPT_FORMAT
+        + build_quiz_request_section(request, knowledge)
+        + build_avoid_section(avoid)
+    )
+
+def validate_generated(adapter: TypeAdapter, raw: Union[str, bytes, dict]) -> Any:
+    """AIの応答をJSONの解析と検証を1回で行って変換する（解析済みの辞書も受け付ける）"""
+    if isinstance(raw, (str, bytes)):
+        return adapter.validate_json(raw)
+    return adapter.validate_python(raw)
+
+def load_for_repair(raw: Union[str, bytes, dict]) -> Any:
+    """検証に失敗した応答を補修のために読み込む（途中で打ち切られたJSONは閉じる）。読み込めない場合はNone"""
+    if not isinstance(raw, (str, bytes)):
+        return raw
+    text = raw.decode("utf-8", errors="replace") if isinstance(raw, bytes) else raw
+    closed = close_truncated_json(text.strip())
+    if closed is None:
+        return None
     try:
-        # Ollamaから応答を取得
-        response_json = await ollama_client.generate_json(
-            prompt=prompt,
+        return orjson.loads(closed)
+    except orjson.JSONDecodeError:
+        return None
+
+def repair_quiz_output(data: Any) -> Any:
+    """
+    検証に失敗した問題の出力を補修する
+
+    必須項目が欠けた（途中で打ち切られた）選択肢を取り除き、正解が複数あるラジオボタン選択式の問題は
+    チェックボックス選択式にする。解説が打ち切られて欠けている場合は空にする。
+    """
+    if not isinstance(data, dict):
+        return data
+    options = data.get("options")
+    if isinstance(options, list):
+        options = [
+            opt for opt in options
+            if isinstance(opt, dict)
+            and isinstance(opt.get("text"), str) and opt["text"].strip()
+            and isinstance(opt.get("isCorrect"), bool)
+        ][:5]
+        correct_count = sum(1 for opt in options if opt["isCorrect"])
+        if correct_count > 1 and all(opt.get("type", OptionType.RADIO.value) == OptionType.RADIO.value for opt in options):
+            options = [dict(opt, type=OptionType.CHECKBOX.value) for opt in options]
+        data = dict(data, options=options)
+    if "explanation" not in data:
+        data = dict(data, explanation="")
+    return data
+
+def repair_feedback_output(data: Any) -> Any:
+    """検証に失敗したフィードバックの出力を補修する（項目が欠けた追加リソースを取り除く）"""
+    if not isinstance(data, dict):
+        return data
+    resources = data.get("additionalResources")
+    if isinstance(resources, list):
+        data = dict(data, additionalResources=[
+            resource for resource in resources
+            if isinstance(resource, dict)
+            and isinstance(resource.get("title"), str) and resource["title"].strip()
+            and isinstance(resource.get("description"), str)
+        ])
+    if "detailedExplanation" not in data:
+        data = dict(data, detailedExplanation="")
+    return data
+
+def validate_with_repair(kind: str, adapter: TypeAdapter, repair, raw: Union[str, bytes, dict]) -> Any:
+    """
+    AIの応答を検証し、失敗した場合は補修してもう一度検証する
+
+    失敗はメトリクスに記録する。補修しても検証に通らない場合は元の検証エラーを送出する。
+    """
+    try:
+        return validate_generated(adapter, raw)
+    except ValidationError as e:
+        invalid_json = any(error["type"] == "json_invalid" for error in e.errors())
+        metrics.response_failures.inc(kind=kind, reason="invalid_json" if invalid_json else "validation")
+        if not OUTPUT_REPAIR:
+            raise
+        data = load_for_repair(raw)
+        if data is None:
+            raise
+        try:
+            result = adapter.validate_python(repair(data))
+        except ValidationError:
+            raise e
+        metrics.output_recovery.inc(kind=kind, outcome="repaired")
+        return result
+
+def parse_quiz_question(raw: Union[str, bytes, dict]) -> QuizQuestion:
+    """AIの応答を検証し（必要に応じて補修し）、新しいIDを付与したQuizQuestionに変換する"""
+    generated = validate_with_repair("quiz", QUIZ_ADAPTER, repair_quiz_output, raw)
+    # 検証済みの値をそのまま使い、QuizQuestionとしての再検証は行わない
+    return QuizQuestion.model_construct(id=str(uuid.uuid4()), **dict(generated))
+
+def parse_quiz_batch(raw: Union[str, bytes, dict]) -> List[Any]:
+    """一括生成の応答を検証し、個別に検証する前の問題のリストを返す"""
+    return validate_with_repair("quiz_batch", QUIZ_BATCH_ADAPTER, lambda data: data, raw).questions
+
+def should_retry(kind: str, attempt: int, elapsed: float, deadline: float) -> bool:
+    """
+    検証に失敗した生成をやり直すかどうかを判定し、結果をメトリクスに記録する
+
+    再生成の回数が上限未満で、直前の試行と同じ時間をかけても期限に間に合う場合のみやり直す。
+    """
+    if attempt < GENERATION_MAX_RETRIES and time.monotonic() + elapsed <= deadline:
+        metrics.output_recovery.inc(kind=kind, outcome="retried")
+        return True
+    metrics.output_recovery.inc(kind=kind, outcome="failed")
+    return False
+
+async def generate_with_retry(
+    ollama_client: ModelRouter,
+    kind: str,
+    deadline: float,
+    first_attempt: int = 0,
+    **kwargs: Any
+) -> Any:
+    """
+    generate_json を呼び出し、応答が検証に通らなければ温度を下げて期限内で再生成する
+
+    Args:
+        ollama_client: Ollamaクライアント
+        kind: メトリクスに記録する応答の種類
+        deadline: 期限（time.monotonic() の値）
+        first_attempt: 最初の試行の番号（ストリーミングでの生成に失敗した後の再生成は1）
+        **kwargs: generate_json に渡す引数（parse を含む）
+    """
+    for attempt in itertools.count(first_attempt):
+        started_at = time.monotonic()
+        try:
+            return await ollama_client.generate_json(
+                deadline=deadline,
+                additional_options={"options": {"temperature": RETRY_TEMPERATURE}} if attempt else None,
+                **kwargs
+            )
+        except ValidationError:
+            if not should_retry(kind, attempt, time.monotonic() - started_at, deadline):
+                raise
+
+def is_near_duplicate(topic: str, question: QuizQuestion) -> bool:
+    """トピックの生成済みの問題とよく似ているかを判定する（似ていなければインデックスに登録する）"""
+    text = " ".join([question.question, *sorted(option.text for option in question.options)])
+    return near_duplicates.check(topic, question.id, text) is not None
+
+def forget_near_duplicate(topic: str, question: QuizQuestion) -> None:
+    """出題しなかった問題を重複判定のインデックスから取り除く（以降の問題が誤って重複と判定されないように）"""
+    near_duplicates.remove(topic, question.id)
+
+def should_regenerate_duplicate(kind: str, attempt: int, elapsed: float, deadline: float) -> bool:
+    """よく似た問題を生成し直すかどうかを判定し、結果をメトリクスに記録する（判定の基準は should_retry と同じ）"""
+    if attempt < DEDUP_MAX_RETRIES and time.monotonic() + elapsed <= deadline:
+        metrics.duplicates.inc(kind=kind, outcome="regenerated")
+        return True
+    metrics.duplicates.inc(kind=kind, outcome="accepted")
+    return False
+
+async def generate_question(
+    request: GenerateQuizRequest,
+    ollama_client: ModelRouter,
+    priority: Priority = Priority.GENERATE,
+    deadline: Optional[float] = None,
+    avoid: Sequence[str] = ()
+) -> QuizQuestion:
+    """
+    Ollamaで問題を1つ生成し、検証済みのQuizQuestionを返す（期限の指定がなければ API_TIMEOUT 秒後まで）
+
+    トピックの生成済みの問題とよく似ていた場合は、その問題を避けるよう指示して期限内で生成し直す。
+    """
+    deadline = deadline if deadline is not None else request_deadline()
+    knowledge = await select_knowledge(request)
+    avoid = list(avoid)
+    # 生成し直すのは DEDUP_MAX_RETRIES 回まで（最後の試行では should_regenerate_duplicate が False を返す）
+    for attempt in range(max(DEDUP_MAX_RETRIES, 0) + 1):
+        started_at = time.monotonic()
+        question = await generate_with_retry(
+            ollama_client,
+            "quiz",
+            deadline=deadline,
+            prompt=build_quiz_prompt(request, knowledge, avoid),
             json_schema=QUIZ_SCHEMA,  # スキーマを明示的に指定
-            timeout=API_TIMEOUT
+            parse=parse_quiz_question,
+            priority=priority
         )
+        if not is_near_duplicate(request.topic, question):
+            return question
+        if not should_regenerate_duplicate("quiz", attempt, time.monotonic() - started_at, deadline):
+            return question
+        avoid.append(question.question)
+    return question
 
-        # JSONデータの検証
-        if not response_json:
-            raise ValueError("Empty response from AI")
-
-        # 必要なフィールドの存在チェック
-        if not all(key in response_json for key in ["question", "options", "explanation"]):
-            raise ValueError("Required fields missing in response")
-            
-        # 選択肢のチェック
-        if len(response_json["options"]) < 2:
-            raise ValueError("At least 2 options are required")
-            
-        # 少なくとも1つの正解が必要
-        correct_options = [opt for opt in response_json["options"] if opt.get("isCorrect", False)]
-        if not correct_options:
-            raise ValueError("At least one option must be marked as correct")
-
-        # uniqueなID生成
-        question_id = str(uuid.uuid4())
-        
-        # QuizQuestionモデルに変換して返す
-        return QuizQuestion(
-            id=question_id,
-            question=response_json["question"],
-            options=response_json["options"],
-            explanation=response_json["explanation"]
-        )
-        
-    except ValueError as e:
-        raise HTTPException(
-            status_code=502,
-            detail=f"Invalid response format from AI: {str(e)}"
+def build_quiz_batch_prompt(
+    request: GenerateQuizRequest, knowledge: Optional[str], count: int, avoid: Sequence[str] = ()
+) -> str:
+    """複数問題の一括生成用のプロンプトを構築する"""
+    return (
+        QUIZ_PROMPT_PREFIX
+        + QUIZ_BATCH_PROMPT_FORMAT
+        + build_quiz_request_section(request, knowledge)
+        + f"問題数: {count}\n"
+        + build_avoid_section(avoid)
+    )
+
+async def generate_question_batch(
+    request: GenerateQuizRequest,
+    count: int,
+    ollama_client: ModelRouter,
+    deadline: float,
+    priority: Priority = Priority.GENERATE
+) -> List[QuizQuestion]:
+    """
+    1回のOllama呼び出しで複数の問題を生成し、検証に通ったものを返す。
+
+    検証に失敗した問題と、トピックの生成済みの問題とよく似た問題は除き、除いた数だけを改めて生成する
+    （最大 BATCH_MAX_ATTEMPTS 回。よく似た問題は避けるようプロンプトで指示し、最後の試行では除かない）。
+    """
+    questions: List[QuizQuestion] = []
+    avoid: List[str] = []
+    for attempt in range(BATCH_MAX_ATTEMPTS):
+        remaining = count - len(questions)
+        if remaining <= 0:
+            break
+        try:
+            items = await ollama_client.generate_json(
+                prompt=build_quiz_batch_prompt(request, await select_knowledge(request), remaining, avoid),
+                json_schema=build_quiz_batch_schema(remaining),
+                parse=parse_quiz_batch,
+                deadline=deadline,
+                additional_options={"options": {"temperature": RETRY_TEMPERATURE}} if attempt else None,
+                priority=priority
+            )
+        except (OllamaOverloadedError, OllamaUnavailableError, DeadlineExceededError):
+            raise
+        except Exception as e:
+            last_attempt = attempt == BATCH_MAX_ATTEMPTS - 1
+            if isinstance(e, ValidationError):
+                metrics.output_recovery.inc(kind="quiz_batch", outcome="failed" if last_attempt else "retried")
+            if last_attempt:
+                raise
+            continue
+
+        # 問題ごとに個別に検証し、正しく、生成済みの問題と似ていないものだけを残す
+        for item in items[:remaining]:
+            try:
+                question = parse_quiz_question(item)
+            except ValidationError:
+                continue
+            if is_near_duplicate(request.topic, question):
+                if attempt < BATCH_MAX_ATTEMPTS - 1:
+                    metrics.duplicates.inc(kind="quiz_batch", outcome="dropped")
+                    avoid.append(question.question)
+                    continue
+                # 最後の試行では、似た問題も（1問ずつ生成する場合と同様に）そのまま使う
+                metrics.duplicates.inc(kind="quiz_batch", outcome="accepted")
+            questions.append(question)
+    return questions
+
+def cluster_queue_depth(ollama_client: ModelRouter, priority: Priority) -> int:
+    """待ち行列の長さ（複数ワーカーの場合は、稼働中の他のワーカーが最後に共有した長さを合算する）"""
+    depth = ollama_client.queue_depth(priority)
+    worker_sync = getattr(app.state, "worker_sync", None)
+    if worker_sync is not None:
+        depth += sum(
+            data.get("queue_depth", {}).get(priority.name.lower(), 0)
+            for data in worker_sync.others(live_only=True).values()
         )
-    except Exception as e:
-        raise HTTPException(status_code=500, detail=f"Internal server error: {str(e)}")
+    return depth
 
-@app.post("/api/evaluate", response_model=FeedbackResponse, tags=["クイズ"])
-async def evaluate_answer(
-    request: EvaluateAnswerRequest,
-    ollama_client: OllamaClient = Depends(get_ollama_client)
-):
+def bank_reason(request: GenerateQuizRequest, ollama_client: ModelRouter, question_bank: QuestionBank[QuizQuestion]) -> Optional[str]:
+    """問題バンクから出題する理由を返す（Ollamaで生成する場合はNone）"""
+    if not question_bank.has_topic(request.topic):
+        return None
+    if QUESTION_BANK_QUEUE_DEPTH > 0 and cluster_queue_depth(ollama_client, Priority.GENERATE) >= QUESTION_BANK_QUEUE_DEPTH:
+        return "saturated"
+    if random.random() < QUESTION_BANK_RATIO:
+        return "policy"
+    return None
+
+async def take_ready_question(
+    request: GenerateQuizRequest,
+    question_pool: QuestionPool,
+    question_bank: QuestionBank[QuizQuestion],
+    ollama_client: ModelRouter
+) -> Optional[QuizQuestion]:
+    """生成せずに返せる問題を取り出す（事前生成プール、次に方針または混雑に応じて問題バンク）"""
+    question = question_pool.take(request)
+    if question is None:
+        reason = bank_reason(request, ollama_client, question_bank)
+        if reason is not None:
+            question = question_bank.sample(request.topic, reason, exclude=await session_history.seen(request.session_id))
+    return question
+
+async def take_bank_fallback(
+    request: GenerateQuizRequest,
+    question_bank: QuestionBank[QuizQuestion],
+    error: Union[OllamaOverloadedError, OllamaUnavailableError]
+) -> Optional[QuizQuestion]:
+    """Ollamaが混雑や障害で受け付けなかった場合に、代わりに問題バンクから出題する"""
+    if not question_bank.has_topic(request.topic):
+        return None
+    return question_bank.sample(
+        request.topic,
+        "unavailable" if isinstance(error, OllamaUnavailableError) else "overloaded",
+        exclude=await session_history.seen(request.session_id)
+    )
+
+async def serve_question(
+    request: GenerateQuizRequest,
+    ollama_client: ModelRouter,
+    question_pool: QuestionPool,
+    question_bank: QuestionBank[QuizQuestion],
+    deadline: float
+) -> QuizQuestion:
     """
-    回答を評価する
+    出題する問題を用意する（事前生成プール・問題バンク、なければ生成し、Ollamaが受け付けなければ問題バンク）
 
-    ユーザーの回答を受け取り、Ollama AIを使用して評価と解説を生成します。
+    Raises:
+        OllamaOverloadedError, OllamaUnavailableError: Ollamaが受け付けず、問題バンクにも問題がない場合
     """
+    ready = await take_ready_question(request, question_pool, question_bank, ollama_client)
+    if ready is not None:
+        return ready
     try:
-        # 正解の選択肢と選択された選択肢を抽出
-        correct_options = [i for i, opt in enumerate(request.options) if opt.isCorrect]
-        selected_indices = [opt.index for opt in request.selected_options]
-        
-        # 単一選択問題の場合の簡易判定
-        single_choice = all(opt.type == "radio" for opt in request.options)
-        if single_choice:
-            is_correct = len(selected_indices) == 1 and selected_indices[0] in correct_options
-        else:
-            # 複数選択問題の場合
-            is_correct = set(selected_indices) == set(correct_options)
-
-        # 評価用プロンプトの構築
-        prompt = f"""あなたは教育目的のクイズ評価AIです。
-ユーザーの回答を評価し、詳細なフィードバックを提供してください。
+        return await generate_question(request, ollama_client, deadline=deadline)
+    except (OllamaOverloadedError, OllamaUnavailableError) as e:
+        banked = await take_bank_fallback(request, question_bank, e)
+        if banked is None:
+            raise
+        return banked
 
-問題:
-{request.question}
+async def record_served(request: GenerateQuizRequest, question: QuizQuestion, question_store: QuestionStore[QuizQuestion]) -> None:
+    """出題する問題を回答評価のためにストアに保存し、セッションの出題済みとして記録する"""
+    await question_store.put(question)
+    await session_history.mark(request.session_id, question.id)
 
-選択肢:
-{json.dumps([opt.model_dump() for opt in request.options], ensure_ascii=False)}
+async def resolve_question(request: EvaluateAnswerRequest, question_store: QuestionStore[QuizQuestion]) -> QuizQuestion:
+    """
+    評価対象の問題を取得する
 
-ユーザーの選択:
-{json.dumps([opt.model_dump() for opt in request.selected_options], ensure_ascii=False)}
+    正誤はサーバー側に保存された問題だけで判定する（クライアントが送信した問題や正誤情報は使用しない）。
+    """
+    question = await question_store.get(request.question_id)
+    if question is None:
+        raise HTTPException(
+            status_code=404,
+            detail=f"Question not found or expired: {request.question_id}"
+        )
 
-ユーザーの追加回答/質問:
-{request.additional_answer or "なし"}
+    for selected in request.selected_options:
+        if selected.index >= len(question.options):
+            raise HTTPException(
+                status_code=400,
+                detail=f"Selected option index out of range: {selected.index}"
+            )
+    return question
 
-正解かどうか:
-{is_correct}
+def judge_answer(options: List[Option], selected_indices: List[int]) -> bool:
+    """選択肢の正誤情報から回答が正解かどうかを判定する"""
+    # 正解の選択肢を抽出
+    correct_options = [i for i, opt in enumerate(options) if opt.isCorrect]
+    
+    # 単一選択問題の場合の簡易判定
+    single_choice = all(opt.type == "radio" for opt in options)
+    if single_choice:
+        return len(selected_indices) == 1 and selected_indices[0] in correct_options
+    # 複数選択問題の場合
+    return set(selected_indices) == set(correct_options)
+
+def use_fast_path(question: QuizQuestion, request: EvaluateAnswerRequest) -> bool:
+    """AIを呼ばずにテンプレートのフィードバックで評価できるかどうかを判定する"""
+    return (
+        EVALUATION_FAST_PATH
+        and not request.detailed
+        and not (request.additional_answer or "").strip()
+        and bool(question.explanation)
+    )
+
+def build_fast_feedback(question: QuizQuestion, is_correct: bool) -> FeedbackResponse:
+    """問題の解説とテンプレートからフィードバックを作成する"""
+    correct_texts = "」「".join(opt.text for opt in question.options if opt.isCorrect)
+    if is_correct:
+        feedback = f"正解です！「{correct_texts}」が正しい答えです。"
+    else:
+        feedback = f"不正解です。正しい答えは「{correct_texts}」です。"
+    return FeedbackResponse(
+        isCorrect=is_correct,
+        feedback=feedback,
+        detailedExplanation=question.explanation,
+        source="template"
+    )
+
+def evaluation_cache_key(question: QuizQuestion, request: EvaluateAnswerRequest) -> EvaluationKey:
+    """問題の内容・選択・自由記述から評価結果のキャッシュキーを作成する（問題IDは含めない）"""
+    return evaluation_key(
+        question.model_dump_json(exclude={"id"}),
+        [opt.index for opt in request.selected_options],
+        request.additional_answer
+    )
+
+EVALUATION_PROMPT_PREFIX = """あなたは教育目的のクイズ評価AIです。
+末尾に示す問題とユーザーの回答を評価し、詳細なフィードバックを提供してください。
 
 以下の形式で回答を評価してください:
 - isCorrect: ユーザーの回答が正解かどうか（boolean）
@@ -333,30 +1065,248 @@ async def evaluate_answer(
 - additionalResources: 追加リソース（オプション）
 """
 
+def build_evaluation_prompt(
+    question: QuizQuestion,
+    request: EvaluateAnswerRequest,
+    is_correct: bool
+) -> str:
+    """回答評価用のプロンプトを構築する（同じ問題の評価は問題部分までが共通になる）"""
+    selected = [
+        {"index": opt.index, "text": question.options[opt.index].text}
+        for opt in request.selected_options
+    ]
+    return EVALUATION_PROMPT_PREFIX + f"""
+問題:
+{question.question}
+
+選択肢:
+{json.dumps([opt.model_dump(mode="json") for opt in question.options], ensure_ascii=False)}
+
+ユーザーの選択:
+{json.dumps(selected, ensure_ascii=False)}
+
+正解かどうか:
+{is_correct}
+
+ユーザーの追加回答/質問:
+{request.additional_answer or "なし"}
+"""
+
+def parse_feedback(raw: Union[str, bytes, dict]) -> FeedbackResponse:
+    """AIの応答を検証し（必要に応じて補修し）、FeedbackResponseに変換する"""
+    generated = validate_with_repair("feedback", FEEDBACK_ADAPTER, repair_feedback_output, raw)
+    return FeedbackResponse.model_construct(**dict(generated))
+
+async def evaluate_question(
+    question: QuizQuestion,
+    request: EvaluateAnswerRequest,
+    ollama_client: ModelRouter,
+    evaluation_cache: EvaluationCache,
+    deadline: float
+) -> FeedbackResponse:
+    """回答を評価する（自由記述がなければテンプレート、あればキャッシュまたはAIによるフィードバック）"""
+    selected_indices = [opt.index for opt in request.selected_options]
+    is_correct = judge_answer(question.options, selected_indices)
+    if use_fast_path(question, request):
+        return build_fast_feedback(question, is_correct)
+
+    # 評価用プロンプトの構築
+    prompt = build_evaluation_prompt(question, request, is_correct)
+
+    async def compute_feedback() -> FeedbackResponse:
         # Ollamaから応答を取得
-        response_json = await ollama_client.generate_json(
+        feedback = await generate_with_retry(
+            ollama_client,
+            "feedback",
+            deadline=deadline,
             prompt=prompt,
             json_schema=EVALUATION_SCHEMA,
-            timeout=API_TIMEOUT
+            parse=parse_feedback,
+            priority=Priority.EVALUATE
         )
+        # 正誤はAIの判断ではなく、保存した問題からの判定結果を使用する（キャッシュにもこの値を保存する）
+        return feedback.model_copy(update={"isCorrect": is_correct})
+
+    return await evaluation_cache.get_or_compute(
+        evaluation_cache_key(question, request), compute_feedback
+    )
+
+def sse_event(event: str, data: Any) -> str:
+    """Server-Sent Events形式のメッセージを組み立てる"""
+    return f"event: {event}\ndata: {orjson.dumps(data).decode()}\n\n"
+
+def overloaded_exception(error: Union[OllamaOverloadedError, OllamaUnavailableError]) -> HTTPException:
+    """混雑やバックエンド不在による拒否を 503 と Retry-After ヘッダーに変換する"""
+    return HTTPException(
+        status_code=503,
+        detail=f"AI service is busy: {str(error)}",
+        headers={"Retry-After": str(error.retry_after)}
+    )
+
+def timeout_exception(error: Exception) -> HTTPException:
+    """期限切れやOllamaの応答のタイムアウトを 504 に変換する"""
+    return HTTPException(status_code=504, detail=f"AI response timed out: {str(error) or type(error).__name__}")
 
-        # JSONデータの検証
-        if not response_json:
-            raise ValueError("Empty response from AI")
-
-        # 必要なフィールドの存在チェック
-        required_fields = ["isCorrect", "feedback", "detailedExplanation"]
-        if not all(key in response_json for key in required_fields):
-            raise ValueError(f"Required fields missing in response. Expected: {required_fields}, got: {list(response_json.keys())}")
-
-        # FeedbackResponseモデルに変換して返す
-        return FeedbackResponse(
-            isCorrect=response_json["isCorrect"],
-            feedback=response_json["feedback"],
-            detailedExplanation=response_json["detailedExplanation"],
-            additionalResources=response_json.get("additionalResources")
+def error_payload(error: Exception) -> dict:
+    """例外をステータスコードと詳細に変換する（SSEとWebSocketのエラー。非ストリーミング版のステータスコードに対応）"""
+    if isinstance(error, HTTPException):
+        return {"status": error.status_code, "detail": error.detail}
+    if isinstance(error, (OllamaOverloadedError, OllamaUnavailableError)):
+        return {
+            "status": 503,
+            "detail": f"AI service is busy: {str(error)}",
+            "retryAfter": error.retry_after
+        }
+    if isinstance(error, (TimeoutError, httpx.TimeoutException)):
+        return {"status": 504, "detail": timeout_exception(error).detail}
+    if isinstance(error, ValueError):
+        return {"status": 502, "detail": f"Invalid response format from AI: {str(error)}"}
+    return {"status": 500, "detail": f"Internal server error: {str(error)}"}
+
+def error_event(error: Exception) -> str:
+    """例外をSSEのerrorイベントに変換する"""
+    return sse_event("error", error_payload(error))
+
+ModelT = TypeVar("ModelT", bound=BaseModel)
+
+def parse_ws_message(model: Type[ModelT], payload: dict) -> ModelT:
+    """WebSocketで受信したメッセージをリクエストのモデルで検証する（検証エラーは 422 とする）"""
+    try:
+        return model.model_validate(payload)
+    except ValidationError as e:
+        raise HTTPException(
+            status_code=422,
+            detail=e.errors(include_url=False, include_context=False, include_input=False)
         )
+
+SSE_HEADERS = {
+    "Cache-Control": "no-cache",
+    "X-Accel-Buffering": "no",  # リバースプロキシでのバッファリングを無効化
+}
+
+# ルート
+@app.api_route("/", methods=["GET", "HEAD"], response_class=HTMLResponse)
+async def root(request: Request):
+    """メインページを表示（起動時に描画したページを返す）"""
+    return static_assets.page_response(request, "index.html")
+
+@app.api_route("/static/{path:path}", methods=["GET", "HEAD"], include_in_schema=False)
+async def static_file(request: Request, path: str) -> Response:
+    """静的ファイルを返す（ハッシュ値を含むファイル名は長期間キャッシュさせる）"""
+    return static_assets.file_response(request, path)
+
+def collect_stats(
+    ollama_client: ModelRouter,
+    question_pool: QuestionPool,
+    question_store: QuestionStore[QuizQuestion],
+    question_bank: QuestionBank[QuizQuestion],
+    evaluation_cache: EvaluationCache
+) -> dict:
+    """このワーカーの稼働統計を集める"""
+    return {
+        "http_pool": ollama_client.get_pool_stats(),
+        "scheduler": ollama_client.get_scheduler_stats(),
+        "routing": ollama_client.get_stats(),
+        "question_pool": question_pool.get_stats(),
+        "question_store": question_store.get_stats(),
+        "question_bank": question_bank.get_stats(),
+        "near_duplicates": near_duplicates.get_stats(),
+        "sessions": session_history.get_stats(),
+        "quiz_sessions": quiz_session_stats.get_stats(),
+        "evaluation_cache": evaluation_cache.get_stats(),
+        "knowledge_base": knowledge_base_cache.get_stats(),
+        "static_assets": static_assets.get_stats()
+    }
+
+def worker_snapshot(state: Any) -> dict:
+    """他のワーカーと共有するこのワーカーの状態（稼働統計、メトリクス、待ち行列の長さ）"""
+    return {
+        "stats": collect_stats(
+            state.ollama_client,
+            state.question_pool,
+            state.question_store,
+            state.question_bank,
+            state.evaluation_cache
+        ),
+        "metrics": metrics.snapshot(),
+        "queue_depth": {priority.name.lower(): state.ollama_client.queue_depth(priority) for priority in Priority},
+    }
+
+@app.get("/api/stats", tags=["運用"])
+async def get_stats(
+    request: Request,
+    ollama_client: ModelRouter = Depends(get_ollama_client),
+    question_pool: QuestionPool = Depends(get_question_pool),
+    question_store: QuestionStore[QuizQuestion] = Depends(get_question_store),
+    question_bank: QuestionBank[QuizQuestion] = Depends(get_question_bank),
+    evaluation_cache: EvaluationCache = Depends(get_evaluation_cache)
+):
+    """
+    稼働統計を取得する
+
+    モデルごとのOllamaへの接続プールと待ち行列、モデルの選択結果、問題の事前生成プール、問題ストア、問題バンク、
+    似た問題の検出、セッションごとの出題履歴、WebSocketのクイズセッション、評価キャッシュ、知識ベースの索引、静的ファイルの配信の状態などを返します。
+    複数ワーカーの場合、これらはリクエストを処理したワーカーの値で、workers.others に稼働中の他のワーカーの値
+    （最後に共有された時点のもの）を返します。
+    """
+    shared_state = request.app.state.shared_state
+    worker_sync = request.app.state.worker_sync
+    return {
+        **collect_stats(ollama_client, question_pool, question_store, question_bank, evaluation_cache),
+        "workers": {
+            "worker_id": WORKER_ID,
+            "app_workers": APP_WORKERS,
+            "shared_state": shared_state.get_stats() if shared_state is not None else None,
+            "sync": worker_sync.get_stats() if worker_sync is not None else None,
+            "others": {
+                worker_id: data.get("stats")
+                for worker_id, data in (worker_sync.others(live_only=True) if worker_sync is not None else {}).items()
+            },
+        }
+    }
+
+@app.get("/metrics", response_class=PlainTextResponse, tags=["運用"])
+async def get_metrics(request: Request):
+    """
+    Prometheus形式のメトリクスを取得する
+
+    Ollamaの応答に含まれるプロンプトのトークン数・生成速度・モデルの読み込み時間、
+    エンドポイントごとの所要時間、AIの応答の解析・検証の失敗数をヒストグラムとカウンターで返します。
+    複数ワーカーの場合は、他のワーカーが最後に共有した値を合算します（ゲージは稼働中のワーカーのみ）。
+    """
+    worker_sync = request.app.state.worker_sync
+    if worker_sync is None:
+        return PlainTextResponse(metrics.render(), media_type=METRICS_CONTENT_TYPE)
+    others = [data.get("metrics", {}) for data in worker_sync.others().values()]
+    live_others = [data.get("metrics", {}) for data in worker_sync.others(live_only=True).values()]
+    return PlainTextResponse(metrics.render(others, live_others), media_type=METRICS_CONTENT_TYPE)
+
+@app.post("/api/generate", response_model=QuizQuestion, tags=["クイズ"])
+async def generate_quiz(
+    request: GenerateQuizRequest,
+    ollama_client: ModelRouter = Depends(get_ollama_client),
+    question_pool: QuestionPool = Depends(get_question_pool),
+    question_store: QuestionStore[QuizQuestion] = Depends(get_question_store),
+    question_bank: QuestionBank[QuizQuestion] = Depends(get_question_bank),
+    deadline: float = Depends(request_deadline)
+):
+    """
+    問題を生成する
+
+    トピックとシステムプロンプトを受け取り、Ollama AIを使用して問題を生成します。
+    事前生成プールに問題があればそれを返し、なければその場で生成します。
+    問題バンクにトピックの問題がある場合は、設定した割合、または問題生成の待ち行列が混雑している場合と
+    Ollamaが受け付けなかった場合に、問題バンクから出題します。
+    """
+    try:
+        question = await serve_question(request, ollama_client, question_pool, question_bank, deadline)
+        await record_served(request, question, question_store)
+        return question
         
+    except (OllamaOverloadedError, OllamaUnavailableError) as e:
+        raise overloaded_exception(e)
+    except (TimeoutError, httpx.TimeoutException) as e:
+        raise timeout_exception(e)
     except ValueError as e:
         raise HTTPException(
             status_code=502,
@@ -365,7 +1315,344 @@ async def evaluate_answer(
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"Internal server error: {str(e)}")
 
+@app.post("/api/generate/stream", tags=["クイズ"])
+async def generate_quiz_stream(
+    request: GenerateQuizRequest,
+    ollama_client: ModelRouter = Depends(get_ollama_client),
+    question_pool: QuestionPool = Depends(get_question_pool),
+    question_store: QuestionStore[QuizQuestion] = Depends(get_question_store),
+    question_bank: QuestionBank[QuizQuestion] = Depends(get_question_bank),
+    deadline: float = Depends(request_deadline)
+):
+    """
+    問題をストリーミングで生成する
+
+    Server-Sent Eventsで、問題文（question）と各選択肢（option）、解説（explanation）を
+    完成した順に送信し、最後に検証済みの問題全体（done）を送信します。
+    送信途中の問題を別の問題に差し替える場合（検証に通らず生成し直した場合、生成済みの問題とよく似ていた場合、
+    混雑により問題バンクから出題する場合）は、done の前に reset イベントを送信します。
+    事前生成プールまたは問題バンクから出題する場合は done イベントのみを送信します。
+    エラー時は error イベントを送信します。
+    """
+    ready = await take_ready_question(request, question_pool, question_bank, ollama_client)
+    if ready is not None:
+        await record_served(request, ready, question_store)
+
+    async def event_stream():
+        if ready is not None:
+            yield sse_event("done", ready.model_dump(mode="json"))
+            return
+
+        parser = IncrementalJSONParser()
+        started_at = time.monotonic()
+        streamed = False  # 途中の問題（question, option, explanation）を送信したかどうか
+        replaced: Optional[str] = None  # 送信した問題を差し替えた理由
+        try:
+            prompt = build_quiz_prompt(request, await select_knowledge(request))
+            async for token in ollama_client.stream_generate(
+                prompt=prompt,
+                json_schema=QUIZ_SCHEMA,
+                timeout=API_TIMEOUT,
+                deadline=deadline,
+                priority=Priority.GENERATE
+            ):
+                for path, value in parser.feed(token):
+                    if path == ("question",):
+                        yield sse_event("question", {"question": value})
+                        streamed = True
+                    elif len(path) == 2 and path[0] == "options":
+                        yield sse_event("option", {"index": path[1], "option": value})
+                        streamed = True
+                    elif path == ("explanation",):
+                        yield sse_event("explanation", {"explanation": value})
+                        streamed = True
+
+            try:
+                question = parse_quiz_question(parser.text)
+            except ValidationError:
+                # 補修できなかった場合は、残り時間内で（ストリーミングせずに）生成し直す
+                if not should_retry("quiz", 0, time.monotonic() - started_at, deadline):
+                    raise
+                replaced = "invalid"
+                question = await generate_with_retry(
+                    ollama_client,
+                    "quiz",
+                    deadline=deadline,
+                    first_attempt=1,
+                    prompt=prompt,
+                    json_schema=QUIZ_SCHEMA,
+                    parse=parse_quiz_question,
+                    priority=Priority.GENERATE
+                )
+            if is_near_duplicate(request.topic, question) and should_regenerate_duplicate(
+                "quiz", 0, time.monotonic() - started_at, deadline
+            ):
+                # 生成済みの問題とよく似ていた場合は、（ストリーミングせずに）避けるよう指示して生成し直す
+                replaced = "duplicate"
+                question = await generate_question(
+                    request, ollama_client, deadline=deadline, avoid=[question.question]
+                )
+            await record_served(request, question, question_store)
+            if streamed and replaced is not None:
+                # クライアントが表示中の途中の問題を破棄させる
+                yield sse_event("reset", {"reason": replaced})
+            yield sse_event("done", question.model_dump(mode="json"))
+        except (OllamaOverloadedError, OllamaUnavailableError) as e:
+            banked = await take_bank_fallback(request, question_bank, e)
+            if banked is None:
+                yield error_event(e)
+                return
+            await record_served(request, banked, question_store)
+            if streamed:
+                yield sse_event("reset", {"reason": "fallback"})
+            yield sse_event("done", banked.model_dump(mode="json"))
+        except Exception as e:
+            yield error_event(e)
+
+    return StreamingResponse(event_stream(), media_type="text/event-stream", headers=SSE_HEADERS)
+
+@app.post("/api/generate/batch", response_model=QuizBatchResponse, tags=["クイズ"])
+async def generate_quiz_batch(
+    request: GenerateQuizBatchRequest,
+    ollama_client: ModelRouter = Depends(get_ollama_client),
+    question_store: QuestionStore[QuizQuestion] = Depends(get_question_store),
+    deadline: float = Depends(request_deadline)
+):
+    """
+    問題を一括で生成する
+
+    1回のOllama呼び出しで複数の問題を生成し、プロンプト評価のコストを問題間で共有します。
+    要求数が多い場合は BATCH_CHUNK_SIZE ごとに分割して並行に生成します。
+    """
+    chunks = [
+        min(BATCH_CHUNK_SIZE, request.count - start)
+        for start in range(0, request.count, BATCH_CHUNK_SIZE)
+    ]
+    results = await asyncio.gather(
+        *(generate_question_batch(request, size, ollama_client, deadline) for size in chunks),
+        return_exceptions=True
+    )
+
+    questions = [q for result in results if not isinstance(result, BaseException) for q in result]
+    if not questions:
+        error = next((r for r in results if isinstance(r, BaseException)), None)
+        if isinstance(error, (OllamaOverloadedError, OllamaUnavailableError)):
+            raise overloaded_exception(error)
+        if isinstance(error, (TimeoutError, httpx.TimeoutException)):
+            raise timeout_exception(error)
+        if error is None or isinstance(error, ValueError):
+            raise HTTPException(
+                status_code=502,
+                detail=f"Invalid response format from AI: {str(error) if error else 'no valid questions'}"
+            )
+        raise HTTPException(status_code=500, detail=f"Internal server error: {str(error)}")
+
+    for question in questions:
+        await record_served(request, question, question_store)
+
+    return QuizBatchResponse(
+        questions=questions,
+        requested=request.count,
+        failed=request.count - len(questions)
+    )
+
+@app.post("/api/evaluate", response_model=FeedbackResponse, tags=["クイズ"])
+async def evaluate_answer(
+    request: EvaluateAnswerRequest,
+    ollama_client: ModelRouter = Depends(get_ollama_client),
+    question_store: QuestionStore[QuizQuestion] = Depends(get_question_store),
+    evaluation_cache: EvaluationCache = Depends(get_evaluation_cache),
+    deadline: float = Depends(request_deadline)
+):
+    """
+    回答を評価する
+
+    ユーザーの回答を受け取り、Ollama AIを使用して評価と解説を生成します。
+    問題はサーバー側に保存されたものを使用するため、問題IDと選択肢のインデックスだけを送信すれば評価できます。
+    自由記述の回答がない場合は、AIを呼ばずに問題の解説からフィードバックを返します
+    （detailed=true を指定するとAIによるフィードバックを生成します）。
+    同じ問題・選択・自由記述の評価結果はキャッシュされ、同時に届いた同一の評価は1回のAI呼び出しにまとめられます。
+    """
+    question = await resolve_question(request, question_store)
+
+    try:
+        return await evaluate_question(question, request, ollama_client, evaluation_cache, deadline)
+        
+    except (OllamaOverloadedError, OllamaUnavailableError) as e:
+        raise overloaded_exception(e)
+    except (TimeoutError, httpx.TimeoutException) as e:
+        raise timeout_exception(e)
+    except ValueError as e:
+        raise HTTPException(
+            status_code=502,
+            detail=f"Invalid response format from AI: {str(e)}"
+        )
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=f"Internal server error: {str(e)}")
+
+@app.post("/api/evaluate/stream", tags=["クイズ"])
+async def evaluate_answer_stream(
+    request: EvaluateAnswerRequest,
+    ollama_client: ModelRouter = Depends(get_ollama_client),
+    question_store: QuestionStore[QuizQuestion] = Depends(get_question_store),
+    evaluation_cache: EvaluationCache = Depends(get_evaluation_cache),
+    deadline: float = Depends(request_deadline)
+):
+    """
+    回答をストリーミングで評価する
+
+    Server-Sent Eventsで、まずローカルで判定した正誤（verdict）を送信し、
+    続いてフィードバック（feedback）と詳細解説（detailedExplanation）を完成した順に送信し、
+    最後に検証済みの評価全体（done）を送信します。エラー時は error イベントを送信します。
+    自由記述の回答がない場合やキャッシュされた評価結果がある場合は、AIを呼ばずに verdict と done のみを送信します。
+    同じ評価が実行中の場合（/api/evaluate を含む）は、その結果を待って verdict と done のみを送信します。
+    """
+    question = await resolve_question(request, question_store)
+    selected_indices = [opt.index for opt in request.selected_options]
+    is_correct = judge_answer(question.options, selected_indices)
+    prompt = build_evaluation_prompt(question, request, is_correct)
+    cache_key = evaluation_cache_key(question, request)
+
+    async def event_stream():
+        yield sse_event("verdict", {"isCorrect": is_correct})
+        if use_fast_path(question, request):
+            yield sse_event("done", build_fast_feedback(question, is_correct).model_dump(mode="json"))
+            return
+
+        cached = await evaluation_cache.lookup(cache_key)
+        if cached is not None:
+            evaluation_cache.record_hit()
+            # 正誤は verdict と同じくサーバーでの判定結果に揃える
+            cached = cached.model_copy(update={"isCorrect": is_correct})
+            yield sse_event("done", cached.model_dump(mode="json"))
+            return
+
+        claimed = evaluation_cache.claim(cache_key)
+        if claimed is None:
+            # 同じ評価が実行中の場合は、AIを呼ばずにその結果を待つ
+            try:
+                feedback = await evaluate_question(question, request, ollama_client, evaluation_cache, deadline)
+                yield sse_event("done", feedback.model_dump(mode="json"))
+            except Exception as e:
+                yield error_event(e)
+            return
+
+        parser = IncrementalJSONParser()
+        started_at = time.monotonic()
+        try:
+            async for token in ollama_client.stream_generate(
+                prompt=prompt,
+                json_schema=EVALUATION_SCHEMA,
+                timeout=API_TIMEOUT,
+                deadline=deadline,
+                priority=Priority.EVALUATE
+            ):
+                for path, value in parser.feed(token):
+                    if path == ("feedback",):
+                        yield sse_event("feedback", {"feedback": value})
+                    elif path == ("detailedExplanation",):
+                        yield sse_event("detailedExplanation", {"detailedExplanation": value})
+
+            try:
+                feedback = parse_feedback(parser.text)
+            except ValidationError:
+                # 補修できなかった場合は、残り時間内で（ストリーミングせずに）生成し直す
+                if not should_retry("feedback", 0, time.monotonic() - started_at, deadline):
+                    raise
+                feedback = await generate_with_retry(
+                    ollama_client,
+                    "feedback",
+                    deadline=deadline,
+                    first_attempt=1,
+                    prompt=prompt,
+                    json_schema=EVALUATION_SCHEMA,
+                    parse=parse_feedback,
+                    priority=Priority.EVALUATE
+                )
+            # AIが返した正誤ではなく、verdict で送信したサーバーでの判定結果を使用する
+            feedback = feedback.model_copy(update={"isCorrect": is_correct})
+            evaluation_cache.put(cache_key, feedback)
+            claimed.set_result(feedback)
+            yield sse_event("done", feedback.model_dump(mode="json"))
+        except Exception as e:
+            if not claimed.done():
+                claimed.set_exception(e)
+            yield error_event(e)
+        finally:
+            # 切断などで中断した場合は、同じ評価を待っている呼び出し元が改めて計算する
+            if not claimed.done():
+                claimed.cancel()
+
+    return StreamingResponse(event_stream(), media_type="text/event-stream", headers=SSE_HEADERS)
+
+@app.websocket("/ws/quiz")
+async def quiz_session(websocket: WebSocket):
+    """
+    WebSocketのクイズセッション
+
+    1つの接続で問題の生成と回答の評価を行います。メッセージはJSONで、request_id を付けて送信すると
+    処理が終わった順に同じ request_id を付けた結果が届きます（複数の要求を並行に処理します）。
+
+    - {"type": "generate", トピックなど /api/generate と同じ項目} → {"type": "question", "question": 問題}
+    - {"type": "evaluate", 問題IDなど /api/evaluate と同じ項目} → {"type": "feedback", "feedback": 評価}
+    - {"type": "ping"} → {"type": "pong"}
+    - エラー時は {"type": "error", "status": ステータスコード, "detail": 詳細}
+
+    出題すると同じトピックの次の問題をバックグラウンドで先行して生成しておき、次の generate で返します
+    （先行生成した問題は "speculative": true）。session_id を省略した場合は接続ごとのIDを使用します。
+    """
+    state = websocket.app.state
+    ollama_client: ModelRouter = state.ollama_client
+    question_pool: QuestionPool = state.question_pool
+    question_store: QuestionStore[QuizQuestion] = state.question_store
+    question_bank: QuestionBank[QuizQuestion] = state.question_bank
+    evaluation_cache: EvaluationCache = state.evaluation_cache
+    connection_session_id = uuid.uuid4().hex
+
+    def parse_generate(payload: dict) -> GenerateQuizRequest:
+        request = parse_ws_message(GenerateQuizRequest, payload)
+        if request.session_id is None:
+            request.session_id = connection_session_id
+        return request
+
+    async def serve(request: GenerateQuizRequest) -> QuizQuestion:
+        return await serve_question(request, ollama_client, question_pool, question_bank, request_deadline())
+
+    async def prefetch(request: GenerateQuizRequest) -> QuizQuestion:
+        return await generate_question(request, ollama_client, priority=Priority.BACKGROUND)
+
+    async def record(request: GenerateQuizRequest, question: QuizQuestion) -> None:
+        await record_served(request, question, question_store)
+
+    def discard(request: GenerateQuizRequest, question: QuizQuestion) -> None:
+        forget_near_duplicate(request.topic, question)
+
+    async def evaluate(payload: dict) -> FeedbackResponse:
+        request = parse_ws_message(EvaluateAnswerRequest, payload)
+        question = await resolve_question(request, question_store)
+        return await evaluate_question(question, request, ollama_client, evaluation_cache, request_deadline())
+
+    await websocket.accept()
+    session = QuizSession(
+        websocket,
+        parse_generate=parse_generate,
+        serve=serve,
+        prefetch=prefetch,
+        record=record,
+        evaluate=evaluate,
+        error_payload=error_payload,
+        stats=quiz_session_stats,
+        speculate=WS_SPECULATE,
+        max_in_flight=WS_MAX_IN_FLIGHT,
+        discard=discard
+    )
+    await session.run()
+
 if __name__ == "__main__":
     import uvicorn
     port = int(os.getenv("APP_PORT", "8000"))
-    uvicorn.run(app, host="0.0.0.0", port=port)
+    if APP_WORKERS > 1:
+        # 複数のワーカープロセスで起動する場合は、各ワーカーがインポートできるようアプリを文字列で指定する
+        uvicorn.run("app:app", host="0.0.0.0", port=port, workers=APP_WORKERS)
+    else:
+        uvicorn.run(app, host="0.0.0.0", port=port)
@@ -0,0 +1,473 @@
+"""複数のOllamaサーバーにリクエストを振り分けるバックエンドプール。"""
+
+import asyncio
+import logging
+import time
+from contextlib import asynccontextmanager
+from typing import Any, AsyncIterator, Callable, Dict, List, Optional, Protocol, Set, Union
+
+import httpx
+from httpx import AsyncClient
+
+from ollama.ollama_client import OllamaClient
+
+logger = logging.getLogger(__name__)
+
+# 期限切れをバックエンドの障害とみなす、リクエスト全体の期限のうちバックエンドが処理していた時間の割合
+TIMEOUT_BLAME_RATIO = 0.5
+
+
+def normalize_model_name(name: str) -> str:
+    """タグが省略されたモデル名を Ollama の表記（name:latest）に揃える"""
+    return name if ":" in name else f"{name}:latest"
+
+
+class OllamaUnavailableError(Exception):
+    """指定したモデルを提供できるバックエンドが1つもない場合の例外"""
+
+    def __init__(self, message: str, retry_after: int) -> None:
+        super().__init__(message)
+        self.retry_after = retry_after
+
+
+class SlotProvider(Protocol):
+    """ヘッジに使う追加の実行枠を提供するもの（OllamaScheduler）"""
+
+    def try_acquire(self) -> bool: ...
+
+    def release(self) -> None: ...
+
+
+class _Backend:
+    """1台のOllamaサーバーの状態"""
+
+    def __init__(self, client: OllamaClient) -> None:
+        self.client = client
+        self.outstanding = 0
+        self.healthy = True
+        self.models: Optional[Set[str]] = None  # None はヘルスチェック前（不明）
+        self.ejected_until = 0.0
+        self.consecutive_failures = 0
+        self.requests = 0
+        self.failures = 0
+        self.ejections = 0
+        self.last_error: Optional[str] = None
+        self.last_used = 0.0  # 最後にリクエストを送信した時刻（time.monotonic）
+        self.warm_ups = 0
+        self.last_load_seconds: Optional[float] = None
+
+    @property
+    def url(self) -> str:
+        return self.client.base_url
+
+    def is_ejected(self, now: float) -> bool:
+        return now < self.ejected_until
+
+    def has_model(self, model: str) -> bool:
+        return self.models is None or model in self.models
+
+
+class OllamaBackendPool:
+    """
+    複数のOllamaサーバーを束ね、OllamaClientと同じインターフェースでリクエストを振り分けるクラス。
+
+    - 処理中のリクエストが最も少ないバックエンドを選択する（least outstanding requests）
+    - タイムアウトや通信エラーが続いたバックエンドは一定時間振り分け対象から外す（passive ejection）
+    - /api/tags を定期的に呼び出し、稼働状況と読み込み済みモデルを確認する（active health check）
+    - 起動時と一定時間使われなかったときにモデルを読み込ませ、初回リクエストの読み込み待ちを避ける（warm-up）
+    - 応答が遅い場合は別のバックエンドにも同じリクエストを送り、先に返った応答を使う（hedged requests）
+    """
+
+    def __init__(
+        self,
+        api_urls: List[str],
+        model_name: str = "gemma3:27b",
+        temperature: float = 0.7,
+        http_client: Optional[AsyncClient] = None,
+        health_interval: float = 10.0,
+        health_timeout: float = 2.0,
+        eject_threshold: int = 2,
+        eject_seconds: float = 30.0,
+        keep_alive: Optional[Union[str, int]] = None,
+        keep_warm_interval: float = 0.0,
+        warm_up_timeout: float = 300.0,
+        on_response: Optional[Callable[[str, Dict[str, Any]], None]] = None,
+        hedge_delay: float = 0.0,
+        request_timeout: float = 30.0,
+    ) -> None:
+        """
+        OllamaBackendPoolを初期化する。
+
+        Args:
+            api_urls (List[str]): OllamaサーバーのベースURLのリスト
+            model_name (str): 使用するモデル名
+            temperature (float): 生成時の温度パラメータ
+            http_client (Optional[AsyncClient]): 全バックエンドで共有するHTTPクライアント
+            health_interval (float): ヘルスチェックの間隔（秒）。0以下の場合は定期実行しない。
+            health_timeout (float): ヘルスチェックのタイムアウト秒数
+            eject_threshold (int): 振り分け対象から外すまでの連続失敗回数
+            eject_seconds (float): 振り分け対象から外す秒数
+            keep_alive (Optional[Union[str, int]]): リクエスト後にモデルをメモリに保持する期間
+            keep_warm_interval (float): この秒数リクエストのなかったバックエンドにモデルの読み込みを
+                要求する間隔。0以下の場合は定期実行しない（keep_alive より短くする）。
+            warm_up_timeout (float): モデルの読み込みを待つ秒数
+            on_response (Optional[Callable[[str, Dict[str, Any]], None]]): 応答ごとに計測値を受け取る関数
+            hedge_delay (float): この秒数以内に応答がない場合、別のバックエンドにも同じリクエストを送る。
+                0以下の場合は送らない（ストリーミングには適用しない）。
+            request_timeout (float): リクエスト全体の期限の長さ（秒）。期限切れのうち、この
+                TIMEOUT_BLAME_RATIO 以上の時間をバックエンドが処理していたものをバックエンドの障害として数える。
+        """
+        if not api_urls:
+            raise ValueError("At least one Ollama backend URL is required")
+        self.model_name = model_name
+        self.health_interval = health_interval
+        self.health_timeout = health_timeout
+        self.eject_threshold = eject_threshold
+        self.eject_seconds = eject_seconds
+        self.keep_warm_interval = keep_warm_interval
+        self.warm_up_timeout = warm_up_timeout
+        self.hedge_delay = hedge_delay
+        self.request_timeout = request_timeout
+        # ヘッジに使う実行枠（プールをラップするスケジューラーが設定する）。Noneの場合は制限しない
+        self.slots: Optional[SlotProvider] = None
+        self._backends = [
+            _Backend(OllamaClient(
+                model_name=model_name,
+                api_url=url,
+                temperature=temperature,
+                http_client=http_client,
+                keep_alive=keep_alive,
+                on_response=on_response,
+            ))
+            for url in api_urls
+        ]
+        self._health_task: Optional[asyncio.Task] = None
+        self._warm_tasks: List[asyncio.Task] = []
+        self._next = 0  # 同数の場合の順番
+        self._hedged = 0
+        self._hedge_wins = 0
+        self._hedges_skipped = 0
+
+    @property
+    def clients(self) -> List[OllamaClient]:
+        """各バックエンドのOllamaClient"""
+        return [backend.client for backend in self._backends]
+
+    def _model_for(self, backend: _Backend) -> str:
+        return normalize_model_name(backend.client.model_name)
+
+    def _select(self, exclude: Set[str]) -> _Backend:
+        """処理中のリクエストが最も少ないバックエンドを選択する"""
+        now = time.monotonic()
+        serving = [
+            b for b in self._backends
+            if b.url not in exclude and b.has_model(self._model_for(b))
+        ]
+        candidates = [b for b in serving if b.healthy and not b.is_ejected(now)]
+        if not candidates:
+            # 全台が除外中の場合は、完全に止めるよりも除外を無視して試す
+            candidates = serving
+        if not candidates:
+            raise OllamaUnavailableError(
+                f"No Ollama backend serves model {self.model_name}",
+                retry_after=max(1, int(self.health_interval)),
+            )
+
+        self._next += 1
+        offset = self._next % len(candidates)
+        rotated = candidates[offset:] + candidates[:offset]
+        return min(rotated, key=lambda b: b.outstanding)
+
+    def _record_success(self, backend: _Backend) -> None:
+        backend.consecutive_failures = 0
+
+    def _record_failure(self, backend: _Backend, error: Exception) -> None:
+        backend.failures += 1
+        backend.consecutive_failures += 1
+        backend.last_error = f"{type(error).__name__}: {error}"
+
+        if isinstance(error, httpx.HTTPStatusError) and error.response.status_code == 404:
+            # モデルが存在しない場合は、次のヘルスチェックまでモデル一覧から外す
+            if backend.models is not None:
+                backend.models.discard(self._model_for(backend))
+            return
+
+        if backend.consecutive_failures >= self.eject_threshold and not backend.is_ejected(time.monotonic()):
+            backend.ejected_until = time.monotonic() + self.eject_seconds
+            backend.ejections += 1
+            logger.warning(
+                "Ollama backend ejected",
+                extra={"backend": backend.url, "error": backend.last_error}
+            )
+
+    def _is_backend_error(self, error: Exception, started_at: float) -> bool:
+        """
+        バックエンド自体の障害とみなすエラーかどうか
+
+        期限切れ（DeadlineExceededError などの TimeoutError）は、期限の大半をこのバックエンドが
+        処理していた場合に限り障害とみなす。待ち行列や再試行で期限をほぼ使い切ってから送信した場合は
+        バックエンドの責任ではないため数えない。
+
+        Args:
+            error (Exception): 発生したエラー
+            started_at (float): バックエンドに送信した時刻（time.monotonic）
+        """
+        if isinstance(error, httpx.HTTPStatusError):
+            return error.response.status_code >= 500 or error.response.status_code == 404
+        if isinstance(error, TimeoutError):
+            return time.monotonic() - started_at >= self.request_timeout * TIMEOUT_BLAME_RATIO
+        return isinstance(error, httpx.TransportError)
+
+    @asynccontextmanager
+    async def _route(self) -> AsyncIterator[_Backend]:
+        """
+        バックエンドを1つ選択して処理中として数え、結果に応じて状態を更新する。
+
+        接続に失敗した場合（リクエストが送信されていない場合）に限り、別のバックエンドで再試行する。
+        """
+        backend = self._select(exclude=set())
+        backend.outstanding += 1
+        backend.requests += 1
+        backend.last_used = time.monotonic()
+        try:
+            yield backend
+        except Exception as e:
+            if self._is_backend_error(e, backend.last_used):
+                self._record_failure(backend, e)
+            raise
+        else:
+            self._record_success(backend)
+        finally:
+            backend.outstanding -= 1
+
+    async def _call_backend(self, backend: _Backend, method: str, args: Any, kwargs: Dict[str, Any]) -> Any:
+        """指定したバックエンドでメソッドを呼び出し、結果に応じて状態を更新する"""
+        backend.outstanding += 1
+        backend.requests += 1
+        started_at = backend.last_used = time.monotonic()
+        try:
+            result = await getattr(backend.client, method)(*args, **kwargs)
+        except Exception as e:
+            if self._is_backend_error(e, started_at):
+                self._record_failure(backend, e)
+            raise
+        finally:
+            backend.outstanding -= 1
+        self._record_success(backend)
+        return result
+
+    async def _call(self, method: str, args: Any, kwargs: Dict[str, Any], tried: Set[str]) -> Any:
+        """
+        バックエンドを選択してメソッドを呼び出す。接続エラーの場合は他のバックエンドで1回だけ再試行する
+
+        Args:
+            tried (Set[str]): 呼び出したバックエンドのURLを追加する集合（ヘッジ先の選択に使用する）
+        """
+        for attempt in range(2):
+            backend = self._select(exclude=tried)
+            tried.add(backend.url)
+            try:
+                return await self._call_backend(backend, method, args, kwargs)
+            except httpx.ConnectError:
+                if attempt == 0 and len(tried) < len(self._backends):
+                    continue
+                raise
+
+    def _hedge_backend(self, tried: Set[str]) -> Optional[_Backend]:
+        """ヘッジ先のバックエンド（未使用で稼働中のもの）を選択する。なければNone"""
+        try:
+            backend = self._select(exclude=tried)
+        except OllamaUnavailableError:
+            return None
+        if not backend.healthy or backend.is_ejected(time.monotonic()):
+            return None
+        return backend
+
+    async def _call_hedge(self, backend: _Backend, method: str, args: Any, kwargs: Dict[str, Any]) -> Any:
+        """ヘッジ先のバックエンドでメソッドを呼び出し、終了（キャンセルを含む）時にヘッジ用の実行枠を返却する"""
+        try:
+            return await self._call_backend(backend, method, args, kwargs)
+        finally:
+            if self.slots is not None:
+                self.slots.release()
+
+    async def _hedged_call(self, method: str, *args: Any, **kwargs: Any) -> Any:
+        """
+        バックエンドを選択してメソッドを呼び出し、hedge_delay 秒以内に応答がなければ
+        別のバックエンドにも同じリクエストを送る。
+
+        ヘッジは同時実行数の上限の内側で行い、スケジューラーの実行枠を追加で取得できない場合は送らない
+        （混雑時にヘッジが負荷を倍増させないように）。
+        先に成功した応答を使い、残りのリクエストはキャンセルする（接続を閉じ、Ollamaの生成を止める）。
+        すべて失敗した場合は最初のエラーを送出する。
+        """
+        tried: Set[str] = set()
+        if self.hedge_delay <= 0 or len(self._backends) < 2:
+            return await self._call(method, args, kwargs, tried)
+
+        primary = asyncio.ensure_future(self._call(method, args, kwargs, tried))
+        pending = {primary}
+        try:
+            done, pending = await asyncio.wait(pending, timeout=self.hedge_delay)
+            if not done:
+                backend = self._hedge_backend(tried)
+                if backend is not None and self.slots is not None and not self.slots.try_acquire():
+                    self._hedges_skipped += 1
+                    backend = None
+                if backend is not None:
+                    tried.add(backend.url)
+                    self._hedged += 1
+                    pending.add(asyncio.ensure_future(self._call_hedge(backend, method, args, kwargs)))
+
+            errors: List[BaseException] = []
+            while True:
+                for task in done:
+                    error = task.exception()
+                    if error is None:
+                        if task is not primary:
+                            self._hedge_wins += 1
+                        return task.result()
+                    errors.append(error)
+                if not pending:
+                    raise errors[0]
+                done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+        finally:
+            for task in pending:
+                task.cancel()
+            if pending:
+                await asyncio.gather(*pending, return_exceptions=True)
+
+    async def generate_text(self, prompt: str, **kwargs: Any) -> str:
+        """選択したバックエンドで OllamaClient.generate_text を呼び出す"""
+        return await self._hedged_call("generate_text", prompt, **kwargs)
+
+    async def generate_json(self, prompt: str, **kwargs: Any) -> Any:
+        """選択したバックエンドで OllamaClient.generate_json を呼び出す"""
+        return await self._hedged_call("generate_json", prompt, **kwargs)
+
+    async def stream_generate(self, prompt: str, **kwargs: Any) -> AsyncIterator[str]:
+        """選択したバックエンドで OllamaClient.stream_generate を呼び出す（ストリーム中は処理中として数える）"""
+        async with self._route() as backend:
+            async for token in backend.client.stream_generate(prompt, **kwargs):
+                yield token
+
+    async def check_health(self) -> None:
+        """全バックエンドの /api/tags を呼び出し、稼働状況とモデル一覧を更新する"""
+        async def check(backend: _Backend) -> None:
+            try:
+                models = await backend.client.list_models(timeout=self.health_timeout)
+            except Exception as e:
+                if backend.healthy:
+                    logger.warning(
+                        "Ollama backend health check failed",
+                        extra={"backend": backend.url, "error": str(e)}
+                    )
+                backend.healthy = False
+                backend.last_error = f"{type(e).__name__}: {e}"
+                return
+            if not backend.healthy:
+                logger.info("Ollama backend recovered", extra={"backend": backend.url})
+            backend.healthy = True
+            backend.models = {normalize_model_name(name) for name in models}
+            backend.ejected_until = 0.0
+            backend.consecutive_failures = 0
+
+        await asyncio.gather(*(check(backend) for backend in self._backends))
+
+    async def warm_up(self, idle_for: float = 0.0) -> None:
+        """
+        稼働中のバックエンドにモデルを読み込ませる。失敗はログに記録するだけで送出しない。
+
+        Args:
+            idle_for (float): この秒数以上リクエストのなかったバックエンドだけを対象にする
+        """
+        now = time.monotonic()
+
+        async def load(backend: _Backend) -> None:
+            backend.last_used = time.monotonic()
+            try:
+                backend.last_load_seconds = await backend.client.load_model(timeout=self.warm_up_timeout)
+            except Exception as e:
+                logger.warning(
+                    "Ollama model warm-up failed",
+                    extra={"backend": backend.url, "error": f"{type(e).__name__}: {e}"}
+                )
+                return
+            backend.warm_ups += 1
+
+        targets = [
+            b for b in self._backends
+            if b.healthy and b.has_model(self._model_for(b))
+            and b.outstanding == 0 and now - b.last_used >= idle_for
+        ]
+        await asyncio.gather(*(load(backend) for backend in targets))
+
+    async def _keep_warm_loop(self) -> None:
+        while True:
+            await asyncio.sleep(self.keep_warm_interval)
+            await self.warm_up(idle_for=self.keep_warm_interval)
+
+    async def _health_loop(self) -> None:
+        while True:
+            await asyncio.sleep(self.health_interval)
+            await self.check_health()
+
+    async def start(self, warm_up: bool = False) -> None:
+        """
+        初回のヘルスチェックを行い、定期的なヘルスチェックを開始する。
+
+        Args:
+            warm_up (bool): モデルの読み込みをバックグラウンドで開始するかどうか（起動は待たない）
+        """
+        await self.check_health()
+        if self.health_interval > 0:
+            self._health_task = asyncio.create_task(self._health_loop())
+        if warm_up:
+            self._warm_tasks.append(asyncio.create_task(self.warm_up()))
+        if self.keep_warm_interval > 0:
+            self._warm_tasks.append(asyncio.create_task(self._keep_warm_loop()))
+
+    async def close(self) -> None:
+        """定期的なヘルスチェックとモデルの読み込みを停止する"""
+        tasks = self._warm_tasks + ([self._health_task] if self._health_task is not None else [])
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+        self._health_task = None
+        self._warm_tasks = []
+
+    def get_pool_stats(self) -> Dict[str, Any]:
+        """
+        接続プールとバックエンドごとの統計情報を取得する。
+
+        Returns:
+            Dict[str, Any]: 共有クライアントの接続状況と、バックエンドごとの稼働状況
+        """
+        stats = self._backends[0].client.get_pool_stats()
+        stats["in_flight"] = sum(b.client.get_pool_stats()["in_flight"] for b in self._backends)
+        stats["requests_total"] = sum(b.client.get_pool_stats()["requests_total"] for b in self._backends)
+        stats["cancelled"] = sum(b.client.get_pool_stats()["cancelled"] for b in self._backends)
+        stats["hedge_delay_seconds"] = self.hedge_delay
+        stats["hedged"] = self._hedged
+        stats["hedge_wins"] = self._hedge_wins
+        stats["hedges_skipped"] = self._hedges_skipped
+
+        now = time.monotonic()
+        stats["backends"] = [
+            {
+                "url": b.url,
+                "healthy": b.healthy,
+                "ejected": b.is_ejected(now),
+                "has_model": b.has_model(self._model_for(b)),
+                "models": sorted(b.models) if b.models is not None else None,
+                "outstanding": b.outstanding,
+                "requests": b.requests,
+                "failures": b.failures,
+                "ejections": b.ejections,
+                "warm_ups": b.warm_ups,
+                "last_load_seconds": b.last_load_seconds,
+                "last_error": b.last_error,
+            }
+            for b in self._backends
+        ]
+        return stats
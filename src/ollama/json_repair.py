@@ -0,0 +1,86 @@
+"""途中で打ち切られたJSON出力を、解析できる形に補修するモジュール。"""
+
+from typing import List, Optional, Tuple
+
+_CLOSERS = {"{": "}", "[": "]"}
+
+
+def close_truncated_json(text: str) -> Optional[str]:
+    """
+    途中で打ち切られたJSONテキストを、最後に完結した値までで閉じたテキストに変換する。
+
+    - 値として書きかけの文字列は、そこまでの内容で閉じる
+    - 書きかけのキーや数値・リテラル、値のないキーは取り除く
+    - 開いたままのオブジェクトと配列を閉じる
+
+    完結しているテキストはそのまま返す（JSONとして正しいかどうかは検証しない）。
+
+    Args:
+        text (str): モデルが出力したテキスト
+
+    Returns:
+        Optional[str]: 補修したテキスト。補修できない場合はNone。
+    """
+    stack: List[str] = []          # 開いている "{" / "["
+    expecting_key: List[bool] = []  # オブジェクトの場合、次の文字列がキーかどうか
+    in_string = False
+    string_is_key = False
+    escaped = False
+    escape_start = -1  # 最後のエスケープシーケンスの開始位置
+    # 切り詰めても正しいJSONになる位置と、その時点で開いている括弧
+    safe_cut: Optional[Tuple[int, Tuple[str, ...]]] = None
+
+    for i, ch in enumerate(text):
+        if in_string:
+            if escaped:
+                escaped = False
+            elif ch == "\\":
+                escaped = True
+                escape_start = i
+            elif ch == '"':
+                in_string = False
+                if not string_is_key:
+                    safe_cut = (i + 1, tuple(stack))
+            continue
+
+        if ch == '"':
+            in_string = True
+            string_is_key = bool(stack) and stack[-1] == "{" and expecting_key[-1]
+        elif ch in "{[":
+            stack.append(ch)
+            expecting_key.append(ch == "{")
+            safe_cut = (i + 1, tuple(stack))
+        elif ch in "}]":
+            if not stack or _CLOSERS[stack[-1]] != ch:
+                return None
+            stack.pop()
+            expecting_key.pop()
+            safe_cut = (i + 1, tuple(stack))
+        elif ch == ":":
+            if stack and stack[-1] == "{":
+                expecting_key[-1] = False
+        elif ch == ",":
+            # 直前の値は完結している
+            safe_cut = (i, tuple(stack))
+            if stack and stack[-1] == "{":
+                expecting_key[-1] = True
+
+    if not stack and not in_string:
+        return text
+
+    if in_string and not string_is_key:
+        # 書きかけの文字列の値は、そこまでの内容で閉じる（途切れたエスケープシーケンスは除く）
+        if escaped or (
+            escape_start >= 0
+            and text[escape_start + 1:escape_start + 2] == "u"
+            and len(text) - escape_start - 2 < 4
+        ):
+            text = text[:escape_start]
+        repaired = text + '"'
+        return repaired + "".join(_CLOSERS[c] for c in reversed(stack))
+
+    if safe_cut is None:
+        return None
+    cut, open_brackets = safe_cut
+    repaired = text[:cut].rstrip().rstrip(",")
+    return repaired + "".join(_CLOSERS[c] for c in reversed(open_brackets))
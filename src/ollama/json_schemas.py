@@ -1,64 +1,76 @@
 """OllamaのJSON出力用スキーマ定義"""
 
-# 問題生成用のスキーマ
-QUIZ_SCHEMA = {
-    "type": "object",
-    "properties": {
-        "question": {
-            "type": "string",
-            "description": "クイズの問題文"
-        },
-        "options": {
-            "type": "array",
-            "items": {
-                "type": "object",
-                "properties": {
-                    "text": {"type": "string", "description": "選択肢のテキスト"},
-                    "isCorrect": {"type": "boolean", "description": "この選択肢が正解かどうか"},
-                    "type": {"type": "string", "enum": ["radio", "checkbox"], "description": "選択肢のタイプ（ラジオボタンかチェックボックスか）", "default": "radio"}
-                },
-                "required": ["text", "isCorrect"]
-            },
-            "minItems": 2,
-            "maxItems": 5,
-            "description": "問題の選択肢リスト"
-        },
-        "explanation": {
-            "type": "string",
-            "description": "問題の解説文（回答後に表示）"
-        }
-    },
-    "required": ["question", "options", "explanation"]
-}
-
-# 回答評価用のスキーマ
-EVALUATION_SCHEMA = {
-    "type": "object",
-    "properties": {
-        "isCorrect": {
-            "type": "boolean",
-            "description": "ユーザーの回答が正解かどうか"
-        },
-        "feedback": {
-            "type": "string",
-            "description": "回答に対するフィードバック"
-        },
-        "detailedExplanation": {
-            "type": "string",
-            "description": "詳細な解説や補足情報"
-        },
-        "additionalResources": {
-            "type": "array",
-            "items": {
-                "type": "object",
-                "properties": {
-                    "title": {"type": "string"},
-                    "description": {"type": "string"}
-                },
-                "required": ["title", "description"]
-            },
-            "description": "追加の学習リソース（オプション）"
-        }
-    },
-    "required": ["isCorrect", "feedback", "detailedExplanation"]
-} 
\ No newline at end of file
+from functools import lru_cache
+from typing import Any, Dict, Type
+
+from pydantic import BaseModel
+
+# Ollama（llama.cpp の文法変換）に渡す必要のないキーワード
+_DROPPED_KEYWORDS = {"title", "example", "examples"}
+
+
+def _inline_refs(node: Any, defs: Dict[str, Any]) -> Any:
+    """$ref を $defs の定義で置き換え、不要なキーワードを取り除く"""
+    if isinstance(node, list):
+        return [_inline_refs(item, defs) for item in node]
+    if not isinstance(node, dict):
+        return node
+
+    if "$ref" in node:
+        resolved = dict(defs[node["$ref"].rsplit("/", 1)[-1]])
+        # $ref と並んだ説明などは参照先より優先する
+        resolved.update({key: value for key, value in node.items() if key != "$ref"})
+        return _inline_refs(resolved, defs)
+
+    result: Dict[str, Any] = {}
+    for key, value in node.items():
+        if key in _DROPPED_KEYWORDS or key == "$defs":
+            continue
+        if key == "properties":
+            # プロパティ名（"title" など）はキーワードではないため、そのまま残す
+            result[key] = {name: _inline_refs(prop, defs) for name, prop in value.items()}
+        else:
+            result[key] = _inline_refs(value, defs)
+    return result
+
+
+@lru_cache(maxsize=None)
+def ollama_schema(model: Type[BaseModel]) -> Dict[str, Any]:
+    """
+    Pydanticモデルから Ollama の format に渡すJSONスキーマを作成する（モデルごとにキャッシュ）。
+
+    参照（$ref）は展開し、タイトルなどの出力の制約に関係しないキーワードは取り除く。
+    戻り値は共有されるため、変更せずに使用すること。
+
+    Args:
+        model (Type[BaseModel]): LLMに出力させる内容を表すモデル
+
+    Returns:
+        Dict[str, Any]: JSONスキーマ
+    """
+    schema = model.model_json_schema()
+    return _inline_refs(schema, schema.get("$defs", {}))
+
+
+def build_list_schema(
+    item_schema: Dict[str, Any],
+    key: str,
+    count: int,
+    description: str = "",
+) -> Dict[str, Any]:
+    """
+    指定した件数の要素のリストを1つのキーに持つオブジェクトのスキーマを作成する。
+
+    Args:
+        item_schema (Dict[str, Any]): 要素のスキーマ
+        key (str): リストを格納するキー
+        count (int): 要素数
+        description (str): リストの説明
+
+    Returns:
+        Dict[str, Any]: スキーマ
+    """
+    items: Dict[str, Any] = {"type": "array", "items": item_schema, "minItems": count, "maxItems": count}
+    if description:
+        items["description"] = description
+    return {"type": "object", "properties": {key: items}, "required": [key]}
@@ -0,0 +1,142 @@
+"""ストリーミング出力されるJSONを逐次的に解析するモジュール。"""
+
+import json
+from typing import Any, Dict, List, Optional, Tuple, Union
+
+# JSON内の位置を表すパス（オブジェクトのキーまたは配列のインデックスの並び）
+JSONPath = Tuple[Union[str, int], ...]
+
+_WHITESPACE = " \t\r\n"
+_STRUCTURAL = ",:{}[]"
+
+
+class IncrementalJSONParser:
+    """
+    チャンク単位で受け取ったJSONテキストから、完成した値を順次取り出すパーサー。
+
+    例えば `{"question": "...", "options": [{...}, {...}]}` を受信中の場合、
+    `("question",)` の文字列や `("options", 0)` のオブジェクトが閉じた時点で
+    イベントとして返す。
+    """
+
+    def __init__(self, max_depth: int = 2) -> None:
+        """
+        IncrementalJSONParserを初期化する。
+
+        Args:
+            max_depth (int): イベントとして返す値のパスの最大の深さ
+        """
+        self.max_depth = max_depth
+        self._text = ""
+        self._pos = 0
+        # 各要素は {"kind": "object"|"array", "start": int, "key": Optional[str], "index": int, "expect_key": bool}
+        self._stack: List[Dict[str, Any]] = []
+        self._string_start: Optional[int] = None
+        self._escape = False
+        self._scalar_start: Optional[int] = None
+        self.done = False
+
+    @property
+    def text(self) -> str:
+        """これまでに受け取ったテキスト全体"""
+        return self._text
+
+    def _current_path(self) -> JSONPath:
+        """現在解析中の値のパスを返す"""
+        path: List[Union[str, int]] = []
+        for frame in self._stack:
+            if frame["kind"] == "object":
+                path.append(frame["key"])
+            else:
+                path.append(frame["index"])
+        return tuple(path)
+
+    def _complete(self, start: int, end: int, events: List[Tuple[JSONPath, Any]]) -> None:
+        """start から end までの値が完成したときにイベントを記録する"""
+        path = self._current_path()
+        if len(path) <= self.max_depth:
+            events.append((path, json.loads(self._text[start:end])))
+
+    def _end_scalar(self, end: int, events: List[Tuple[JSONPath, Any]]) -> None:
+        """数値・真偽値・nullの終端を処理する"""
+        if self._scalar_start is not None:
+            start, self._scalar_start = self._scalar_start, None
+            self._complete(start, end, events)
+
+    def feed(self, chunk: str) -> List[Tuple[JSONPath, Any]]:
+        """
+        テキストのチャンクを追加し、新たに完成した値を返す。
+
+        Args:
+            chunk (str): 追加するテキスト
+
+        Returns:
+            List[Tuple[JSONPath, Any]]: 完成した値のパスと値のリスト（完成順）
+
+        Raises:
+            json.JSONDecodeError: 完成した値が不正なJSONだった場合
+        """
+        self._text += chunk
+        events: List[Tuple[JSONPath, Any]] = []
+        text = self._text
+
+        for i in range(self._pos, len(text)):
+            char = text[i]
+
+            # 文字列の内部
+            if self._string_start is not None:
+                if self._escape:
+                    self._escape = False
+                elif char == "\\":
+                    self._escape = True
+                elif char == '"':
+                    start, self._string_start = self._string_start, None
+                    frame = self._stack[-1] if self._stack else None
+                    if frame is not None and frame["kind"] == "object" and frame["expect_key"]:
+                        frame["key"] = json.loads(text[start:i + 1])
+                    else:
+                        self._complete(start, i + 1, events)
+                continue
+
+            # 数値・真偽値・nullの内部
+            if self._scalar_start is not None:
+                if char in _WHITESPACE or char in _STRUCTURAL:
+                    self._end_scalar(i, events)
+                else:
+                    continue
+
+            if char in _WHITESPACE:
+                continue
+            if char == '"':
+                self._string_start = i
+            elif char in "{[":
+                self._stack.append({
+                    "kind": "object" if char == "{" else "array",
+                    "start": i,
+                    "key": None,
+                    "index": 0,
+                    "expect_key": char == "{",
+                })
+            elif char in "}]":
+                if not self._stack:
+                    continue
+                frame = self._stack.pop()
+                self._complete(frame["start"], i + 1, events)
+                if not self._stack:
+                    self.done = True
+            elif char == ":":
+                if self._stack:
+                    self._stack[-1]["expect_key"] = False
+            elif char == ",":
+                if self._stack:
+                    frame = self._stack[-1]
+                    if frame["kind"] == "object":
+                        frame["expect_key"] = True
+                        frame["key"] = None
+                    else:
+                        frame["index"] += 1
+            else:
+                self._scalar_start = i
+
+        self._pos = len(text)
+        return events
@@ -0,0 +1,142 @@
+"""リクエストの種類と負荷に応じて使用するモデルを選択するルーター。"""
+
+import logging
+from typing import Any, AsyncIterator, Dict, Mapping, Optional
+
+from ollama.scheduler import OllamaScheduler, Priority
+
+logger = logging.getLogger(__name__)
+
+
+class ModelRouter:
+    """
+    モデルごとのOllamaSchedulerを束ね、OllamaSchedulerと同じインターフェースでリクエストを振り分けるクラス。
+
+    - 優先度（回答評価・問題生成・バックグラウンド）ごとに使用するモデルを指定できる
+    - ユーザーが待っているリクエストは、指定モデルの待ち行列や処理時間がしきい値を超えた場合に
+      フォールバック用のモデル（小さく速いモデル）に切り替える
+    """
+
+    def __init__(
+        self,
+        schedulers: Mapping[str, OllamaScheduler],
+        routes: Mapping[Priority, str],
+        fallback_model: Optional[str] = None,
+        fallback_queue_depth: int = 4,
+        fallback_latency: float = 0.0,
+    ) -> None:
+        """
+        ModelRouterを初期化する。
+
+        Args:
+            schedulers (Mapping[str, OllamaScheduler]): モデル名ごとのスケジューラー
+            routes (Mapping[Priority, str]): 優先度ごとに使用するモデル名
+            fallback_model (Optional[str]): 混雑時に切り替えるモデル名。Noneの場合は切り替えない。
+            fallback_queue_depth (int): 切り替える待ち行列の長さ。0以下の場合は待ち行列で判断しない。
+            fallback_latency (float): 切り替える1リクエストの平均処理時間（秒）。0以下の場合は処理時間で判断しない。
+        """
+        for model in list(routes.values()) + ([fallback_model] if fallback_model else []):
+            if model not in schedulers:
+                raise ValueError(f"No scheduler configured for model: {model}")
+        self.schedulers = dict(schedulers)
+        self.routes = dict(routes)
+        self.fallback_model = fallback_model
+        self.fallback_queue_depth = fallback_queue_depth
+        self.fallback_latency = fallback_latency
+        self._decisions: Dict[str, Dict[str, int]] = {p.name.lower(): {} for p in Priority}
+        self._fallbacks: Dict[str, int] = {}
+
+    @property
+    def model_name(self) -> str:
+        """問題生成に使用するモデル名"""
+        return self.routes[Priority.GENERATE]
+
+    def _overloaded(self, scheduler: OllamaScheduler) -> Optional[str]:
+        """しきい値を超えていればその理由を返す"""
+        stats = scheduler.get_stats()
+        if self.fallback_queue_depth > 0 and stats["queue_depth"] >= self.fallback_queue_depth:
+            return "queue_depth"
+        if self.fallback_latency > 0 and stats["avg_service_seconds"] >= self.fallback_latency:
+            return "latency"
+        return None
+
+    def select(self, priority: Priority) -> str:
+        """
+        リクエストに使用するモデルを選択し、選択結果を記録する。
+
+        バックグラウンド処理は混雑時も切り替えない（待ち行列で順番を待つ）。
+
+        Args:
+            priority (Priority): リクエストの優先度
+
+        Returns:
+            str: 使用するモデル名
+        """
+        model = self.routes[priority]
+        if (
+            self.fallback_model
+            and model != self.fallback_model
+            and priority != Priority.BACKGROUND
+        ):
+            reason = self._overloaded(self.schedulers[model])
+            fallback = self.schedulers[self.fallback_model]
+            # 切り替え先も同じように混雑している場合は切り替えない
+            if reason is not None and self._overloaded(fallback) is None:
+                self._fallbacks[reason] = self._fallbacks.get(reason, 0) + 1
+                logger.info(
+                    "Routing to fallback model",
+                    extra={"priority": priority.name, "model": model, "fallback": self.fallback_model, "reason": reason}
+                )
+                model = self.fallback_model
+
+        decisions = self._decisions[priority.name.lower()]
+        decisions[model] = decisions.get(model, 0) + 1
+        return model
+
+    def queue_depth(self, priority: Priority) -> int:
+        """優先度に設定されたモデルの待ち行列の長さ"""
+        return self.schedulers[self.routes[priority]].get_stats()["queue_depth"]
+
+    async def generate_text(
+        self, prompt: str, priority: Priority = Priority.GENERATE, **kwargs: Any
+    ) -> str:
+        """選択したモデルのスケジューラーで generate_text を呼び出す"""
+        return await self.schedulers[self.select(priority)].generate_text(prompt, priority=priority, **kwargs)
+
+    async def generate_json(
+        self, prompt: str, priority: Priority = Priority.GENERATE, **kwargs: Any
+    ) -> Any:
+        """選択したモデルのスケジューラーで generate_json を呼び出す"""
+        return await self.schedulers[self.select(priority)].generate_json(prompt, priority=priority, **kwargs)
+
+    async def stream_generate(
+        self, prompt: str, priority: Priority = Priority.GENERATE, **kwargs: Any
+    ) -> AsyncIterator[str]:
+        """選択したモデルのスケジューラーで stream_generate を呼び出す"""
+        scheduler = self.schedulers[self.select(priority)]
+        async for token in scheduler.stream_generate(prompt, priority=priority, **kwargs):
+            yield token
+
+    def get_pool_stats(self) -> Dict[str, Any]:
+        """モデルごとの接続プールとバックエンドの統計情報を取得する"""
+        return {model: scheduler.get_pool_stats() for model, scheduler in self.schedulers.items()}
+
+    def get_scheduler_stats(self) -> Dict[str, Any]:
+        """モデルごとの待ち行列の統計情報を取得する"""
+        return {model: scheduler.get_stats() for model, scheduler in self.schedulers.items()}
+
+    def get_stats(self) -> Dict[str, Any]:
+        """
+        ルーティングの統計情報を取得する。
+
+        Returns:
+            Dict[str, Any]: 優先度ごとの設定モデル、選択されたモデルの回数、フォールバックの回数など
+        """
+        return {
+            "routes": {p.name.lower(): model for p, model in self.routes.items()},
+            "fallback_model": self.fallback_model,
+            "fallback_queue_depth": self.fallback_queue_depth,
+            "fallback_latency_seconds": self.fallback_latency,
+            "decisions": {name: dict(counts) for name, counts in self._decisions.items()},
+            "fallbacks": dict(self._fallbacks),
+        }
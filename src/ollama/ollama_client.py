@@ -1,30 +1,88 @@
 """Ollama APIクライアントを実装するモジュール。"""
 
+import asyncio
 import json
 import logging
-import os
-from datetime import datetime
-from typing import Optional, Dict, Any, NoReturn, Union
+import time
+from contextlib import asynccontextmanager, nullcontext
+from typing import Optional, Dict, Any, AsyncIterator, Callable, List, NoReturn, Union
 
 import httpx
-from httpx import AsyncClient, HTTPError
+import orjson
+from httpx import AsyncClient, HTTPError, Limits
 
-# ロガーの設定
+# ロガーの設定（出力先とレベルはアプリケーション側で設定する。smartq.logging_config を参照）
 logger = logging.getLogger(__name__)
-logger.setLevel(logging.INFO)
 
-# ログディレクトリの作成
-os.makedirs('logs', exist_ok=True)
 
-# ファイルハンドラーの設定
-fh = logging.FileHandler(
-    f'logs/ollama_client_{datetime.now().strftime("%Y%m%d")}.log',
-    encoding="utf-8"
-)
-fh.setLevel(logging.DEBUG)
-formatter = logging.Formatter("%(asctime)s - %(name)s - %(levelname)s - %(message)s")
-fh.setFormatter(formatter)
-logger.addHandler(fh)
+class DeadlineExceededError(TimeoutError):
+    """リクエスト全体の期限を過ぎたためにOllamaを呼び出せない（待てない）場合の例外"""
+
+
+def parse_keep_alive(value: Optional[str]) -> Optional[Union[str, int]]:
+    """
+    keep_alive の設定値をOllamaに渡す形式に変換する。
+
+    数値のみの場合は秒数（負の値は無期限）、それ以外は "30m" のような期間の文字列として扱う。
+
+    Args:
+        value (Optional[str]): 設定値。空の場合はOllamaのデフォルト（5分）を使用する。
+
+    Returns:
+        Optional[Union[str, int]]: Ollamaに渡す keep_alive の値
+    """
+    if value is None or not value.strip():
+        return None
+    value = value.strip()
+    try:
+        return int(value)
+    except ValueError:
+        return value
+
+
+def create_http_client(
+    max_connections: int = 10,
+    max_keepalive_connections: int = 10,
+    keepalive_expiry: float = 30.0,
+    http2: bool = False,
+    timeout: float = 30.0,
+) -> AsyncClient:
+    """
+    アプリケーション全体で共有するコネクションプール付きHTTPクライアントを作成する。
+
+    Args:
+        max_connections (int): 同時接続数の上限
+        max_keepalive_connections (int): キープアライブで保持する接続数の上限
+        keepalive_expiry (float): アイドル接続を保持する秒数
+        http2 (bool): HTTP/2を有効にするかどうか（h2パッケージが必要）
+        timeout (float): デフォルトのタイムアウト秒数
+
+    Returns:
+        AsyncClient: 共有用のHTTPクライアント
+    """
+    limits = Limits(
+        max_connections=max_connections,
+        max_keepalive_connections=max_keepalive_connections,
+        keepalive_expiry=keepalive_expiry,
+    )
+    try:
+        client = AsyncClient(limits=limits, timeout=timeout, http2=http2)
+    except ImportError:
+        # h2 がインストールされていない場合は HTTP/1.1 で継続する
+        logger.warning("HTTP/2 requested but h2 is not installed; falling back to HTTP/1.1")
+        http2 = False
+        client = AsyncClient(limits=limits, timeout=timeout)
+
+    logger.info(
+        "Shared HTTP client created",
+        extra={
+            "max_connections": max_connections,
+            "max_keepalive_connections": max_keepalive_connections,
+            "keepalive_expiry": keepalive_expiry,
+            "http2": http2,
+        }
+    )
+    return client
 
 
 class OllamaClient:
@@ -35,6 +93,9 @@ class OllamaClient:
         model_name: str = "gemma3:27b",
         api_url: str = "http://localhost:11434",
         temperature: float = 0.7,
+        http_client: Optional[AsyncClient] = None,
+        keep_alive: Optional[Union[str, int]] = None,
+        on_response: Optional[Callable[[str, Dict[str, Any]], None]] = None,
     ) -> None:
         """
         OllamaClientを初期化する。
@@ -43,10 +104,22 @@ class OllamaClient:
             model_name (str): 使用するモデル名
             api_url (str): Ollama APIのベースURL
             temperature (float): 生成時の温度パラメータ
+            http_client (Optional[AsyncClient]): 共有するHTTPクライアント。
+                Noneの場合は呼び出しごとに接続を作成する。クローズは呼び出し側の責任。
+            keep_alive (Optional[Union[str, int]]): リクエスト後にモデルをメモリに保持する期間。
+                Noneの場合はOllamaのデフォルトを使用する。
+            on_response (Optional[Callable[[str, Dict[str, Any]], None]]): 応答ごとにモデル名と
+                応答（所要時間やトークン数を含む。ストリーミングの場合は最後の行）を受け取る関数
         """
         self.model_name = model_name
         self.base_url = api_url.rstrip('/')  # 末尾のスラッシュを削除
         self.temperature = temperature
+        self.keep_alive = keep_alive
+        self.on_response = on_response
+        self._http_client = http_client
+        self._in_flight = 0
+        self._requests_total = 0
+        self._cancelled = 0
         logger.info(
             "OllamaClient initialized",
             extra={
@@ -60,7 +133,8 @@ class OllamaClient:
         self,
         prompt: str,
         additional_options: Optional[Dict[str, Any]] = None,
-        json_schema: Optional[Dict[str, Any]] = None
+        json_schema: Optional[Dict[str, Any]] = None,
+        stream: bool = False
     ) -> Dict[str, Any]:
         """
         APIリクエストのデータを準備する。
@@ -69,6 +143,7 @@ class OllamaClient:
             prompt (str): 入力プロンプト
             additional_options (Optional[Dict[str, Any]]): 追加のオプション
             json_schema (Optional[Dict[str, Any]]): JSONスキーマ。Noneの場合は通常のテキスト形式。
+            stream (bool): トークン単位のストリーミング応答を要求するかどうか
 
         Returns:
             Dict[str, Any]: リクエストデータ
@@ -77,8 +152,10 @@ class OllamaClient:
             "model": self.model_name,
             "prompt": prompt,
             "temperature": self.temperature,
-            "stream": False,
+            "stream": stream,
         }
+        if self.keep_alive is not None:
+            data["keep_alive"] = self.keep_alive
 
         # JSON形式の出力を要求する場合
         if json_schema:
@@ -102,19 +179,209 @@ class OllamaClient:
         Raises:
             Exception: 元のエラーを再送出
         """
-        if isinstance(error, HTTPError):
+        if isinstance(error, DeadlineExceededError):
+            logger.warning("Request deadline exceeded", extra={"error": str(error)})
+        elif isinstance(error, HTTPError):
             logger.error("API request failed", exc_info=error)
         elif isinstance(error, json.JSONDecodeError):
             logger.error("Failed to decode API response", exc_info=error)
+        elif isinstance(error, ValueError):
+            # 応答の検証エラー（parse で指定した変換の失敗）はスタックトレースを出力しない
+            logger.warning("Model output failed validation", extra={"error": str(error)})
         else:
             logger.error("Unexpected error occurred", exc_info=error)
         raise error
 
+    @staticmethod
+    def _timeout_until(deadline: Optional[float], timeout: float) -> float:
+        """
+        期限までの残り時間をタイムアウト秒数として返す。期限がない場合は timeout をそのまま返す。
+
+        Args:
+            deadline (Optional[float]): リクエスト全体の期限（time.monotonic() の値）
+            timeout (float): 期限がない場合のタイムアウト秒数
+
+        Raises:
+            DeadlineExceededError: 期限を過ぎている場合
+        """
+        if deadline is None:
+            return timeout
+        remaining = deadline - time.monotonic()
+        if remaining <= 0:
+            raise DeadlineExceededError("Request deadline exceeded before the Ollama call completed")
+        return remaining
+
+    def _record_cancelled(self) -> None:
+        """呼び出し元のキャンセル（クライアントの切断など）で中断したリクエストを記録する"""
+        self._cancelled += 1
+        logger.info("Ollama request cancelled", extra={"model": self.model_name, "base_url": self.base_url})
+
+    def _notify_response(self, result: Dict[str, Any]) -> None:
+        """応答の計測値を on_response に渡す（失敗してもリクエストには影響させない）"""
+        if self.on_response is None:
+            return
+        try:
+            self.on_response(self.model_name, result)
+        except Exception:
+            logger.warning("Failed to record Ollama response stats", exc_info=True)
+
+    async def _post_generate(
+        self, data: Dict[str, Any], timeout: float, deadline: Optional[float] = None
+    ) -> Dict[str, Any]:
+        """
+        /api/generate にリクエストを送信し、レスポンスのJSONを返す。
+
+        共有クライアントがあればその接続プールを再利用する。
+        キャンセルされた場合や期限を過ぎた場合は接続が閉じられ、Ollamaは生成を中止する。
+
+        Args:
+            data (Dict[str, Any]): リクエストデータ
+            timeout (float): リクエストのタイムアウト秒数（httpx の読み書きごとのタイムアウト）
+            deadline (Optional[float]): リクエスト全体の期限（time.monotonic() の値）
+
+        Returns:
+            Dict[str, Any]: Ollama APIのレスポンス
+        """
+        api_url = f"{self.base_url}/api/generate"
+        # httpx のタイムアウトは読み込みごとのため、期限は応答全体に対して適用する
+        limit = asyncio.timeout(self._timeout_until(deadline, timeout)) if deadline is not None else nullcontext()
+        self._in_flight += 1
+        self._requests_total += 1
+        try:
+            async with limit:
+                if self._http_client is None:
+                    async with AsyncClient(timeout=timeout) as client:
+                        response = await client.post(api_url, json=data)
+                else:
+                    response = await self._http_client.post(api_url, json=data, timeout=timeout)
+            response.raise_for_status()
+            result = orjson.loads(response.content)
+            self._notify_response(result)
+            return result
+        except asyncio.CancelledError:
+            self._record_cancelled()
+            raise
+        except TimeoutError:
+            raise DeadlineExceededError("Request deadline exceeded while waiting for Ollama") from None
+        finally:
+            self._in_flight -= 1
+
+    @asynccontextmanager
+    async def _stream_generate_response(
+        self, data: Dict[str, Any], timeout: float
+    ) -> AsyncIterator[httpx.Response]:
+        """
+        /api/generate にストリーミングリクエストを送信し、レスポンスを返すコンテキストマネージャ。
+
+        Args:
+            data (Dict[str, Any]): リクエストデータ
+            timeout (float): リクエストのタイムアウト秒数
+
+        Yields:
+            httpx.Response: 本文が未読のレスポンス
+        """
+        api_url = f"{self.base_url}/api/generate"
+        self._in_flight += 1
+        self._requests_total += 1
+        try:
+            if self._http_client is None:
+                async with AsyncClient(timeout=timeout) as client:
+                    async with client.stream("POST", api_url, json=data) as response:
+                        response.raise_for_status()
+                        yield response
+            else:
+                async with self._http_client.stream(
+                    "POST", api_url, json=data, timeout=timeout
+                ) as response:
+                    response.raise_for_status()
+                    yield response
+        except (asyncio.CancelledError, GeneratorExit):
+            # 読み終える前に呼び出し元がキャンセルされた（またはストリームを閉じた）場合
+            self._record_cancelled()
+            raise
+        finally:
+            self._in_flight -= 1
+
+    async def load_model(self, timeout: float = 300.0) -> float:
+        """
+        空のプロンプトを送信し、モデルをメモリに読み込ませる（ウォームアップ）。
+
+        読み込み済みの場合は keep_alive の期限が延長されるだけで、すぐに応答が返る。
+
+        Args:
+            timeout (float): リクエストのタイムアウト秒数（モデルの読み込み時間を含む）
+
+        Returns:
+            float: 応答までにかかった秒数
+        """
+        data: Dict[str, Any] = {"model": self.model_name, "prompt": "", "stream": False}
+        if self.keep_alive is not None:
+            data["keep_alive"] = self.keep_alive
+
+        started_at = time.monotonic()
+        await self._post_generate(data, timeout)
+        elapsed = time.monotonic() - started_at
+        logger.info(
+            "Ollama model loaded",
+            extra={"model": self.model_name, "base_url": self.base_url, "seconds": elapsed}
+        )
+        return elapsed
+
+    async def list_models(self, timeout: float = 5.0) -> List[str]:
+        """
+        Ollamaで利用可能なモデル名の一覧を取得する（/api/tags）。
+
+        ヘルスチェックにも使用するため、エラーはログに記録せずにそのまま送出する。
+
+        Args:
+            timeout (float): リクエストのタイムアウト秒数
+
+        Returns:
+            List[str]: モデル名のリスト
+        """
+        api_url = f"{self.base_url}/api/tags"
+        if self._http_client is None:
+            async with AsyncClient(timeout=timeout) as client:
+                response = await client.get(api_url)
+        else:
+            response = await self._http_client.get(api_url, timeout=timeout)
+        response.raise_for_status()
+        return [model.get("name", "") for model in response.json().get("models", [])]
+
+    def get_pool_stats(self) -> Dict[str, Any]:
+        """
+        接続プールの統計情報を取得する。
+
+        Returns:
+            Dict[str, Any]: 共有クライアントの有無、処理中リクエスト数、接続数など
+        """
+        stats: Dict[str, Any] = {
+            "shared": self._http_client is not None,
+            "in_flight": self._in_flight,
+            "requests_total": self._requests_total,
+            "cancelled": self._cancelled,
+        }
+        # httpx は接続プールの状態を公開していないため、httpcore のプールを参照する
+        pool = getattr(getattr(self._http_client, "_transport", None), "_pool", None)
+        connections = getattr(pool, "connections", None)
+        if connections is not None:
+            idle = sum(1 for conn in connections if conn.is_idle())
+            stats.update({
+                "connections": len(connections),
+                "idle_connections": idle,
+                "active_connections": len(connections) - idle,
+                "http2_connections": sum(
+                    1 for conn in connections if "HTTP/2" in repr(conn)
+                ),
+            })
+        return stats
+
     async def generate_text(
         self,
         prompt: str,
         additional_options: Optional[Dict[str, Any]] = None,
-        timeout: float = 30.0
+        timeout: float = 30.0,
+        deadline: Optional[float] = None
     ) -> str:
         """
         テキストを非同期で生成する。
@@ -122,7 +389,9 @@ class OllamaClient:
         Args:
             prompt (str): 入力プロンプト
             additional_options (Optional[Dict[str, Any]]): 追加のオプション
-            timeout (float): リクエストのタイムアウト秒数
+            timeout (float): リクエストのタイムアウト秒数（deadline を指定した場合は使用しない）
+            deadline (Optional[float]): リクエスト全体の期限（time.monotonic() の値）。
+                指定した場合は期限までの残り時間をタイムアウトにする。
 
         Returns:
             str: 生成されたテキスト。エラー時は空文字列を返す。
@@ -131,13 +400,8 @@ class OllamaClient:
             data = self._prepare_request_data(prompt, additional_options)
             logger.debug("Sending async request to Ollama API", extra={"request_data": data})
 
-            async with AsyncClient(timeout=timeout) as client:
-                api_url = f"{self.base_url}/api/generate"
-                response = await client.post(api_url, json=data)
-                response.raise_for_status()
-
-                result = response.json()
-                generated_text = result.get("response", "")
+            result = await self._post_generate(data, self._timeout_until(deadline, timeout), deadline)
+            generated_text = result.get("response", "")
 
             logger.debug(
                 "Async text generation completed",
@@ -154,8 +418,10 @@ class OllamaClient:
         prompt: str,
         json_schema: Optional[Dict[str, Any]] = None,
         additional_options: Optional[Dict[str, Any]] = None,
-        timeout: float = 30.0
-    ) -> Dict[str, Any]:
+        timeout: float = 30.0,
+        parse: Optional[Callable[[str], Any]] = None,
+        deadline: Optional[float] = None
+    ) -> Any:
         """
         JSON形式のデータを非同期で生成する。
 
@@ -163,22 +429,24 @@ class OllamaClient:
             prompt (str): 入力プロンプト
             json_schema (Optional[Dict[str, Any]]): JSONスキーマ。Noneの場合は単純なJSON形式を指定。
             additional_options (Optional[Dict[str, Any]]): 追加のオプション
-            timeout (float): リクエストのタイムアウト秒数
+            timeout (float): リクエストのタイムアウト秒数（deadline を指定した場合は使用しない）
+            parse (Optional[Callable[[str], Any]]): 生成されたテキストを解析・検証する関数
+                （例: TypeAdapter.validate_json）。指定した場合は失敗時に例外を送出する。
+            deadline (Optional[float]): リクエスト全体の期限（time.monotonic() の値）。
+                指定した場合は期限までの残り時間をタイムアウトにする。
 
         Returns:
-            Dict[str, Any]: 生成されたJSON。エラー時は空の辞書を返す。
+            Any: 生成されたJSON（parse を指定した場合はその戻り値）。parse を指定しない場合、
+                JSONとして解析できなければ空の辞書を返す。
         """
         try:
             data = self._prepare_request_data(prompt, additional_options, json_schema)
             logger.debug("Sending async JSON request to Ollama API", extra={"request_data": data})
 
-            async with AsyncClient(timeout=timeout) as client:
-                api_url = f"{self.base_url}/api/generate"
-                response = await client.post(api_url, json=data)
-                response.raise_for_status()
-
-                result = response.json()
-                generated_text = result.get("response", "{}")
+            result = await self._post_generate(data, self._timeout_until(deadline, timeout), deadline)
+            generated_text = result.get("response", "{}")
+            if parse is not None:
+                return parse(generated_text)
 
             # レスポンスがJSON文字列の場合はパースする
             try:
@@ -192,3 +460,52 @@ class OllamaClient:
         except Exception as e:
             self._handle_api_error(e)
             return {}
+
+    async def stream_generate(
+        self,
+        prompt: str,
+        json_schema: Optional[Dict[str, Any]] = None,
+        additional_options: Optional[Dict[str, Any]] = None,
+        timeout: float = 30.0,
+        deadline: Optional[float] = None
+    ) -> AsyncIterator[str]:
+        """
+        生成されたテキストをトークン（チャンク）単位で非同期に返す。
+
+        Args:
+            prompt (str): 入力プロンプト
+            json_schema (Optional[Dict[str, Any]]): JSONスキーマ。Noneの場合は単純なJSON形式を指定。
+            additional_options (Optional[Dict[str, Any]]): 追加のオプション
+            timeout (float): チャンク間のタイムアウト秒数
+            deadline (Optional[float]): リクエスト全体の期限（time.monotonic() の値）。
+                期限を過ぎた場合はストリームを閉じて DeadlineExceededError を送出する。
+
+        Yields:
+            str: 生成されたテキストの断片
+        """
+        try:
+            data = self._prepare_request_data(prompt, additional_options, json_schema, stream=True)
+            logger.debug("Sending async streaming request to Ollama API", extra={"request_data": data})
+
+            if deadline is not None:
+                timeout = min(timeout, self._timeout_until(deadline, timeout))
+            async with self._stream_generate_response(data, timeout) as response:
+                async for line in response.aiter_lines():
+                    if not line:
+                        continue
+                    if deadline is not None and time.monotonic() > deadline:
+                        raise DeadlineExceededError("Request deadline exceeded while streaming from Ollama")
+                    chunk = orjson.loads(line)
+                    if "error" in chunk:
+                        raise ValueError(f"Ollama returned an error: {chunk['error']}")
+                    token = chunk.get("response", "")
+                    if token:
+                        yield token
+                    if chunk.get("done"):
+                        self._notify_response(chunk)
+                        break
+
+            logger.debug("Async streaming generation completed")
+
+        except Exception as e:
+            self._handle_api_error(e)
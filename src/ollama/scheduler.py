@@ -0,0 +1,343 @@
+"""Ollamaへのリクエストの同時実行数と待ち行列を制御するスケジューラー。"""
+
+import asyncio
+import heapq
+import itertools
+import logging
+import math
+import time
+from contextlib import asynccontextmanager
+from enum import IntEnum
+from typing import Any, AsyncIterator, Dict, List, Optional, Tuple, Union
+
+from ollama.backend_pool import OllamaBackendPool
+from ollama.ollama_client import OllamaClient
+
+logger = logging.getLogger(__name__)
+
+
+class Priority(IntEnum):
+    """リクエストの優先度（値が小さいほど優先）"""
+    EVALUATE = 0     # 回答評価（ユーザーが結果を待っている）
+    GENERATE = 1     # 問題生成
+    BACKGROUND = 2   # 事前生成プールの補充などのバックグラウンド処理
+
+
+class OllamaOverloadedError(Exception):
+    """待ち行列が満杯、または待ち時間の上限を超えたためにリクエストを受け付けられない場合の例外"""
+
+    def __init__(self, message: str, retry_after: int) -> None:
+        super().__init__(message)
+        self.retry_after = retry_after
+
+
+class _Waiter:
+    """待ち行列の要素"""
+
+    def __init__(self, priority: Priority, future: asyncio.Future) -> None:
+        self.priority = priority
+        self.future = future
+        self.enqueued_at = time.monotonic()
+
+
+class ConcurrencyLimit:
+    """
+    複数のスケジューラーで共有する同時実行数の上限。
+
+    同じOllamaサーバーで複数のモデル（用途ごとのモデルや切り替え先のモデル）を使う場合に、
+    モデルごとのスケジューラーで1つの上限を共有し、サーバーへの同時リクエスト数が上限を超えないようにする。
+    実行枠が空くと、共有しているすべてのスケジューラーの待機者のうち、優先度が最も高く最も早く到着したものに割り当てる。
+    """
+
+    def __init__(self, max_concurrency: int = 2) -> None:
+        """
+        ConcurrencyLimitを初期化する。
+
+        Args:
+            max_concurrency (int): 共有するすべてのスケジューラーを合わせた同時実行数の上限
+        """
+        self.max_concurrency = max(1, max_concurrency)
+        self.active = 0
+        self.counter = itertools.count()  # スケジューラーをまたいだ到着順
+        self._schedulers: List["OllamaScheduler"] = []
+
+    def register(self, scheduler: "OllamaScheduler") -> None:
+        """上限を共有するスケジューラーを登録する"""
+        self._schedulers.append(scheduler)
+
+    def has_waiters(self) -> bool:
+        """いずれかのスケジューラーに待機者がいるかどうか"""
+        return any(scheduler._queue_depth() for scheduler in self._schedulers)
+
+    def dispatch(self) -> None:
+        """空いている実行枠を、優先度が最も高く最も早く到着した待機者に割り当てる"""
+        while self.active < self.max_concurrency:
+            best: Optional["OllamaScheduler"] = None
+            for scheduler in self._schedulers:
+                queue = scheduler._queue
+                while queue and queue[0][2].future.done():
+                    heapq.heappop(queue)
+                if queue and (best is None or queue[0][:2] < best._queue[0][:2]):
+                    best = scheduler
+            if best is None:
+                return
+            _, _, waiter = heapq.heappop(best._queue)
+            self.active += 1
+            best._active += 1
+            waiter.future.set_result(None)
+
+
+class OllamaScheduler:
+    """
+    OllamaClientをラップし、同時実行数の上限と優先度付きの待ち行列を提供するクラス。
+
+    同時実行数が上限に達している場合は優先度順に待機させ、待ち行列が満杯の場合は
+    最も優先度の低い待機中のリクエストを押し出すか、新しいリクエストを即座に拒否する。
+    limit を指定した場合、同時実行数の上限はそれを共有するスケジューラー全体に適用される
+    （待ち行列と統計情報はスケジューラーごと）。
+    """
+
+    def __init__(
+        self,
+        client: Union[OllamaClient, OllamaBackendPool],
+        max_concurrency: int = 2,
+        max_queue: int = 16,
+        max_wait: float = 60.0,
+        limit: Optional[ConcurrencyLimit] = None,
+    ) -> None:
+        """
+        OllamaSchedulerを初期化する。
+
+        Args:
+            client (Union[OllamaClient, OllamaBackendPool]): ラップするクライアント（複数バックエンドの場合はプール）
+            max_concurrency (int): Ollamaへ同時に送信するリクエスト数の上限（limit を指定した場合は使用しない）
+            max_queue (int): 待機できるリクエスト数の上限
+            max_wait (float): 実行開始まで待機する秒数の上限
+            limit (Optional[ConcurrencyLimit]): 他のスケジューラーと共有する同時実行数の上限。
+                Noneの場合はこのスケジューラー専用の上限（max_concurrency）を使用する。
+        """
+        self.client = client
+        self.limit = limit if limit is not None else ConcurrencyLimit(max_concurrency)
+        self.limit.register(self)
+        if isinstance(client, OllamaBackendPool):
+            # プールのヘッジ（同じリクエストの追加送信）にも実行枠を使わせる
+            client.slots = self
+        self.max_queue = max_queue
+        self.max_wait = max_wait
+        self._active = 0  # このスケジューラーで実行中のリクエスト数
+        self._queue: List[Tuple[int, int, _Waiter]] = []  # (優先度, 到着順, 待機者)
+
+        # 統計情報
+        self._avg_service_time = 5.0  # 1リクエストの処理時間の指数移動平均（秒）
+        self._max_queue_depth = 0
+        self._admitted = {p.name.lower(): 0 for p in Priority}
+        self._rejected = {p.name.lower(): 0 for p in Priority}
+        self._wait_total = {p.name.lower(): 0.0 for p in Priority}
+        self._wait_max = {p.name.lower(): 0.0 for p in Priority}
+
+    @property
+    def max_concurrency(self) -> int:
+        """同時実行数の上限（共有している場合は共有するスケジューラー全体の上限）"""
+        return self.limit.max_concurrency
+
+    @property
+    def model_name(self) -> str:
+        """ラップしているクライアントのモデル名"""
+        return self.client.model_name
+
+    def _queue_depth(self) -> int:
+        return sum(1 for _, _, waiter in self._queue if not waiter.future.done())
+
+    def _queue_depth_by_priority(self) -> Dict[str, int]:
+        depths = {p.name.lower(): 0 for p in Priority}
+        for _, _, waiter in self._queue:
+            if not waiter.future.done():
+                depths[waiter.priority.name.lower()] += 1
+        return depths
+
+    def _retry_after(self) -> int:
+        """待ち行列が解消するまでのおおよその秒数"""
+        backlog = self._queue_depth() + self._active
+        return max(1, math.ceil(self._avg_service_time * backlog / self.max_concurrency))
+
+    def _reject(self, priority: Priority, reason: str) -> OllamaOverloadedError:
+        self._rejected[priority.name.lower()] += 1
+        logger.warning("Ollama request rejected", extra={"priority": priority.name, "reason": reason})
+        return OllamaOverloadedError(reason, self._retry_after())
+
+    def _record_wait(self, priority: Priority, waited: float) -> None:
+        name = priority.name.lower()
+        self._admitted[name] += 1
+        self._wait_total[name] += waited
+        self._wait_max[name] = max(self._wait_max[name], waited)
+
+    def _evict_lowest(self, priority: Priority) -> bool:
+        """新しいリクエストより優先度の低い待機者がいれば、最も低いものを拒否して枠を空ける"""
+        candidates = [entry for entry in self._queue if not entry[2].future.done()]
+        if not candidates:
+            return False
+        lowest = max(candidates, key=lambda entry: (entry[0], entry[1]))
+        if lowest[0] <= priority:
+            return False
+        waiter = lowest[2]
+        waiter.future.set_exception(self._reject(waiter.priority, "Displaced by a higher-priority request"))
+        self._queue.remove(lowest)
+        heapq.heapify(self._queue)
+        return True
+
+    def try_acquire(self) -> bool:
+        """
+        待たずに実行枠を1つ取得する。取得した枠は release() で返却する。
+
+        空きがない場合や待機者がいる場合は取得しない（待機者より先に枠を使わない）。
+
+        Returns:
+            bool: 取得できたかどうか
+        """
+        if self.limit.active < self.limit.max_concurrency and not self.limit.has_waiters():
+            self.limit.active += 1
+            self._active += 1
+            return True
+        return False
+
+    def release(self) -> None:
+        """try_acquire() で取得した実行枠を返却する"""
+        self._release()
+
+    async def _acquire(self, priority: Priority, deadline: Optional[float] = None) -> None:
+        """実行枠を取得する。取得できない場合は OllamaOverloadedError を送出する"""
+        if self.try_acquire():
+            self._record_wait(priority, 0.0)
+            return
+
+        if self._queue_depth() >= self.max_queue and not self._evict_lowest(priority):
+            raise self._reject(priority, "Ollama request queue is full")
+
+        # リクエスト全体の期限が先に来る場合は、期限まで待つ
+        max_wait = self.max_wait
+        if deadline is not None and deadline - time.monotonic() < max_wait:
+            max_wait = deadline - time.monotonic()
+            if max_wait <= 0:
+                raise self._reject(priority, "Request deadline expired before an Ollama slot was available")
+
+        future = asyncio.get_running_loop().create_future()
+        waiter = _Waiter(priority, future)
+        heapq.heappush(self._queue, (int(priority), next(self.limit.counter), waiter))
+        self._max_queue_depth = max(self._max_queue_depth, self._queue_depth())
+
+        try:
+            # wait_for は割り当てと同時にキャンセルされるとキャンセルを握りつぶすため、timeout で待つ
+            async with asyncio.timeout(max_wait):
+                await future
+        except TimeoutError:
+            if future.done() and not future.cancelled() and future.exception() is None:
+                # タイムアウトと同時に実行枠が割り当てられた場合は返却する
+                self._release()
+            else:
+                future.cancel()
+            raise self._reject(priority, "Timed out waiting for an Ollama slot")
+        except asyncio.CancelledError:
+            if future.done() and not future.cancelled() and future.exception() is None:
+                self._release()
+            else:
+                future.cancel()
+            raise
+
+        self._record_wait(priority, time.monotonic() - waiter.enqueued_at)
+
+    def _release(self) -> None:
+        """実行枠を返却し、上限を共有するスケジューラーの中で最も優先度の高い待機者に割り当てる"""
+        self._active -= 1
+        self.limit.active -= 1
+        self.limit.dispatch()
+
+    @asynccontextmanager
+    async def slot(
+        self, priority: Priority = Priority.GENERATE, deadline: Optional[float] = None
+    ) -> AsyncIterator[None]:
+        """
+        実行枠を確保するコンテキストマネージャ。
+
+        待機中にキャンセルされた場合（クライアントの切断など）は待ち行列から外れる。
+
+        Args:
+            priority (Priority): リクエストの優先度
+            deadline (Optional[float]): リクエスト全体の期限（time.monotonic() の値）。
+                max_wait より先に来る場合は期限まで待つ。
+
+        Raises:
+            OllamaOverloadedError: 待ち行列が満杯、または待ち時間の上限（期限）を超えた場合
+        """
+        await self._acquire(priority, deadline)
+        started_at = time.monotonic()
+        try:
+            yield
+        finally:
+            elapsed = time.monotonic() - started_at
+            self._avg_service_time = 0.8 * self._avg_service_time + 0.2 * elapsed
+            self._release()
+
+    async def generate_text(
+        self,
+        prompt: str,
+        priority: Priority = Priority.GENERATE,
+        deadline: Optional[float] = None,
+        **kwargs: Any
+    ) -> str:
+        """優先度に従って実行枠を確保し、OllamaClient.generate_text を呼び出す（期限は待ち時間と呼び出しの両方に適用する）"""
+        async with self.slot(priority, deadline):
+            return await self.client.generate_text(prompt, deadline=deadline, **kwargs)
+
+    async def generate_json(
+        self,
+        prompt: str,
+        priority: Priority = Priority.GENERATE,
+        deadline: Optional[float] = None,
+        **kwargs: Any
+    ) -> Any:
+        """優先度に従って実行枠を確保し、OllamaClient.generate_json を呼び出す（期限は待ち時間と呼び出しの両方に適用する）"""
+        async with self.slot(priority, deadline):
+            return await self.client.generate_json(prompt, deadline=deadline, **kwargs)
+
+    async def stream_generate(
+        self,
+        prompt: str,
+        priority: Priority = Priority.GENERATE,
+        deadline: Optional[float] = None,
+        **kwargs: Any
+    ) -> AsyncIterator[str]:
+        """優先度に従って実行枠を確保し、ストリーミングが終わるまで保持する"""
+        async with self.slot(priority, deadline):
+            async for token in self.client.stream_generate(prompt, deadline=deadline, **kwargs):
+                yield token
+
+    def get_pool_stats(self) -> Dict[str, Any]:
+        """ラップしているクライアントの接続プールの統計情報を取得する"""
+        return self.client.get_pool_stats()
+
+    def get_stats(self) -> Dict[str, Any]:
+        """
+        スケジューラーの統計情報を取得する。
+
+        Returns:
+            Dict[str, Any]: 実行中・待機中のリクエスト数、優先度ごとの待ち時間や拒否数など
+        """
+        return {
+            "active": self._active,
+            "max_concurrency": self.max_concurrency,
+            "limit_active": self.limit.active,  # 上限を共有するスケジューラー全体で実行中のリクエスト数
+            "queue_depth": self._queue_depth(),
+            "queue_depth_by_priority": self._queue_depth_by_priority(),
+            "max_queue": self.max_queue,
+            "max_queue_depth_seen": self._max_queue_depth,
+            "avg_service_seconds": self._avg_service_time,
+            "retry_after_seconds": self._retry_after(),
+            "admitted": dict(self._admitted),
+            "rejected": dict(self._rejected),
+            "avg_wait_seconds": {
+                name: (self._wait_total[name] / count if count else 0.0)
+                for name, count in self._admitted.items()
+            },
+            "max_wait_seconds": dict(self._wait_max),
+            "wait_seconds_total": dict(self._wait_total),
+        }
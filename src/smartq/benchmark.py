@@ -0,0 +1,319 @@
+"""
+SmartQ の API に一定の同時実行数でリクエストを送り、スループットとレイテンシを計測するベンチマーク。
+
+/api/generate と /api/evaluate を同時実行数ごとに計測し、p50/p95/p99 のレイテンシと
+スループットを表示してJSONに保存する。--baseline に以前の結果を指定すると差分を表示する。
+Ollama の代わりに smartq.fake_ollama を使うと、SmartQ 自体のオーバーヘッドを計測できる。
+
+    PYTHONPATH=src python -m smartq.fake_ollama --port 11435 &
+    OLLAMA_HOST=http://127.0.0.1:11435 QUESTION_POOL_SIZE=0 python src/app.py &
+    PYTHONPATH=src python -m smartq.benchmark --concurrency 1,8,32 --requests 200
+"""
+
+import argparse
+import asyncio
+import itertools
+import json
+import os
+import subprocess
+import time
+from datetime import datetime, timezone
+from typing import Any, Awaitable, Callable, Dict, List, Optional, Sequence
+
+import httpx
+
+ENDPOINTS = ("generate", "evaluate")
+
+DEFAULT_SYSTEM_PROMPT = "ネットワーク技術者向けの4択問題を作成してください。"
+
+
+def percentile(sorted_values: Sequence[float], q: float) -> float:
+    """
+    昇順に並んだ値のパーセンタイルを線形補間で求める。
+
+    Args:
+        sorted_values (Sequence[float]): 昇順の値
+        q (float): パーセンタイル（0〜100）
+
+    Returns:
+        float: パーセンタイル値。値がない場合は0.0。
+    """
+    if not sorted_values:
+        return 0.0
+    position = (len(sorted_values) - 1) * q / 100
+    lower = int(position)
+    upper = min(lower + 1, len(sorted_values) - 1)
+    return sorted_values[lower] + (sorted_values[upper] - sorted_values[lower]) * (position - lower)
+
+
+def summarize(
+    endpoint: str,
+    concurrency: int,
+    latencies: List[float],
+    statuses: List[int],
+    duration: float,
+) -> Dict[str, Any]:
+    """
+    1つの計測結果を集計する。
+
+    Args:
+        endpoint (str): 計測したエンドポイント
+        concurrency (int): 同時実行数
+        latencies (List[float]): 成功したリクエストのレイテンシ（秒）
+        statuses (List[int]): すべてのリクエストのステータスコード（通信エラーは0）
+        duration (float): 計測にかかった秒数
+
+    Returns:
+        Dict[str, Any]: スループット、レイテンシのパーセンタイル（ミリ秒）、ステータスコードごとの件数
+    """
+    ordered = sorted(latencies)
+    status_counts: Dict[str, int] = {}
+    for status in statuses:
+        status_counts[str(status)] = status_counts.get(str(status), 0) + 1
+    return {
+        "endpoint": endpoint,
+        "concurrency": concurrency,
+        "requests": len(statuses),
+        "ok": len(latencies),
+        "errors": len(statuses) - len(latencies),
+        "statuses": status_counts,
+        "duration_seconds": round(duration, 3),
+        "throughput_rps": round(len(latencies) / duration, 3) if duration > 0 else 0.0,
+        "latency_ms": {
+            "p50": round(percentile(ordered, 50) * 1000, 2),
+            "p95": round(percentile(ordered, 95) * 1000, 2),
+            "p99": round(percentile(ordered, 99) * 1000, 2),
+            "mean": round(sum(ordered) / len(ordered) * 1000, 2) if ordered else 0.0,
+            "max": round(ordered[-1] * 1000, 2) if ordered else 0.0,
+        },
+    }
+
+
+async def run_level(
+    send: Callable[[int], Awaitable[httpx.Response]],
+    endpoint: str,
+    concurrency: int,
+    total: int,
+) -> Dict[str, Any]:
+    """
+    total 件のリクエストを concurrency 件ずつ並行に送信して計測する。
+
+    Args:
+        send (Callable[[int], Awaitable[httpx.Response]]): 通し番号を受け取ってリクエストを送信する関数
+        endpoint (str): 計測するエンドポイント
+        concurrency (int): 同時実行数
+        total (int): 送信するリクエスト数
+
+    Returns:
+        Dict[str, Any]: summarize の結果
+    """
+    counter = itertools.count()
+    latencies: List[float] = []
+    statuses: List[int] = []
+
+    async def worker() -> None:
+        while True:
+            index = next(counter)
+            if index >= total:
+                return
+            started_at = time.perf_counter()
+            try:
+                response = await send(index)
+                status = response.status_code
+            except httpx.HTTPError:
+                status = 0
+            elapsed = time.perf_counter() - started_at
+            statuses.append(status)
+            if status == 200:
+                latencies.append(elapsed)
+
+    started_at = time.perf_counter()
+    await asyncio.gather(*(worker() for _ in range(concurrency)))
+    return summarize(endpoint, concurrency, latencies, statuses, time.perf_counter() - started_at)
+
+
+class Scenario:
+    """ベンチマークで送信するリクエストの内容"""
+
+    def __init__(
+        self,
+        client: httpx.AsyncClient,
+        topics: Sequence[str],
+        system_prompt: str,
+        detailed: bool,
+        unique_answers: bool,
+    ) -> None:
+        """
+        Scenarioを初期化する。
+
+        Args:
+            client (httpx.AsyncClient): SmartQ に接続するクライアント（base_url を設定済み）
+            topics (Sequence[str]): 問題生成で順番に使用するトピック
+            system_prompt (str): 問題生成のシステムプロンプト
+            detailed (bool): 回答評価でAIによるフィードバックを要求するかどうか（false の場合は高速パス）
+            unique_answers (bool): 回答評価ごとに異なる自由記述を送り、評価キャッシュに当たらないようにするかどうか
+        """
+        self.client = client
+        self.topics = list(topics)
+        self.system_prompt = system_prompt
+        self.detailed = detailed
+        self.unique_answers = unique_answers
+        self.questions: List[Dict[str, Any]] = []
+        self._answers = itertools.count()  # 同時実行数を変えても同じ自由記述を送らないための通し番号
+
+    async def generate(self, index: int) -> httpx.Response:
+        return await self.client.post("/api/generate", json={
+            "topic": self.topics[index % len(self.topics)],
+            "system_prompt": self.system_prompt,
+        })
+
+    async def prepare_questions(self, count: int) -> None:
+        """回答評価の計測に使う問題を生成しておく"""
+        while len(self.questions) < count:
+            response = await self.generate(len(self.questions))
+            response.raise_for_status()
+            self.questions.append(response.json())
+
+    async def evaluate(self, index: int) -> httpx.Response:
+        question = self.questions[index % len(self.questions)]
+        body: Dict[str, Any] = {
+            "question_id": question["id"],
+            "selected_options": [{"index": index % len(question["options"])}],
+            "detailed": self.detailed,
+        }
+        if self.unique_answers:
+            body["additional_answer"] = f"ベンチマークの回答 {next(self._answers)}"
+        return await self.client.post("/api/evaluate", json=body)
+
+    def sender(self, endpoint: str) -> Callable[[int], Awaitable[httpx.Response]]:
+        return {"generate": self.generate, "evaluate": self.evaluate}[endpoint]
+
+
+def git_revision() -> Optional[str]:
+    """計測したコードのコミット（取得できない場合はNone）"""
+    try:
+        output = subprocess.run(
+            ["git", "rev-parse", "--short", "HEAD"], capture_output=True, text=True, check=True, timeout=5
+        )
+    except (OSError, subprocess.SubprocessError):
+        return None
+    return output.stdout.strip() or None
+
+
+def format_table(results: List[Dict[str, Any]], baseline: Optional[Dict[str, Any]] = None) -> str:
+    """
+    計測結果を表形式の文字列にする。baseline を指定した場合は p95 とスループットの変化率を加える。
+
+    Args:
+        results (List[Dict[str, Any]]): summarize の結果のリスト
+        baseline (Optional[Dict[str, Any]]): 比較する以前の結果（保存したJSON）
+
+    Returns:
+        str: 表形式の文字列
+    """
+    previous = {
+        (row["endpoint"], row["concurrency"]): row for row in (baseline or {}).get("results", [])
+    }
+    header = f"{'endpoint':<10} {'conc':>5} {'ok/req':>10} {'rps':>9} {'p50 ms':>9} {'p95 ms':>9} {'p99 ms':>9}"
+    if baseline is not None:
+        header += f" {'Δp95':>8} {'Δrps':>8}"
+    lines = [header]
+    for row in results:
+        latency = row["latency_ms"]
+        line = (
+            f"{row['endpoint']:<10} {row['concurrency']:>5} {row['ok']:>5}/{row['requests']:<4} "
+            f"{row['throughput_rps']:>9.2f} {latency['p50']:>9.1f} {latency['p95']:>9.1f} {latency['p99']:>9.1f}"
+        )
+        before = previous.get((row["endpoint"], row["concurrency"]))
+        if baseline is not None:
+            if before and before["latency_ms"]["p95"] and before["throughput_rps"]:
+                p95_change = latency["p95"] / before["latency_ms"]["p95"] - 1
+                rps_change = row["throughput_rps"] / before["throughput_rps"] - 1
+                line += f" {p95_change:>+8.1%} {rps_change:>+8.1%}"
+            else:
+                line += f" {'-':>8} {'-':>8}"
+        lines.append(line)
+    return "\n".join(lines)
+
+
+async def run_benchmark(args: argparse.Namespace) -> Dict[str, Any]:
+    """設定に従ってすべての計測を行い、保存する結果を返す"""
+    endpoints = [name.strip() for name in args.endpoints.split(",") if name.strip()]
+    levels = [int(level) for level in args.concurrency.split(",") if level.strip()]
+    limits = httpx.Limits(max_connections=max(levels), max_keepalive_connections=max(levels))
+
+    async with httpx.AsyncClient(base_url=args.url, timeout=args.timeout, limits=limits) as client:
+        scenario = Scenario(
+            client,
+            topics=[topic.strip() for topic in args.topics.split(",") if topic.strip()],
+            system_prompt=args.system_prompt,
+            detailed=args.detailed,
+            unique_answers=args.unique_answers,
+        )
+        if "evaluate" in endpoints:
+            await scenario.prepare_questions(args.questions)
+
+        results = []
+        for endpoint in endpoints:
+            send = scenario.sender(endpoint)
+            if args.warmup:
+                await run_level(send, endpoint, min(levels), args.warmup)
+            for level in levels:
+                results.append(await run_level(send, endpoint, level, args.requests))
+
+    return {
+        "created_at": datetime.now(timezone.utc).isoformat(),
+        "git_revision": git_revision(),
+        "config": {
+            "url": args.url,
+            "endpoints": endpoints,
+            "concurrency": levels,
+            "requests": args.requests,
+            "warmup": args.warmup,
+            "detailed": args.detailed,
+            "unique_answers": args.unique_answers,
+        },
+        "results": results,
+    }
+
+
+def main(argv: Optional[Sequence[str]] = None) -> None:
+    parser = argparse.ArgumentParser(description="SmartQ API のベンチマーク")
+    parser.add_argument("--url", default="http://127.0.0.1:8000", help="SmartQ のベースURL")
+    parser.add_argument("--endpoints", default=",".join(ENDPOINTS), help="計測するエンドポイント（generate,evaluate）")
+    parser.add_argument("--concurrency", default="1,4,16", help="同時実行数（カンマ区切り）")
+    parser.add_argument("--requests", type=int, default=100, help="同時実行数ごとのリクエスト数")
+    parser.add_argument("--warmup", type=int, default=5, help="計測前に送るリクエスト数")
+    parser.add_argument("--questions", type=int, default=20, help="回答評価に使う問題の数")
+    parser.add_argument("--topics", default="VLAN,ACL,OSPF,BGP", help="問題生成のトピック（カンマ区切り）")
+    parser.add_argument("--system-prompt", default=DEFAULT_SYSTEM_PROMPT)
+    parser.add_argument("--detailed", action=argparse.BooleanOptionalAction, default=True,
+                        help="回答評価でAIによるフィードバックを要求する（--no-detailed で高速パス）")
+    parser.add_argument("--unique-answers", action=argparse.BooleanOptionalAction, default=True,
+                        help="回答ごとに異なる自由記述を送り、評価キャッシュに当たらないようにする")
+    parser.add_argument("--timeout", type=float, default=120.0, help="1リクエストのタイムアウト秒数")
+    parser.add_argument("--output", default=None, help="結果を保存するJSONファイル（省略時は benchmarks/ 以下）")
+    parser.add_argument("--baseline", default=None, help="比較する以前の結果のJSONファイル")
+    args = parser.parse_args(argv)
+
+    report = asyncio.run(run_benchmark(args))
+
+    baseline = None
+    if args.baseline:
+        with open(args.baseline, encoding="utf-8") as f:
+            baseline = json.load(f)
+    print(format_table(report["results"], baseline))
+
+    output = args.output or os.path.join(
+        "benchmarks", f"bench-{datetime.now().strftime('%Y%m%d-%H%M%S')}-{report['git_revision'] or 'nogit'}.json"
+    )
+    directory = os.path.dirname(output)
+    if directory:
+        os.makedirs(directory, exist_ok=True)
+    with open(output, "w", encoding="utf-8") as f:
+        json.dump(report, f, ensure_ascii=False, indent=2)
+    print(f"saved: {output}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,343 @@
+"""
+問題バンクを一括生成するコマンドラインツール。
+
+トピックごとに指定した数の問題を、同時実行数を制限しながら一括生成（1回の呼び出しで複数問）し、
+検証済みの問題を1行1問のJSONL（topic 付き）に追記する。確定した書き込み位置とトピックごとの件数を
+チェックポイントに記録するため、中断した場合も同じコマンドで続きから再開できる。
+
+    PYTHONPATH=src python -m smartq.bulk --topics VLAN,ACL,OSPF --per-topic 500 --output banks/network.jsonl
+
+プロンプトの構築、Ollamaへの接続（OLLAMA_HOST などの環境変数）、応答の検証と補修は app.py と共通。
+アプリ（ログの設定、静的ファイル、共有状態など）は起動せず、Ollamaへの接続だけを作成する。
+"""
+
+import argparse
+import asyncio
+import json
+import os
+import sys
+import time
+from typing import Any, Awaitable, Callable, Dict, List, Optional, Sequence, Tuple
+
+import orjson
+
+# (トピック, 生成する問題数, 試行回数)
+WorkUnit = Tuple[str, int, int]
+
+
+class Checkpoint:
+    """出力ファイルの確定済みの位置（バイト）とトピックごとの問題数"""
+
+    def __init__(self, path: str) -> None:
+        self.path = path
+        self.offset = 0
+        self.counts: Dict[str, int] = {}
+
+    def load(self) -> bool:
+        """チェックポイントを読み込む。存在しない場合はFalse"""
+        try:
+            with open(self.path, "rb") as f:
+                data = orjson.loads(f.read())
+        except FileNotFoundError:
+            return False
+        self.offset = data["offset"]
+        self.counts = dict(data["counts"])
+        return True
+
+    def save(self) -> None:
+        """一時ファイルに書き込んでから置き換える（書き込み中に中断しても壊れない）"""
+        temp_path = f"{self.path}.tmp"
+        with open(temp_path, "wb") as f:
+            f.write(orjson.dumps({"offset": self.offset, "counts": self.counts, "updated_at": time.time()}))
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(temp_path, self.path)
+
+
+def scan_output(path: str) -> Tuple[int, Dict[str, int]]:
+    """
+    チェックポイントがない出力ファイルから、完全な行までの位置とトピックごとの問題数を求める。
+
+    Args:
+        path (str): 出力ファイルのパス
+
+    Returns:
+        Tuple[int, Dict[str, int]]: 最後の完全な行の終わりの位置と、トピックごとの問題数
+    """
+    offset = 0
+    counts: Dict[str, int] = {}
+    with open(path, "rb") as f:
+        for line in f:
+            if not line.endswith(b"\n"):
+                break  # 書き込み途中で中断した行
+            try:
+                topic = orjson.loads(line)["topic"]
+            except (orjson.JSONDecodeError, KeyError, TypeError):
+                break
+            counts[topic] = counts.get(topic, 0) + 1
+            offset += len(line)
+    return offset, counts
+
+
+class BulkGenerator:
+    """
+    トピックごとの目標数まで問題を生成し、JSONLに追記するクラス。
+
+    - 作業単位（トピックと問題数）を同時実行数のワーカーで処理する
+    - 生成できなかった分は試行回数の上限まで作業単位として戻す
+    - 混雑による拒否（retry_after を持つ例外）は試行回数に数えず、待ってから再試行する
+    - checkpoint_every 問ごとに出力を fsync し、確定した位置と件数をチェックポイントに記録する
+    """
+
+    def __init__(
+        self,
+        generate: Callable[[str, int], Awaitable[List[Any]]],
+        output_path: str,
+        checkpoint_path: Optional[str] = None,
+        concurrency: int = 2,
+        batch_size: int = 5,
+        checkpoint_every: int = 50,
+        max_attempts: int = 3,
+        progress_interval: float = 30.0,
+    ) -> None:
+        """
+        BulkGeneratorを初期化する。
+
+        Args:
+            generate (Callable[[str, int], Awaitable[List[Any]]]): トピックと問題数を受け取り、
+                検証済みの問題（pydantic モデル）のリストを返す関数
+            output_path (str): 出力するJSONLファイルのパス
+            checkpoint_path (Optional[str]): チェックポイントのパス（省略時は出力ファイル名 + .checkpoint）
+            concurrency (int): 同時に実行する生成の数
+            batch_size (int): 1回の生成で要求する問題数
+            checkpoint_every (int): チェックポイントを記録する間隔（問題数）
+            max_attempts (int): 1つの作業単位を試行する回数の上限
+            progress_interval (float): 進捗を表示する間隔（秒）。0以下の場合は表示しない。
+        """
+        self.generate = generate
+        self.output_path = output_path
+        self.checkpoint = Checkpoint(checkpoint_path or f"{output_path}.checkpoint")
+        self.concurrency = max(1, concurrency)
+        self.batch_size = max(1, batch_size)
+        self.checkpoint_every = max(1, checkpoint_every)
+        self.max_attempts = max(1, max_attempts)
+        self.progress_interval = progress_interval
+
+        self._counts: Dict[str, int] = {}
+        self._unflushed = 0
+        self._generated = 0
+        self._failed_units = 0
+        self._throttled = 0
+        self._started_at = 0.0
+
+    def _resume(self) -> None:
+        """チェックポイント（なければ出力ファイル）から再開位置を求め、未確定の書き込みを切り詰める"""
+        if self.checkpoint.load():
+            if os.path.exists(self.output_path) and os.path.getsize(self.output_path) < self.checkpoint.offset:
+                raise RuntimeError(
+                    f"{self.output_path} is shorter than its checkpoint; remove {self.checkpoint.path} to rebuild it"
+                )
+        elif os.path.exists(self.output_path):
+            self.checkpoint.offset, self.checkpoint.counts = scan_output(self.output_path)
+
+        if os.path.exists(self.output_path):
+            os.truncate(self.output_path, self.checkpoint.offset)
+        self._counts = dict(self.checkpoint.counts)
+
+    def _plan(self, targets: Dict[str, int]) -> List[WorkUnit]:
+        """目標数に足りない分を batch_size ごとの作業単位に分割する"""
+        units = []
+        for topic, target in targets.items():
+            remaining = target - self._counts.get(topic, 0)
+            while remaining > 0:
+                size = min(self.batch_size, remaining)
+                units.append((topic, size, 0))
+                remaining -= size
+        return units
+
+    def _write(self, output: Any, topic: str, questions: List[Any]) -> None:
+        """問題をJSONLに追記し、一定数ごとに確定させる"""
+        output.write(b"".join(
+            orjson.dumps({"topic": topic, **question.model_dump(mode="json")}) + b"\n"
+            for question in questions
+        ))
+        self._counts[topic] = self._counts.get(topic, 0) + len(questions)
+        self._generated += len(questions)
+        self._unflushed += len(questions)
+        if self._unflushed >= self.checkpoint_every:
+            self._commit(output)
+
+    def _commit(self, output: Any) -> None:
+        """出力を fsync し、その位置と件数をチェックポイントに記録する"""
+        output.flush()
+        os.fsync(output.fileno())
+        self.checkpoint.offset = output.tell()
+        self.checkpoint.counts = dict(self._counts)
+        self.checkpoint.save()
+        self._unflushed = 0
+
+    async def _worker(self, queue: "asyncio.Queue[WorkUnit]", output: Any) -> None:
+        while True:
+            try:
+                topic, size, attempt = queue.get_nowait()
+            except asyncio.QueueEmpty:
+                return
+            try:
+                questions = await self.generate(topic, size)
+            except Exception as e:
+                retry_after = getattr(e, "retry_after", None)
+                if retry_after is not None:
+                    # 混雑による拒否は試行回数に数えない
+                    self._throttled += 1
+                    await asyncio.sleep(retry_after)
+                    queue.put_nowait((topic, size, attempt))
+                    continue
+                print(f"[bulk] {topic}: generation failed: {type(e).__name__}: {e}", file=sys.stderr)
+                questions = []
+
+            questions = questions[:size]
+            if questions:
+                self._write(output, topic, questions)
+            shortfall = size - len(questions)
+            if shortfall > 0:
+                if attempt + 1 < self.max_attempts:
+                    queue.put_nowait((topic, shortfall, attempt + 1))
+                else:
+                    self._failed_units += 1
+
+    def _progress(self, total_target: int) -> str:
+        done = sum(self._counts.values())
+        elapsed = time.monotonic() - self._started_at
+        rate = self._generated / elapsed if elapsed > 0 else 0.0
+        eta = (total_target - done) / rate if rate > 0 else float("inf")
+        eta_text = f"{eta / 60:.1f} min" if eta != float("inf") else "-"
+        return f"[bulk] {done}/{total_target} questions, {rate * 3600:.0f} q/h, ETA {eta_text}"
+
+    async def _report_progress(self, total_target: int) -> None:
+        while True:
+            await asyncio.sleep(self.progress_interval)
+            print(self._progress(total_target), file=sys.stderr)
+
+    async def run(self, targets: Dict[str, int]) -> Dict[str, Any]:
+        """
+        目標数に達するまで生成し、スループットなどの結果を返す。
+
+        Args:
+            targets (Dict[str, int]): トピックごとの目標の問題数（出力ファイル全体での数）
+
+        Returns:
+            Dict[str, Any]: 今回生成した問題数、所要時間、1時間あたりの問題数、トピックごとの件数など
+        """
+        self._resume()
+        units = self._plan(targets)
+        queue: "asyncio.Queue[WorkUnit]" = asyncio.Queue()
+        for unit in units:
+            queue.put_nowait(unit)
+
+        directory = os.path.dirname(self.output_path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+
+        total_target = sum(targets.values())
+        self._started_at = time.monotonic()
+        reporter = (
+            asyncio.create_task(self._report_progress(total_target)) if self.progress_interval > 0 else None
+        )
+        try:
+            with open(self.output_path, "ab") as output:
+                try:
+                    await asyncio.gather(*(self._worker(queue, output) for _ in range(self.concurrency)))
+                finally:
+                    # 中断された場合も、書き込み済みの問題までを確定させる
+                    self._commit(output)
+        finally:
+            if reporter is not None:
+                reporter.cancel()
+
+        elapsed = time.monotonic() - self._started_at
+        return {
+            "output": self.output_path,
+            "generated": self._generated,
+            "elapsed_seconds": round(elapsed, 2),
+            "questions_per_second": round(self._generated / elapsed, 3) if elapsed > 0 else 0.0,
+            "questions_per_hour": round(self._generated / elapsed * 3600) if elapsed > 0 else 0,
+            "throttled": self._throttled,
+            "failed_units": self._failed_units,
+            "complete": all(self._counts.get(topic, 0) >= target for topic, target in targets.items()),
+            "topics": {
+                topic: {"done": self._counts.get(topic, 0), "target": target} for topic, target in targets.items()
+            },
+        }
+
+
+def read_topics(topics: Optional[str], topics_file: Optional[str]) -> List[str]:
+    """カンマ区切りの指定と、1行1トピックのファイル（# で始まる行は無視）からトピックの一覧を作る"""
+    names = [topic.strip() for topic in (topics or "").split(",")]
+    if topics_file:
+        with open(topics_file, encoding="utf-8") as f:
+            names.extend(line.strip() for line in f if not line.lstrip().startswith("#"))
+    return list(dict.fromkeys(name for name in names if name))
+
+
+async def run_bulk(args: argparse.Namespace, topics: List[str]) -> Dict[str, Any]:
+    """app.py の設定で Ollama に接続し（アプリは起動しない）、一括生成を実行する"""
+    import app as smartq_app
+    from ollama.scheduler import Priority
+
+    knowledge_base = None
+    if args.knowledge_file:
+        with open(args.knowledge_file, encoding="utf-8") as f:
+            knowledge_base = f.read()
+
+    async with smartq_app.open_ollama_router() as ollama_client:
+
+        async def generate(topic: str, count: int) -> List[Any]:
+            request = smartq_app.GenerateQuizRequest(
+                topic=topic, system_prompt=args.system_prompt, knowledge_base=knowledge_base
+            )
+            return await smartq_app.generate_question_batch(
+                request, count, ollama_client, deadline=time.monotonic() + args.timeout, priority=Priority.BACKGROUND
+            )
+
+        generator = BulkGenerator(
+            generate,
+            output_path=args.output,
+            checkpoint_path=args.checkpoint,
+            concurrency=args.concurrency or smartq_app.OLLAMA_MAX_CONCURRENCY,
+            batch_size=args.batch_size or smartq_app.BATCH_CHUNK_SIZE,
+            checkpoint_every=args.checkpoint_every,
+            max_attempts=args.max_attempts,
+            progress_interval=args.progress_interval,
+        )
+        return await generator.run({topic: args.per_topic for topic in topics})
+
+
+def main(argv: Optional[Sequence[str]] = None) -> None:
+    parser = argparse.ArgumentParser(description="問題バンクの一括生成（中断しても続きから再開できる）")
+    parser.add_argument("--topics", default=None, help="トピック（カンマ区切り）")
+    parser.add_argument("--topics-file", default=None, help="1行1トピックのファイル")
+    parser.add_argument("--per-topic", type=int, required=True, help="トピックごとの問題数")
+    parser.add_argument("--output", required=True, help="出力するJSONLファイル（既存の場合は続きから追記する）")
+    parser.add_argument("--checkpoint", default=None, help="チェックポイントのファイル（省略時は出力ファイル名 + .checkpoint）")
+    parser.add_argument("--system-prompt", default="指定されたトピックに関する4択の問題を作成してください。")
+    parser.add_argument("--knowledge-file", default=None, help="プロンプトに含める知識ベースのファイル")
+    parser.add_argument("--concurrency", type=int, default=0, help="同時に実行する生成の数（省略時は OLLAMA_MAX_CONCURRENCY）")
+    parser.add_argument("--batch-size", type=int, default=0, help="1回の呼び出しで生成する問題数（省略時は BATCH_CHUNK_SIZE）")
+    parser.add_argument("--checkpoint-every", type=int, default=50, help="チェックポイントを記録する間隔（問題数）")
+    parser.add_argument("--max-attempts", type=int, default=3, help="生成できなかった分を再試行する回数の上限")
+    parser.add_argument("--timeout", type=float, default=300.0, help="1回の呼び出しの期限（秒）")
+    parser.add_argument("--progress-interval", type=float, default=30.0, help="進捗を表示する間隔（秒）")
+    args = parser.parse_args(argv)
+
+    topics = read_topics(args.topics, args.topics_file)
+    if not topics:
+        parser.error("--topics or --topics-file is required")
+
+    report = asyncio.run(run_bulk(args, topics))
+    print(json.dumps(report, ensure_ascii=False, indent=2))
+    if not report["complete"]:
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,88 @@
+"""クライアントが切断したリクエストの処理をキャンセルするASGIミドルウェア。"""
+
+import asyncio
+import logging
+from typing import Sequence
+
+from starlette.types import ASGIApp, Message, Receive, Scope, Send
+
+from smartq.metrics import SmartQMetrics
+
+logger = logging.getLogger(__name__)
+
+
+class CancelOnDisconnectMiddleware:
+    """
+    応答を送信し終える前にクライアントが切断した場合、リクエストの処理をキャンセルするASGIミドルウェア。
+
+    Starlette は通常の（ストリーミングでない）応答では切断を検知しないため、タブを閉じても
+    エンドポイントは Ollama の応答を API_TIMEOUT まで待ち続ける。このミドルウェアは受信側を
+    別のタスクで監視し、http.disconnect を受け取った時点で処理中のタスクをキャンセルする。
+    キャンセルは待ち行列と httpx まで伝わり、Ollama への接続が閉じられて生成が止まる。
+    """
+
+    def __init__(self, app: ASGIApp, metrics: SmartQMetrics, path_prefixes: Sequence[str] = ("/api/",)) -> None:
+        """
+        CancelOnDisconnectMiddlewareを初期化する。
+
+        Args:
+            app (ASGIApp): ラップするASGIアプリケーション
+            metrics (SmartQMetrics): 切断によるキャンセルを記録するメトリクス
+            path_prefixes (Sequence[str]): 対象とするパスの接頭辞
+        """
+        self.app = app
+        self.metrics = metrics
+        self.path_prefixes = tuple(path_prefixes)
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send) -> None:
+        if scope["type"] != "http" or not scope["path"].startswith(self.path_prefixes):
+            await self.app(scope, receive, send)
+            return
+
+        messages: "asyncio.Queue[Message]" = asyncio.Queue()
+        disconnected = False
+        response_complete = False
+
+        async def receive_wrapper() -> Message:
+            # 切断後に受信しようとした場合は待たせずに切断を返す
+            if disconnected and messages.empty():
+                return {"type": "http.disconnect"}
+            return await messages.get()
+
+        async def send_wrapper(message: Message) -> None:
+            nonlocal response_complete
+            await send(message)
+            if message["type"] == "http.response.body" and not message.get("more_body", False):
+                response_complete = True
+
+        async def watch_disconnect() -> None:
+            # リクエスト本文の受信後も受信側を読み続け、切断を検知する
+            nonlocal disconnected
+            while True:
+                message = await receive()
+                messages.put_nowait(message)
+                if message["type"] == "http.disconnect":
+                    disconnected = True
+                    return
+
+        app_task = asyncio.ensure_future(self.app(scope, receive_wrapper, send_wrapper))
+        watcher = asyncio.ensure_future(watch_disconnect())
+        cancelled = False
+        try:
+            await asyncio.wait({app_task, watcher}, return_when=asyncio.FIRST_COMPLETED)
+            if not app_task.done() and not response_complete:
+                route = scope.get("route")
+                endpoint = getattr(route, "path", None) or "other"
+                self.metrics.client_disconnects.inc(endpoint=endpoint)
+                logger.info("Client disconnected; cancelling request", extra={"endpoint": endpoint})
+                app_task.cancel()
+                cancelled = True
+            # キャンセルした場合も、後片付け（待ち行列の枠や接続の解放）が終わるまで待つ
+            try:
+                await app_task
+            except asyncio.CancelledError:
+                if not cancelled:
+                    raise
+        finally:
+            watcher.cancel()
+            app_task.cancel()
@@ -0,0 +1,221 @@
+"""生成した問題の重複（言い換えや選択肢の並べ替えを含む、よく似た問題）を検出する類似度インデックス。"""
+
+import re
+import time
+import unicodedata
+import zlib
+from collections import OrderedDict
+from typing import Any, Dict, Iterator, Optional, Set, Tuple
+
+import numpy as np
+
+from smartq.question_bank import normalize_topic
+
+_MERSENNE_PRIME = np.uint64((1 << 61) - 1)
+# 空白と記号（類似度の計算では無視する）
+_NOISE = re.compile(r"[\W_]+")
+
+
+def normalize_text(text: str) -> str:
+    """全角・半角、大文字・小文字の違いと空白・記号を取り除いたテキスト"""
+    return _NOISE.sub("", unicodedata.normalize("NFKC", text).casefold())
+
+
+def shingle_hashes(text: str, n: int = 3) -> np.ndarray:
+    """
+    テキストの文字 n-gram のハッシュ値（重複なし）を求める。
+
+    Args:
+        text (str): 対象のテキスト
+        n (int): n-gram の文字数
+
+    Returns:
+        np.ndarray: 32ビットのハッシュ値の配列（uint64）
+    """
+    normalized = normalize_text(text)
+    grams = {normalized[i:i + n] for i in range(max(1, len(normalized) - n + 1))} if normalized else set()
+    return np.fromiter((zlib.crc32(gram.encode("utf-8")) for gram in grams), dtype=np.uint64, count=len(grams))
+
+
+class MinHasher:
+    """文字 n-gram の集合の MinHash 署名を、すべてのハッシュ関数についてまとめて（NumPyで）計算するクラス"""
+
+    def __init__(self, num_perm: int = 64, ngram: int = 3, seed: int = 1) -> None:
+        """
+        MinHasherを初期化する。
+
+        Args:
+            num_perm (int): ハッシュ関数の数（署名の長さ）
+            ngram (int): n-gram の文字数
+            seed (int): ハッシュ関数の係数を決める乱数のシード
+        """
+        rng = np.random.default_rng(seed)
+        # (a * h + b) mod p の係数は p 未満の全範囲から選ぶ（uint64 の桁あふれは混ぜ合わせとして許容する）
+        self._a = rng.integers(1, int(_MERSENNE_PRIME), size=num_perm, dtype=np.uint64)[:, None]
+        self._b = rng.integers(0, int(_MERSENNE_PRIME), size=num_perm, dtype=np.uint64)[:, None]
+        self.num_perm = num_perm
+        self.ngram = ngram
+
+    def signature(self, text: str) -> np.ndarray:
+        """テキストの MinHash 署名（uint32 の配列）を計算する"""
+        hashes = shingle_hashes(text, self.ngram)
+        if hashes.size == 0:
+            return np.full(self.num_perm, 0xFFFFFFFF, dtype=np.uint32)
+        values = (self._a * hashes[None, :] + self._b) % _MERSENNE_PRIME
+        return (values.min(axis=1) & np.uint64(0xFFFFFFFF)).astype(np.uint32)
+
+
+class _TopicIndex:
+    """1つのトピックの署名と LSH のバケット"""
+
+    def __init__(self) -> None:
+        self.signatures: "OrderedDict[str, np.ndarray]" = OrderedDict()  # 問題ID -> 署名（追加順）
+        self.buckets: Dict[Tuple[int, bytes], Set[str]] = {}  # (バンド, バンドの値) -> 問題ID
+
+
+class NearDuplicateIndex:
+    """
+    トピックごとに生成済みの問題の MinHash 署名を保持し、LSH（署名をバンドに分けたバケット）で
+    似た問題の候補を絞り込んでから推定 Jaccard 類似度を比較するインデックス。
+
+    - 1回の判定は署名の計算（NumPy）とバケットの参照だけで済み、問題数にほとんど依存しない
+    - トピックごと・トピック数の上限を超えた場合は古いものから忘れる
+    """
+
+    def __init__(
+        self,
+        threshold: float = 0.6,
+        num_perm: int = 64,
+        bands: int = 16,
+        max_per_topic: int = 1000,
+        max_topics: int = 128,
+    ) -> None:
+        """
+        NearDuplicateIndexを初期化する。
+
+        Args:
+            threshold (float): 重複とみなす推定 Jaccard 類似度（文字3-gram）。0以下の場合は判定しない。
+            num_perm (int): MinHash 署名の長さ（bands で割り切れる数）
+            bands (int): LSH のバンド数（多いほど低い類似度の候補も拾う）
+            max_per_topic (int): トピックごとに保持する問題数の上限
+            max_topics (int): 保持するトピック数の上限
+        """
+        if num_perm % bands:
+            raise ValueError("num_perm must be a multiple of bands")
+        self.threshold = threshold
+        self.bands = bands
+        self.rows = num_perm // bands
+        self.max_per_topic = max_per_topic
+        self.max_topics = max_topics
+        self.hasher = MinHasher(num_perm)
+        self._topics: "OrderedDict[str, _TopicIndex]" = OrderedDict()
+
+        # 統計情報
+        self._checks = 0
+        self._duplicates = 0
+        self._check_seconds = 0.0
+
+    @property
+    def enabled(self) -> bool:
+        """重複を判定するかどうか"""
+        return self.threshold > 0
+
+    def _band_keys(self, signature: np.ndarray) -> Iterator[Tuple[int, bytes]]:
+        for band in range(self.bands):
+            yield band, signature[band * self.rows:(band + 1) * self.rows].tobytes()
+
+    def _similar(self, index: _TopicIndex, signature: np.ndarray) -> Optional[str]:
+        """しきい値以上で最も似た問題のIDを返す"""
+        candidates: Set[str] = set()
+        for key in self._band_keys(signature):
+            candidates.update(index.buckets.get(key, ()))
+        best_id, best_score = None, self.threshold
+        for question_id in candidates:
+            score = np.count_nonzero(index.signatures[question_id] == signature) / signature.size
+            if score >= best_score:
+                best_id, best_score = question_id, score
+        return best_id
+
+    def _add(self, index: _TopicIndex, question_id: str, signature: np.ndarray) -> None:
+        index.signatures[question_id] = signature
+        for key in self._band_keys(signature):
+            index.buckets.setdefault(key, set()).add(question_id)
+        while len(index.signatures) > self.max_per_topic:
+            self._remove(index, next(iter(index.signatures)))
+
+    def _remove(self, index: _TopicIndex, question_id: str) -> None:
+        signature = index.signatures.pop(question_id)
+        for key in self._band_keys(signature):
+            bucket = index.buckets.get(key)
+            if bucket is not None:
+                bucket.discard(question_id)
+                if not bucket:
+                    del index.buckets[key]
+
+    def check(self, topic: str, question_id: str, text: str) -> Optional[str]:
+        """
+        問題がトピックの既存の問題とよく似ているかを判定し、似ていなければ登録する。
+
+        Args:
+            topic (str): トピック
+            question_id (str): 問題のID
+            text (str): 比較に使う問題のテキスト（問題文と選択肢）
+
+        Returns:
+            Optional[str]: よく似た既存の問題のID。重複でない場合（登録した場合）はNone。
+        """
+        if not self.enabled:
+            return None
+        started_at = time.perf_counter()
+        key = normalize_topic(topic)
+        index = self._topics.get(key)
+        if index is None:
+            index = self._topics[key] = _TopicIndex()
+            while len(self._topics) > self.max_topics:
+                self._topics.popitem(last=False)
+        self._topics.move_to_end(key)
+
+        signature = self.hasher.signature(text)
+        duplicate = self._similar(index, signature)
+        if duplicate is None:
+            self._add(index, question_id, signature)
+        else:
+            self._duplicates += 1
+        self._checks += 1
+        self._check_seconds += time.perf_counter() - started_at
+        return duplicate
+
+    def remove(self, topic: str, question_id: str) -> bool:
+        """
+        登録した問題をインデックスから取り除く（出題しなかった問題を以降の判定の対象から外す）。
+
+        Args:
+            topic (str): 登録したときのトピック
+            question_id (str): 問題のID
+
+        Returns:
+            bool: 取り除いた場合はTrue。登録されていない場合（すでに忘れた場合を含む）はFalse。
+        """
+        index = self._topics.get(normalize_topic(topic))
+        if index is None or question_id not in index.signatures:
+            return False
+        self._remove(index, question_id)
+        return True
+
+    def get_stats(self) -> Dict[str, Any]:
+        """
+        インデックスの統計情報を取得する。
+
+        Returns:
+            Dict[str, Any]: トピック数、保持している問題数、判定数、重複と判定した数、1回の判定の平均時間など
+        """
+        return {
+            "enabled": self.enabled,
+            "threshold": self.threshold,
+            "topics": len(self._topics),
+            "questions": sum(len(index.signatures) for index in self._topics.values()),
+            "checks": self._checks,
+            "duplicates": self._duplicates,
+            "duplicate_rate": self._duplicates / self._checks if self._checks else 0.0,
+            "avg_check_ms": self._check_seconds / self._checks * 1000 if self._checks else 0.0,
+        }
@@ -0,0 +1,287 @@
+"""回答評価の結果をキャッシュし、同一の評価リクエストを1回のAI呼び出しにまとめるモジュール。"""
+
+import asyncio
+import hashlib
+import re
+import time
+import unicodedata
+from collections import OrderedDict
+from typing import Any, Awaitable, Callable, Dict, Iterable, Optional, Set, Tuple, Type
+
+import orjson
+from pydantic import BaseModel
+
+from smartq.shared_state import SharedState
+
+# (問題内容のハッシュ, ソート済みの選択インデックス, 正規化した自由記述)
+EvaluationKey = Tuple[str, Tuple[int, ...], str]
+
+
+def normalize_answer(text: Optional[str]) -> str:
+    """
+    自由記述の回答を比較用に正規化する。
+
+    全角・半角の違い、大文字・小文字、連続する空白を同一視する。
+
+    Args:
+        text (Optional[str]): 自由記述の回答
+
+    Returns:
+        str: 正規化した文字列
+    """
+    normalized = unicodedata.normalize("NFKC", text or "").lower()
+    return re.sub(r"\s+", " ", normalized).strip()
+
+
+def evaluation_key(
+    question_content: str,
+    selected_indices: Iterable[int],
+    additional_answer: Optional[str],
+) -> EvaluationKey:
+    """
+    評価結果のキャッシュキーを作成する。
+
+    Args:
+        question_content (str): 問題文と選択肢を表す文字列（問題IDは含めない）
+        selected_indices (Iterable[int]): 選択された選択肢のインデックス
+        additional_answer (Optional[str]): 自由記述の回答
+
+    Returns:
+        EvaluationKey: キャッシュキー
+    """
+    content_hash = hashlib.sha256(question_content.encode("utf-8")).hexdigest()
+    return (content_hash, tuple(sorted(selected_indices)), normalize_answer(additional_answer))
+
+
+def shared_key(key: EvaluationKey) -> str:
+    """共有状態に保存する際のキー（自由記述は長くなりうるため、キー全体のハッシュ値とする）"""
+    return hashlib.sha256(orjson.dumps(key)).hexdigest()
+
+
+class EvaluationCache:
+    """
+    評価結果のLRUキャッシュ（TTL付き）。
+
+    同じキーの評価が実行中の場合は新たにAIを呼ばず、実行中の結果を共有する（シングルフライト）。
+    呼び出し元自身が計算する評価（ストリーミングの評価）も claim() で実行中として登録し、同じ仕組みで共有する。
+    共有状態を指定した場合は、保存した結果を他のワーカーにも共有し、メモリ上にない結果は共有状態から探す。
+    """
+
+    def __init__(
+        self,
+        max_items: int = 1000,
+        ttl: float = 3600.0,
+        model: Optional[Type[BaseModel]] = None,
+        shared: Optional[SharedState] = None,
+    ) -> None:
+        """
+        EvaluationCacheを初期化する。
+
+        Args:
+            max_items (int): 保持する評価結果の数の上限。0の場合はキャッシュしない（まとめのみ行う）。
+            ttl (float): 評価結果を保持する秒数
+            model (Optional[Type[BaseModel]]): 評価結果のモデルクラス（共有状態との変換に使用する）
+            shared (Optional[SharedState]): ワーカー間で共有する状態。Noneの場合はプロセス内のみで保持する。
+        """
+        self.max_items = max_items
+        self.ttl = ttl
+        self.model = model
+        self.shared = shared if model is not None and max_items > 0 else None
+        self._shared_writes: Set[asyncio.Task] = set()
+        self._shared_hits = 0
+        self._items: "OrderedDict[EvaluationKey, Tuple[Any, float]]" = OrderedDict()  # key -> (結果, 期限)
+        self._in_flight: Dict[EvaluationKey, asyncio.Future] = {}
+        self._waiters: Dict[asyncio.Future, int] = {}  # 実行中の計算ごとの待っている呼び出し元の数
+        self._claimed: Set[asyncio.Future] = set()  # claim() で登録した（呼び出し元自身が計算している）計算
+        self._hits = 0
+        self._misses = 0
+        self._coalesced = 0
+        self._abandoned = 0
+
+    def get(self, key: EvaluationKey) -> Optional[Any]:
+        """
+        キャッシュされた評価結果を取得する。
+
+        Args:
+            key (EvaluationKey): キャッシュキー
+
+        Returns:
+            Optional[Any]: 評価結果。存在しないか期限切れの場合はNone。
+        """
+        entry = self._items.get(key)
+        if entry is None:
+            return None
+        result, expires_at = entry
+        if expires_at < time.monotonic():
+            del self._items[key]
+            return None
+        self._items.move_to_end(key)
+        return result
+
+    def put(self, key: EvaluationKey, result: Any) -> None:
+        """
+        評価結果を保存する。
+
+        Args:
+            key (EvaluationKey): キャッシュキー
+            result (Any): 評価結果
+        """
+        if self.max_items <= 0:
+            return
+        self._remember(key, result)
+        if self.shared is not None:
+            task = asyncio.ensure_future(
+                self.shared.put("evaluation", shared_key(key), result.model_dump_json().encode(), self.ttl)
+            )
+            self._shared_writes.add(task)
+            task.add_done_callback(self._shared_writes.discard)
+
+    def _remember(self, key: EvaluationKey, result: Any) -> None:
+        self._items[key] = (result, time.monotonic() + self.ttl)
+        self._items.move_to_end(key)
+        while len(self._items) > self.max_items:
+            self._items.popitem(last=False)
+
+    async def _get_shared(self, key: EvaluationKey) -> Optional[Any]:
+        """他のワーカーが保存した評価結果を共有状態から取得し、メモリ上にも保持する"""
+        if self.shared is None or self.model is None:
+            return None
+        data = await self.shared.get("evaluation", shared_key(key))
+        if data is None:
+            return None
+        result = self.model.model_validate_json(data)
+        self._remember(key, result)
+        self._shared_hits += 1
+        return result
+
+    async def lookup(self, key: EvaluationKey) -> Optional[Any]:
+        """
+        評価結果をメモリ上、次に共有状態から取得する（get() のワーカー間共有版）。
+
+        Args:
+            key (EvaluationKey): キャッシュキー
+
+        Returns:
+            Optional[Any]: 評価結果。存在しないか期限切れの場合はNone。
+        """
+        return self.get(key) or await self._get_shared(key)
+
+    async def _fetch_or_compute(self, key: EvaluationKey, compute: Callable[[], Awaitable[Any]]) -> Any:
+        result = await self._get_shared(key)
+        if result is not None:
+            return result
+        result = await compute()
+        # 呼び出し元がいなくなっても、計算を終えた結果はキャッシュする
+        self.put(key, result)
+        return result
+
+    async def get_or_compute(
+        self, key: EvaluationKey, compute: Callable[[], Awaitable[Any]]
+    ) -> Any:
+        """
+        キャッシュから評価結果を取得し、なければ計算する。
+
+        同じキーの計算が実行中であれば、その結果を待って共有する。
+        呼び出し元がキャンセルされても、他に待っている呼び出し元がいれば計算は継続し、結果はキャッシュされる。
+        待っている呼び出し元がいなくなった場合（クライアントの切断など）は計算も中止する。
+
+        Args:
+            key (EvaluationKey): キャッシュキー
+            compute (Callable[[], Awaitable[Any]]): 評価結果を計算する関数
+
+        Returns:
+            Any: 評価結果
+        """
+        while True:
+            result = self.get(key)
+            if result is not None:
+                self._hits += 1
+                return result
+
+            task = self._in_flight.get(key)
+            if task is not None:
+                self._coalesced += 1
+            else:
+                self._misses += 1
+                task = asyncio.ensure_future(self._fetch_or_compute(key, compute))
+                self._track(key, task)
+
+            self._waiters[task] = self._waiters.get(task, 0) + 1
+            try:
+                return await asyncio.shield(task)
+            except asyncio.CancelledError:
+                current = asyncio.current_task()
+                if task.cancelled() and current is not None and not current.cancelling():
+                    # 計算していた呼び出し元（claim() した評価）が切断した場合は、改めて計算する
+                    continue
+                if self._waiters[task] == 1 and not task.done() and task not in self._claimed:
+                    self._abandoned += 1
+                    task.cancel()
+                raise
+            finally:
+                self._waiters[task] -= 1
+                if self._waiters[task] == 0:
+                    del self._waiters[task]
+
+    def claim(self, key: EvaluationKey) -> Optional[asyncio.Future]:
+        """
+        呼び出し元自身が計算する評価（ストリーミングの評価）を実行中として登録する。
+
+        登録した評価の結果は、同じキーの get_or_compute() がAIを呼ばずに待つ。
+        計算を終えたら結果を保存（put）してから Future に結果か例外を設定し、
+        中断した場合は Future をキャンセルする（待っている呼び出し元は改めて計算する）。
+
+        Args:
+            key (EvaluationKey): キャッシュキー
+
+        Returns:
+            Optional[asyncio.Future]: 結果を設定する Future。同じキーの計算がすでに実行中の場合はNone
+                （get_or_compute() でその結果を待つ）。
+        """
+        if key in self._in_flight:
+            return None
+        self._misses += 1
+        future = asyncio.get_running_loop().create_future()
+        self._claimed.add(future)
+        self._track(key, future)
+        return future
+
+    def _track(self, key: EvaluationKey, task: asyncio.Future) -> None:
+        """計算を実行中の一覧に加える"""
+        self._in_flight[key] = task
+        task.add_done_callback(lambda done: self._on_done(key, done))
+
+    def record_hit(self) -> None:
+        """get() を直接使用した場合のヒットを記録する"""
+        self._hits += 1
+
+    def _on_done(self, key: EvaluationKey, task: asyncio.Future) -> None:
+        """計算の完了時に実行中の一覧から外す"""
+        self._in_flight.pop(key, None)
+        self._claimed.discard(task)
+        if not task.cancelled():
+            task.exception()  # 待っている呼び出し元がいない場合も例外を取得済みにする
+
+    async def close(self) -> None:
+        """共有状態への書き込みが終わるまで待つ"""
+        await asyncio.gather(*self._shared_writes, return_exceptions=True)
+
+    def get_stats(self) -> Dict[str, Any]:
+        """
+        キャッシュの統計情報を取得する。
+
+        Returns:
+            Dict[str, Any]: ヒット数、ミス数（共有状態から取得した数 shared_hits を含む）、まとめられたリクエスト数など
+        """
+        requests = self._hits + self._misses + self._coalesced
+        return {
+            "items": len(self._items),
+            "in_flight": len(self._in_flight),
+            "hits": self._hits,
+            "misses": self._misses,
+            "shared": self.shared is not None,
+            "shared_hits": self._shared_hits,
+            "coalesced": self._coalesced,
+            "abandoned": self._abandoned,
+            "hit_rate": self._hits / requests if requests else 0.0,
+        }
@@ -0,0 +1,351 @@
+"""
+ベンチマークと負荷試験用の Ollama 互換サーバー。
+
+実際のモデルを使わずに /api/generate（ストリーミングと非ストリーミング）と /api/tags を模擬し、
+format に渡されたスキーマに応じて SmartQ の検証に通るクイズ・評価のJSONを返す。
+応答までの待ち時間、生成速度、同時処理数、障害や不正な出力の発生率を設定できる。
+
+    PYTHONPATH=src python -m smartq.fake_ollama --port 11435 --latency 0.3 --tokens-per-second 40
+"""
+
+import argparse
+import asyncio
+import itertools
+import random
+import time
+from typing import Any, AsyncIterator, Dict, List, Optional, Sequence
+
+import orjson
+from fastapi import FastAPI, Request
+from fastapi.responses import ORJSONResponse, Response, StreamingResponse
+
+# 1トークンあたりのおおよその文字数（生成時間とトークン数の計算に使用する）
+CHARS_PER_TOKEN = 4
+
+_TERMS = [
+    "VLAN", "ACL", "OSPF", "BGP", "STP", "NAT", "DHCP", "DNS", "TCP", "UDP",
+    "IPv6", "QoS", "VPN", "HSRP", "LACP", "SNMP", "ARP", "ICMP", "MPLS", "EIGRP",
+]
+_WORDS = [
+    "スイッチ", "ルーター", "ポート", "フレーム", "パケット", "経路", "タグ", "トランク", "帯域", "遅延",
+    "冗長化", "認証", "暗号化", "アドレス", "サブネット", "ゲートウェイ", "キャッシュ", "タイマー", "優先度", "コスト",
+    "隣接関係", "障害", "監視", "設定", "転送", "フィルタ", "セグメント", "ループ", "収束", "集約",
+    "ブロードキャスト", "マルチキャスト", "ユニキャスト", "テーブル", "エントリ", "インターフェース", "プロトコル",
+    "ヘッダー", "ペイロード", "セッション",
+]
+
+
+class FakeOllamaConfig:
+    """模擬サーバーの設定"""
+
+    def __init__(
+        self,
+        models: Sequence[str] = ("gemma3:27b",),
+        latency: float = 0.2,
+        jitter: float = 0.0,
+        tokens_per_second: float = 50.0,
+        num_parallel: int = 4,
+        load_seconds: float = 0.0,
+        failure_rate: float = 0.0,
+        invalid_rate: float = 0.0,
+        seed: Optional[int] = None,
+    ) -> None:
+        """
+        FakeOllamaConfigを初期化する。
+
+        Args:
+            models (Sequence[str]): 提供するモデル名（/api/tags で返す）
+            latency (float): 生成開始までの秒数（プロンプトの評価時間に相当）
+            jitter (float): latency に加える揺らぎの最大秒数（一様分布）
+            tokens_per_second (float): 生成速度（トークン/秒）。0以下の場合は待たずに返す。
+            num_parallel (int): 同時に処理するリクエスト数（OLLAMA_NUM_PARALLEL に相当）。超えた分は待たせる。
+            load_seconds (float): モデルごとの最初のリクエストでモデルの読み込みにかかる秒数
+            failure_rate (float): 500 エラーを返す割合（0.0〜1.0）
+            invalid_rate (float): 途中で打ち切られたJSONを返す割合（0.0〜1.0）
+            seed (Optional[int]): 乱数のシード（再現性のある負荷を作る場合に指定する）
+        """
+        self.models = list(models)
+        self.latency = latency
+        self.jitter = jitter
+        self.tokens_per_second = tokens_per_second
+        self.num_parallel = max(1, num_parallel)
+        self.load_seconds = load_seconds
+        self.failure_rate = failure_rate
+        self.invalid_rate = invalid_rate
+        self.seed = seed
+
+
+def _phrase(rng: random.Random, words: int) -> str:
+    """無作為な語の並び（SmartQ の重複検出で似た問題と判定されないよう、問題ごとに内容を変える）"""
+    return " ".join(rng.sample(_WORDS, words))
+
+
+def build_quiz(rng: random.Random, serial: int) -> Dict[str, Any]:
+    """SmartQ の GeneratedQuiz として検証に通る問題を作成する（問題ごとに内容を変える）"""
+    term = rng.choice(_TERMS)
+    count = rng.randint(3, 5)
+    correct = rng.randrange(count)
+    return {
+        "question": f"{term} の {_phrase(rng, 3)} に関する説明として正しいものはどれですか？（問題 {serial}）",
+        "options": [
+            {
+                "text": f"{_phrase(rng, 4)}（{'正しい' if index == correct else '誤り'}）",
+                "isCorrect": index == correct,
+                "type": "radio",
+            }
+            for index in range(count)
+        ],
+        "explanation": f"{term} は負荷試験用の模擬サーバーが生成した問題です。選択肢 {correct + 1} が正解です。",
+    }
+
+
+def build_feedback(rng: random.Random) -> Dict[str, Any]:
+    """SmartQ の GeneratedFeedback として検証に通る評価を作成する"""
+    is_correct = rng.random() < 0.5
+    return {
+        "isCorrect": is_correct,
+        "feedback": "正解です。" if is_correct else "不正解です。",
+        "detailedExplanation": "模擬サーバーによる評価です。" * rng.randint(2, 6),
+        "additionalResources": [
+            {"title": "参考資料", "description": "模擬サーバーが返す学習リソースです。"}
+        ],
+    }
+
+
+def build_document(schema: Any, rng: random.Random, serial: int) -> Any:
+    """
+    format に渡されたスキーマの形に合わせて応答のJSONを作成する。
+
+    Args:
+        schema (Any): リクエストの format（スキーマの辞書、または "json"）
+        rng (random.Random): 乱数生成器
+        serial (int): 問題の通し番号
+
+    Returns:
+        Any: 応答として返すJSONの値
+    """
+    properties = schema.get("properties", {}) if isinstance(schema, dict) else {}
+    if "questions" in properties:
+        count = properties["questions"].get("minItems", 1)
+        return {"questions": [build_quiz(rng, serial * 100 + index) for index in range(count)]}
+    if "feedback" in properties:
+        return build_feedback(rng)
+    if "question" in properties:
+        return build_quiz(rng, serial)
+    return {"response": "ok"}
+
+
+def split_tokens(text: str) -> List[str]:
+    """テキストを CHARS_PER_TOKEN 文字ごとの擬似トークンに分割する"""
+    return [text[i:i + CHARS_PER_TOKEN] for i in range(0, len(text), CHARS_PER_TOKEN)]
+
+
+class ClientDisconnected(Exception):
+    """待っている間にクライアントが切断した場合の例外"""
+
+
+class FakeOllama:
+    """/api/generate の応答を模擬するクラス"""
+
+    def __init__(self, config: FakeOllamaConfig) -> None:
+        self.config = config
+        self._rng = random.Random(config.seed)
+        self._serial = itertools.count(1)
+        self._slots = asyncio.Semaphore(config.num_parallel)
+        self._loaded: set = set()
+        self._active = 0
+        self._waiting = 0
+        self._requests = 0
+        self._failures = 0
+        self._invalid = 0
+        self._cancelled = 0
+
+    async def _sleep(self, request: Request, seconds: float) -> None:
+        """
+        指定した秒数待つ。待っている間にクライアントが切断した場合は ClientDisconnected を送出する
+        （Ollama と同様に、切断されたリクエストの生成は中止する）。
+        """
+        deadline = time.monotonic() + seconds
+        while True:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                return
+            await asyncio.sleep(min(remaining, 0.05))
+            if await request.is_disconnected():
+                raise ClientDisconnected()
+
+    def _stats(self, prompt: str, tokens: int, load: float, prompt_eval: float, eval_seconds: float) -> Dict[str, Any]:
+        """Ollama の応答に含まれる計測値（ナノ秒）を作成する"""
+        return {
+            "total_duration": int((load + prompt_eval + eval_seconds) * 1e9),
+            "load_duration": int(load * 1e9),
+            "prompt_eval_count": max(1, len(prompt) // CHARS_PER_TOKEN),
+            "prompt_eval_duration": int(prompt_eval * 1e9),
+            "eval_count": tokens,
+            "eval_duration": int(eval_seconds * 1e9),
+        }
+
+    def _plan(self, body: Dict[str, Any]) -> Dict[str, Any]:
+        """応答の内容と待ち時間を決める"""
+        config = self.config
+        model = body.get("model", "")
+        load = 0.0
+        if model not in self._loaded:
+            self._loaded.add(model)
+            load = config.load_seconds
+        prompt_eval = max(0.0, config.latency + self._rng.uniform(0.0, config.jitter))
+
+        text = orjson.dumps(build_document(body.get("format"), self._rng, next(self._serial))).decode()
+        if self._rng.random() < config.invalid_rate:
+            self._invalid += 1
+            text = text[: len(text) // 2]
+        tokens = split_tokens(text)
+        per_token = 1.0 / config.tokens_per_second if config.tokens_per_second > 0 else 0.0
+        return {"model": model, "load": load, "prompt_eval": prompt_eval, "tokens": tokens, "per_token": per_token}
+
+    async def generate(self, request: Request) -> Response:
+        """POST /api/generate"""
+        body = orjson.loads(await request.body())
+        self._requests += 1
+        model = body.get("model", "")
+        if model not in self.config.models:
+            return ORJSONResponse({"error": f"model '{model}' not found"}, status_code=404)
+        if self._rng.random() < self.config.failure_rate:
+            self._failures += 1
+            return ORJSONResponse({"error": "injected failure"}, status_code=500)
+
+        if not body.get("prompt"):
+            # 空のプロンプトはモデルの読み込み（ウォームアップ）
+            load = self.config.load_seconds if model not in self._loaded else 0.0
+            self._loaded.add(model)
+            await asyncio.sleep(load)
+            return ORJSONResponse({"model": model, "response": "", "done": True, "load_duration": int(load * 1e9)})
+
+        if body.get("stream", True):
+            return StreamingResponse(self._stream(request, body), media_type="application/x-ndjson")
+
+        self._waiting += 1
+        try:
+            async with self._slots:
+                self._waiting -= 1
+                self._active += 1
+                try:
+                    plan = self._plan(body)
+                    eval_seconds = plan["per_token"] * len(plan["tokens"])
+                    await self._sleep(request, plan["load"] + plan["prompt_eval"] + eval_seconds)
+                finally:
+                    self._active -= 1
+        except ClientDisconnected:
+            self._cancelled += 1
+            return Response(status_code=499)
+        except asyncio.CancelledError:
+            # 同じプロセスで動かしている場合のキャンセルは呼び出し元に伝える
+            self._cancelled += 1
+            raise
+        return ORJSONResponse({
+            "model": model,
+            "response": "".join(plan["tokens"]),
+            "done": True,
+            **self._stats(body["prompt"], len(plan["tokens"]), plan["load"], plan["prompt_eval"], eval_seconds),
+        })
+
+    async def _stream(self, request: Request, body: Dict[str, Any]) -> AsyncIterator[bytes]:
+        """ストリーミング応答（1行1チャンクのNDJSON）を生成する"""
+        self._waiting += 1
+        try:
+            async with self._slots:
+                self._waiting -= 1
+                self._active += 1
+                try:
+                    plan = self._plan(body)
+                    await asyncio.sleep(plan["load"] + plan["prompt_eval"])
+                    for token in plan["tokens"]:
+                        if plan["per_token"]:
+                            await asyncio.sleep(plan["per_token"])
+                        yield orjson.dumps({"model": plan["model"], "response": token, "done": False}) + b"\n"
+                    eval_seconds = plan["per_token"] * len(plan["tokens"])
+                    yield orjson.dumps({
+                        "model": plan["model"],
+                        "response": "",
+                        "done": True,
+                        **self._stats(body["prompt"], len(plan["tokens"]), plan["load"], plan["prompt_eval"], eval_seconds),
+                    }) + b"\n"
+                finally:
+                    self._active -= 1
+        except (asyncio.CancelledError, GeneratorExit):
+            self._cancelled += 1
+            raise
+
+    def get_stats(self) -> Dict[str, Any]:
+        """模擬サーバーの統計情報を取得する"""
+        return {
+            "requests": self._requests,
+            "active": self._active,
+            "waiting": self._waiting,
+            "failures_injected": self._failures,
+            "invalid_injected": self._invalid,
+            "cancelled": self._cancelled,
+        }
+
+
+def create_app(config: FakeOllamaConfig) -> FastAPI:
+    """
+    模擬サーバーのFastAPIアプリケーションを作成する。
+
+    Args:
+        config (FakeOllamaConfig): 模擬サーバーの設定
+
+    Returns:
+        FastAPI: /api/tags、/api/generate、/fake/stats を提供するアプリケーション
+    """
+    fake = FakeOllama(config)
+    app = FastAPI(title="Fake Ollama", docs_url=None, redoc_url=None)
+
+    @app.get("/api/tags")
+    async def tags():
+        return ORJSONResponse({"models": [{"name": name} for name in config.models]})
+
+    @app.post("/api/generate")
+    async def generate(request: Request):
+        return await fake.generate(request)
+
+    @app.get("/fake/stats")
+    async def stats():
+        return ORJSONResponse(fake.get_stats())
+
+    return app
+
+
+def main(argv: Optional[Sequence[str]] = None) -> None:
+    parser = argparse.ArgumentParser(description="ベンチマーク用の Ollama 互換サーバー")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=11435)
+    parser.add_argument("--models", default="gemma3:27b", help="提供するモデル名（カンマ区切り）")
+    parser.add_argument("--latency", type=float, default=0.2, help="生成開始までの秒数")
+    parser.add_argument("--jitter", type=float, default=0.0, help="latency に加える揺らぎの最大秒数")
+    parser.add_argument("--tokens-per-second", type=float, default=50.0, help="生成速度（0 で待たない）")
+    parser.add_argument("--num-parallel", type=int, default=4, help="同時に処理するリクエスト数")
+    parser.add_argument("--load-seconds", type=float, default=0.0, help="モデルの読み込みにかかる秒数")
+    parser.add_argument("--failure-rate", type=float, default=0.0, help="500 エラーを返す割合")
+    parser.add_argument("--invalid-rate", type=float, default=0.0, help="途中で打ち切られたJSONを返す割合")
+    parser.add_argument("--seed", type=int, default=None)
+    args = parser.parse_args(argv)
+
+    import uvicorn
+
+    config = FakeOllamaConfig(
+        models=[name.strip() for name in args.models.split(",") if name.strip()],
+        latency=args.latency,
+        jitter=args.jitter,
+        tokens_per_second=args.tokens_per_second,
+        num_parallel=args.num_parallel,
+        load_seconds=args.load_seconds,
+        failure_rate=args.failure_rate,
+        invalid_rate=args.invalid_rate,
+        seed=args.seed,
+    )
+    uvicorn.run(create_app(config), host=args.host, port=args.port, log_level="warning")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,308 @@
+"""知識ベースをチャンクに分割し、問題生成に関連する部分だけをプロンプトに含めるための検索インデックス。"""
+
+import hashlib
+import re
+import threading
+from collections import OrderedDict
+from typing import Any, Dict, List, Optional
+
+import numpy as np
+
+# 日本語（ひらがな・カタカナ・漢字）の連続
+_CJK_RUN = re.compile(r"[\u3040-\u30ff\u3400-\u4dbf\u4e00-\u9fff\uff66-\uff9f]+")
+# 英数字の単語
+_WORD = re.compile(r"[a-z0-9][a-z0-9_\-./]*")
+# 文の区切り（句点・改行など）
+_SENTENCE_END = re.compile(r"(?<=[。．！？!?])|\n+")
+
+
+def tokenize(text: str) -> List[str]:
+    """
+    検索用にテキストをトークンに分割する。
+
+    英数字は単語単位、日本語は分かち書きの代わりに文字バイグラム（1文字の場合はその文字）で分割する。
+
+    Args:
+        text (str): 対象のテキスト
+
+    Returns:
+        List[str]: トークンのリスト
+    """
+    lowered = text.lower()
+    tokens = _WORD.findall(lowered)
+    for run in _CJK_RUN.findall(lowered):
+        if len(run) == 1:
+            tokens.append(run)
+        else:
+            tokens.extend(run[i:i + 2] for i in range(len(run) - 1))
+    return tokens
+
+
+def estimate_tokens(text: str) -> int:
+    """
+    LLMのトークン数を概算する。
+
+    日本語は1文字1トークン、それ以外はおよそ4文字1トークンとして数える。
+
+    Args:
+        text (str): 対象のテキスト
+
+    Returns:
+        int: 推定トークン数
+    """
+    cjk = sum(len(run) for run in _CJK_RUN.findall(text))
+    return cjk + (len(text) - cjk + 3) // 4
+
+
+def chunk_text(text: str, chunk_chars: int = 400) -> List[str]:
+    """
+    テキストを文の区切りでおよそ chunk_chars 文字ずつのチャンクに分割する。
+
+    Args:
+        text (str): 対象のテキスト
+        chunk_chars (int): 1チャンクのおおよその最大文字数
+
+    Returns:
+        List[str]: チャンクのリスト（元の順序）
+    """
+    chunks: List[str] = []
+    current = ""
+    for sentence in _SENTENCE_END.split(text):
+        sentence = sentence.strip()
+        if not sentence:
+            continue
+        # 1文が長すぎる場合は強制的に分割する
+        while len(sentence) > chunk_chars:
+            if current:
+                chunks.append(current)
+                current = ""
+            chunks.append(sentence[:chunk_chars])
+            sentence = sentence[chunk_chars:]
+        if current and len(current) + len(sentence) + 1 > chunk_chars:
+            chunks.append(current)
+            current = ""
+        current = f"{current}\n{sentence}" if current else sentence
+    if current:
+        chunks.append(current)
+    return chunks
+
+
+class KnowledgeIndex:
+    """
+    1つの知識ベースに対するBM25インデックス。
+
+    語ごとのBM25重みを転置インデックスとしてあらかじめ計算しておき、検索時はクエリに含まれる語の重みを足し合わせる。
+    """
+
+    def __init__(
+        self, text: str, chunk_chars: int = 400, k1: float = 1.5, b: float = 0.75, max_queries: int = 256
+    ) -> None:
+        """
+        KnowledgeIndexを初期化する。
+
+        Args:
+            text (str): 知識ベースのテキスト
+            chunk_chars (int): 1チャンクのおおよその最大文字数
+            k1 (float): BM25の語頻度の飽和パラメータ
+            b (float): BM25の文書長の正規化パラメータ
+            max_queries (int): 選ぶ位置を記録するクエリ数の上限（最も長く使われていないものから忘れる）
+        """
+        self.chunks = chunk_text(text, chunk_chars)
+        self.chunk_tokens = np.array([estimate_tokens(chunk) for chunk in self.chunks], dtype=np.int64)
+        self.max_queries = max(1, max_queries)
+        self._rotation: "OrderedDict[str, int]" = OrderedDict()  # 正規化したクエリ -> 次に選ぶ位置
+        self._lock = threading.Lock()
+
+        tokenized = [tokenize(chunk) for chunk in self.chunks]
+        self.vocabulary: Dict[str, int] = {}
+        rows: List[np.ndarray] = []
+        cols: List[np.ndarray] = []
+        counts: List[np.ndarray] = []
+        for row, tokens in enumerate(tokenized):
+            if not tokens:
+                continue
+            ids = np.fromiter(
+                (self.vocabulary.setdefault(t, len(self.vocabulary)) for t in tokens),
+                dtype=np.int64,
+                count=len(tokens),
+            )
+            unique_ids, unique_counts = np.unique(ids, return_counts=True)
+            rows.append(np.full(len(unique_ids), row, dtype=np.int64))
+            cols.append(unique_ids)
+            counts.append(unique_counts)
+
+        # 語ごとに (チャンク番号, BM25重み) を並べた転置インデックス（CSC形式）を作る
+        n_docs = len(self.chunks)
+        n_terms = len(self.vocabulary)
+        row_ids = np.concatenate(rows) if rows else np.zeros(0, dtype=np.int64)
+        col_ids = np.concatenate(cols) if cols else np.zeros(0, dtype=np.int64)
+        tf = np.concatenate(counts).astype(np.float32) if counts else np.zeros(0, dtype=np.float32)
+
+        doc_len = np.bincount(row_ids, weights=tf, minlength=n_docs)
+        doc_freq = np.bincount(col_ids, minlength=n_terms)
+        avg_len = max(float(doc_len.mean()) if n_docs else 1.0, 1.0)
+        idf = np.log(1.0 + (n_docs - doc_freq + 0.5) / (doc_freq + 0.5))
+        norm = k1 * (1.0 - b + b * doc_len[row_ids] / avg_len)
+        weights = (idf[col_ids] * tf * (k1 + 1.0) / (tf + norm)).astype(np.float32)
+
+        order = np.argsort(col_ids, kind="stable")
+        self._postings_rows = row_ids[order]
+        self._postings_weights = weights[order]
+        self._postings_ptr = np.concatenate(([0], np.cumsum(doc_freq)))
+
+    def score(self, query: str) -> np.ndarray:
+        """
+        クエリに対する各チャンクのBM25スコアを計算する。
+
+        Args:
+            query (str): 検索クエリ
+
+        Returns:
+            np.ndarray: チャンクごとのスコア
+        """
+        scores = np.zeros(len(self.chunks), dtype=np.float32)
+        for token in tokenize(query):
+            term = self.vocabulary.get(token)
+            if term is None:
+                continue
+            start, end = self._postings_ptr[term], self._postings_ptr[term + 1]
+            # 1つの語について同じチャンクは1回しか現れないため、添字での加算で足りる
+            scores[self._postings_rows[start:end]] += self._postings_weights[start:end]
+        return scores
+
+    def select(self, query: str, top_k: int = 4, token_budget: int = 1500) -> str:
+        """
+        クエリに関連するチャンクを選び、トークン数の上限内で連結して返す。
+
+        呼び出すたびに候補（上位 top_k×3 件）の中で選ぶ位置をずらし、同じ知識ベースからでも
+        異なる部分を使った問題が生成されるようにする。選ぶ位置は表記揺れ（空白、大文字と小文字）を
+        吸収したクエリごとに、最大 max_queries 件まで記録する。
+
+        Args:
+            query (str): 検索クエリ（トピックやシステムプロンプト）
+            top_k (int): 選択するチャンク数の上限
+            token_budget (int): 連結したテキストの推定トークン数の上限
+
+        Returns:
+            str: 選択したチャンクを元の順序で連結したテキスト
+        """
+        if not self.chunks:
+            return ""
+        scores = self.score(query)
+        # スコアが同じ場合は元の順序を保つ
+        ranked = np.argsort(-scores, kind="stable")
+        candidates = ranked[:max(top_k * 3, top_k)]
+
+        key = " ".join(query.split()).casefold()
+        with self._lock:
+            offset = self._rotation.pop(key, 0)
+            self._rotation[key] = (offset + top_k) % len(candidates)
+            while len(self._rotation) > self.max_queries:
+                self._rotation.popitem(last=False)
+        rotated = np.roll(candidates, -offset)
+
+        selected: List[int] = []
+        used = 0
+        for index in rotated:
+            if len(selected) >= top_k:
+                break
+            cost = int(self.chunk_tokens[index])
+            if used + cost > token_budget:
+                continue
+            selected.append(int(index))
+            used += cost
+
+        if not selected:
+            # 1チャンクも収まらない場合は最上位のチャンクを上限まで切り詰める（1文字は1トークン以下）
+            return self.chunks[int(rotated[0])][:token_budget]
+        return "\n...\n".join(self.chunks[i] for i in sorted(selected))
+
+
+class KnowledgeBaseCache:
+    """知識ベースの内容のハッシュ値をキーに、構築済みのインデックスをLRUで保持するキャッシュ"""
+
+    def __init__(
+        self,
+        max_items: int = 16,
+        chunk_chars: int = 400,
+        top_k: int = 4,
+        token_budget: int = 1500,
+    ) -> None:
+        """
+        KnowledgeBaseCacheを初期化する。
+
+        Args:
+            max_items (int): 保持するインデックス数の上限
+            chunk_chars (int): 1チャンクのおおよその最大文字数
+            top_k (int): 1回の生成で使用するチャンク数の上限
+            token_budget (int): プロンプトに含める知識ベースの推定トークン数の上限
+        """
+        self.max_items = max_items
+        self.chunk_chars = chunk_chars
+        self.top_k = top_k
+        self.token_budget = token_budget
+        self._indexes: "OrderedDict[str, KnowledgeIndex]" = OrderedDict()
+        self._lock = threading.Lock()
+        self._hits = 0
+        self._builds = 0
+        self._passthrough = 0
+
+    def get_index(self, text: str) -> KnowledgeIndex:
+        """
+        知識ベースのインデックスを取得する。キャッシュになければ構築する。
+
+        Args:
+            text (str): 知識ベースのテキスト
+
+        Returns:
+            KnowledgeIndex: インデックス
+        """
+        key = hashlib.sha256(text.encode("utf-8")).hexdigest()
+        with self._lock:
+            index = self._indexes.get(key)
+            if index is not None:
+                self._indexes.move_to_end(key)
+                self._hits += 1
+                return index
+
+        index = KnowledgeIndex(text, chunk_chars=self.chunk_chars)
+        with self._lock:
+            self._indexes[key] = index
+            self._builds += 1
+            while len(self._indexes) > self.max_items:
+                self._indexes.popitem(last=False)
+        return index
+
+    def select(self, text: Optional[str], query: str) -> Optional[str]:
+        """
+        プロンプトに含める知識ベースのテキストを選択する。
+
+        トークン数の上限に収まる短い知識ベースはそのまま返す。
+
+        Args:
+            text (Optional[str]): 知識ベースのテキスト
+            query (str): 検索クエリ（トピックやシステムプロンプト）
+
+        Returns:
+            Optional[str]: プロンプトに含めるテキスト
+        """
+        if not text or estimate_tokens(text) <= self.token_budget:
+            self._passthrough += 1
+            return text
+        return self.get_index(text).select(query, top_k=self.top_k, token_budget=self.token_budget)
+
+    def get_stats(self) -> Dict[str, Any]:
+        """
+        キャッシュの統計情報を取得する。
+
+        Returns:
+            Dict[str, Any]: 保持しているインデックス数、構築回数、ヒット数など
+        """
+        return {
+            "indexes": len(self._indexes),
+            "chunks": sum(len(index.chunks) for index in self._indexes.values()),
+            "builds": self._builds,
+            "hits": self._hits,
+            "passthrough": self._passthrough,
+            "token_budget": self.token_budget,
+        }
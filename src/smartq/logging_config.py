@@ -0,0 +1,219 @@
+"""ファイルへのログ出力をイベントループの外で行うためのロギング設定。"""
+
+import copy
+import json
+import logging
+import logging.handlers
+import os
+import queue
+import random
+from datetime import datetime, timezone
+from typing import Any, Iterable, Optional
+
+# LogRecord が標準で持つ属性（これ以外は extra で渡された項目として出力する）
+_RECORD_ATTRS = set(vars(logging.LogRecord("", 0, "", 0, "", (), None))) | {"message", "asctime", "taskName"}
+
+
+def truncate_value(value: Any, max_chars: int, depth: int = 0) -> Any:
+    """
+    ログに出力する値の長い文字列を切り詰める（辞書とリストは要素ごとに切り詰める）。
+
+    Args:
+        value (Any): 対象の値
+        max_chars (int): 文字列の最大文字数
+        depth (int): 入れ子の深さ（深すぎる場合は文字列に変換して切り詰める）
+
+    Returns:
+        Any: 切り詰めた値
+    """
+    if isinstance(value, str):
+        if len(value) <= max_chars:
+            return value
+        return f"{value[:max_chars]}...(+{len(value) - max_chars} chars)"
+    if depth >= 4 and isinstance(value, (dict, list, tuple)):
+        return truncate_value(str(value), max_chars)
+    if isinstance(value, dict):
+        return {key: truncate_value(item, max_chars, depth + 1) for key, item in value.items()}
+    if isinstance(value, (list, tuple)):
+        return [truncate_value(item, max_chars, depth + 1) for item in value]
+    return value
+
+
+class TruncateFilter(logging.Filter):
+    """メッセージと extra の項目の長い文字列を切り詰めるフィルター"""
+
+    def __init__(self, max_chars: int = 500) -> None:
+        super().__init__()
+        self.max_chars = max_chars
+
+    def filter(self, record: logging.LogRecord) -> bool:
+        if self.max_chars <= 0:
+            return True
+        if isinstance(record.msg, str) and not record.args:
+            record.msg = truncate_value(record.msg, self.max_chars)
+        for key, value in list(vars(record).items()):
+            if key not in _RECORD_ATTRS:
+                setattr(record, key, truncate_value(value, self.max_chars))
+        return True
+
+
+class DebugSamplingFilter(logging.Filter):
+    """DEBUGレベルのログを指定した割合だけ通すフィルター（INFO以上はすべて通す）"""
+
+    def __init__(self, rate: float = 1.0) -> None:
+        super().__init__()
+        self.rate = rate
+
+    def filter(self, record: logging.LogRecord) -> bool:
+        if record.levelno > logging.DEBUG or self.rate >= 1.0:
+            return True
+        return random.random() < self.rate
+
+
+class JsonFormatter(logging.Formatter):
+    """ログを1行のJSONとして出力するフォーマッター（extra の項目も含める）"""
+
+    def format(self, record: logging.LogRecord) -> str:
+        entry = {
+            "time": datetime.fromtimestamp(record.created, timezone.utc).isoformat(),
+            "level": record.levelname,
+            "logger": record.name,
+            "message": record.getMessage(),
+        }
+        for key, value in vars(record).items():
+            if key not in _RECORD_ATTRS:
+                entry[key] = value
+        if record.exc_info:
+            entry["exc_info"] = self.formatException(record.exc_info)
+        elif record.exc_text:
+            entry["exc_info"] = record.exc_text
+        return json.dumps(entry, ensure_ascii=False, default=str)
+
+
+class DroppingQueueHandler(logging.handlers.QueueHandler):
+    """待ち行列が満杯の場合はログを破棄し、呼び出し元（イベントループ）を待たせないQueueHandler"""
+
+    def __init__(self, log_queue: "queue.Queue[Any]") -> None:
+        super().__init__(log_queue)
+        self.dropped = 0
+        self._exc_formatter = logging.Formatter()
+
+    def prepare(self, record: logging.LogRecord) -> logging.LogRecord:
+        """
+        スレッドに渡せるよう引数を展開したコピーを作る。
+
+        標準の QueueHandler はトレースバックをメッセージに連結するため、例外は exc_text に分けて残す。
+        """
+        record = copy.copy(record)
+        record.message = record.getMessage()
+        record.msg = record.message
+        record.args = None
+        if record.exc_info:
+            record.exc_text = self._exc_formatter.formatException(record.exc_info)
+        record.exc_info = None
+        return record
+
+    def enqueue(self, record: logging.LogRecord) -> None:
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            self.dropped += 1
+
+
+def create_file_handler(
+    path: str,
+    max_bytes: int = 10 * 1024 * 1024,
+    backup_count: int = 5,
+    rotate_when: Optional[str] = None,
+) -> logging.Handler:
+    """
+    ローテーション付きのファイルハンドラーを作成する。
+
+    Args:
+        path (str): ログファイルのパス
+        max_bytes (int): サイズでローテーションする場合のファイルサイズの上限
+        backup_count (int): 保持する過去のファイル数
+        rotate_when (Optional[str]): 時刻でローテーションする場合の単位（"midnight" や "H" など）。
+            指定した場合はサイズではなく時刻でローテーションする。
+
+    Returns:
+        logging.Handler: ファイルハンドラー
+    """
+    directory = os.path.dirname(path)
+    if directory:
+        os.makedirs(directory, exist_ok=True)
+    if rotate_when:
+        return logging.handlers.TimedRotatingFileHandler(
+            path, when=rotate_when, backupCount=backup_count, encoding="utf-8"
+        )
+    return logging.handlers.RotatingFileHandler(
+        path, maxBytes=max_bytes, backupCount=backup_count, encoding="utf-8"
+    )
+
+
+def configure_logging(
+    logger_names: Iterable[str],
+    path: str = "logs/smartq.log",
+    level: str = "INFO",
+    max_bytes: int = 10 * 1024 * 1024,
+    backup_count: int = 5,
+    rotate_when: Optional[str] = None,
+    max_field_chars: int = 500,
+    debug_sample_rate: float = 1.0,
+    queue_size: int = 10000,
+) -> logging.handlers.QueueListener:
+    """
+    指定したロガーのログを待ち行列経由でファイルに出力するよう設定する。
+
+    呼び出し元ではログの切り詰めと間引きだけを行って待ち行列に入れ、ファイルへの書き込みと
+    JSONへの変換は QueueListener のスレッドで行う。終了時は shutdown_logging を呼び出す。
+
+    Args:
+        logger_names (Iterable[str]): 対象のロガー名
+        path (str): ログファイルのパス
+        level (str): ログレベル
+        max_bytes (int): サイズでローテーションする場合のファイルサイズの上限
+        backup_count (int): 保持する過去のファイル数
+        rotate_when (Optional[str]): 時刻でローテーションする場合の単位
+        max_field_chars (int): メッセージと extra の文字列の最大文字数（0以下で切り詰めない）
+        debug_sample_rate (float): DEBUGレベルのログを出力する割合（0.0〜1.0）
+        queue_size (int): 待ち行列の上限（満杯の場合は破棄する）
+
+    Returns:
+        logging.handlers.QueueListener: 開始済みのリスナー
+    """
+    file_handler = create_file_handler(path, max_bytes, backup_count, rotate_when)
+    file_handler.setFormatter(JsonFormatter())
+
+    queue_handler = DroppingQueueHandler(queue.Queue(maxsize=queue_size))
+    queue_handler.addFilter(DebugSamplingFilter(debug_sample_rate))
+    queue_handler.addFilter(TruncateFilter(max_field_chars))
+
+    for name in logger_names:
+        target = logging.getLogger(name)
+        target.setLevel(level.upper())
+        target.addHandler(queue_handler)
+
+    listener = logging.handlers.QueueListener(
+        queue_handler.queue, file_handler, respect_handler_level=True
+    )
+    listener.start()
+    return listener
+
+
+def shutdown_logging(listener: logging.handlers.QueueListener, logger_names: Iterable[str]) -> None:
+    """
+    configure_logging で追加したハンドラーを外し、待ち行列に残ったログを書き出して終了する。
+
+    Args:
+        listener (logging.handlers.QueueListener): configure_logging の戻り値
+        logger_names (Iterable[str]): configure_logging に渡したロガー名
+    """
+    for name in logger_names:
+        target = logging.getLogger(name)
+        for handler in list(target.handlers):
+            if isinstance(handler, DroppingQueueHandler) and handler.queue is listener.queue:
+                target.removeHandler(handler)
+    listener.stop()
+    for handler in listener.handlers:
+        handler.close()
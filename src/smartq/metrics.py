@@ -0,0 +1,467 @@
+"""Prometheus のテキスト形式で公開するメトリクス（カウンター、ゲージとヒストグラム）。"""
+
+import asyncio
+import bisect
+import logging
+import math
+import time
+from typing import Any, Callable, Dict, Iterable, List, Optional, Sequence, Tuple
+
+from starlette.types import ASGIApp, Message, Receive, Scope, Send
+
+logger = logging.getLogger(__name__)
+
+# Prometheus のテキスト形式のContent-Type
+CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+
+LabelValues = Tuple[str, ...]
+
+
+def _escape(value: str) -> str:
+    """ラベル値をエスケープする"""
+    return value.replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _format_labels(names: Sequence[str], values: Sequence[str], extra: Optional[Tuple[str, str]] = None) -> str:
+    pairs = [f'{name}="{_escape(value)}"' for name, value in zip(names, values)]
+    if extra is not None:
+        pairs.append(f'{extra[0]}="{extra[1]}"')
+    return "{" + ",".join(pairs) + "}" if pairs else ""
+
+
+def _format_value(value: float) -> str:
+    if math.isinf(value):
+        return "+Inf" if value > 0 else "-Inf"
+    return repr(float(value)) if not float(value).is_integer() else str(int(value))
+
+
+class Counter:
+    """単調増加するカウンター"""
+
+    type = "counter"
+    # 停止したプロセスの値も合算するかどうか（累計値は停止後も合計に含める）
+    include_stopped = True
+
+    def __init__(self, name: str, documentation: str, labelnames: Sequence[str] = ()) -> None:
+        """
+        Counterを初期化する。
+
+        Args:
+            name (str): メトリクス名
+            documentation (str): HELP 行に出力する説明
+            labelnames (Sequence[str]): ラベル名
+        """
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._values: Dict[LabelValues, float] = {}
+
+    def inc(self, amount: float = 1.0, **labels: str) -> None:
+        """
+        カウンターを増やす。
+
+        Args:
+            amount (float): 増やす量
+            **labels (str): ラベルの値
+        """
+        key = tuple(str(labels.get(name, "")) for name in self.labelnames)
+        self._values[key] = self._values.get(key, 0.0) + amount
+
+    def set(self, value: float, **labels: str) -> None:
+        """
+        値を設定する（他のコンポーネントが数えている累計値を出力時に取り込む場合に使用する）。
+
+        Args:
+            value (float): 設定する値
+            **labels (str): ラベルの値
+        """
+        key = tuple(str(labels.get(name, "")) for name in self.labelnames)
+        self._values[key] = value
+
+    def snapshot(self) -> List[Any]:
+        """他のプロセスで合算するための値（[ラベル, 値] の一覧）"""
+        return [[list(key), value] for key, value in self._values.items()]
+
+    def render(self, others: Sequence[List[Any]] = ()) -> List[str]:
+        """
+        テキスト形式で出力する。
+
+        Args:
+            others (Sequence[List[Any]]): 合算する他のプロセスの snapshot() の値
+        """
+        values = dict(self._values)
+        for snapshot in others:
+            for key, value in snapshot:
+                values[tuple(key)] = values.get(tuple(key), 0.0) + value
+        lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} {self.type}"]
+        for key, value in sorted(values.items()):
+            lines.append(f"{self.name}{_format_labels(self.labelnames, key)} {_format_value(value)}")
+        return lines
+
+
+class Gauge(Counter):
+    """
+    増減する現在の値。
+
+    複数のプロセスの値は合算するが、停止したプロセスの最後の値は現在の値ではないため、
+    稼働中のプロセスの値だけを合算する（SmartQMetrics.render の live_others）。
+    """
+
+    type = "gauge"
+    include_stopped = False
+
+
+class Histogram:
+    """値の分布をバケットごとの件数で記録するヒストグラム"""
+
+    include_stopped = True
+
+    def __init__(
+        self,
+        name: str,
+        documentation: str,
+        buckets: Iterable[float],
+        labelnames: Sequence[str] = (),
+    ) -> None:
+        """
+        Histogramを初期化する。
+
+        Args:
+            name (str): メトリクス名
+            documentation (str): HELP 行に出力する説明
+            buckets (Iterable[float]): バケットの上限値（昇順、+Inf は自動で追加）
+            labelnames (Sequence[str]): ラベル名
+        """
+        self.name = name
+        self.documentation = documentation
+        self.buckets = sorted(float(b) for b in buckets)
+        self.labelnames = tuple(labelnames)
+        self._series: Dict[LabelValues, Tuple[List[int], List[float]]] = {}  # ラベル -> (バケットごとの件数, [合計])
+
+    def observe(self, value: float, **labels: str) -> None:
+        """
+        値を記録する。
+
+        Args:
+            value (float): 記録する値
+            **labels (str): ラベルの値
+        """
+        key = tuple(str(labels.get(name, "")) for name in self.labelnames)
+        series = self._series.get(key)
+        if series is None:
+            series = ([0] * (len(self.buckets) + 1), [0.0])
+            self._series[key] = series
+        counts, total = series
+        counts[bisect.bisect_left(self.buckets, value)] += 1
+        total[0] += value
+
+    def snapshot(self) -> List[Any]:
+        """他のプロセスで合算するための値（[ラベル, バケットごとの件数, 合計] の一覧）"""
+        return [[list(key), counts, total[0]] for key, (counts, total) in self._series.items()]
+
+    def render(self, others: Sequence[List[Any]] = ()) -> List[str]:
+        """
+        テキスト形式で出力する。
+
+        Args:
+            others (Sequence[List[Any]]): 合算する他のプロセスの snapshot() の値（バケットが同じもの）
+        """
+        series = {key: (list(counts), [total[0]]) for key, (counts, total) in self._series.items()}
+        for snapshot in others:
+            for key, counts, total in snapshot:
+                merged = series.setdefault(tuple(key), ([0] * (len(self.buckets) + 1), [0.0]))
+                if len(counts) != len(merged[0]):
+                    continue
+                for index, count in enumerate(counts):
+                    merged[0][index] += count
+                merged[1][0] += total
+        lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} histogram"]
+        for key, (counts, total) in sorted(series.items()):
+            cumulative = 0
+            for bound, count in zip(self.buckets + [math.inf], counts):
+                cumulative += count
+                labels = _format_labels(self.labelnames, key, ("le", _format_value(bound)))
+                lines.append(f"{self.name}_bucket{labels} {cumulative}")
+            labels = _format_labels(self.labelnames, key)
+            lines.append(f"{self.name}_sum{labels} {_format_value(total[0])}")
+            lines.append(f"{self.name}_count{labels} {cumulative}")
+        return lines
+
+
+class SmartQMetrics:
+    """SmartQ が公開するメトリクスの一覧"""
+
+    def __init__(self) -> None:
+        self.prompt_tokens = Histogram(
+            "smartq_ollama_prompt_tokens",
+            "Prompt tokens evaluated by Ollama per call (prompt_eval_count).",
+            [64, 128, 256, 512, 1024, 2048, 4096, 8192],
+            ["model"],
+        )
+        self.completion_tokens = Histogram(
+            "smartq_ollama_completion_tokens",
+            "Tokens generated by Ollama per call (eval_count).",
+            [32, 64, 128, 256, 512, 1024, 2048],
+            ["model"],
+        )
+        self.tokens_per_second = Histogram(
+            "smartq_ollama_tokens_per_second",
+            "Generation speed per call (eval_count / eval_duration).",
+            [1, 2, 5, 10, 20, 30, 50, 75, 100, 150],
+            ["model"],
+        )
+        self.load_seconds = Histogram(
+            "smartq_ollama_load_seconds",
+            "Time Ollama spent loading the model per call (load_duration).",
+            [0.01, 0.1, 0.5, 1, 2, 5, 10, 30, 60],
+            ["model"],
+        )
+        self.ollama_seconds = Histogram(
+            "smartq_ollama_total_seconds",
+            "Total time reported by Ollama per call (total_duration).",
+            [0.5, 1, 2, 5, 10, 20, 30, 60, 120],
+            ["model"],
+        )
+        self.request_seconds = Histogram(
+            "smartq_http_request_duration_seconds",
+            "End-to-end HTTP request latency, including streamed bodies.",
+            [0.01, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 20, 30, 60],
+            ["method", "endpoint", "status"],
+        )
+        self.client_disconnects = Counter(
+            "smartq_http_client_disconnects_total",
+            "Requests cancelled because the client disconnected before the response was sent.",
+            ["endpoint"],
+        )
+        self.response_failures = Counter(
+            "smartq_ai_response_failures_total",
+            "AI responses rejected because they could not be parsed as JSON or failed validation.",
+            ["kind", "reason"],
+        )
+        self.output_recovery = Counter(
+            "smartq_ai_output_recovery_total",
+            "Outcome of recovering rejected AI responses (repaired, retried or failed).",
+            ["kind", "outcome"],
+        )
+        self.duplicates = Counter(
+            "smartq_ai_duplicate_questions_total",
+            "Generated questions found to be near-duplicates of earlier ones (regenerated, accepted or dropped).",
+            ["kind", "outcome"],
+        )
+
+        # 待ち行列・モデルの選択・評価キャッシュ（各コンポーネントが数えている値を出力時に取り込む）
+        self.scheduler_active = Gauge(
+            "smartq_scheduler_active_requests",
+            "Ollama requests currently running, per model.",
+            ["model"],
+        )
+        self.scheduler_queue_depth = Gauge(
+            "smartq_scheduler_queue_depth",
+            "Ollama requests waiting for a slot, per model and priority.",
+            ["model", "priority"],
+        )
+        self.scheduler_admitted = Counter(
+            "smartq_scheduler_admitted_total",
+            "Ollama requests that were given a slot, per model and priority.",
+            ["model", "priority"],
+        )
+        self.scheduler_rejected = Counter(
+            "smartq_scheduler_rejected_total",
+            "Ollama requests rejected with 503 (queue full, displaced or wait timeout), per model and priority.",
+            ["model", "priority"],
+        )
+        self.scheduler_wait_seconds = Counter(
+            "smartq_scheduler_wait_seconds_total",
+            "Total time admitted requests waited for a slot, per model and priority.",
+            ["model", "priority"],
+        )
+        self.routing_decisions = Counter(
+            "smartq_routing_decisions_total",
+            "Model chosen for each Ollama request, per priority.",
+            ["priority", "model"],
+        )
+        self.routing_fallbacks = Counter(
+            "smartq_routing_fallbacks_total",
+            "Requests routed to the fallback model, per reason (queue_depth or latency).",
+            ["reason"],
+        )
+        self.evaluation_cache = Counter(
+            "smartq_evaluation_cache_requests_total",
+            "Evaluation cache lookups by result (hit, miss, coalesced, abandoned or shared_hit).",
+            ["result"],
+        )
+        self.collectors: List[Callable[[], None]] = []  # 出力前に呼び出し、上記の値を更新する関数
+
+    @property
+    def metrics(self) -> List[Any]:
+        """出力するメトリクスの一覧"""
+        return [
+            self.prompt_tokens,
+            self.completion_tokens,
+            self.tokens_per_second,
+            self.load_seconds,
+            self.ollama_seconds,
+            self.request_seconds,
+            self.client_disconnects,
+            self.response_failures,
+            self.output_recovery,
+            self.duplicates,
+            self.scheduler_active,
+            self.scheduler_queue_depth,
+            self.scheduler_admitted,
+            self.scheduler_rejected,
+            self.scheduler_wait_seconds,
+            self.routing_decisions,
+            self.routing_fallbacks,
+            self.evaluation_cache,
+        ]
+
+    def observe_ollama(self, model: str, result: Dict[str, Any]) -> None:
+        """
+        Ollamaの応答に含まれる計測値（ナノ秒単位の所要時間とトークン数）を記録する。
+
+        Args:
+            model (str): モデル名
+            result (Dict[str, Any]): /api/generate の応答（ストリーミングの場合は done の行）
+        """
+        if "prompt_eval_count" in result:
+            self.prompt_tokens.observe(result["prompt_eval_count"], model=model)
+        if "eval_count" in result:
+            self.completion_tokens.observe(result["eval_count"], model=model)
+            if result.get("eval_duration"):
+                self.tokens_per_second.observe(
+                    result["eval_count"] / (result["eval_duration"] / 1e9), model=model
+                )
+        if "load_duration" in result:
+            self.load_seconds.observe(result["load_duration"] / 1e9, model=model)
+        if "total_duration" in result:
+            self.ollama_seconds.observe(result["total_duration"] / 1e9, model=model)
+
+    def collect_routing(self, routing: Dict[str, Any], schedulers: Dict[str, Dict[str, Any]]) -> None:
+        """
+        モデルごとの待ち行列とモデルの選択結果の統計情報を取り込む。
+
+        Args:
+            routing (Dict[str, Any]): ModelRouter.get_stats() の値
+            schedulers (Dict[str, Dict[str, Any]]): ModelRouter.get_scheduler_stats() の値（モデル名 -> 統計情報）
+        """
+        for model, stats in schedulers.items():
+            self.scheduler_active.set(stats["active"], model=model)
+            for priority, depth in stats["queue_depth_by_priority"].items():
+                self.scheduler_queue_depth.set(depth, model=model, priority=priority)
+            for priority, count in stats["admitted"].items():
+                self.scheduler_admitted.set(count, model=model, priority=priority)
+            for priority, count in stats["rejected"].items():
+                self.scheduler_rejected.set(count, model=model, priority=priority)
+            for priority, seconds in stats["wait_seconds_total"].items():
+                self.scheduler_wait_seconds.set(seconds, model=model, priority=priority)
+        for priority, counts in routing["decisions"].items():
+            for model, count in counts.items():
+                self.routing_decisions.set(count, priority=priority, model=model)
+        for reason, count in routing["fallbacks"].items():
+            self.routing_fallbacks.set(count, reason=reason)
+
+    def collect_evaluation_cache(self, stats: Dict[str, Any]) -> None:
+        """
+        評価キャッシュの統計情報を取り込む。
+
+        Args:
+            stats (Dict[str, Any]): EvaluationCache.get_stats() の値
+        """
+        results = {"hit": "hits", "miss": "misses", "coalesced": "coalesced", "abandoned": "abandoned", "shared_hit": "shared_hits"}
+        for result, key in results.items():
+            self.evaluation_cache.set(stats[key], result=result)
+
+    def _collect(self) -> None:
+        for collector in self.collectors:
+            try:
+                collector()
+            except Exception as e:
+                logger.warning("Metrics collector failed", extra={"error": str(e)})
+
+    def snapshot(self) -> Dict[str, List[Any]]:
+        """
+        すべてのメトリクスの値を、他のプロセスで合算できる形式（JSONに変換できる値）で取得する。
+
+        Returns:
+            Dict[str, List[Any]]: メトリクス名ごとの値
+        """
+        self._collect()
+        return {metric.name: metric.snapshot() for metric in self.metrics}
+
+    def render(
+        self,
+        others: Sequence[Dict[str, List[Any]]] = (),
+        live_others: Optional[Sequence[Dict[str, List[Any]]]] = None,
+    ) -> str:
+        """
+        すべてのメトリクスを Prometheus のテキスト形式で出力する。
+
+        Args:
+            others (Sequence[Dict[str, List[Any]]]): 合算する他のプロセス（ワーカー）の snapshot() の値
+            live_others (Optional[Sequence[Dict[str, List[Any]]]]): そのうち稼働中のプロセスの値。
+                ゲージはこの値だけを合算する（省略時は others をすべて稼働中とみなす）。
+
+        Returns:
+            str: テキスト形式のメトリクス
+        """
+        self._collect()
+        live = others if live_others is None else live_others
+        lines: List[str] = []
+        for metric in self.metrics:
+            sources = others if metric.include_stopped else live
+            lines.extend(metric.render([snapshot.get(metric.name, []) for snapshot in sources]))
+        return "\n".join(lines) + "\n"
+
+
+class MetricsMiddleware:
+    """
+    HTTPリクエストの所要時間をエンドポイントごとに記録するASGIミドルウェア。
+
+    ストリーミング応答は本文の送信が終わるまでを計測する。キャンセルされたリクエストは 499 として記録する。
+    エンドポイントはパスではなくルートのテンプレート（/api/generate など）で集計する。
+    """
+
+    def __init__(self, app: ASGIApp, metrics: SmartQMetrics) -> None:
+        self.app = app
+        self.metrics = metrics
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send) -> None:
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        started_at = time.perf_counter()
+        status = {"code": 500}
+        recorded = False
+
+        def record() -> None:
+            nonlocal recorded
+            if recorded:
+                return
+            recorded = True
+            route = scope.get("route")
+            endpoint = getattr(route, "path", None) or ("/static" if scope["path"].startswith("/static/") else "other")
+            self.metrics.request_seconds.observe(
+                time.perf_counter() - started_at,
+                method=scope["method"],
+                endpoint=endpoint,
+                status=str(status["code"]),
+            )
+
+        async def send_wrapper(message: Message) -> None:
+            if message["type"] == "http.response.start":
+                status["code"] = message["status"]
+            await send(message)
+            if message["type"] == "http.response.body" and not message.get("more_body", False):
+                record()
+
+        try:
+            await self.app(scope, receive, send_wrapper)
+        except asyncio.CancelledError:
+            # クライアントの切断でキャンセルされた場合は 499（Client Closed Request）として記録する
+            status["code"] = 499
+            raise
+        finally:
+            # 切断やエラーで本文の送信が完了しなかった場合も記録する
+            record()
@@ -0,0 +1,248 @@
+"""事前に生成した問題（JSONL）から、トピックごとに問題を取り出す問題バンク。"""
+
+import logging
+import mmap
+import os
+import random
+import re
+from array import array
+from typing import Any, Container, Dict, Generic, Optional, Protocol, Self, Tuple, Type, TypeVar
+
+import orjson
+from pydantic import ValidationError
+
+logger = logging.getLogger(__name__)
+
+INDEX_VERSION = 1
+# smartq.bulk が出力する行の先頭（topic を最初のキーとして書き出す）
+_TOPIC_PREFIX = re.compile(rb'\{\s*"topic"\s*:\s*"((?:[^"\\]|\\.)*)"')
+
+
+def normalize_topic(topic: str) -> str:
+    """トピックの表記揺れ（前後・連続する空白、大文字と小文字）を吸収したキー"""
+    return " ".join(topic.split()).casefold()
+
+
+def _line_topic(line: bytes) -> Optional[str]:
+    """1行のJSONからトピックを取り出す（先頭が topic の場合は行全体を解析しない）"""
+    match = _TOPIC_PREFIX.match(line)
+    try:
+        if match is not None:
+            return orjson.loads(b'"' + match.group(1) + b'"')
+        topic = orjson.loads(line).get("topic")
+    except (orjson.JSONDecodeError, AttributeError):
+        return None
+    return topic if isinstance(topic, str) else None
+
+
+class BankQuestion(Protocol):
+    """問題バンクから取り出す問題（id フィールドを持つ pydantic のモデル）"""
+
+    id: str
+
+    @classmethod
+    def model_validate(cls, obj: Any) -> Self: ...
+
+
+QuestionT = TypeVar("QuestionT", bound=BankQuestion)
+
+
+class QuestionBank(Generic[QuestionT]):
+    """
+    1行1問のJSONL（smartq.bulk の出力）をメモリマップで開き、トピックごとの行の位置（オフセット）だけを
+    メモリに保持する問題バンク。
+
+    - 問題そのものは取り出す時にファイルから読むため、メモリ使用量は問題数 × 4〜8バイトで済む
+    - トピックごとの無作為な取り出しは O(1)
+    - 作成した索引は <パス>.idx に保存し、ファイルが変わっていなければ次回の起動時に再利用する
+
+    読み込み中のファイルを切り詰めないこと（smartq.bulk の出力先を直接指定しない）。
+    """
+
+    def __init__(self, model: Type[QuestionT], path: Optional[str] = None, index_path: Optional[str] = None) -> None:
+        """
+        QuestionBankを初期化し、索引を読み込む（なければ作成する）。
+
+        Args:
+            model (Type[QuestionT]): 問題のモデルクラス（各行から topic を除いたものを検証する）
+            path (Optional[str]): 問題バンクのJSONLファイルのパス。Noneの場合は無効（常に問題を返さない）。
+            index_path (Optional[str]): 索引を保存するパス（省略時は path + .idx）
+        """
+        self.model = model
+        self.path = path
+        self.index_path = index_path or (f"{path}.idx" if path else "")  # 無効の場合は空（使用しない）
+        self._offsets: Dict[str, array] = {}
+        self._file: Any = None
+        self._mmap: Optional[mmap.mmap] = None
+        self._index_source = "none"
+        self._served: Dict[str, int] = {}
+        self._misses = 0
+        self._repeats = 0
+        self._invalid = 0
+
+        if path is None:
+            return
+        self._file = open(path, "rb")
+        size = os.fstat(self._file.fileno()).st_size
+        if size == 0:
+            return
+        self._mmap = mmap.mmap(self._file.fileno(), 0, access=mmap.ACCESS_READ)
+        if not self._load_index():
+            self._build_index()
+            self._save_index()
+        logger.info(
+            "Question bank loaded",
+            extra={"path": path, "topics": len(self._offsets), "questions": self.size, "index": self._index_source}
+        )
+
+    @property
+    def enabled(self) -> bool:
+        """問題バンクを読み込んでいるかどうか"""
+        return self._mmap is not None
+
+    @property
+    def size(self) -> int:
+        """問題数"""
+        return sum(len(offsets) for offsets in self._offsets.values())
+
+    def _signature(self) -> Tuple[int, int]:
+        stat = os.fstat(self._file.fileno())
+        return stat.st_size, stat.st_mtime_ns
+
+    def _build_index(self) -> None:
+        """ファイル全体を走査し、トピックごとに行の開始位置を記録する"""
+        assert self._mmap is not None
+        typecode = "I" if len(self._mmap) < 2 ** 32 else "Q"
+        offsets: Dict[str, array] = {}
+        start = 0
+        end_of_file = len(self._mmap)
+        while start < end_of_file:
+            end = self._mmap.find(b"\n", start)
+            if end < 0:
+                break  # 書き込み途中の最後の行は含めない
+            topic = _line_topic(self._mmap[start:end])
+            if topic is not None:
+                offsets.setdefault(normalize_topic(topic), array(typecode)).append(start)
+            start = end + 1
+        self._offsets = offsets
+        self._index_source = "built"
+
+    def _save_index(self) -> None:
+        """索引を（一時ファイルに書き込んでから置き換えて）保存する。失敗しても動作は続ける"""
+        size, mtime_ns = self._signature()
+        header = {
+            "version": INDEX_VERSION,
+            "size": size,
+            "mtime_ns": mtime_ns,
+            "typecode": next(iter(self._offsets.values())).typecode if self._offsets else "I",
+            "topics": [[topic, len(offsets)] for topic, offsets in self._offsets.items()],
+        }
+        temp_path = f"{self.index_path}.{os.getpid()}.tmp"  # 複数のワーカーが同時に作成しても競合しない
+        try:
+            with open(temp_path, "wb") as f:
+                f.write(orjson.dumps(header) + b"\n")
+                for offsets in self._offsets.values():
+                    offsets.tofile(f)
+            os.replace(temp_path, self.index_path)
+        except OSError as e:
+            logger.warning("Failed to save question bank index", extra={"path": self.index_path, "error": str(e)})
+
+    def _load_index(self) -> bool:
+        """保存した索引が現在のファイルのものであれば読み込む"""
+        try:
+            with open(self.index_path, "rb") as f:
+                header = orjson.loads(f.readline())
+                if (
+                    header.get("version") != INDEX_VERSION
+                    or (header.get("size"), header.get("mtime_ns")) != self._signature()
+                ):
+                    return False
+                offsets: Dict[str, array] = {}
+                for topic, count in header["topics"]:
+                    offsets[topic] = array(header["typecode"])
+                    offsets[topic].fromfile(f, count)
+        except (OSError, EOFError, ValueError, KeyError, TypeError):
+            return False
+        self._offsets = offsets
+        self._index_source = "loaded"
+        return True
+
+    def has_topic(self, topic: str) -> bool:
+        """トピックの問題があるかどうか"""
+        return normalize_topic(topic) in self._offsets
+
+    def _read(self, offset: int) -> Optional[QuestionT]:
+        assert self._mmap is not None
+        end = self._mmap.find(b"\n", offset)
+        try:
+            data = orjson.loads(self._mmap[offset:end])
+            data.pop("topic", None)
+            return self.model.model_validate(data)
+        except (orjson.JSONDecodeError, AttributeError, ValidationError):
+            self._invalid += 1
+            return None
+
+    def sample(
+        self, topic: str, reason: str = "policy", exclude: Container[str] = (), attempts: int = 8
+    ) -> Optional[QuestionT]:
+        """
+        トピックの問題を無作為に1つ取り出す。
+
+        exclude に含まれる問題（出題済みの問題など）は引き直し、引き直しても見つからない場合に限り返す。
+
+        Args:
+            topic (str): トピック
+            reason (str): 取り出す理由（統計情報に理由ごとの件数として記録する）
+            exclude (Container[str]): 避ける問題のID
+            attempts (int): 引き直す回数の上限
+
+        Returns:
+            Optional[QuestionT]: 問題。トピックの問題がない場合はNone。
+        """
+        offsets = self._offsets.get(normalize_topic(topic))
+        fallback: Optional[QuestionT] = None
+        if offsets:
+            for _ in range(attempts):
+                question = self._read(offsets[random.randrange(len(offsets))])
+                if question is None:
+                    continue
+                if question.id not in exclude:
+                    self._served[reason] = self._served.get(reason, 0) + 1
+                    return question
+                fallback = fallback or question
+        if fallback is not None:
+            self._served[reason] = self._served.get(reason, 0) + 1
+            self._repeats += 1
+            return fallback
+        self._misses += 1
+        return None
+
+    def close(self) -> None:
+        """メモリマップとファイルを閉じる"""
+        if self._mmap is not None:
+            self._mmap.close()
+            self._mmap = None
+        if self._file is not None:
+            self._file.close()
+            self._file = None
+
+    def get_stats(self) -> Dict[str, Any]:
+        """
+        問題バンクの統計情報を取得する。
+
+        Returns:
+            Dict[str, Any]: トピック数、問題数、索引の取得元（作成・読み込み）、理由ごとの出題数、
+                出題済みの問題しか見つからなかった回数（repeats）など
+        """
+        return {
+            "enabled": self.enabled,
+            "path": self.path,
+            "topics": len(self._offsets),
+            "questions": self.size,
+            "index": self._index_source,
+            "index_bytes": sum(offsets.itemsize * len(offsets) for offsets in self._offsets.values()),
+            "served": dict(self._served),
+            "misses": self._misses,
+            "repeats": self._repeats,
+            "invalid": self._invalid,
+        }
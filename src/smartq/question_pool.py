@@ -0,0 +1,247 @@
+"""プロファイル（トピック・システムプロンプト・知識ベース）ごとに問題を事前生成しておくプール。"""
+
+import asyncio
+import hashlib
+import logging
+import time
+from collections import OrderedDict, deque
+from typing import Any, Awaitable, Callable, Deque, Dict, Optional, Tuple
+
+logger = logging.getLogger(__name__)
+
+# (トピック, システムプロンプト, 知識ベースのハッシュ)
+ProfileKey = Tuple[str, str, str]
+
+
+def profile_key(topic: str, system_prompt: str, knowledge_base: Optional[str]) -> ProfileKey:
+    """
+    プールのキーを作成する。
+
+    知識ベースは長文になりうるため、ハッシュ値をキーに使用する。
+
+    Args:
+        topic (str): トピック
+        system_prompt (str): システムプロンプト
+        knowledge_base (Optional[str]): 知識ベース
+
+    Returns:
+        ProfileKey: プロファイルのキー
+    """
+    kb_hash = hashlib.sha256((knowledge_base or "").encode("utf-8")).hexdigest()
+    return (topic, system_prompt, kb_hash)
+
+
+class _Profile:
+    """1つのプロファイルに対応する事前生成済み問題の集合"""
+
+    def __init__(self, spec: Any) -> None:
+        self.spec = spec
+        self.items: Deque[Tuple[Any, int]] = deque()  # (問題, 推定バイト数)
+        self.spec_bytes = (
+            len(spec.topic) + len(spec.system_prompt) + len(spec.knowledge_base or "")
+        )
+        self.last_access = time.monotonic()
+        self.refill_task: Optional[asyncio.Task] = None
+        self.depleted_at: Optional[float] = None  # 補充が必要になった時刻
+
+    @property
+    def item_bytes(self) -> int:
+        return sum(size for _, size in self.items)
+
+
+class QuestionPool:
+    """
+    事前生成した問題をプロファイルごとに保持し、消費に応じてバックグラウンドで補充するプール。
+
+    問題数が低水位（low_watermark）以下になると、目標数（target_size）まで補充する。
+    一定時間アクセスのないプロファイルや、メモリ上限を超えた場合の最も古いプロファイルは破棄する。
+    """
+
+    def __init__(
+        self,
+        generate: Callable[[Any], Awaitable[Any]],
+        target_size: int = 3,
+        low_watermark: int = 1,
+        max_profiles: int = 32,
+        max_bytes: int = 16 * 1024 * 1024,
+        idle_ttl: float = 1800.0,
+        refill_concurrency: int = 1,
+        retry_delay: float = 5.0,
+        max_consecutive_failures: int = 3,
+    ) -> None:
+        """
+        QuestionPoolを初期化する。
+
+        Args:
+            generate (Callable[[Any], Awaitable[Any]]): 生成リクエストから検証済みの問題を1つ生成する関数
+            target_size (int): プロファイルごとに保持する問題数の目標
+            low_watermark (int): 補充を開始する問題数
+            max_profiles (int): 保持するプロファイル数の上限
+            max_bytes (int): プール全体で保持するデータの推定バイト数の上限
+            idle_ttl (float): アクセスのないプロファイルを破棄するまでの秒数
+            refill_concurrency (int): 同時に実行するバックグラウンド生成の数
+            retry_delay (float): 生成に失敗した場合に再試行するまでの秒数
+            max_consecutive_failures (int): 補充を中断するまでの連続失敗回数
+        """
+        self._generate = generate
+        self.target_size = target_size
+        self.low_watermark = min(low_watermark, target_size)
+        self.max_profiles = max_profiles
+        self.max_bytes = max_bytes
+        self.idle_ttl = idle_ttl
+        self.retry_delay = retry_delay
+        self.max_consecutive_failures = max_consecutive_failures
+        self._refill_semaphore = asyncio.Semaphore(max(1, refill_concurrency))
+        self._profiles: "OrderedDict[ProfileKey, _Profile]" = OrderedDict()
+        self._closed = False
+
+        # 統計情報
+        self._hits = 0
+        self._misses = 0
+        self._refilled = 0
+        self._refill_failures = 0
+        self._evictions = 0
+        self._last_refill_lag = 0.0
+        self._max_refill_lag = 0.0
+
+    @property
+    def enabled(self) -> bool:
+        """プールが有効かどうか"""
+        return self.target_size > 0
+
+    def _total_bytes(self) -> int:
+        return sum(p.spec_bytes + p.item_bytes for p in self._profiles.values())
+
+    def _evict(self, key: ProfileKey) -> None:
+        """プロファイルを破棄し、実行中の補充を取り消す"""
+        profile = self._profiles.pop(key)
+        if profile.refill_task is not None and not profile.refill_task.done():
+            profile.refill_task.cancel()
+        self._evictions += 1
+        logger.info("Question pool profile evicted", extra={"topic": key[0]})
+
+    def _sweep(self, keep: Optional[ProfileKey] = None) -> None:
+        """アクセスのないプロファイルと上限を超えたプロファイルを古い順に破棄する"""
+        now = time.monotonic()
+        for key in [k for k, p in self._profiles.items() if now - p.last_access > self.idle_ttl]:
+            if key != keep:
+                self._evict(key)
+
+        # OrderedDictの先頭が最も長くアクセスされていないプロファイル
+        while len(self._profiles) > self.max_profiles or self._total_bytes() > self.max_bytes:
+            oldest = next((k for k in self._profiles if k != keep), None)
+            if oldest is None:
+                break
+            self._evict(oldest)
+
+    def take(self, request: Any) -> Optional[Any]:
+        """
+        プールから問題を1つ取り出す。
+
+        取り出しの結果にかかわらず、必要に応じてバックグラウンドでの補充を開始する。
+
+        Args:
+            request (Any): 問題生成リクエスト（topic, system_prompt, knowledge_base を持つ）
+
+        Returns:
+            Optional[Any]: 事前生成済みの問題。プールが空の場合はNone。
+        """
+        if not self.enabled or self._closed:
+            return None
+
+        key = profile_key(request.topic, request.system_prompt, request.knowledge_base)
+        profile = self._profiles.get(key)
+        if profile is None:
+            profile = _Profile(request)
+            self._profiles[key] = profile
+        self._profiles.move_to_end(key)
+        profile.last_access = time.monotonic()
+        self._sweep(keep=key)
+
+        item = None
+        if profile.items:
+            item, _ = profile.items.popleft()
+            self._hits += 1
+        else:
+            self._misses += 1
+
+        if len(profile.items) <= self.low_watermark:
+            self._schedule_refill(key, profile)
+        return item
+
+    def _schedule_refill(self, key: ProfileKey, profile: _Profile) -> None:
+        """補充タスクが実行されていなければ開始する"""
+        if profile.depleted_at is None:
+            profile.depleted_at = time.monotonic()
+        if profile.refill_task is None or profile.refill_task.done():
+            profile.refill_task = asyncio.create_task(self._refill(key, profile))
+
+    async def _refill(self, key: ProfileKey, profile: _Profile) -> None:
+        """プロファイルの問題数が目標数に達するまで生成を繰り返す"""
+        consecutive_failures = 0
+        while not self._closed and self._profiles.get(key) is profile:
+            if len(profile.items) >= self.target_size:
+                break
+            if self._total_bytes() >= self.max_bytes:
+                logger.warning("Question pool memory cap reached; refill paused")
+                break
+
+            try:
+                async with self._refill_semaphore:
+                    item = await self._generate(profile.spec)
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                self._refill_failures += 1
+                consecutive_failures += 1
+                logger.warning("Question pool refill failed", extra={"topic": key[0], "error": str(e)})
+                if consecutive_failures >= self.max_consecutive_failures:
+                    # 次回の取り出し時に改めて補充を試みる
+                    break
+                await asyncio.sleep(self.retry_delay)
+                continue
+
+            consecutive_failures = 0
+            profile.items.append((item, len(item.model_dump_json())))
+            self._refilled += 1
+
+        if len(profile.items) >= self.target_size and profile.depleted_at is not None:
+            lag = time.monotonic() - profile.depleted_at
+            profile.depleted_at = None
+            self._last_refill_lag = lag
+            self._max_refill_lag = max(self._max_refill_lag, lag)
+
+    async def close(self) -> None:
+        """すべての補充タスクを停止する"""
+        self._closed = True
+        tasks = [p.refill_task for p in self._profiles.values() if p.refill_task is not None]
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+
+    def get_stats(self) -> Dict[str, Any]:
+        """
+        プールの統計情報を取得する。
+
+        Returns:
+            Dict[str, Any]: ヒット率、補充の遅延、保持している問題数など
+        """
+        requests = self._hits + self._misses
+        return {
+            "enabled": self.enabled,
+            "profiles": len(self._profiles),
+            "questions": sum(len(p.items) for p in self._profiles.values()),
+            "bytes": self._total_bytes(),
+            "hits": self._hits,
+            "misses": self._misses,
+            "hit_rate": self._hits / requests if requests else 0.0,
+            "refilled": self._refilled,
+            "refill_failures": self._refill_failures,
+            "refilling": sum(
+                1 for p in self._profiles.values()
+                if p.refill_task is not None and not p.refill_task.done()
+            ),
+            "evictions": self._evictions,
+            "last_refill_lag_seconds": self._last_refill_lag,
+            "max_refill_lag_seconds": self._max_refill_lag,
+        }
@@ -0,0 +1,175 @@
+"""生成した問題を question_id で引けるように保持するストア。"""
+
+import asyncio
+import logging
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+from typing import Any, Dict, Generic, Optional, Protocol, Self, Tuple, Type, TypeVar
+
+logger = logging.getLogger(__name__)
+
+
+class StoredQuestion(Protocol):
+    """ストアに保存できる問題（id フィールドを持つ pydantic のモデル）"""
+
+    id: str
+
+    def model_dump_json(self) -> str: ...
+
+    @classmethod
+    def model_validate_json(cls, json_data: str) -> Self: ...
+
+
+QuestionT = TypeVar("QuestionT", bound=StoredQuestion)
+
+
+class QuestionStore(Generic[QuestionT]):
+    """
+    問題をメモリ上のLRUキャッシュ（TTL付き）に保持し、必要に応じてSQLiteにも永続化するストア。
+
+    SQLiteはWALモードで開き、メモリ上にない問題（再起動後や追い出し後）の参照に使用する。
+    """
+
+    def __init__(
+        self,
+        model: Type[QuestionT],
+        max_items: int = 10000,
+        ttl: float = 86400.0,
+        db_path: Optional[str] = None,
+        purge_interval: int = 1000,
+    ) -> None:
+        """
+        QuestionStoreを初期化する。
+
+        Args:
+            model (Type[QuestionT]): 保存する問題のモデルクラス（id フィールドを持つ）
+            max_items (int): メモリ上に保持する問題数の上限
+            ttl (float): 問題を保持する秒数
+            db_path (Optional[str]): SQLiteデータベースのパス。Noneの場合はメモリ上のみで保持する。
+            purge_interval (int): 期限切れの問題をSQLiteから削除する間隔（保存回数）
+        """
+        self.model = model
+        self.max_items = max_items
+        self.ttl = ttl
+        self.purge_interval = purge_interval
+        self._items: "OrderedDict[str, Tuple[QuestionT, float]]" = OrderedDict()  # id -> (問題, 期限)
+        self._puts = 0
+        self._hits = 0
+        self._db_hits = 0
+        self._misses = 0
+
+        self._db: Optional[sqlite3.Connection] = None
+        self._db_lock = threading.Lock()
+        if db_path:
+            self._db = sqlite3.connect(db_path, check_same_thread=False)
+            self._db.execute("PRAGMA journal_mode=WAL")
+            self._db.execute("PRAGMA synchronous=NORMAL")
+            self._db.execute(
+                "CREATE TABLE IF NOT EXISTS questions ("
+                "id TEXT PRIMARY KEY, data TEXT NOT NULL, expires_at REAL NOT NULL)"
+            )
+            self._db.commit()
+            logger.info("Question store backed by SQLite", extra={"db_path": db_path})
+
+    def _conn(self) -> sqlite3.Connection:
+        """SQLiteへの接続（永続化している場合に限り呼び出す）"""
+        assert self._db is not None
+        return self._db
+
+    def _remember(self, question: QuestionT, expires_at: float) -> None:
+        """メモリ上のLRUキャッシュに問題を追加する"""
+        self._items[question.id] = (question, expires_at)
+        self._items.move_to_end(question.id)
+        while len(self._items) > self.max_items:
+            self._items.popitem(last=False)
+
+    def _db_put(self, question_id: str, data: str, expires_at: float, purge: bool) -> None:
+        with self._db_lock:
+            db = self._conn()
+            db.execute(
+                "INSERT OR REPLACE INTO questions (id, data, expires_at) VALUES (?, ?, ?)",
+                (question_id, data, expires_at),
+            )
+            if purge:
+                db.execute("DELETE FROM questions WHERE expires_at < ?", (time.time(),))
+            db.commit()
+
+    def _db_get(self, question_id: str) -> Optional[Tuple[str, float]]:
+        with self._db_lock:
+            row = self._conn().execute(
+                "SELECT data, expires_at FROM questions WHERE id = ?", (question_id,)
+            ).fetchone()
+        return row
+
+    async def put(self, question: QuestionT) -> None:
+        """
+        問題を保存する。
+
+        Args:
+            question (QuestionT): 保存する問題
+        """
+        expires_at = time.time() + self.ttl
+        self._remember(question, expires_at)
+        self._puts += 1
+
+        if self._db is not None:
+            purge = self._puts % self.purge_interval == 0
+            await asyncio.to_thread(
+                self._db_put, question.id, question.model_dump_json(), expires_at, purge
+            )
+
+    async def get(self, question_id: str) -> Optional[QuestionT]:
+        """
+        問題を取得する。
+
+        Args:
+            question_id (str): 問題の識別子
+
+        Returns:
+            Optional[QuestionT]: 保存されている問題。存在しないか期限切れの場合はNone。
+        """
+        now = time.time()
+        entry = self._items.get(question_id)
+        if entry is not None:
+            question, expires_at = entry
+            if expires_at >= now:
+                self._items.move_to_end(question_id)
+                self._hits += 1
+                return question
+            del self._items[question_id]
+
+        if self._db is not None:
+            row = await asyncio.to_thread(self._db_get, question_id)
+            if row is not None and row[1] >= now:
+                question = self.model.model_validate_json(row[0])
+                self._remember(question, row[1])
+                self._db_hits += 1
+                return question
+
+        self._misses += 1
+        return None
+
+    def close(self) -> None:
+        """SQLiteへの接続を閉じる"""
+        if self._db is not None:
+            with self._db_lock:
+                self._db.close()
+            self._db = None
+
+    def get_stats(self) -> Dict[str, Any]:
+        """
+        ストアの統計情報を取得する。
+
+        Returns:
+            Dict[str, Any]: 保持している問題数やヒット数など
+        """
+        return {
+            "items": len(self._items),
+            "persistent": self._db is not None,
+            "puts": self._puts,
+            "hits": self._hits,
+            "db_hits": self._db_hits,
+            "misses": self._misses,
+        }
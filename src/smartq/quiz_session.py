@@ -0,0 +1,268 @@
+"""1つのWebSocket接続で問題生成と回答評価をまとめて扱い、次の問題を先行して生成するクイズセッション。"""
+
+import asyncio
+import logging
+import time
+from typing import Any, Awaitable, Callable, Coroutine, Dict, Optional, Set, Tuple
+
+import orjson
+from starlette.websockets import WebSocket, WebSocketDisconnect
+
+from smartq.question_pool import ProfileKey, profile_key
+
+logger = logging.getLogger(__name__)
+
+SPECULATION_OUTCOMES = ("ready", "pending", "failed", "discarded")
+
+
+class QuizSessionStats:
+    """すべてのクイズセッションで共有する統計情報"""
+
+    def __init__(self) -> None:
+        self.connections = 0
+        self.active = 0
+        self.messages: Dict[str, int] = {}
+        self.errors = 0
+        self.rejected = 0
+        self.speculative_started = 0
+        self.speculative: Dict[str, int] = dict.fromkeys(SPECULATION_OUTCOMES, 0)
+        self._seconds: Dict[str, float] = {}
+
+    def record_message(self, kind: str, elapsed: float) -> None:
+        """処理したメッセージの種類と所要時間を記録する"""
+        self.messages[kind] = self.messages.get(kind, 0) + 1
+        self._seconds[kind] = self._seconds.get(kind, 0.0) + elapsed
+
+    def record_speculation(self, outcome: str) -> None:
+        """先行生成した問題の結果（ready: 生成済みで使用、pending: 生成中に要求され待って使用、failed、discarded）"""
+        self.speculative[outcome] += 1
+
+    def get_stats(self) -> Dict[str, Any]:
+        """
+        統計情報を取得する。
+
+        Returns:
+            Dict[str, Any]: 接続数、種類ごとのメッセージ数と平均所要時間、先行生成の開始数と結果ごとの件数、
+                先行生成した問題が使われた割合（hit_rate）など
+        """
+        used = self.speculative["ready"] + self.speculative["pending"]
+        finished = sum(self.speculative.values())
+        return {
+            "connections": self.connections,
+            "active": self.active,
+            "messages": dict(self.messages),
+            "avg_seconds": {kind: self._seconds[kind] / count for kind, count in self.messages.items()},
+            "errors": self.errors,
+            "rejected": self.rejected,
+            "speculative_started": self.speculative_started,
+            "speculative": dict(self.speculative),
+            "speculative_hit_rate": used / finished if finished else 0.0,
+        }
+
+
+class QuizSession:
+    """
+    /ws/quiz の1つの接続を処理するクラス。
+
+    クライアントは request_id を付けたJSONメッセージ（generate, evaluate, ping）を送信し、
+    サーバーは処理が終わった順に同じ request_id を付けて結果（question, feedback, pong, error）を送信する。
+    各メッセージは並行に処理するため、評価を待っている間に次の問題を要求することもできる。
+
+    問題を出題すると、同じプロファイル（トピック・システムプロンプト・知識ベース）の次の問題を
+    バックグラウンドの優先度で先行して生成しておき、次の generate で使用する。
+    プロファイルが変わった場合と切断した場合は、先行生成を取り消す。
+    """
+
+    def __init__(
+        self,
+        websocket: WebSocket,
+        parse_generate: Callable[[Dict[str, Any]], Any],
+        serve: Callable[[Any], Awaitable[Any]],
+        prefetch: Callable[[Any], Coroutine[Any, Any, Any]],
+        record: Callable[[Any, Any], Awaitable[None]],
+        evaluate: Callable[[Dict[str, Any]], Awaitable[Any]],
+        error_payload: Callable[[Exception], Dict[str, Any]],
+        stats: QuizSessionStats,
+        speculate: bool = True,
+        max_in_flight: int = 8,
+        discard: Optional[Callable[[Any, Any], None]] = None,
+    ) -> None:
+        """
+        QuizSessionを初期化する。
+
+        Args:
+            websocket (WebSocket): 接続済み（accept済み）のWebSocket
+            parse_generate (Callable[[Dict[str, Any]], Any]): generate メッセージを問題生成リクエストに変換する関数
+            serve (Callable[[Any], Awaitable[Any]]): 先行生成した問題がない場合に問題を用意する関数
+            prefetch (Callable[[Any], Coroutine[Any, Any, Any]]): 次の問題を先行して生成する関数（タスクとして実行する）
+            record (Callable[[Any, Any], Awaitable[None]]): 出題する問題を記録する関数（評価のための保存など）
+            evaluate (Callable[[Dict[str, Any]], Awaitable[Any]]): evaluate メッセージから回答を評価する関数
+            error_payload (Callable[[Exception], Dict[str, Any]]): 例外をステータスコードと詳細に変換する関数
+            stats (QuizSessionStats): 統計情報の記録先
+            speculate (bool): 次の問題を先行して生成するかどうか
+            max_in_flight (int): 1つの接続で同時に処理するメッセージ数の上限
+            discard (Optional[Callable[[Any, Any], None]]): 先行生成したが出題しなかった問題を
+                リクエストとともに受け取る関数（重複判定のインデックスから取り除くなど）
+        """
+        self.websocket = websocket
+        self.parse_generate = parse_generate
+        self.serve = serve
+        self.prefetch = prefetch
+        self.record = record
+        self.evaluate = evaluate
+        self.error_payload = error_payload
+        self.stats = stats
+        self.speculate = speculate
+        self.max_in_flight = max_in_flight
+        self.discard = discard
+        self._handlers: Dict[str, Callable[[Dict[str, Any]], Awaitable[Dict[str, Any]]]] = {
+            "generate": self._generate,
+            "evaluate": self._evaluate,
+            "ping": self._ping,
+        }
+        self._tasks: Set[asyncio.Task] = set()
+        self._speculative: Optional[Tuple[ProfileKey, Any, asyncio.Task]] = None
+        self._send_lock = asyncio.Lock()
+
+    async def run(self) -> None:
+        """切断されるまでメッセージを受信して処理し、切断後は処理中のタスクと先行生成を取り消す"""
+        self.stats.connections += 1
+        self.stats.active += 1
+        try:
+            while True:
+                message = await self.websocket.receive()
+                if message["type"] == "websocket.disconnect":
+                    break
+                await self._dispatch(message.get("text") or message.get("bytes") or b"")
+        except WebSocketDisconnect:
+            pass
+        finally:
+            self.stats.active -= 1
+            self._discard_speculation()
+            for task in self._tasks:
+                task.cancel()
+            await asyncio.gather(*self._tasks, return_exceptions=True)
+
+    async def _dispatch(self, data: Any) -> None:
+        """メッセージを解析し、種類に応じた処理を別のタスクで開始する"""
+        try:
+            payload = orjson.loads(data)
+            if not isinstance(payload, dict):
+                raise ValueError("message must be a JSON object")
+        except ValueError as e:
+            await self._send_error(None, 400, f"Invalid message: {e}")
+            return
+
+        kind = payload.get("type")
+        request_id = payload.get("request_id")
+        if not isinstance(kind, str) or kind not in self._handlers:
+            await self._send_error(request_id, 400, f"Unknown message type: {kind}")
+            return
+        handler = self._handlers[kind]
+        if len(self._tasks) >= self.max_in_flight:
+            self.stats.rejected += 1
+            await self._send_error(request_id, 429, "Too many requests in flight on this connection")
+            return
+
+        task = asyncio.create_task(self._handle(kind, handler, request_id, payload))
+        self._tasks.add(task)
+        task.add_done_callback(self._tasks.discard)
+
+    async def _handle(
+        self,
+        kind: str,
+        handler: Callable[[Dict[str, Any]], Awaitable[Dict[str, Any]]],
+        request_id: Any,
+        payload: Dict[str, Any]
+    ) -> None:
+        started_at = time.monotonic()
+        try:
+            response = await handler(payload)
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            self.stats.errors += 1
+            response = {"type": "error", **self.error_payload(e)}
+        self.stats.record_message(kind, time.monotonic() - started_at)
+        await self._send({**response, "request_id": request_id})
+
+    async def _send(self, message: Dict[str, Any]) -> None:
+        """メッセージを送信する（同時に送信しないよう直列化し、切断後の送信は無視する）"""
+        async with self._send_lock:
+            try:
+                await self.websocket.send_text(orjson.dumps(message).decode())
+            except (WebSocketDisconnect, RuntimeError):
+                pass
+
+    async def _send_error(self, request_id: Any, status: int, detail: str) -> None:
+        self.stats.errors += 1
+        await self._send({"type": "error", "request_id": request_id, "status": status, "detail": detail})
+
+    async def _ping(self, payload: Dict[str, Any]) -> Dict[str, Any]:
+        return {"type": "pong"}
+
+    async def _generate(self, payload: Dict[str, Any]) -> Dict[str, Any]:
+        """先行生成した問題があれば使用し、なければ問題を用意して、次の問題の先行生成を開始する"""
+        request = self.parse_generate(payload)
+        key = profile_key(request.topic, request.system_prompt, request.knowledge_base)
+        question = await self._take_speculation(key)
+        speculative = question is not None
+        if question is None:
+            question = await self.serve(request)
+        await self.record(request, question)
+        self._start_speculation(key, request)
+        return {"type": "question", "question": question.model_dump(mode="json"), "speculative": speculative}
+
+    async def _evaluate(self, payload: Dict[str, Any]) -> Dict[str, Any]:
+        feedback = await self.evaluate(payload)
+        return {"type": "feedback", "feedback": feedback.model_dump(mode="json")}
+
+    def _start_speculation(self, key: ProfileKey, request: Any) -> None:
+        """次の問題の先行生成を開始する（実行中の先行生成は置き換える）"""
+        if not self.speculate:
+            return
+        self._discard_speculation()
+        self._speculative = (key, request, asyncio.create_task(self.prefetch(request)))
+        self.stats.speculative_started += 1
+
+    def _discard_speculation(self) -> None:
+        """使われなかった先行生成を取り消す（生成済みの問題は discard に渡す）"""
+        if self._speculative is None:
+            return
+        _, request, task = self._speculative
+        self._speculative = None
+        if not task.done():
+            task.cancel()
+            self.stats.record_speculation("discarded")
+        elif task.exception() is None:
+            self.stats.record_speculation("discarded")
+            if self.discard is not None:
+                self.discard(request, task.result())
+        else:
+            self.stats.record_speculation("failed")
+
+    async def _take_speculation(self, key: ProfileKey) -> Optional[Any]:
+        """
+        同じプロファイルの先行生成があれば、その問題を取り出す（生成中の場合は完了を待つ）。
+
+        Returns:
+            Optional[Any]: 先行生成した問題。ない場合、プロファイルが異なる場合、生成に失敗した場合はNone。
+        """
+        if self._speculative is None:
+            return None
+        if self._speculative[0] != key:
+            self._discard_speculation()
+            return None
+        _, _, task = self._speculative
+        self._speculative = None
+        outcome = "ready" if task.done() else "pending"
+        try:
+            question = await task
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            self.stats.record_speculation("failed")
+            logger.warning("Speculative question generation failed", extra={"topic": key[0], "error": str(e)})
+            return None
+        self.stats.record_speculation(outcome)
+        return question
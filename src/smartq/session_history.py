@@ -0,0 +1,106 @@
+"""セッションごとに出題済みの問題を記録し、同じ問題を繰り返し出題しないようにする履歴。"""
+
+import time
+from collections import OrderedDict
+from typing import Any, Dict, Optional, Set, Tuple
+
+from smartq.shared_state import SharedState
+
+
+class SessionHistory:
+    """
+    セッションIDごとに出題した問題のIDを保持するLRUキャッシュ（TTL付き）。
+
+    セッションは最後に出題した時刻から ttl 秒で破棄し、セッション数の上限を超えた場合は最も古いものから破棄する。
+    1セッションで保持する問題数にも上限を設け、超えた場合は記録をやり直す。
+    共有状態を指定した場合は、ワーカー間で共有する記録を使用する（セッション数の上限は適用しない）。
+    """
+
+    def __init__(
+        self,
+        max_sessions: int = 10000,
+        ttl: float = 86400.0,
+        max_per_session: int = 500,
+        shared: Optional[SharedState] = None,
+    ) -> None:
+        """
+        SessionHistoryを初期化する。
+
+        Args:
+            max_sessions (int): 保持するセッション数の上限
+            ttl (float): 最後の出題からセッションを保持する秒数
+            max_per_session (int): 1セッションで保持する問題数の上限
+            shared (Optional[SharedState]): ワーカー間で共有する状態。Noneの場合はプロセス内で保持する。
+        """
+        self.max_sessions = max_sessions
+        self.ttl = ttl
+        self.max_per_session = max_per_session
+        self.shared = shared
+        self._sessions: "OrderedDict[str, Tuple[Set[str], float]]" = OrderedDict()  # セッションID -> (問題ID, 期限)
+        self._marked = 0
+        self._expired = 0
+
+    async def seen(self, session_id: Optional[str]) -> Set[str]:
+        """
+        セッションで出題済みの問題のIDを取得する。
+
+        Args:
+            session_id (Optional[str]): セッションID。Noneの場合は空の集合を返す。
+
+        Returns:
+            Set[str]: 出題済みの問題のID
+        """
+        if not session_id:
+            return set()
+        if self.shared is not None:
+            return await self.shared.members("session", session_id)
+        return self._local_seen(session_id)
+
+    def _local_seen(self, session_id: str) -> Set[str]:
+        entry = self._sessions.get(session_id)
+        if entry is None:
+            return set()
+        if entry[1] <= time.monotonic():
+            del self._sessions[session_id]
+            self._expired += 1
+            return set()
+        return entry[0]
+
+    async def mark(self, session_id: Optional[str], question_id: str) -> None:
+        """
+        問題をセッションで出題済みとして記録する。
+
+        Args:
+            session_id (Optional[str]): セッションID。Noneの場合は記録しない。
+            question_id (str): 問題のID
+        """
+        if not session_id or self.max_sessions <= 0:
+            return
+        if self.shared is not None:
+            await self.shared.add_member("session", session_id, question_id, self.ttl, self.max_per_session)
+            self._marked += 1
+            return
+        question_ids = self._local_seen(session_id)
+        if not question_ids or len(question_ids) >= self.max_per_session:
+            question_ids = set()
+        question_ids.add(question_id)
+        self._sessions[session_id] = (question_ids, time.monotonic() + self.ttl)
+        self._sessions.move_to_end(session_id)
+        self._marked += 1
+        while len(self._sessions) > self.max_sessions:
+            self._sessions.popitem(last=False)
+
+    def get_stats(self) -> Dict[str, Any]:
+        """
+        履歴の統計情報を取得する。
+
+        Returns:
+            Dict[str, Any]: 保持しているセッション数、記録した出題数など（共有する場合のセッション数は含まない）
+        """
+        return {
+            "shared": self.shared is not None,
+            "sessions": len(self._sessions),
+            "questions": sum(len(question_ids) for question_ids, _ in self._sessions.values()),
+            "marked": self._marked,
+            "expired": self._expired,
+        }
@@ -0,0 +1,339 @@
+"""複数のワーカープロセスで共有する状態（キャッシュ、セッションの記録、ワーカーごとの統計情報）。"""
+
+import abc
+import asyncio
+import logging
+import os
+import sqlite3
+import threading
+import time
+from typing import Any, Callable, Dict, Optional, Set, Tuple
+
+import orjson
+
+logger = logging.getLogger(__name__)
+
+
+class SharedState(abc.ABC):
+    """
+    ワーカー間で共有する状態のインターフェース。
+
+    値は名前空間とキーごとのバイト列（期限付き）、集合はキーごとのメンバー（期限付き）、
+    ワーカーの状態はワーカーIDごとのバイト列（最終更新時刻付き）として保持する。
+    期限は time.time() を基準とする（プロセス間で共通の時計）。
+    """
+
+    backend = "none"
+
+    @abc.abstractmethod
+    async def get(self, namespace: str, key: str) -> Optional[bytes]:
+        """期限内の値を取得する。ない場合はNone"""
+        raise NotImplementedError
+
+    @abc.abstractmethod
+    async def put(self, namespace: str, key: str, value: bytes, ttl: float) -> None:
+        """値を ttl 秒の期限付きで保存する"""
+        raise NotImplementedError
+
+    @abc.abstractmethod
+    async def members(self, namespace: str, key: str) -> Set[str]:
+        """集合の期限内のメンバーを取得する"""
+        raise NotImplementedError
+
+    @abc.abstractmethod
+    async def add_member(self, namespace: str, key: str, member: str, ttl: float, max_members: int) -> None:
+        """集合にメンバーを追加し、集合全体の期限を延ばす（max_members 以上の場合は集合を作り直す）"""
+        raise NotImplementedError
+
+    @abc.abstractmethod
+    async def publish(self, worker_id: str, data: bytes) -> None:
+        """ワーカーの状態を保存する"""
+        raise NotImplementedError
+
+    @abc.abstractmethod
+    async def workers(self) -> Dict[str, Tuple[bytes, float]]:
+        """すべてのワーカーの状態と最終更新時刻を取得する"""
+        raise NotImplementedError
+
+    @abc.abstractmethod
+    async def purge(self, worker_retention: float) -> None:
+        """期限切れの値と、worker_retention 秒以上更新のないワーカーの状態を削除する"""
+        raise NotImplementedError
+
+    def close(self) -> None:
+        """接続を閉じる"""
+
+    def get_stats(self) -> Dict[str, Any]:
+        """共有状態の統計情報を取得する"""
+        return {"backend": self.backend}
+
+
+class SQLiteSharedState(SharedState):
+    """
+    同じホストのワーカー間で、WALモードのSQLiteファイルを介して状態を共有する実装。
+
+    各ワーカーは自身の接続を持ち、読み込みは他のワーカーの書き込みと並行して行える。
+    問い合わせは（QuestionStoreと同様に）別スレッドで実行し、イベントループを止めない。
+    """
+
+    backend = "sqlite"
+
+    def __init__(self, path: str, busy_timeout: float = 5.0) -> None:
+        """
+        SQLiteSharedStateを初期化し、テーブルがなければ作成する。
+
+        Args:
+            path (str): SQLiteデータベースのパス（ディレクトリがなければ作成する）
+            busy_timeout (float): 他のワーカーの書き込みを待つ秒数の上限
+        """
+        self.path = path
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        self._lock = threading.Lock()
+        self._db = sqlite3.connect(path, timeout=busy_timeout, check_same_thread=False)
+        self._db.execute("PRAGMA journal_mode=WAL")
+        self._db.execute("PRAGMA synchronous=NORMAL")
+        self._db.executescript(
+            "CREATE TABLE IF NOT EXISTS kv ("
+            "namespace TEXT NOT NULL, key TEXT NOT NULL, value BLOB NOT NULL, expires_at REAL NOT NULL, "
+            "PRIMARY KEY (namespace, key)) WITHOUT ROWID;"
+            "CREATE INDEX IF NOT EXISTS kv_expires_at ON kv (expires_at);"
+            "CREATE TABLE IF NOT EXISTS members ("
+            "namespace TEXT NOT NULL, key TEXT NOT NULL, member TEXT NOT NULL, expires_at REAL NOT NULL, "
+            "PRIMARY KEY (namespace, key, member)) WITHOUT ROWID;"
+            "CREATE INDEX IF NOT EXISTS members_expires_at ON members (expires_at);"
+            "CREATE TABLE IF NOT EXISTS workers ("
+            "worker_id TEXT PRIMARY KEY, data BLOB NOT NULL, updated_at REAL NOT NULL);"
+        )
+        self._db.commit()
+        self._reads = 0
+        self._writes = 0
+        self._seconds = 0.0
+        logger.info("Shared state backed by SQLite", extra={"db_path": path})
+
+    async def _run(self, function: Callable[..., Any], *args: Any) -> Any:
+        return await asyncio.to_thread(self._locked, function, *args)
+
+    def _locked(self, function: Callable[..., Any], *args: Any) -> Any:
+        started_at = time.perf_counter()
+        with self._lock:
+            try:
+                return function(*args)
+            finally:
+                self._seconds += time.perf_counter() - started_at
+
+    def _get(self, namespace: str, key: str) -> Optional[bytes]:
+        self._reads += 1
+        row = self._db.execute(
+            "SELECT value FROM kv WHERE namespace = ? AND key = ? AND expires_at >= ?",
+            (namespace, key, time.time()),
+        ).fetchone()
+        return row[0] if row else None
+
+    def _put(self, namespace: str, key: str, value: bytes, ttl: float) -> None:
+        self._writes += 1
+        self._db.execute(
+            "INSERT OR REPLACE INTO kv (namespace, key, value, expires_at) VALUES (?, ?, ?, ?)",
+            (namespace, key, value, time.time() + ttl),
+        )
+        self._db.commit()
+
+    def _members(self, namespace: str, key: str) -> Set[str]:
+        self._reads += 1
+        rows = self._db.execute(
+            "SELECT member FROM members WHERE namespace = ? AND key = ? AND expires_at >= ?",
+            (namespace, key, time.time()),
+        ).fetchall()
+        return {row[0] for row in rows}
+
+    def _add_member(self, namespace: str, key: str, member: str, ttl: float, max_members: int) -> None:
+        self._writes += 1
+        now = time.time()
+        with self._db:
+            count = self._db.execute(
+                "SELECT COUNT(*) FROM members WHERE namespace = ? AND key = ? AND expires_at >= ?",
+                (namespace, key, now),
+            ).fetchone()[0]
+            if count >= max_members:
+                self._db.execute("DELETE FROM members WHERE namespace = ? AND key = ?", (namespace, key))
+            self._db.execute(
+                "INSERT OR REPLACE INTO members (namespace, key, member, expires_at) VALUES (?, ?, ?, ?)",
+                (namespace, key, member, now + ttl),
+            )
+            self._db.execute(
+                "UPDATE members SET expires_at = ? WHERE namespace = ? AND key = ?", (now + ttl, namespace, key)
+            )
+
+    def _publish(self, worker_id: str, data: bytes) -> None:
+        self._writes += 1
+        self._db.execute(
+            "INSERT OR REPLACE INTO workers (worker_id, data, updated_at) VALUES (?, ?, ?)",
+            (worker_id, data, time.time()),
+        )
+        self._db.commit()
+
+    def _workers(self) -> Dict[str, Tuple[bytes, float]]:
+        self._reads += 1
+        rows = self._db.execute("SELECT worker_id, data, updated_at FROM workers").fetchall()
+        return {worker_id: (data, updated_at) for worker_id, data, updated_at in rows}
+
+    def _purge(self, worker_retention: float) -> None:
+        now = time.time()
+        with self._db:
+            self._db.execute("DELETE FROM kv WHERE expires_at < ?", (now,))
+            self._db.execute("DELETE FROM members WHERE expires_at < ?", (now,))
+            self._db.execute("DELETE FROM workers WHERE updated_at < ?", (now - worker_retention,))
+
+    async def get(self, namespace: str, key: str) -> Optional[bytes]:
+        return await self._run(self._get, namespace, key)
+
+    async def put(self, namespace: str, key: str, value: bytes, ttl: float) -> None:
+        await self._run(self._put, namespace, key, value, ttl)
+
+    async def members(self, namespace: str, key: str) -> Set[str]:
+        return await self._run(self._members, namespace, key)
+
+    async def add_member(self, namespace: str, key: str, member: str, ttl: float, max_members: int) -> None:
+        await self._run(self._add_member, namespace, key, member, ttl, max_members)
+
+    async def publish(self, worker_id: str, data: bytes) -> None:
+        await self._run(self._publish, worker_id, data)
+
+    async def workers(self) -> Dict[str, Tuple[bytes, float]]:
+        return await self._run(self._workers)
+
+    async def purge(self, worker_retention: float) -> None:
+        await self._run(self._purge, worker_retention)
+
+    def close(self) -> None:
+        with self._lock:
+            self._db.close()
+
+    def get_stats(self) -> Dict[str, Any]:
+        operations = self._reads + self._writes
+        return {
+            "backend": self.backend,
+            "path": self.path,
+            "reads": self._reads,
+            "writes": self._writes,
+            "avg_ms": self._seconds / operations * 1000 if operations else 0.0,
+        }
+
+
+def open_shared_state(path: Optional[str]) -> Optional[SharedState]:
+    """
+    設定に応じた共有状態を開く。
+
+    Args:
+        path (Optional[str]): SQLiteデータベースのパス。Noneの場合は共有しない（単一ワーカー）。
+
+    Returns:
+        Optional[SharedState]: 共有状態。共有しない場合はNone。
+    """
+    return SQLiteSharedState(path) if path else None
+
+
+class WorkerSync:
+    """
+    各ワーカーのメトリクスと統計情報（snapshot の戻り値）を一定間隔で共有状態に書き込み、
+    他のワーカーの最新の値を読み込んでおくクラス。
+
+    /metrics はすべてのワーカーの値を合算し、/api/stats は稼働中の他のワーカーの値を併せて返すために使用する。
+    停止したワーカーの値は retention 秒が経過するまで合算に含める（カウンターが減らないように）。
+    ゲージ（現在値）は others(live_only=True) で得た稼働中のワーカーの値だけを合算する。
+    """
+
+    def __init__(
+        self,
+        shared: SharedState,
+        worker_id: str,
+        snapshot: Callable[[], Dict[str, Any]],
+        interval: float = 5.0,
+        retention: float = 86400.0,
+    ) -> None:
+        """
+        WorkerSyncを初期化する。
+
+        Args:
+            shared (SharedState): 共有状態
+            worker_id (str): このワーカーのID
+            snapshot (Callable[[], Dict[str, Any]]): このワーカーの状態を返す関数（JSONに変換できる値）
+            interval (float): 書き込みと読み込みの間隔（秒）
+            retention (float): 更新のなくなったワーカーの値を保持する秒数
+        """
+        self.shared = shared
+        self.worker_id = worker_id
+        self.snapshot = snapshot
+        self.interval = interval
+        self.retention = retention
+        self._others: Dict[str, Tuple[Dict[str, Any], float]] = {}
+        self._task: Optional[asyncio.Task] = None
+        self._failures = 0
+
+    async def start(self) -> None:
+        """最初の同期を行い、定期的な同期を開始する"""
+        await self.sync()
+        self._task = asyncio.create_task(self._loop())
+
+    async def _loop(self) -> None:
+        while True:
+            await asyncio.sleep(self.interval)
+            try:
+                await self.sync()
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                self._failures += 1
+                logger.warning("Worker state sync failed", extra={"worker_id": self.worker_id, "error": str(e)})
+
+    async def sync(self) -> None:
+        """このワーカーの状態を書き込み、他のワーカーの状態を読み込む"""
+        await self.shared.publish(self.worker_id, orjson.dumps(self.snapshot(), option=orjson.OPT_NON_STR_KEYS))
+        rows = await self.shared.workers()
+        self._others = {
+            worker_id: (orjson.loads(data), updated_at)
+            for worker_id, (data, updated_at) in rows.items()
+            if worker_id != self.worker_id
+        }
+        await self.shared.purge(self.retention)
+
+    def others(self, live_only: bool = False) -> Dict[str, Dict[str, Any]]:
+        """
+        他のワーカーの最新の状態を取得する。
+
+        Args:
+            live_only (bool): 稼働中（同期間隔の3倍以内に更新のあった）ワーカーに限るかどうか
+
+        Returns:
+            Dict[str, Dict[str, Any]]: ワーカーIDごとの状態
+        """
+        threshold = time.time() - self.interval * 3
+        return {
+            worker_id: data
+            for worker_id, (data, updated_at) in self._others.items()
+            if not live_only or updated_at >= threshold
+        }
+
+    async def close(self) -> None:
+        """定期的な同期を停止し、最後の状態を書き込む"""
+        if self._task is not None:
+            self._task.cancel()
+            await asyncio.gather(self._task, return_exceptions=True)
+            self._task = None
+        try:
+            await self.shared.publish(
+                self.worker_id, orjson.dumps(self.snapshot(), option=orjson.OPT_NON_STR_KEYS)
+            )
+        except Exception as e:
+            logger.warning("Final worker state sync failed", extra={"worker_id": self.worker_id, "error": str(e)})
+
+    def get_stats(self) -> Dict[str, Any]:
+        """同期の統計情報（稼働中の他のワーカー数、失敗数）を取得する"""
+        return {
+            "worker_id": self.worker_id,
+            "interval_seconds": self.interval,
+            "live_workers": len(self.others(live_only=True)) + 1,
+            "known_workers": len(self._others) + 1,
+            "failures": self._failures,
+        }
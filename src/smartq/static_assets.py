@@ -0,0 +1,286 @@
+"""静的ファイルとメインページを起動時に用意し、圧縮済みの内容をメモリから配信する。"""
+
+import gzip
+import hashlib
+import logging
+import mimetypes
+import os
+import time
+from typing import Any, Container, Dict, Iterator, Optional, Tuple
+
+from jinja2 import Environment, FileSystemLoader, select_autoescape
+from starlette.requests import Request
+from starlette.responses import Response
+
+try:
+    import brotli
+except ImportError:
+    # brotli がインストールされていない場合は gzip のみで配信する
+    brotli = None
+
+logger = logging.getLogger(__name__)
+
+# ファイル名にハッシュ値を含むファイルは内容が変わらないため、ブラウザに1年間キャッシュさせる
+IMMUTABLE_CACHE_CONTROL = "public, max-age=31536000, immutable"
+# ハッシュ値を含まないファイルとページは毎回 ETag で更新を確認させる
+REVALIDATE_CACHE_CONTROL = "no-cache"
+
+# 圧縮の優先順（クライアントの q 値が同じ場合は先頭を使用する）
+ENCODINGS = ("br", "gzip")
+COMPRESSIBLE_TYPES = ("text/", "application/javascript", "application/json", "image/svg+xml")
+MIN_COMPRESS_BYTES = 256
+
+
+class Asset:
+    """1つのファイルの内容と、圧縮した内容（エンコーディング -> (内容, ETag)）"""
+
+    def __init__(self, body: bytes, media_type: str, digest: str, cache_control: str) -> None:
+        self.media_type = media_type
+        self.cache_control = cache_control
+        self.variants: Dict[str, Tuple[bytes, str]] = {"identity": (body, f'"{digest}"')}
+
+    def compress(self) -> None:
+        """gzip と（インストールされていれば）brotli で圧縮し、元より小さくなった場合だけ保持する"""
+        body, etag = self.variants["identity"]
+        if len(body) < MIN_COMPRESS_BYTES or not self.media_type.startswith(COMPRESSIBLE_TYPES):
+            return
+        compressed = {"gzip": gzip.compress(body, compresslevel=9, mtime=0)}
+        if brotli is not None:
+            compressed["br"] = brotli.compress(body, quality=11)
+        for encoding, data in compressed.items():
+            if len(data) < len(body):
+                self.variants[encoding] = (data, f'{etag[:-1]}-{encoding}"')
+
+
+def parse_accept_encoding(header: str) -> Dict[str, float]:
+    """
+    Accept-Encoding ヘッダーを解析する。
+
+    Args:
+        header (str): Accept-Encoding ヘッダーの値
+
+    Returns:
+        Dict[str, float]: エンコーディング（小文字）ごとの q 値
+    """
+    accepted: Dict[str, float] = {}
+    for item in header.split(","):
+        name, _, params = item.strip().partition(";")
+        if not name:
+            continue
+        quality = 1.0
+        for param in params.split(";"):
+            key, _, value = param.strip().partition("=")
+            if key == "q":
+                try:
+                    quality = float(value)
+                except ValueError:
+                    quality = 0.0
+        accepted[name.strip().lower()] = quality
+    return accepted
+
+
+def select_encoding(accepted: Dict[str, float], available: Container[str]) -> str:
+    """
+    クライアントの q 値が最も高いエンコーディングを選ぶ。
+
+    q 値が同じ場合は ENCODINGS の順に選ぶ。指定のないエンコーディングには "*" の q 値を使い、
+    identity の q 値が圧縮より高い場合は圧縮しない。
+
+    Args:
+        accepted (Dict[str, float]): parse_accept_encoding で解析した q 値
+        available (Container[str]): 用意されているエンコーディング
+
+    Returns:
+        str: 使用するエンコーディング（圧縮しない場合は identity）
+    """
+    wildcard = accepted.get("*", 0.0)
+    best, best_quality = "identity", 0.0
+    for name in ENCODINGS:
+        quality = accepted.get(name, wildcard)
+        if name in available and quality > best_quality:
+            best, best_quality = name, quality
+    if best != "identity" and accepted.get("identity", 0.0) > best_quality:
+        return "identity"
+    return best
+
+
+class StaticAssets:
+    """
+    起動時に静的ファイルを読み込み、内容のハッシュ値をファイル名に含めて（例: script.3f2a9c1b.js）配信するクラス。
+
+    - ハッシュ値を含むファイル名は `Cache-Control: immutable` で配信し、内容が変わるとファイル名も変わる
+    - ページ（テンプレート）は起動時に一度だけ描画し、ハッシュ値を含むファイル名を埋め込んでおく
+    - すべて gzip（と brotli）で圧縮済みの内容をメモリに保持し、Accept-Encoding に応じて返す
+    - ETag を付け、If-None-Match が一致する場合は 304 を返す
+
+    ファイルやテンプレートを変更した場合は再起動（または build() の再実行）で反映される。
+    """
+
+    def __init__(
+        self,
+        directory: str,
+        templates_directory: str,
+        url_prefix: str = "/static",
+        pages: Tuple[str, ...] = ("index.html",),
+        hash_length: int = 12,
+    ) -> None:
+        """
+        StaticAssetsを初期化する。
+
+        Args:
+            directory (str): 静的ファイルのディレクトリ
+            templates_directory (str): ページのテンプレートのディレクトリ
+            url_prefix (str): 静的ファイルのURLの接頭辞
+            pages (Tuple[str, ...]): 起動時に描画するテンプレート
+            hash_length (int): ファイル名に含めるハッシュ値（SHA-256の16進数）の文字数
+        """
+        self.directory = directory
+        self.url_prefix = url_prefix.rstrip("/")
+        self.pages = pages
+        self.hash_length = hash_length
+        self._environment = Environment(
+            loader=FileSystemLoader(templates_directory),
+            autoescape=select_autoescape(["html"])
+        )
+        self._files: Dict[str, Asset] = {}  # URLのパス（接頭辞以降） -> ファイル
+        self._pages: Dict[str, Asset] = {}  # テンプレート名 -> 描画済みのページ
+        self._urls: Dict[str, str] = {}  # 元のファイル名 -> ハッシュ値を含むURL
+        self._built_at: Optional[float] = None
+        self._build_seconds = 0.0
+
+        # 統計情報
+        self._responses: Dict[str, int] = {}  # エンコーディングごとの配信数
+        self._not_modified = 0
+        self._not_found = 0
+
+    def _walk(self) -> Iterator[str]:
+        for root, _, names in os.walk(self.directory):
+            for name in sorted(names):
+                yield os.path.relpath(os.path.join(root, name), self.directory).replace(os.sep, "/")
+
+    def fingerprinted_name(self, name: str, digest: str) -> str:
+        """ファイル名の拡張子の前にハッシュ値を挿入する（script.js -> script.<hash>.js）"""
+        stem, ext = os.path.splitext(name)
+        return f"{stem}.{digest}{ext}"
+
+    def build(self) -> None:
+        """静的ファイルの読み込み・圧縮と、ページの描画を行う（起動時に1回実行する）"""
+        started_at = time.perf_counter()
+        files: Dict[str, Asset] = {}
+        urls: Dict[str, str] = {}
+        for name in self._walk():
+            with open(os.path.join(self.directory, name), "rb") as f:
+                body = f.read()
+            digest = hashlib.sha256(body).hexdigest()[:self.hash_length]
+            media_type = mimetypes.guess_type(name)[0] or "application/octet-stream"
+            if media_type.startswith("text/") or media_type == "application/javascript":
+                media_type += "; charset=utf-8"
+            hashed_name = self.fingerprinted_name(name, digest)
+            files[hashed_name] = Asset(body, media_type, digest, IMMUTABLE_CACHE_CONTROL)
+            # 元のファイル名でも配信する（ETag で更新を確認させる）
+            files[name] = Asset(body, media_type, digest, REVALIDATE_CACHE_CONTROL)
+            urls[name] = f"{self.url_prefix}/{hashed_name}"
+        for asset in files.values():
+            asset.compress()
+        self._files = files
+        self._urls = urls
+
+        pages: Dict[str, Asset] = {}
+        for page in self.pages:
+            html = self._environment.get_template(page).render(static_url=self.url_for).encode("utf-8")
+            digest = hashlib.sha256(html).hexdigest()[:self.hash_length]
+            pages[page] = Asset(html, "text/html; charset=utf-8", digest, REVALIDATE_CACHE_CONTROL)
+            pages[page].compress()
+        self._pages = pages
+
+        self._built_at = time.time()
+        self._build_seconds = time.perf_counter() - started_at
+        if brotli is None:
+            logger.info("brotli is not installed; serving gzip only (install the brotli extra to enable .br)")
+        logger.info(
+            "Static assets built",
+            extra={
+                "files": len(urls),
+                "pages": len(pages),
+                "brotli": brotli is not None,
+                "build_ms": round(self._build_seconds * 1000, 1),
+            }
+        )
+
+    def url_for(self, name: str) -> str:
+        """
+        静的ファイルのURL（ハッシュ値を含むファイル名）を取得する。
+
+        Args:
+            name (str): 静的ファイルのディレクトリからの相対パス（例: script.js）
+
+        Returns:
+            str: URL（存在しないファイルの場合はハッシュ値を含まないURL）
+        """
+        return self._urls.get(name, f"{self.url_prefix}/{name}")
+
+    def _respond(self, request: Request, asset: Asset) -> Response:
+        """Accept-Encoding に応じた内容を返す（If-None-Match が一致する場合は 304）"""
+        accepted = parse_accept_encoding(request.headers.get("accept-encoding", ""))
+        encoding = select_encoding(accepted, asset.variants)
+        body, etag = asset.variants[encoding]
+        headers = {"ETag": etag, "Cache-Control": asset.cache_control}
+        if len(asset.variants) > 1:
+            headers["Vary"] = "Accept-Encoding"
+        if encoding != "identity":
+            headers["Content-Encoding"] = encoding
+
+        if_none_match = request.headers.get("if-none-match")
+        if if_none_match and (if_none_match.strip() == "*" or etag in [tag.strip() for tag in if_none_match.split(",")]):
+            self._not_modified += 1
+            return Response(status_code=304, headers=headers)
+        self._responses[encoding] = self._responses.get(encoding, 0) + 1
+        if request.method == "HEAD":
+            headers["Content-Length"] = str(len(body))
+            return Response(status_code=200, headers=headers, media_type=asset.media_type)
+        return Response(body, headers=headers, media_type=asset.media_type)
+
+    def file_response(self, request: Request, path: str) -> Response:
+        """
+        静的ファイルを返す。
+
+        Args:
+            request (Request): リクエスト
+            path (str): URLのパスの接頭辞以降（例: script.3f2a9c1b.js）
+
+        Returns:
+            Response: ファイルの内容（存在しない場合は 404）
+        """
+        asset = self._files.get(path)
+        if asset is None:
+            self._not_found += 1
+            return Response("Not Found", status_code=404, media_type="text/plain")
+        return self._respond(request, asset)
+
+    def page_response(self, request: Request, page: str) -> Response:
+        """起動時に描画したページを返す"""
+        return self._respond(request, self._pages[page])
+
+    def get_stats(self) -> Dict[str, Any]:
+        """
+        配信の統計情報を取得する。
+
+        Returns:
+            Dict[str, Any]: ファイル数、元の合計サイズと圧縮後の合計サイズ、brotli の有無、
+                エンコーディングごとの配信数、304 と 404 の件数、構築にかかった時間など
+        """
+        sizes: Dict[str, int] = {}
+        for name in self._urls:
+            for encoding, (body, _) in self._files[name].variants.items():
+                sizes[encoding] = sizes.get(encoding, 0) + len(body)
+        return {
+            "files": len(self._urls),
+            "pages": list(self._pages),
+            "brotli": brotli is not None,
+            "bytes": sizes,
+            "responses": dict(self._responses),
+            "not_modified": self._not_modified,
+            "not_found": self._not_found,
+            "built_at": self._built_at,
+            "build_ms": self._build_seconds * 1000,
+        }
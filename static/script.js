@@ -1,16 +1,27 @@
 // アプリケーションの状態管理
 const appState = {
     isLoading: false,
+    isStreaming: false,     // ストリーミング受信中かどうか
     isError: false,
     errorMessage: '',
     currentQuestion: null,  // QuizQuestion型
     selectedOptions: [],    // 選択されたオプションのインデックス配列
-    feedback: null,         // FeedbackResponse型
-    logs: []               // アプリケーションログ
+    feedback: null          // FeedbackResponse型
 };
 
+// タブごとのセッションID（同じセッションに出題済みの問題をサーバー側で避ける）
+const sessionId = (() => {
+    let id = sessionStorage.getItem('smartqSessionId');
+    if (!id) {
+        id = crypto.randomUUID ? crypto.randomUUID() : `${Date.now()}-${Math.random().toString(36).slice(2)}`;
+        sessionStorage.setItem('smartqSessionId', id);
+    }
+    return id;
+})();
+
 // DOM要素の参照
 const elements = {
+    appRoot: document.querySelector('.container'),
     topicSelect: document.getElementById('topicSelect'),
     generateButton: document.getElementById('generateButton'),
     submitButton: document.getElementById('submitButton'),
@@ -23,56 +34,277 @@ const elements = {
     systemPrompt: document.getElementById('systemPrompt'),
     knowledgeInput: document.getElementById('knowledgeInput'),
     loadingSpinner: document.getElementById('loadingSpinner'),
-    initialMessage: document.getElementById('initialMessage')
+    initialMessage: document.getElementById('initialMessage'),
+    debugToggle: document.getElementById('debugToggle'),
+    latencySummary: document.getElementById('latencySummary'),
+    latencyRows: document.getElementById('latencyRows')
 };
 
-// 状態更新関数
-const updateState = (newState) => {
-    Object.assign(appState, newState);
-    render();
-};
+// ログ（直近 LOG_CAPACITY 件だけを保持するリングバッファ）
+// コンソールへの出力はデバッグ時のみ（?debug=1、パネルのチェックボックス、または smartq.setDebug(true)）
+const LOG_CAPACITY = 200;
+const logBuffer = { entries: new Array(LOG_CAPACITY), next: 0, size: 0 };
+let debugEnabled = new URLSearchParams(window.location.search).has('debug')
+    || localStorage.getItem('smartqDebug') === 'true';
 
 // ログ関数
 const log = (type, message, data = null) => {
     const logEntry = {
-        timestamp: new Date().toISOString(),
+        timestamp: Date.now(),
         type,
         message,
         data
     };
-    console.log(`[${logEntry.type}] ${logEntry.message}`, data);
-    appState.logs.push(logEntry);
+    logBuffer.entries[logBuffer.next] = logEntry;
+    logBuffer.next = (logBuffer.next + 1) % LOG_CAPACITY;
+    logBuffer.size = Math.min(logBuffer.size + 1, LOG_CAPACITY);
+    if (debugEnabled) {
+        console.log(`[${logEntry.type}] ${logEntry.message}`, data ?? '');
+    } else if (type === 'error' || type === 'api-error') {
+        console.warn(`[${logEntry.type}] ${logEntry.message}`);
+    }
+};
+
+// 保持しているログを古い順に取得する
+const getLogs = () => {
+    const start = (logBuffer.next - logBuffer.size + LOG_CAPACITY) % LOG_CAPACITY;
+    return Array.from({ length: logBuffer.size }, (_, i) => logBuffer.entries[(start + i) % LOG_CAPACITY]);
+};
+
+const setDebug = (enabled) => {
+    debugEnabled = enabled;
+    localStorage.setItem('smartqDebug', String(enabled));
+    if (elements.debugToggle) {
+        elements.debugToggle.checked = enabled;
+    }
+};
+
+// API呼び出しの所要時間（パネルには直近 LATENCY_ROWS 件、集計は呼び出し先ごとに直近 LATENCY_SAMPLES 件）
+const LATENCY_ROWS = 20;
+const LATENCY_SAMPLES = 50;
+const latencySamples = new Map();
+
+const percentile = (sorted, p) => sorted[Math.min(sorted.length - 1, Math.floor(sorted.length * p))];
+
+const recordLatency = ({ label, transport, status, startedAt, firstAt = null }) => {
+    const total = performance.now() - startedAt;
+    const samples = latencySamples.get(label) || [];
+    samples.push(total);
+    if (samples.length > LATENCY_SAMPLES) {
+        samples.shift();
+    }
+    latencySamples.set(label, samples);
+    log('latency', `${label} ${Math.round(total)}ms`, { transport, status });
+
+    if (!elements.latencyRows) {
+        return;
+    }
+    const row = document.createElement('tr');
+    [
+        new Date().toLocaleTimeString(),
+        label,
+        transport,
+        String(status),
+        firstAt === null ? '-' : String(Math.round(firstAt - startedAt)),
+        String(Math.round(total))
+    ].forEach(text => {
+        const cell = document.createElement('td');
+        cell.textContent = text;
+        row.appendChild(cell);
+    });
+    elements.latencyRows.prepend(row);
+    while (elements.latencyRows.rows.length > LATENCY_ROWS) {
+        elements.latencyRows.lastElementChild.remove();
+    }
+
+    elements.latencySummary.textContent = Array.from(latencySamples, ([name, values]) => {
+        const sorted = [...values].sort((a, b) => a - b);
+        const average = sorted.reduce((sum, value) => sum + value, 0) / sorted.length;
+        return `${name}: 平均 ${Math.round(average)}ms / p95 ${Math.round(percentile(sorted, 0.95))}ms (${sorted.length}件)`;
+    }).join('\n');
+};
+
+// 開発者ツールから参照するためのデバッグ用の関数
+window.smartq = { getLogs, setDebug, getLatencies: () => Object.fromEntries(latencySamples) };
+
+// 状態更新関数（描画は次のフレームでまとめて行う）
+let renderScheduled = false;
+const updateState = (newState) => {
+    Object.assign(appState, newState);
+    if (!renderScheduled) {
+        renderScheduled = true;
+        requestAnimationFrame(() => {
+            renderScheduled = false;
+            render();
+        });
+    }
+};
+
+// 値が変わった場合だけDOMを更新する
+const setText = (node, text) => {
+    if (node.textContent !== text) {
+        node.textContent = text;
+    }
+};
+
+const setVisible = (node, visible) => {
+    if (node.hidden === visible) {
+        node.hidden = !visible;
+    }
+};
+
+const createElement = (tag, className = '', text = '') => {
+    const node = document.createElement(tag);
+    if (className) {
+        node.className = className;
+    }
+    if (text) {
+        node.textContent = text;
+    }
+    return node;
+};
+
+// 描画済みの選択肢（選択肢のインデックスをキーとして、同じ要素を更新して使い回す）
+const optionNodes = new Map();
+
+const createOptionNode = (index) => {
+    const label = createElement('label', 'option-label');
+    label.dataset.optionIndex = String(index);
+    const input = document.createElement('input');
+    input.value = String(index);
+    const text = createElement('span', 'option-text');
+    label.append(input, text);
+    return { label, input, text, type: null, selected: false };
+};
+
+const renderOptions = (options) => {
+    options.forEach((option, index) => {
+        let node = optionNodes.get(index);
+        if (!node) {
+            node = createOptionNode(index);
+            optionNodes.set(index, node);
+            elements.optionsContainer.appendChild(node.label);
+        }
+
+        // 選択肢の種類を決定（デフォルトはradio）
+        const inputType = option.type || 'radio';
+        if (node.type !== inputType) {
+            node.input.type = inputType;
+            node.input.name = inputType === 'checkbox' ? `answer_${index}` : 'answer';
+            node.label.classList.remove('radio', 'checkbox');
+            node.label.classList.add(inputType);
+            node.type = inputType;
+        }
+        setText(node.text, option.text);
+
+        const isSelected = appState.selectedOptions.includes(index);
+        if (node.input.checked !== isSelected) {
+            node.input.checked = isSelected;
+        }
+        if (node.selected !== isSelected) {
+            node.label.classList.toggle('selected', isSelected);
+            node.selected = isSelected;
+        }
+    });
+
+    optionNodes.forEach((node, index) => {
+        if (index >= options.length) {
+            node.label.remove();
+            optionNodes.delete(index);
+        }
+    });
+};
+
+// フィードバックの表示（構造は一度だけ作成し、内容だけを更新する）
+let feedbackView = null;
+let renderedResources = null;
+
+const createFeedbackView = () => {
+    const root = createElement('div', 'feedback');
+    const heading = createElement('h3');
+    const message = createElement('p');
+    const detailed = createElement('div', 'detailed-explanation');
+    const detailedText = createElement('p');
+    detailed.append(createElement('h4', '', '詳細解説:'), detailedText);
+    const resources = createElement('div', 'additional-resources');
+    const resourceList = createElement('ul');
+    resources.append(createElement('h4', '', '追加リソース:'), resourceList);
+    const explanation = createElement('div', 'explanation');
+    const explanationText = createElement('p');
+    explanation.append(createElement('h4', '', '問題解説:'), explanationText);
+    const detailButton = createElement('button', 'secondary-button', 'AIの詳しい解説を見る');
+    detailButton.type = 'button';
+    detailButton.dataset.action = 'detailed-feedback';
+    root.append(heading, message, detailed, resources, explanation, detailButton);
+    elements.feedbackContainer.appendChild(root);
+    return { root, heading, message, detailedText, resources, resourceList, explanation, explanationText, detailButton };
+};
+
+const renderResources = (resources) => {
+    if (resources === renderedResources) {
+        return;
+    }
+    renderedResources = resources;
+    feedbackView.resourceList.replaceChildren(...(resources || []).map(resource => {
+        const item = createElement('li');
+        item.append(createElement('strong', '', resource.title), `: ${resource.description}`);
+        return item;
+    }));
+};
+
+const renderFeedback = (feedback, question) => {
+    if (!feedback) {
+        if (feedbackView) {
+            setVisible(feedbackView.root, false);
+        }
+        elements.feedbackContainer.classList.remove('visible');
+        return;
+    }
+    if (!feedbackView) {
+        feedbackView = createFeedbackView();
+    }
+    const view = feedbackView;
+    setVisible(view.root, true);
+    view.root.classList.toggle('correct', feedback.isCorrect);
+    view.root.classList.toggle('incorrect', !feedback.isCorrect);
+    setText(view.heading, feedback.isCorrect ? '正解です！' : '不正解です。');
+    setText(view.message, feedback.feedback || '...');
+    setText(view.detailedText, feedback.detailedExplanation || '...');
+
+    setVisible(view.resources, Boolean(feedback.additionalResources));
+    renderResources(feedback.additionalResources);
+
+    const showExplanation = Boolean(question && question.explanation) && feedback.source !== 'template';
+    setVisible(view.explanation, showExplanation);
+    if (showExplanation) {
+        setText(view.explanationText, question.explanation);
+    }
+    setVisible(view.detailButton, feedback.source === 'template' && !appState.isLoading);
+    elements.feedbackContainer.classList.add('visible');
 };
 
 // UI更新関数
 const render = () => {
     // ローディング状態の更新
     elements.generateButton.disabled = appState.isLoading;
-    elements.submitButton.disabled = appState.isLoading || 
-                                    !appState.currentQuestion || 
+    elements.submitButton.disabled = appState.isLoading ||
+                                    appState.isStreaming ||
+                                    !appState.currentQuestion ||
                                     appState.selectedOptions.length === 0;
-    
-    if (appState.isLoading) {
-        elements.loadingSpinner.classList.add('visible');
-        elements.generateButton.classList.add('loading');
-        elements.submitButton.classList.add('loading');
-    } else {
-        elements.loadingSpinner.classList.remove('visible');
-        elements.generateButton.classList.remove('loading');
-        elements.submitButton.classList.remove('loading');
-    }
+
+    elements.loadingSpinner.classList.toggle('visible', appState.isLoading);
+    elements.generateButton.classList.toggle('loading', appState.isLoading);
+    elements.submitButton.classList.toggle('loading', appState.isLoading);
 
     // エラーメッセージの表示/非表示
     if (appState.isError) {
-        elements.errorMessage.textContent = appState.errorMessage;
-        elements.errorMessage.classList.add('visible');
-    } else {
-        elements.errorMessage.classList.remove('visible');
+        setText(elements.errorMessage, appState.errorMessage);
     }
+    elements.errorMessage.classList.toggle('visible', appState.isError);
 
     // 次の問題ボタンの状態
     if (elements.nextButton) {
-        elements.nextButton.style.display = appState.feedback ? 'block' : 'none';
+        elements.nextButton.style.display = appState.feedback && !appState.isStreaming ? 'block' : 'none';
     }
 
     // 初期メッセージの表示/非表示
@@ -81,85 +313,21 @@ const render = () => {
     }
 
     // 問題と選択肢の表示
-    if (appState.currentQuestion) {
-        log('render', 'Rendering question and options', appState.currentQuestion);
-        
-        // 問題文の表示
-        elements.questionText.textContent = appState.currentQuestion.question;
-        
-        // 選択肢の表示
-        const optionsHtml = appState.currentQuestion.options.map((option, index) => {
-            // 選択肢の種類を決定（デフォルトはradio）
-            const inputType = option.type || 'radio';
-            const name = inputType === 'checkbox' ? `answer_${index}` : 'answer';
-            const isSelected = appState.selectedOptions.includes(index);
-            
-            // 選択肢のHTMLを生成
-            return `
-                <label class="option-label ${inputType} ${isSelected ? 'selected' : ''}"
-                       data-option-index="${index}">
-                    <input type="${inputType}" 
-                           name="${name}" 
-                           value="${index}"
-                           ${isSelected ? 'checked' : ''}>
-                    <span class="option-text">${option.text}</span>
-                </label>
-            `;
-        }).join('');
-        
-        elements.optionsContainer.innerHTML = optionsHtml;
-        
-        // 選択肢のイベントリスナーを設定
-        const optionLabels = elements.optionsContainer.querySelectorAll('.option-label');
-        optionLabels.forEach(label => {
-            const input = label.querySelector('input');
-            input.addEventListener('change', handleOptionSelect);
-        });
-        
-        log('render', 'Options rendered successfully');
-    } else {
-        elements.questionText.textContent = '問題を生成してください';
-        elements.optionsContainer.innerHTML = '';
-    }
+    const question = appState.currentQuestion;
+    setText(elements.questionText, question ? question.question : '問題を生成してください');
+    renderOptions(question ? question.options : []);
 
     // フィードバック表示の更新
-    if (appState.feedback) {
-        elements.feedbackContainer.innerHTML = `
-            <div class="feedback ${appState.feedback.isCorrect ? 'correct' : 'incorrect'}">
-                <h3>${appState.feedback.isCorrect ? '正解です！' : '不正解です。'}</h3>
-                <p>${appState.feedback.feedback}</p>
-                <div class="detailed-explanation">
-                    <h4>詳細解説:</h4>
-                    <p>${appState.feedback.detailedExplanation}</p>
-                </div>
-                ${appState.feedback.additionalResources ? `
-                    <div class="additional-resources">
-                        <h4>追加リソース:</h4>
-                        <ul>
-                            ${appState.feedback.additionalResources.map(resource => `
-                                <li><strong>${resource.title}</strong>: ${resource.description}</li>
-                            `).join('')}
-                        </ul>
-                    </div>
-                ` : ''}
-                <div class="explanation">
-                    <h4>問題解説:</h4>
-                    <p>${appState.currentQuestion.explanation}</p>
-                </div>
-            </div>
-        `;
-        elements.feedbackContainer.classList.add('visible');
-    } else {
-        elements.feedbackContainer.innerHTML = '';
-        elements.feedbackContainer.classList.remove('visible');
-    }
+    renderFeedback(appState.feedback, question);
 };
 
 // API呼び出し関数
 const callApi = async (endpoint, data) => {
+    const startedAt = performance.now();
+    let status = 'network';
     try {
         log('api-request', `Sending request to ${endpoint}`, data);
-        
+
         const response = await fetch(endpoint, {
             method: 'POST',
             headers: {
@@ -167,6 +335,7 @@ const callApi = async (endpoint, data) => {
             },
             body: JSON.stringify(data)
         });
+        status = response.status;
 
         const responseData = await response.json();
         log('api-response', `Received response from ${endpoint}`, responseData);
@@ -184,6 +353,191 @@ const callApi = async (endpoint, data) => {
             responseData: error.responseData
         });
         throw new Error(`Network error: ${error.message}`);
+    } finally {
+        recordLatency({ label: endpoint, transport: 'http', status, startedAt });
+    }
+};
+
+// Server-Sent Eventsの1メッセージを解析する
+const parseSseEvent = (rawEvent) => {
+    let event = 'message';
+    const dataLines = [];
+    rawEvent.split('\n').forEach(line => {
+        if (line.startsWith('event:')) {
+            event = line.slice(6).trim();
+        } else if (line.startsWith('data:')) {
+            dataLines.push(line.slice(5).trim());
+        }
+    });
+    return { event, data: dataLines.length ? JSON.parse(dataLines.join('\n')) : null };
+};
+
+// ストリーミングAPI呼び出し関数
+// 途中経過のイベントは onEvent に渡し、done イベントのデータを結果として返す
+const callApiStream = async (endpoint, data, onEvent) => {
+    const startedAt = performance.now();
+    let firstAt = null;
+    let status = 'network';
+    try {
+        log('api-request', `Sending streaming request to ${endpoint}`, data);
+
+        const response = await fetch(endpoint, {
+            method: 'POST',
+            headers: {
+                'Content-Type': 'application/json',
+                'Accept': 'text/event-stream'
+            },
+            body: JSON.stringify(data)
+        });
+        status = response.status;
+
+        if (!response.ok) {
+            const responseData = await response.json();
+            const error = new Error(responseData.detail || `API error: ${response.status}`);
+            error.responseData = responseData;
+            throw error;
+        }
+
+        const reader = response.body.getReader();
+        const decoder = new TextDecoder();
+        let buffer = '';
+        let result = null;
+
+        while (result === null) {
+            const { value, done } = await reader.read();
+            if (done) {
+                break;
+            }
+            buffer += decoder.decode(value, { stream: true });
+
+            let boundary;
+            while ((boundary = buffer.indexOf('\n\n')) !== -1) {
+                const message = parseSseEvent(buffer.slice(0, boundary));
+                buffer = buffer.slice(boundary + 2);
+                firstAt = firstAt ?? performance.now();
+
+                if (message.event === 'error') {
+                    status = message.data.status;
+                    const error = new Error(message.data.detail);
+                    error.responseData = message.data;
+                    throw error;
+                } else if (message.event === 'done') {
+                    result = message.data;
+                } else {
+                    onEvent(message.event, message.data);
+                }
+            }
+        }
+
+        if (result === null) {
+            throw new Error('Stream ended before completion');
+        }
+        log('api-response', `Received streamed response from ${endpoint}`, result);
+        return result;
+    } catch (error) {
+        log('api-error', `Error in streaming API call to ${endpoint}`, {
+            error: error.message,
+            responseData: error.responseData
+        });
+        throw new Error(`Network error: ${error.message}`);
+    } finally {
+        recordLatency({ label: endpoint, transport: 'sse', status, startedAt, firstAt });
+    }
+};
+
+// クイズセッションのWebSocket（/ws/quiz）
+// 問題生成と回答評価を1つの接続で行い、サーバーは出題後に次の問題を先行して生成する
+// 接続できない場合は available が false になり、HTTPのAPIを使用する
+const quizSocket = (() => {
+    let connecting = null;
+    let nextRequestId = 1;
+    let available = 'WebSocket' in window;
+    const pending = new Map();
+
+    const connect = () => {
+        if (connecting) {
+            return connecting;
+        }
+        connecting = new Promise((resolve, reject) => {
+            const protocol = window.location.protocol === 'https:' ? 'wss:' : 'ws:';
+            const socket = new WebSocket(`${protocol}//${window.location.host}/ws/quiz`);
+            let opened = false;
+
+            socket.addEventListener('open', () => {
+                opened = true;
+                resolve(socket);
+            });
+            socket.addEventListener('message', (event) => {
+                const message = JSON.parse(event.data);
+                const request = pending.get(message.request_id);
+                if (!request) {
+                    return;
+                }
+                pending.delete(message.request_id);
+                if (message.type === 'error') {
+                    const error = new Error(typeof message.detail === 'string' ? message.detail : JSON.stringify(message.detail));
+                    error.responseData = message;
+                    request.reject(error);
+                } else {
+                    request.resolve(message);
+                }
+            });
+            socket.addEventListener('close', () => {
+                if (!opened) {
+                    // 接続できなかった場合は以降HTTPのAPIを使用する
+                    available = false;
+                }
+                connecting = null;
+                pending.forEach(request => request.reject(new Error('WebSocket connection closed')));
+                pending.clear();
+                reject(new Error('WebSocket connection failed'));
+            });
+        });
+        return connecting;
+    };
+
+    // メッセージを送信し、同じ request_id の応答を待つ
+    const send = async (type, data) => {
+        const socket = await connect();
+        const requestId = nextRequestId++;
+        return new Promise((resolve, reject) => {
+            pending.set(requestId, { resolve, reject });
+            socket.send(JSON.stringify({ type, request_id: requestId, ...data }));
+        });
+    };
+
+    return { send, isAvailable: () => available };
+})();
+
+// WebSocketでの呼び出し関数
+// 接続の問題の場合は null を返し（呼び出し側でHTTPのAPIを使用する）、サーバーのエラーは例外として送出する
+const callSocket = async (type, data) => {
+    if (!quizSocket.isAvailable()) {
+        return null;
+    }
+    const startedAt = performance.now();
+    let status = 'network';
+    try {
+        log('api-request', `Sending ${type} over WebSocket`, data);
+        const message = await quizSocket.send(type, data);
+        status = message.speculative ? 'ok (先行生成)' : 'ok';
+        log('api-response', `Received ${message.type} over WebSocket`, message);
+        return message;
+    } catch (error) {
+        if (!error.responseData) {
+            log('api-fallback', `WebSocket unavailable, falling back to HTTP for ${type}`, { error: error.message });
+            return null;
+        }
+        status = error.responseData.status;
+        log('api-error', `Error in WebSocket ${type}`, {
+            error: error.message,
+            responseData: error.responseData
+        });
+        throw error;
+    } finally {
+        if (status !== 'network') {
+            recordLatency({ label: `ws:${type}`, transport: 'ws', status, startedAt });
+        }
     }
 };
 
@@ -191,34 +545,62 @@ const callApi = async (endpoint, data) => {
 const handleGenerate = async () => {
     try {
         log('user-action', 'Generating new question');
-        updateState({ 
-            isLoading: true, 
-            isError: false, 
-            currentQuestion: null, 
-            selectedOptions: [], 
-            feedback: null 
+        updateState({
+            isLoading: true,
+            isError: false,
+            currentQuestion: null,
+            selectedOptions: [],
+            feedback: null
         });
 
         const data = {
             topic: elements.topicSelect.value,
             system_prompt: elements.systemPrompt.value,
-            knowledge_base: elements.knowledgeInput.value
+            knowledge_base: elements.knowledgeInput.value,
+            session_id: sessionId
         };
 
-        const result = await callApi('/api/generate', data);
-        log('question-generated', 'New question generated successfully', result);
-        updateState({ 
+        // WebSocketでは先行生成された問題がすぐに届く
+        const message = await callSocket('generate', data);
+        if (message) {
+            log('question-generated', 'New question received', { id: message.question.id, speculative: message.speculative });
+            updateState({ currentQuestion: message.question, selectedOptions: [] });
+            return;
+        }
+
+        // 問題文と選択肢を受信した順に表示する
+        const partial = { id: null, question: '', options: [], explanation: '' };
+        updateState({ isStreaming: true });
+        const result = await callApiStream('/api/generate/stream', data, (event, payload) => {
+            if (event === 'reset') {
+                // サーバーが別の問題に差し替える場合は、表示中の途中の問題を消して done を待つ
+                log('question-reset', 'Streamed question was replaced', payload);
+                Object.assign(partial, { question: '', options: [], explanation: '' });
+                updateState({ currentQuestion: null });
+                return;
+            }
+            if (event === 'question') {
+                partial.question = payload.question;
+            } else if (event === 'option') {
+                partial.options[payload.index] = payload.option;
+            } else if (event === 'explanation') {
+                partial.explanation = payload.explanation;
+            }
+            updateState({ currentQuestion: { ...partial, options: partial.options.filter(Boolean) } });
+        });
+        log('question-generated', 'New question generated successfully', { id: result.id });
+        updateState({
             currentQuestion: result,
             selectedOptions: []
         });
     } catch (error) {
         log('error', 'Failed to generate question', error);
-        updateState({ 
-            isError: true, 
+        updateState({
+            isError: true,
             errorMessage: `問題の生成中にエラーが発生しました: ${error.message}`
         });
     } finally {
-        updateState({ isLoading: false });
+        updateState({ isLoading: false, isStreaming: false });
     }
 };
 
@@ -233,7 +615,7 @@ const handleOptionSelect = (event) => {
     } else if (event.target.type === 'checkbox') {
         // チェックボックスの場合は複数選択可能
         let selectedOptions = [...appState.selectedOptions];
-        
+
         if (event.target.checked) {
             // 選択追加
             if (!selectedOptions.includes(value)) {
@@ -243,15 +625,14 @@ const handleOptionSelect = (event) => {
             // 選択解除
             selectedOptions = selectedOptions.filter(item => item !== value);
         }
-        
+
         updateState({ selectedOptions });
     }
-    
-    log('state-update', 'Selected options updated', appState.selectedOptions);
 };
 
 // 回答送信ハンドラ
-const handleSubmit = async () => {
+// detailed が true の場合は、自由記述がなくてもAIによる詳しいフィードバックを要求する
+const submitAnswer = async (detailed) => {
     if (!appState.currentQuestion || appState.selectedOptions.length === 0) {
         log('validation-error', 'No answer selected');
         updateState({
@@ -266,22 +647,32 @@ const handleSubmit = async () => {
             selectedOptions: appState.selectedOptions,
             additionalAnswer: elements.additionalAnswer.value
         });
-        
+
         updateState({ isLoading: true, isError: false });
 
+        // 問題はサーバー側に保存されているため、IDと選択肢のインデックスだけを送信する
         const data = {
             question_id: appState.currentQuestion.id,
-            selected_options: appState.selectedOptions.map(index => ({
-                index,
-                text: appState.currentQuestion.options[index].text
-            })),
+            selected_options: appState.selectedOptions.map(index => ({ index })),
             additional_answer: elements.additionalAnswer.value,
-            question: appState.currentQuestion.question,
-            options: appState.currentQuestion.options
+            detailed
         };
 
-        const result = await callApi('/api/evaluate', data);
-        log('answer-evaluated', 'Answer evaluation received', result);
+        const message = await callSocket('evaluate', data);
+        if (message) {
+            log('answer-evaluated', 'Answer evaluation received', { isCorrect: message.feedback.isCorrect });
+            updateState({ feedback: message.feedback });
+            return;
+        }
+
+        // 正誤判定とフィードバックを受信した順に表示する
+        const partial = { isCorrect: false, feedback: '', detailedExplanation: '', additionalResources: null };
+        updateState({ isStreaming: true });
+        const result = await callApiStream('/api/evaluate/stream', data, (event, payload) => {
+            Object.assign(partial, event === 'verdict' ? { isCorrect: payload.isCorrect } : payload);
+            updateState({ feedback: { ...partial } });
+        });
+        log('answer-evaluated', 'Answer evaluation received', { isCorrect: result.isCorrect, source: result.source });
         updateState({ feedback: result });
     } catch (error) {
         log('error', 'Failed to evaluate answer', error);
@@ -290,10 +681,18 @@ const handleSubmit = async () => {
             errorMessage: `回答の評価中にエラーが発生しました: ${error.message}`
         });
     } finally {
-        updateState({ isLoading: false });
+        updateState({ isLoading: false, isStreaming: false });
     }
 };
 
+const handleSubmit = () => submitAnswer(false);
+
+// AIによる詳しいフィードバックの要求ハンドラ
+const handleDetailedFeedback = () => {
+    log('user-action', 'Requesting detailed feedback');
+    submitAnswer(true);
+};
+
 // 次の問題ハンドラ
 const handleNext = () => {
     updateState({
@@ -302,26 +701,48 @@ const handleNext = () => {
         feedback: null,
         isError: false
     });
-    
+
     // フォーカスを問題生成ボタンに移動
     elements.generateButton.focus();
 };
 
-// イベントリスナーの設定
-const setupEventListeners = () => {
-    elements.generateButton.addEventListener('click', handleGenerate);
-    elements.submitButton.addEventListener('click', handleSubmit);
-    elements.optionsContainer.addEventListener('change', handleOptionSelect);
-    if (elements.nextButton) {
-        elements.nextButton.addEventListener('click', handleNext);
+// data-action 属性の値ごとのハンドラ
+const actions = {
+    generate: handleGenerate,
+    submit: handleSubmit,
+    next: handleNext,
+    'detailed-feedback': handleDetailedFeedback
+};
+
+// アプリ全体のイベントを1つのハンドラで受け取り、対象の要素に応じて振り分ける
+const handleEvent = (event) => {
+    if (event.type === 'change') {
+        if (event.target.closest('[data-option-index]')) {
+            handleOptionSelect(event);
+        } else if (event.target === elements.debugToggle) {
+            setDebug(event.target.checked);
+        }
+        return;
     }
+
+    const target = event.target.closest('[data-action]');
+    if (target && !target.disabled && actions[target.dataset.action]) {
+        actions[target.dataset.action](event);
+    }
+};
+
+// イベントリスナーの設定（選択肢やフィードバックは描画のたびに登録し直さない）
+const setupEventListeners = () => {
+    elements.appRoot.addEventListener('click', handleEvent);
+    elements.appRoot.addEventListener('change', handleEvent);
 };
 
 // アプリケーションの初期化
 const init = () => {
     setupEventListeners();
+    setDebug(debugEnabled);
     render();
 };
 
 // アプリケーションの起動
-document.addEventListener('DOMContentLoaded', init); 
\ No newline at end of file
+document.addEventListener('DOMContentLoaded', init);
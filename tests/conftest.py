@@ -0,0 +1,51 @@
+"""テスト共通の設定と、模擬 Ollama サーバー（smartq.fake_ollama）に接続したアプリのフィクスチャ。"""
+
+import os
+import tempfile
+
+import pytest
+
+# app.py は読み込み時に環境変数から設定を読むため、import より前に設定する
+os.environ.update(
+    QUESTION_POOL_SIZE="0",             # 事前生成プールによるバックグラウンドの呼び出しを行わない
+    OLLAMA_WARMUP="false",
+    OLLAMA_HEALTH_INTERVAL="0",
+    LOG_FILE=os.path.join(tempfile.mkdtemp(prefix="smartq-test-"), "smartq.log"),
+)
+
+
+@pytest.fixture
+def anyio_backend():
+    return "asyncio"
+
+
+@pytest.fixture
+def fake_ollama_config():
+    """模擬サーバーの設定（テストごとに上書きできる）"""
+    from smartq.fake_ollama import FakeOllamaConfig
+
+    return FakeOllamaConfig(latency=0.0, tokens_per_second=0, seed=1)
+
+
+@pytest.fixture
+async def app_client(monkeypatch, fake_ollama_config):
+    """
+    模擬 Ollama サーバーに接続した SmartQ アプリを起動し、アプリに送信する HTTP クライアントを返す。
+
+    Ollama への HTTP クライアントを、模擬サーバーの ASGI アプリに直接送信するものに差し替える。
+    """
+    import httpx
+
+    import app as smartq_app
+    from smartq.fake_ollama import create_app
+
+    fake = create_app(fake_ollama_config)
+    monkeypatch.setattr(
+        smartq_app,
+        "create_http_client",
+        lambda **kwargs: httpx.AsyncClient(transport=httpx.ASGITransport(app=fake), timeout=30),
+    )
+    async with smartq_app.app.router.lifespan_context(smartq_app.app):
+        transport = httpx.ASGITransport(app=smartq_app.app)
+        async with httpx.AsyncClient(transport=transport, base_url="http://smartq", timeout=30) as client:
+            yield client
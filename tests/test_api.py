@@ -0,0 +1,156 @@
+import asyncio
+
+import orjson
+import pytest
+
+import app as smartq_app
+from app import Option, judge_answer
+from smartq.fake_ollama import FakeOllamaConfig
+
+pytestmark = pytest.mark.anyio
+
+GENERATE = {"topic": "VLAN", "system_prompt": "ネットワークの問題を作成してください。"}
+
+
+async def generate(client):
+    response = await client.post("/api/generate", json=GENERATE)
+    assert response.status_code == 200
+    return response.json()
+
+
+def selections(question):
+    """正解の選択と不正解の選択"""
+    options = question["options"]
+    correct = [i for i, option in enumerate(options) if option["isCorrect"]]
+    wrong = [i for i in range(len(options)) if i not in correct][:1]
+    return [correct, wrong]
+
+
+def expected_verdict(question, indices):
+    return judge_answer([Option(**option) for option in question["options"]], indices)
+
+
+def read_events(text):
+    events = []
+    for block in text.strip().split("\n\n"):
+        fields = dict(line.split(": ", 1) for line in block.splitlines())
+        events.append((fields["event"], orjson.loads(fields["data"])))
+    return events
+
+
+async def test_evaluation_uses_the_server_side_verdict(app_client):
+    for _ in range(5):
+        question = await generate(app_client)
+        for indices in selections(question):
+            response = await app_client.post("/api/evaluate", json={
+                "question_id": question["id"],
+                "selected_options": [{"index": index} for index in indices],
+                "additional_answer": "ブロードキャストドメインを分割するためです。",
+            })
+            assert response.status_code == 200
+            assert response.json()["isCorrect"] is expected_verdict(question, indices)
+
+
+async def test_fast_path_returns_the_server_side_verdict(app_client):
+    question = await generate(app_client)
+    for indices in selections(question):
+        response = await app_client.post("/api/evaluate", json={
+            "question_id": question["id"],
+            "selected_options": [{"index": index} for index in indices],
+        })
+        assert response.status_code == 200
+        assert response.json()["isCorrect"] is expected_verdict(question, indices)
+
+
+async def test_streamed_done_event_agrees_with_verdict(app_client):
+    question = await generate(app_client)
+    payload = {
+        "question_id": question["id"],
+        "selected_options": [{"index": index} for index in selections(question)[0]],
+        "additional_answer": "ブロードキャストドメインを分割するためです。",
+    }
+    # 2回目はキャッシュされた評価結果を返す
+    for _ in range(2):
+        response = await app_client.post("/api/evaluate/stream", json=payload)
+        assert response.status_code == 200
+        events = dict(read_events(response.text))
+        assert events["verdict"]["isCorrect"] is True
+        assert events["done"]["isCorrect"] is True
+
+
+async def test_unknown_question_is_not_found(app_client):
+    response = await app_client.post("/api/evaluate", json={
+        "question_id": "unknown",
+        "selected_options": [{"index": 0}],
+    })
+    assert response.status_code == 404
+
+
+async def test_client_supplied_question_is_not_trusted(app_client):
+    response = await app_client.post("/api/evaluate", json={
+        "question_id": "unknown",
+        "selected_options": [{"index": 0}],
+        "question": "自分で作った問題",
+        "options": [{"text": "A", "isCorrect": True}, {"text": "B", "isCorrect": False}],
+    })
+    assert response.status_code == 404
+    assert response.json()["detail"] == "Question not found or expired: unknown"
+
+
+async def test_replaced_stream_question_is_reset_before_done(app_client, monkeypatch):
+    checks = []
+
+    def duplicate_once(topic, question):
+        checks.append(question.question)
+        return len(checks) == 1
+
+    monkeypatch.setattr(smartq_app, "is_near_duplicate", duplicate_once)
+    response = await app_client.post("/api/generate/stream", json=GENERATE)
+    events = read_events(response.text)
+    names = [name for name, _ in events]
+
+    assert names[0] == "question"
+    assert names[-2:] == ["reset", "done"]
+    assert events[-2][1] == {"reason": "duplicate"}
+    assert events[-1][1]["question"] != events[0][1]["question"]
+
+
+async def test_stream_without_replacement_has_no_reset(app_client, monkeypatch):
+    monkeypatch.setattr(smartq_app, "is_near_duplicate", lambda topic, question: False)
+    response = await app_client.post("/api/generate/stream", json=GENERATE)
+    events = read_events(response.text)
+    assert "reset" not in [name for name, _ in events]
+    assert events[-1][1]["question"] == events[0][1]["question"]
+
+
+async def test_duplicate_regeneration_is_bounded(app_client, monkeypatch):
+    checks = []
+
+    def always_duplicate(topic, question):
+        checks.append(question.question)
+        return True
+
+    monkeypatch.setattr(smartq_app, "is_near_duplicate", always_duplicate)
+    monkeypatch.setattr(smartq_app, "DEDUP_MAX_RETRIES", 2)
+    question = await generate(app_client)
+    # 上限まで生成し直したら、最後に生成した問題を返す
+    assert len(checks) == 3
+    assert question["question"] == checks[-1]
+
+
+@pytest.mark.parametrize("fake_ollama_config", [FakeOllamaConfig(latency=0.2, tokens_per_second=0, seed=1)])
+async def test_streamed_and_plain_evaluations_share_one_ai_call(app_client):
+    question = await generate(app_client)
+    payload = {
+        "question_id": question["id"],
+        "selected_options": [{"index": index} for index in selections(question)[0]],
+        "additional_answer": "ブロードキャストドメインを分割するためです。",
+    }
+    streamed, plain = await asyncio.gather(
+        app_client.post("/api/evaluate/stream", json=payload),
+        app_client.post("/api/evaluate", json=payload),
+    )
+    assert dict(read_events(streamed.text))["done"]["feedback"] == plain.json()["feedback"]
+
+    stats = (await app_client.get("/api/stats")).json()["evaluation_cache"]
+    assert (stats["misses"], stats["coalesced"]) == (1, 1)
@@ -0,0 +1,74 @@
+import time
+
+import httpx
+import pytest
+
+from ollama.backend_pool import OllamaBackendPool
+from ollama.ollama_client import DeadlineExceededError
+from ollama.scheduler import OllamaScheduler
+from smartq.fake_ollama import FakeOllamaConfig, create_app
+
+pytestmark = pytest.mark.anyio
+
+
+def fake_backends(**latencies):
+    """ホスト名ごとに応答時間の異なる模擬サーバーに振り分けるHTTPクライアント"""
+    mounts = {
+        f"http://{name}": httpx.ASGITransport(app=create_app(
+            FakeOllamaConfig(latency=latency, tokens_per_second=0, seed=1)
+        ))
+        for name, latency in latencies.items()
+    }
+    return httpx.AsyncClient(mounts=mounts)
+
+
+def backend_stats(pool):
+    return {b["url"]: b for b in pool.get_pool_stats()["backends"]}
+
+
+async def test_timeout_after_most_of_the_deadline_ejects_the_backend():
+    async with fake_backends(slow=1.0) as http_client:
+        pool = OllamaBackendPool(
+            ["http://slow"], http_client=http_client, eject_threshold=1, request_timeout=0.4
+        )
+        with pytest.raises(DeadlineExceededError):
+            await pool.generate_text("VLAN", deadline=time.monotonic() + 0.3)
+    stats = backend_stats(pool)["http://slow"]
+    assert stats["ejected"]
+
+
+async def test_timeout_with_a_spent_deadline_is_not_a_backend_failure():
+    async with fake_backends(slow=1.0) as http_client:
+        pool = OllamaBackendPool(
+            ["http://slow"], http_client=http_client, eject_threshold=1, request_timeout=0.4
+        )
+        # 待ち行列などで期限をほぼ使い切ってから送信した場合
+        with pytest.raises(DeadlineExceededError):
+            await pool.generate_text("VLAN", deadline=time.monotonic() + 0.05)
+    assert not backend_stats(pool)["http://slow"]["ejected"]
+
+
+async def test_slow_response_is_hedged_when_a_slot_is_free():
+    async with fake_backends(fast=0.0, slow=1.0) as http_client:
+        pool = OllamaBackendPool(["http://fast", "http://slow"], http_client=http_client, hedge_delay=0.05)
+        scheduler = OllamaScheduler(pool, max_concurrency=2)
+        started_at = time.monotonic()
+        # 最初のリクエストは2台目（遅いバックエンド）に振り分けられる
+        assert await scheduler.generate_text("VLAN")
+        assert time.monotonic() - started_at < 0.5
+
+    stats = pool.get_pool_stats()
+    assert (stats["hedged"], stats["hedge_wins"], stats["hedges_skipped"]) == (1, 1, 0)
+    # ヘッジに使った実行枠も返却されている
+    assert scheduler.get_stats()["limit_active"] == 0
+
+
+async def test_hedge_is_skipped_without_a_free_slot():
+    async with fake_backends(fast=0.0, slow=0.3) as http_client:
+        pool = OllamaBackendPool(["http://fast", "http://slow"], http_client=http_client, hedge_delay=0.05)
+        scheduler = OllamaScheduler(pool, max_concurrency=1)
+        assert await scheduler.generate_text("VLAN")
+
+    stats = pool.get_pool_stats()
+    assert (stats["hedged"], stats["hedge_wins"], stats["hedges_skipped"]) == (0, 0, 1)
+    assert scheduler.get_stats()["limit_active"] == 0
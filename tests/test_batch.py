@@ -0,0 +1,83 @@
+import pytest
+from pydantic import ValidationError
+
+import app as smartq_app
+
+pytestmark = pytest.mark.anyio
+
+GENERATE = {"topic": "VLAN", "system_prompt": "ネットワークの問題を作成してください。"}
+
+
+@pytest.fixture
+def batch_calls(monkeypatch):
+    """一括生成のプロンプトで要求した問題数（Ollama呼び出しごと）"""
+    calls = []
+    build_prompt = smartq_app.build_quiz_batch_prompt
+
+    def recording(request, knowledge, count, avoid=()):
+        calls.append(count)
+        return build_prompt(request, knowledge, count, avoid)
+
+    monkeypatch.setattr(smartq_app, "build_quiz_batch_prompt", recording)
+    monkeypatch.setattr(smartq_app, "is_near_duplicate", lambda topic, question: False)
+    return calls
+
+
+async def test_batch_is_split_into_chunks(app_client, batch_calls, monkeypatch):
+    monkeypatch.setattr(smartq_app, "BATCH_CHUNK_SIZE", 3)
+    response = await app_client.post("/api/generate/batch", json={**GENERATE, "count": 7})
+    assert response.status_code == 200
+    body = response.json()
+    assert (len(body["questions"]), body["requested"], body["failed"]) == (7, 7, 0)
+    assert sorted(batch_calls) == [1, 3, 3]
+    assert len({question["id"] for question in body["questions"]}) == 7
+
+    # 生成した問題はそのまま評価できる
+    question = body["questions"][0]
+    evaluated = await app_client.post("/api/evaluate", json={
+        "question_id": question["id"],
+        "selected_options": [{"index": 0}],
+    })
+    assert evaluated.status_code == 200
+
+
+async def test_only_invalid_questions_are_requested_again(app_client, batch_calls, monkeypatch):
+    parse = smartq_app.parse_quiz_question
+    parsed = []
+
+    def failing_first(raw):
+        parsed.append(raw)
+        if len(parsed) == 1:
+            raise ValidationError.from_exception_data("GeneratedQuiz", [])
+        return parse(raw)
+
+    monkeypatch.setattr(smartq_app, "parse_quiz_question", failing_first)
+    response = await app_client.post("/api/generate/batch", json={**GENERATE, "count": 3})
+    body = response.json()
+    assert (len(body["questions"]), body["failed"]) == (3, 0)
+    assert batch_calls == [3, 1]
+
+
+async def test_questions_that_never_validate_are_reported_as_failed(app_client, batch_calls, monkeypatch):
+    parse = smartq_app.parse_quiz_question
+    parsed = []
+
+    def failing_second(raw):
+        # 2問目以降（再生成した問題を含む）を常に不正とする
+        parsed.append(raw)
+        if len(parsed) >= 2:
+            raise ValidationError.from_exception_data("GeneratedQuiz", [])
+        return parse(raw)
+
+    monkeypatch.setattr(smartq_app, "parse_quiz_question", failing_second)
+    response = await app_client.post("/api/generate/batch", json={**GENERATE, "count": 2})
+    body = response.json()
+    assert (len(body["questions"]), body["requested"], body["failed"]) == (1, 2, 1)
+    assert batch_calls == [2] + [1] * (smartq_app.BATCH_MAX_ATTEMPTS - 1)
+
+
+async def test_count_above_the_limit_is_rejected(app_client):
+    response = await app_client.post(
+        "/api/generate/batch", json={**GENERATE, "count": smartq_app.BATCH_MAX_COUNT + 1}
+    )
+    assert response.status_code == 422
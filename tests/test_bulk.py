@@ -0,0 +1,113 @@
+import argparse
+
+import httpx
+import orjson
+import pytest
+from pydantic import BaseModel
+
+import app as smartq_app
+from smartq.bulk import BulkGenerator, run_bulk, scan_output
+from smartq.fake_ollama import FakeOllamaConfig, create_app
+
+pytestmark = pytest.mark.anyio
+
+
+class Question(BaseModel):
+    question: str
+
+
+def make_generate(calls):
+    async def generate(topic, count):
+        calls.append((topic, count))
+        return [Question(question=f"{topic} {len(calls)}-{i}") for i in range(count)]
+
+    return generate
+
+
+def read_topics(path):
+    with open(path, "rb") as f:
+        return [orjson.loads(line)["topic"] for line in f]
+
+
+async def test_generates_until_each_topic_reaches_its_target(tmp_path):
+    output = str(tmp_path / "bank.jsonl")
+    calls = []
+    result = await BulkGenerator(make_generate(calls), output, batch_size=2, progress_interval=0).run(
+        {"VLAN": 3, "ACL": 2}
+    )
+
+    assert result["complete"] and result["generated"] == 5
+    assert sorted(calls) == [("ACL", 2), ("VLAN", 1), ("VLAN", 2)]
+    assert sorted(read_topics(output)) == ["ACL", "ACL", "VLAN", "VLAN", "VLAN"]
+
+
+async def test_resume_truncates_writes_after_the_checkpoint(tmp_path):
+    output = str(tmp_path / "bank.jsonl")
+    await BulkGenerator(make_generate([]), output, progress_interval=0).run({"VLAN": 2})
+    # チェックポイントの後に書き込まれた行と、書き込み途中で中断した行
+    with open(output, "ab") as f:
+        f.write(b'{"topic": "VLAN", "question": "unflushed"}\n{"topic": "VLAN", "quest')
+
+    calls = []
+    result = await BulkGenerator(make_generate(calls), output, progress_interval=0).run({"VLAN": 3, "ACL": 1})
+
+    assert sorted(calls) == [("ACL", 1), ("VLAN", 1)]
+    assert result["topics"]["VLAN"] == {"done": 3, "target": 3}
+    assert sorted(read_topics(output)) == ["ACL", "VLAN", "VLAN", "VLAN"]
+
+
+async def test_resume_without_checkpoint_scans_complete_lines(tmp_path):
+    output = tmp_path / "bank.jsonl"
+    output.write_bytes(b'{"topic": "VLAN", "question": "q1"}\n{"topic": "VLAN", "quest')
+    assert scan_output(str(output)) == (len(b'{"topic": "VLAN", "question": "q1"}\n'), {"VLAN": 1})
+
+    calls = []
+    await BulkGenerator(make_generate(calls), str(output), progress_interval=0).run({"VLAN": 2})
+    assert calls == [("VLAN", 1)]
+    assert read_topics(output) == ["VLAN", "VLAN"]
+
+
+async def test_output_shorter_than_checkpoint_is_refused(tmp_path):
+    output = tmp_path / "bank.jsonl"
+    await BulkGenerator(make_generate([]), str(output), progress_interval=0).run({"VLAN": 2})
+    output.write_bytes(b"")
+
+    with pytest.raises(RuntimeError):
+        await BulkGenerator(make_generate([]), str(output), progress_interval=0).run({"VLAN": 2})
+
+
+async def test_failed_batches_are_retried_up_to_max_attempts(tmp_path):
+    output = str(tmp_path / "bank.jsonl")
+    calls = []
+
+    async def generate(topic, count):
+        calls.append(count)
+        return [Question(question="only one")]
+
+    result = await BulkGenerator(generate, output, batch_size=3, max_attempts=2, progress_interval=0).run(
+        {"VLAN": 3}
+    )
+    assert calls == [3, 2]
+    assert result["failed_units"] == 1
+    assert not result["complete"]
+
+
+async def test_run_bulk_uses_only_the_ollama_connection(tmp_path, monkeypatch):
+    fake = create_app(FakeOllamaConfig(latency=0.0, tokens_per_second=0, seed=1))
+    monkeypatch.setattr(
+        smartq_app,
+        "create_http_client",
+        lambda **kwargs: httpx.AsyncClient(transport=httpx.ASGITransport(app=fake), timeout=30),
+    )
+    # アプリを起動しないため、作業ディレクトリに static/ や logs/ がなくてもよい
+    monkeypatch.chdir(tmp_path)
+    args = argparse.Namespace(
+        output="bank.jsonl", checkpoint=None, system_prompt="問題を作成してください。", knowledge_file=None,
+        concurrency=1, batch_size=2, checkpoint_every=50, max_attempts=3, timeout=30.0, progress_interval=0,
+        per_topic=3,
+    )
+    result = await run_bulk(args, ["VLAN"])
+
+    assert result["complete"]
+    assert read_topics(tmp_path / "bank.jsonl") == ["VLAN"] * 3
+    assert not (tmp_path / "logs").exists()
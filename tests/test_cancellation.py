@@ -0,0 +1,95 @@
+import asyncio
+import time
+
+import orjson
+import pytest
+
+import app as smartq_app
+from smartq.cancellation import CancelOnDisconnectMiddleware
+from smartq.fake_ollama import FakeOllamaConfig
+from smartq.metrics import SmartQMetrics
+
+pytestmark = pytest.mark.anyio
+
+
+def http_scope(path, method="POST"):
+    return {"type": "http", "method": method, "path": path, "headers": [], "query_string": b""}
+
+
+def disconnecting_receive(body=b"", disconnect_after=0.05):
+    """本文を送ったあと、指定した秒数で切断するクライアント"""
+    messages = [{"type": "http.request", "body": body, "more_body": False}]
+
+    async def receive():
+        if messages:
+            return messages.pop(0)
+        await asyncio.sleep(disconnect_after)
+        return {"type": "http.disconnect"}
+
+    return receive
+
+
+async def collect(messages, message):
+    messages.append(message)
+
+
+def slow_app(events, seconds=5.0):
+    async def app(scope, receive, send):
+        await receive()
+        try:
+            await asyncio.sleep(seconds)
+        except asyncio.CancelledError:
+            events.append("cancelled")
+            raise
+        await send({"type": "http.response.start", "status": 200, "headers": []})
+        await send({"type": "http.response.body", "body": b"done"})
+        events.append("completed")
+
+    return app
+
+
+async def test_disconnect_cancels_the_request():
+    metrics, events, sent = SmartQMetrics(), [], []
+    middleware = CancelOnDisconnectMiddleware(slow_app(events), metrics=metrics)
+    started_at = time.monotonic()
+    await middleware(http_scope("/api/generate"), disconnecting_receive(), lambda m: collect(sent, m))
+
+    assert time.monotonic() - started_at < 1.0
+    assert events == ["cancelled"] and sent == []
+    assert metrics.client_disconnects._values == {("other",): 1}
+
+
+async def test_completed_response_is_not_cancelled():
+    metrics, events, sent = SmartQMetrics(), [], []
+    middleware = CancelOnDisconnectMiddleware(slow_app(events, seconds=0.01), metrics=metrics)
+    await middleware(
+        http_scope("/api/generate"), disconnecting_receive(disconnect_after=1.0), lambda m: collect(sent, m)
+    )
+    assert events == ["completed"]
+    assert sent[-1]["body"] == b"done"
+    assert metrics.client_disconnects._values == {}
+
+
+async def test_paths_outside_the_prefixes_are_passed_through():
+    metrics, events, sent = SmartQMetrics(), [], []
+    middleware = CancelOnDisconnectMiddleware(slow_app(events, seconds=0.2), metrics=metrics)
+    await middleware(http_scope("/static/script.js", "GET"), disconnecting_receive(), lambda m: collect(sent, m))
+    assert events == ["completed"]
+
+
+@pytest.mark.parametrize("fake_ollama_config", [FakeOllamaConfig(latency=2.0, tokens_per_second=0, seed=1)])
+async def test_disconnect_stops_the_ollama_call(app_client):
+    body = orjson.dumps({"topic": "VLAN", "system_prompt": "ネットワークの問題を作成してください。"})
+    scope = dict(
+        http_scope("/api/generate"),
+        headers=[(b"content-type", b"application/json"), (b"content-length", str(len(body)).encode())],
+    )
+    sent = []
+    started_at = time.monotonic()
+    await smartq_app.app(scope, disconnecting_receive(body, disconnect_after=0.1), lambda m: collect(sent, m))
+
+    assert time.monotonic() - started_at < 1.0
+    assert sent == []
+    stats = (await app_client.get("/api/stats")).json()
+    assert stats["http_pool"][smartq_app.OLLAMA_GENERATE_MODEL]["cancelled"] == 1
+    assert stats["scheduler"][smartq_app.OLLAMA_GENERATE_MODEL]["active"] == 0
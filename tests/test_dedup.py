@@ -0,0 +1,62 @@
+from smartq.dedup import NearDuplicateIndex, normalize_text
+
+QUESTION = (
+    "VLAN を使用する主な目的として正しいものはどれか。"
+    "ブロードキャストドメインを分割する / ルーティングテーブルを縮小する / "
+    "MAC アドレスを暗号化する / 物理ポートの数を増やす"
+)
+REORDERED = (
+    "VLAN を使用する主な目的として正しいものはどれか？"
+    "MAC アドレスを暗号化する / 物理ポートの数を増やす / "
+    "ブロードキャストドメインを分割する / ルーティングテーブルを縮小する"
+)
+UNRELATED = (
+    "OSPF のエリア 0 の役割として正しいものはどれか。"
+    "バックボーンとして他のエリアを接続する / DHCP のアドレスを配布する / "
+    "スパニングツリーのルートを決める / NAT の変換表を保持する"
+)
+
+
+def test_normalize_text_ignores_width_case_and_punctuation():
+    assert normalize_text("ＶＬＡＮ を、使う!") == normalize_text("vlan を使う")
+
+
+def test_reworded_question_is_detected_as_duplicate():
+    index = NearDuplicateIndex(threshold=0.6)
+    assert index.check("VLAN", "q1", QUESTION) is None
+    assert index.check("VLAN", "q2", REORDERED) == "q1"
+    assert index.check("VLAN", "q3", UNRELATED) is None
+
+    stats = index.get_stats()
+    assert (stats["checks"], stats["duplicates"], stats["questions"]) == (3, 1, 2)
+
+
+def test_topics_are_indexed_separately():
+    index = NearDuplicateIndex(threshold=0.6)
+    assert index.check("VLAN", "q1", QUESTION) is None
+    assert index.check("ACL", "q2", QUESTION) is None
+    # 表記揺れのあるトピックは同じトピックとして扱う
+    assert index.check("  vlan ", "q3", QUESTION) == "q1"
+
+
+def test_oldest_questions_are_forgotten_per_topic():
+    index = NearDuplicateIndex(threshold=0.6, max_per_topic=1)
+    assert index.check("VLAN", "q1", QUESTION) is None
+    assert index.check("VLAN", "q2", UNRELATED) is None
+    assert index.check("VLAN", "q3", QUESTION) is None
+
+
+def test_zero_threshold_disables_detection():
+    index = NearDuplicateIndex(threshold=0)
+    assert not index.enabled
+    assert index.check("VLAN", "q1", QUESTION) is None
+    assert index.check("VLAN", "q2", QUESTION) is None
+
+
+def test_removed_question_is_no_longer_compared():
+    index = NearDuplicateIndex(threshold=0.6)
+    assert index.check("VLAN", "q1", QUESTION) is None
+    assert index.remove(" vlan", "q1")
+    assert not index.remove("VLAN", "q1")
+    assert index.check("VLAN", "q2", REORDERED) is None
+    assert index.get_stats()["questions"] == 1
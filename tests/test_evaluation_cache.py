@@ -0,0 +1,139 @@
+import asyncio
+
+import pytest
+
+from smartq.evaluation_cache import EvaluationCache, evaluation_key, normalize_answer
+
+pytestmark = pytest.mark.anyio
+
+
+def test_key_ignores_option_order_and_answer_formatting():
+    first = evaluation_key("question", [2, 0], "  ＴＣＰ は\tコネクション型 ")
+    second = evaluation_key("question", [0, 2], "tcp は コネクション型")
+    assert first == second
+    assert normalize_answer(None) == ""
+    assert evaluation_key("other question", [0, 2], "tcp は コネクション型") != first
+
+
+async def test_concurrent_requests_share_one_computation():
+    cache = EvaluationCache(max_items=10)
+    calls = 0
+
+    async def compute():
+        nonlocal calls
+        calls += 1
+        await asyncio.sleep(0.01)
+        return {"feedback": "ok"}
+
+    key = evaluation_key("question", [1], "")
+    results = await asyncio.gather(*(cache.get_or_compute(key, compute) for _ in range(5)))
+
+    assert calls == 1
+    assert all(result is results[0] for result in results)
+    assert await cache.get_or_compute(key, compute) is results[0]
+    stats = cache.get_stats()
+    assert (stats["misses"], stats["coalesced"], stats["hits"]) == (1, 4, 1)
+    assert stats["in_flight"] == 0
+
+
+async def test_computation_is_cancelled_when_last_waiter_leaves():
+    cache = EvaluationCache(max_items=10)
+    started = asyncio.Event()
+    cancelled = asyncio.Event()
+
+    async def compute():
+        started.set()
+        try:
+            await asyncio.sleep(10)
+        except asyncio.CancelledError:
+            cancelled.set()
+            raise
+
+    key = evaluation_key("question", [0], "answer")
+    waiter = asyncio.create_task(cache.get_or_compute(key, compute))
+    await started.wait()
+    waiter.cancel()
+    with pytest.raises(asyncio.CancelledError):
+        await waiter
+    await asyncio.wait_for(cancelled.wait(), 1)
+    await asyncio.sleep(0)
+
+    stats = cache.get_stats()
+    assert stats["abandoned"] == 1
+    assert stats["in_flight"] == 0
+    assert cache.get(key) is None
+
+
+async def test_computation_continues_while_another_waiter_remains():
+    cache = EvaluationCache(max_items=10)
+    started = asyncio.Event()
+    finish = asyncio.Event()
+
+    async def compute():
+        started.set()
+        await finish.wait()
+        return "result"
+
+    key = evaluation_key("question", [0], "answer")
+    leaving = asyncio.create_task(cache.get_or_compute(key, compute))
+    staying = asyncio.create_task(cache.get_or_compute(key, compute))
+    await started.wait()
+    leaving.cancel()
+    with pytest.raises(asyncio.CancelledError):
+        await leaving
+    finish.set()
+
+    assert await staying == "result"
+    assert cache.get(key) == "result"
+    assert cache.get_stats()["abandoned"] == 0
+
+
+async def test_failed_computation_is_not_cached():
+    cache = EvaluationCache(max_items=10)
+
+    async def compute():
+        raise ValueError("invalid output")
+
+    key = evaluation_key("question", [0], "answer")
+    with pytest.raises(ValueError):
+        await cache.get_or_compute(key, compute)
+    assert cache.get(key) is None
+    assert cache.get_stats()["in_flight"] == 0
+
+
+async def test_claimed_computation_is_shared_with_get_or_compute():
+    cache = EvaluationCache(max_items=10)
+    key = evaluation_key("question", [1], "ブロードキャストドメインを分割する")
+    claimed = cache.claim(key)
+    assert claimed is not None
+    assert cache.claim(key) is None
+
+    async def compute():
+        raise AssertionError("the claimed evaluation must be reused")
+
+    waiter = asyncio.create_task(cache.get_or_compute(key, compute))
+    await asyncio.sleep(0)
+    result = {"feedback": "streamed"}
+    cache.put(key, result)
+    claimed.set_result(result)
+
+    assert await waiter is result
+    stats = cache.get_stats()
+    assert (stats["misses"], stats["coalesced"], stats["in_flight"]) == (1, 1, 0)
+
+
+async def test_waiters_recompute_when_the_claimed_computation_is_abandoned():
+    cache = EvaluationCache(max_items=10)
+    key = evaluation_key("question", [1], "ブロードキャストドメインを分割する")
+    claimed = cache.claim(key)
+
+    async def compute():
+        return {"feedback": "recomputed"}
+
+    waiter = asyncio.create_task(cache.get_or_compute(key, compute))
+    await asyncio.sleep(0)
+    # ストリーミングの評価が切断で中断した場合
+    claimed.cancel()
+
+    assert await waiter == {"feedback": "recomputed"}
+    assert cache.get(key) == {"feedback": "recomputed"}
@@ -0,0 +1,64 @@
+import json
+
+import httpx
+import pytest
+
+from smartq.fake_ollama import FakeOllamaConfig, create_app
+
+pytestmark = pytest.mark.anyio
+
+QUIZ_FORMAT = {"type": "object", "properties": {"question": {}, "options": {}, "explanation": {}}}
+
+
+def fake_client(**options):
+    config = FakeOllamaConfig(latency=0.0, tokens_per_second=0, seed=1, **options)
+    transport = httpx.ASGITransport(app=create_app(config))
+    return httpx.AsyncClient(transport=transport, base_url="http://fake-ollama")
+
+
+async def test_returns_a_quiz_matching_the_requested_format():
+    async with fake_client() as client:
+        response = await client.post("/api/generate", json={
+            "model": "gemma3:27b", "prompt": "VLAN", "format": QUIZ_FORMAT, "stream": False,
+        })
+    assert response.status_code == 200
+    body = response.json()
+    quiz = json.loads(body["response"])
+    assert [option["isCorrect"] for option in quiz["options"]].count(True) == 1
+    assert body["done"] and body["eval_count"] > 0
+
+
+async def test_streamed_chunks_form_the_same_kind_of_document():
+    async with fake_client() as client:
+        response = await client.post("/api/generate", json={
+            "model": "gemma3:27b", "prompt": "VLAN", "format": QUIZ_FORMAT,
+        })
+    chunks = [json.loads(line) for line in response.text.splitlines()]
+    assert chunks[-1]["done"] and not any(chunk["done"] for chunk in chunks[:-1])
+    quiz = json.loads("".join(chunk["response"] for chunk in chunks))
+    assert set(quiz) == {"question", "options", "explanation"}
+
+
+async def test_injected_failures_and_truncated_output():
+    async with fake_client(failure_rate=1.0) as client:
+        response = await client.post("/api/generate", json={"model": "gemma3:27b", "prompt": "VLAN"})
+        assert response.status_code == 500
+        response = await client.post("/api/generate", json={"model": "unknown", "prompt": "VLAN"})
+        assert response.status_code == 404
+
+    async with fake_client(invalid_rate=1.0) as client:
+        response = await client.post("/api/generate", json={
+            "model": "gemma3:27b", "prompt": "VLAN", "format": QUIZ_FORMAT, "stream": False,
+        })
+        with pytest.raises(json.JSONDecodeError):
+            json.loads(response.json()["response"])
+        stats = (await client.get("/fake/stats")).json()
+    assert stats["invalid_injected"] == 1
+
+
+async def test_app_generates_questions_through_the_fake_server(app_client):
+    response = await app_client.post("/api/generate", json={
+        "topic": "VLAN", "system_prompt": "ネットワークの問題を作成してください。",
+    })
+    assert response.status_code == 200
+    assert response.json()["options"]
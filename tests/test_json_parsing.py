@@ -0,0 +1,88 @@
+import json
+
+import pytest
+
+from ollama.json_repair import close_truncated_json
+from ollama.json_stream import IncrementalJSONParser
+
+QUIZ = {
+    "question": "VLAN の目的は？",
+    "options": [
+        {"text": "ブロードキャストドメインを分割する", "isCorrect": True, "type": "radio"},
+        {"text": "ルーティングを高速化する", "isCorrect": False, "type": "radio"},
+    ],
+    "explanation": "引用符 \" とバックスラッシュ \\ を含む説明",
+}
+
+
+@pytest.mark.parametrize(
+    ("truncated", "expected"),
+    [
+        ('{"question": "VLAN の目', {"question": "VLAN の目"}),
+        ('{"question": "Q", "expla', {"question": "Q"}),
+        ('{"question": "Q", "count": 12', {"question": "Q"}),
+        ('{"question": "Q", "explanation":', {"question": "Q"}),
+        ('{"options": [{"text": "A", "isCorrect": true}, {"text": "B", "isCorrect": fa',
+         {"options": [{"text": "A", "isCorrect": True}, {"text": "B"}]}),
+        ('{"question": "Q\\', {"question": "Q"}),
+        ('{"question": "Q\\u00', {"question": "Q"}),
+    ],
+)
+def test_close_truncated_json(truncated, expected):
+    assert json.loads(close_truncated_json(truncated)) == expected
+
+
+def test_close_truncated_json_keeps_complete_text():
+    text = json.dumps(QUIZ, ensure_ascii=False)
+    assert close_truncated_json(text) == text
+
+
+def test_close_truncated_json_rejects_mismatched_brackets():
+    assert close_truncated_json('{"options": [1, 2}') is None
+
+
+def test_every_prefix_of_a_document_can_be_repaired():
+    text = json.dumps(QUIZ, ensure_ascii=False)
+    for end in range(1, len(text) + 1):
+        repaired = close_truncated_json(text[:end])
+        assert repaired is not None, text[:end]
+        json.loads(repaired)
+
+
+def test_incremental_parser_reports_values_as_they_complete():
+    parser = IncrementalJSONParser()
+    events = []
+    for char in json.dumps(QUIZ, ensure_ascii=False):
+        events.extend(parser.feed(char))
+
+    assert [path for path, _ in events] == [
+        ("question",),
+        ("options", 0),
+        ("options", 1),
+        ("options",),
+        ("explanation",),
+        (),
+    ]
+    assert events[1][1] == QUIZ["options"][0]
+    assert events[4][1] == QUIZ["explanation"]
+    assert events[-1][1] == QUIZ
+    assert parser.done
+
+
+def test_incremental_parser_handles_arbitrary_chunking():
+    text = json.dumps(QUIZ, ensure_ascii=False)
+    expected = IncrementalJSONParser().feed(text)
+    for size in (2, 3, 7, 16):
+        parser = IncrementalJSONParser()
+        events = []
+        for start in range(0, len(text), size):
+            events.extend(parser.feed(text[start:start + size]))
+        assert events == expected
+        assert parser.text == text
+
+
+def test_incremental_parser_limits_reported_depth():
+    parser = IncrementalJSONParser(max_depth=1)
+    paths = [path for path, _ in parser.feed(json.dumps(QUIZ))]
+    assert ("options", 0) not in paths
+    assert ("options",) in paths
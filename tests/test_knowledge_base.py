@@ -0,0 +1,57 @@
+from smartq.knowledge_base import KnowledgeBaseCache, KnowledgeIndex, chunk_text, tokenize
+
+SENTENCES = [
+    "VLAN はスイッチのポートを論理的なグループに分ける技術です。",
+    "OSPF はリンクステート型のルーティングプロトコルです。",
+    "ACL はパケットを許可または拒否する条件の一覧です。",
+    "NAT はプライベートアドレスをグローバルアドレスに変換します。",
+    "STP はループを防ぐためにポートをブロックします。",
+    "DHCP はクライアントに IP アドレスを自動で割り当てます。",
+]
+
+
+def knowledge_index(**options):
+    # 1文を1チャンクにする
+    return KnowledgeIndex("\n".join(SENTENCES), chunk_chars=40, **options)
+
+
+def test_tokenize_uses_words_and_japanese_bigrams():
+    assert tokenize("VLAN の設定") == ["vlan", "の設", "設定"]
+    assert tokenize("VLAN 表") == ["vlan", "表"]
+    assert tokenize("ルーティング") == ["ルー", "ーテ", "ティ", "ィン", "ング"]
+
+
+def test_chunks_follow_sentence_boundaries():
+    assert chunk_text("\n".join(SENTENCES), chunk_chars=40) == SENTENCES
+
+
+def test_bm25_ranks_the_matching_chunk_first():
+    index = knowledge_index()
+    scores = index.score("OSPF ルーティング")
+    assert int(scores.argmax()) == 1
+    assert index.score("BGP").sum() == 0
+
+
+def test_repeated_queries_rotate_through_candidates():
+    index = knowledge_index()
+    first = index.select("VLAN", top_k=1)
+    second = index.select("VLAN", top_k=1)
+    assert first == SENTENCES[0]
+    assert second != first
+    # 表記揺れのあるクエリは同じクエリとして位置をずらす
+    assert index.select("  vlan ", top_k=1) not in (first, second)
+
+
+def test_rotation_state_is_bounded():
+    index = knowledge_index(max_queries=2)
+    for query in ("VLAN", "OSPF", "ACL", "NAT"):
+        index.select(query, top_k=1)
+    assert len(index._rotation) == 2
+    # 忘れたクエリは最上位の候補から選び直す
+    assert index.select("VLAN", top_k=1) == SENTENCES[0]
+
+
+def test_short_knowledge_base_is_passed_through():
+    cache = KnowledgeBaseCache(token_budget=1500)
+    assert cache.select("VLAN の説明", "VLAN") == "VLAN の説明"
+    assert cache.get_stats()["passthrough"] == 1
@@ -0,0 +1,71 @@
+import json
+import logging
+import queue
+
+from smartq.logging_config import (
+    DebugSamplingFilter,
+    DroppingQueueHandler,
+    TruncateFilter,
+    configure_logging,
+    shutdown_logging,
+    truncate_value,
+)
+
+
+def make_record(level=logging.INFO, msg="Ollama request sent", **extra):
+    record = logging.LogRecord("smartq.test", level, __file__, 1, msg, (), None)
+    for key, value in extra.items():
+        setattr(record, key, value)
+    return record
+
+
+def test_long_strings_are_truncated_recursively():
+    assert truncate_value("a" * 12, 5) == "aaaaa...(+7 chars)"
+    assert truncate_value({"prompt": ["b" * 8, 3]}, 5) == {"prompt": ["bbbbb...(+3 chars)", 3]}
+    assert truncate_value("short", 5) == "short"
+
+
+def test_truncate_filter_shortens_message_and_extra_fields():
+    record = make_record(msg="m" * 20, prompt="p" * 20, model="gemma3")
+    assert TruncateFilter(max_chars=10).filter(record)
+    assert record.msg == "mmmmmmmmmm...(+10 chars)"
+    assert record.prompt == "pppppppppp...(+10 chars)"
+    assert record.model == "gemma3"
+    # 標準の属性は変更しない
+    assert record.pathname == __file__
+
+
+def test_debug_logs_are_sampled():
+    assert not DebugSamplingFilter(rate=0.0).filter(make_record(logging.DEBUG))
+    assert DebugSamplingFilter(rate=0.0).filter(make_record(logging.INFO))
+    assert DebugSamplingFilter(rate=1.0).filter(make_record(logging.DEBUG))
+
+
+def test_full_queue_drops_records_without_blocking():
+    handler = DroppingQueueHandler(queue.Queue(maxsize=1))
+    for _ in range(3):
+        handler.handle(make_record())
+    assert (handler.queue.qsize(), handler.dropped) == (1, 2)
+
+
+def test_records_are_written_as_json_lines(tmp_path):
+    path = tmp_path / "logs" / "smartq.log"
+    names = ["smartq.test_logging"]
+    logger = logging.getLogger(names[0])
+    listener = configure_logging(names, path=str(path), level="DEBUG", max_field_chars=30, debug_sample_rate=0.0)
+    try:
+        logger.debug("Sampled out")
+        logger.info("Ollama request sent", extra={"model": "gemma3", "prompt": "p" * 40})
+        try:
+            raise ValueError("broken JSON")
+        except ValueError:
+            logger.exception("Failed to decode API response")
+    finally:
+        shutdown_logging(listener, names)
+    assert not logger.handlers
+
+    entries = [json.loads(line) for line in path.read_text(encoding="utf-8").splitlines()]
+    assert [entry["message"] for entry in entries] == ["Ollama request sent", "Failed to decode API response"]
+    assert entries[0]["level"] == "INFO"
+    assert (entries[0]["model"], entries[0]["prompt"]) == ("gemma3", "p" * 30 + "...(+10 chars)")
+    assert "ValueError: broken JSON" in entries[1]["exc_info"]
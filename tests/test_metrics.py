@@ -0,0 +1,48 @@
+from smartq.metrics import Counter, Gauge, Histogram, SmartQMetrics
+
+
+def test_counter_and_gauge_exposition():
+    counter = Counter("smartq_test_total", "Test counter.", ["kind"])
+    counter.inc(kind="quiz")
+    counter.inc(2, kind='a"b')
+    assert counter.render() == [
+        "# HELP smartq_test_total Test counter.",
+        "# TYPE smartq_test_total counter",
+        'smartq_test_total{kind="a\\"b"} 2',
+        'smartq_test_total{kind="quiz"} 1',
+    ]
+
+    gauge = Gauge("smartq_test_active", "Test gauge.")
+    gauge.set(0.5)
+    assert gauge.render()[1:] == ["# TYPE smartq_test_active gauge", "smartq_test_active 0.5"]
+
+
+def test_histogram_exposition_is_cumulative():
+    histogram = Histogram("smartq_test_seconds", "Test histogram.", [0.1, 1])
+    for value in (0.05, 0.5, 5):
+        histogram.observe(value)
+    lines = histogram.render()
+    assert 'smartq_test_seconds_bucket{le="0.1"} 1' in lines
+    assert 'smartq_test_seconds_bucket{le="1"} 2' in lines
+    assert 'smartq_test_seconds_bucket{le="+Inf"} 3' in lines
+    assert "smartq_test_seconds_count 3" in lines
+    assert "smartq_test_seconds_sum 5.55" in lines
+
+
+def test_gauges_sum_only_live_workers():
+    metrics = SmartQMetrics()
+    metrics.scheduler_active.set(1, model="m")
+    metrics.scheduler_admitted.set(10, model="m", priority="generate")
+    live = {
+        "smartq_scheduler_active_requests": [[["m"], 2]],
+        "smartq_scheduler_admitted_total": [[["m", "generate"], 20]],
+    }
+    stopped = {
+        "smartq_scheduler_active_requests": [[["m"], 4]],
+        "smartq_scheduler_admitted_total": [[["m", "generate"], 40]],
+    }
+
+    text = metrics.render([live, stopped], live_others=[live])
+    assert 'smartq_scheduler_active_requests{model="m"} 3' in text
+    # 累計値は停止したワーカーの分も含める
+    assert 'smartq_scheduler_admitted_total{model="m",priority="generate"} 70' in text
@@ -0,0 +1,89 @@
+import asyncio
+
+import httpx
+import orjson
+import pytest
+
+import app as smartq_app
+from ollama.ollama_client import OllamaClient, create_http_client
+from smartq.fake_ollama import create_app
+
+pytestmark = pytest.mark.anyio
+
+
+class KeepAliveServer:
+    """接続数を数える最小限の HTTP/1.1 サーバー（/api/generate に固定の応答を返す）"""
+
+    def __init__(self):
+        self.connections = 0
+        self.requests = 0
+
+    async def handle(self, reader, writer):
+        self.connections += 1
+        try:
+            while head := await reader.readuntil(b"\r\n\r\n"):
+                length = next(
+                    (int(line.split(b":", 1)[1]) for line in head.split(b"\r\n")
+                     if line.lower().startswith(b"content-length:")),
+                    0
+                )
+                await reader.readexactly(length)
+                self.requests += 1
+                body = orjson.dumps({"response": "ok", "done": True})
+                writer.write(
+                    b"HTTP/1.1 200 OK\r\nContent-Type: application/json\r\n"
+                    b"Content-Length: %d\r\n\r\n%s" % (len(body), body)
+                )
+                await writer.drain()
+        except asyncio.IncompleteReadError:
+            pass
+        finally:
+            writer.close()
+
+    async def __aenter__(self):
+        self._server = await asyncio.start_server(self.handle, "127.0.0.1", 0)
+        host, port = self._server.sockets[0].getsockname()[:2]
+        self.url = f"http://{host}:{port}"
+        return self
+
+    async def __aexit__(self, *exc_info):
+        self._server.close()
+
+
+async def test_shared_client_reuses_one_connection():
+    async with KeepAliveServer() as server:
+        http_client = create_http_client(max_connections=2)
+        client = OllamaClient(api_url=server.url, http_client=http_client)
+        for _ in range(5):
+            assert await client.generate_text("VLAN") == "ok"
+
+        stats = client.get_pool_stats()
+        assert (stats["shared"], stats["requests_total"], stats["in_flight"]) == (True, 5, 0)
+        assert (stats["connections"], stats["idle_connections"]) == (1, 1)
+        assert (server.connections, server.requests) == (1, 5)
+
+        await http_client.aclose()
+        assert client.get_pool_stats()["connections"] == 0
+
+
+async def test_client_without_shared_pool_connects_per_request():
+    async with KeepAliveServer() as server:
+        client = OllamaClient(api_url=server.url)
+        for _ in range(3):
+            await client.generate_text("VLAN")
+        assert client.get_pool_stats()["shared"] is False
+        assert server.connections == 3
+
+
+async def test_lifespan_closes_the_shared_client(monkeypatch, fake_ollama_config):
+    created = []
+
+    def recording_factory(**kwargs):
+        transport = httpx.ASGITransport(app=create_app(fake_ollama_config))
+        created.append(httpx.AsyncClient(transport=transport))
+        return created[-1]
+
+    monkeypatch.setattr(smartq_app, "create_http_client", recording_factory)
+    async with smartq_app.app.router.lifespan_context(smartq_app.app):
+        assert len(created) == 1 and not created[0].is_closed
+    assert created[0].is_closed
@@ -0,0 +1,94 @@
+import json
+
+import orjson
+import pytest
+from pydantic import ValidationError
+
+import app as smartq_app
+from app import GeneratedFeedback, GeneratedQuiz, parse_feedback, parse_quiz_question
+from ollama.json_schemas import build_list_schema, ollama_schema
+
+QUIZ = {
+    "question": "VLAN を使用する主な目的はどれですか？",
+    "options": [
+        {"text": "ブロードキャストドメインを分割する", "isCorrect": True},
+        {"text": "IP アドレスを自動で割り当てる", "isCorrect": False},
+        {"text": "経路を学習する", "isCorrect": False},
+    ],
+    "explanation": "VLAN はスイッチのポートを論理的なグループに分けます。",
+}
+
+
+def repaired_count(kind):
+    return smartq_app.metrics.output_recovery._values.get((kind, "repaired"), 0)
+
+
+def test_schema_is_derived_from_the_model_without_references():
+    schema = ollama_schema(GeneratedQuiz)
+    text = json.dumps(schema)
+    assert "$ref" not in text and "$defs" not in text
+    assert schema["required"] == ["question", "options", "explanation"]
+    option = schema["properties"]["options"]["items"]
+    assert option["properties"]["type"]["enum"] == ["radio", "checkbox"]
+    assert "title" not in option
+    # モデルごとにキャッシュされる
+    assert ollama_schema(GeneratedQuiz) is schema
+
+
+def test_property_named_title_is_kept():
+    resources = ollama_schema(GeneratedFeedback)["properties"]["additionalResources"]
+    item = next(choice for choice in resources["anyOf"] if choice.get("type") == "array")["items"]
+    assert set(item["properties"]) == {"title", "description"}
+
+
+def test_list_schema_fixes_the_number_of_items():
+    schema = build_list_schema({"type": "string"}, "questions", 3)
+    assert schema["properties"]["questions"]["minItems"] == schema["properties"]["questions"]["maxItems"] == 3
+    assert schema["required"] == ["questions"]
+
+
+@pytest.mark.parametrize("raw", [orjson.dumps(QUIZ), orjson.dumps(QUIZ).decode(), QUIZ])
+def test_valid_output_is_parsed_in_one_pass(raw):
+    question = parse_quiz_question(raw)
+    assert question.question == QUIZ["question"]
+    assert [option.text for option in question.options] == [option["text"] for option in QUIZ["options"]]
+    assert question.id
+
+
+def test_truncated_output_is_repaired():
+    text = orjson.dumps(QUIZ).decode()
+    # 3つ目の選択肢の途中で打ち切られた出力
+    truncated = text[: text.index("経路")]
+    before = repaired_count("quiz")
+    question = parse_quiz_question(truncated)
+    assert len(question.options) == 2
+    assert question.explanation == ""
+    assert repaired_count("quiz") == before + 1
+
+
+def test_radio_question_with_several_answers_becomes_checkbox():
+    data = dict(QUIZ, options=[dict(option, isCorrect=True) for option in QUIZ["options"]])
+    question = parse_quiz_question(orjson.dumps(data))
+    assert {option.type.value for option in question.options} == {"checkbox"}
+
+
+def test_incomplete_resources_are_dropped_from_feedback():
+    feedback = parse_feedback({
+        "isCorrect": True,
+        "feedback": "正解です。",
+        "detailedExplanation": "",
+        "additionalResources": [{"title": "", "description": "x"}, {"title": "IEEE 802.1Q", "description": "規格"}],
+    })
+    assert [resource.title for resource in feedback.additionalResources] == ["IEEE 802.1Q"]
+
+
+def test_unrepairable_output_raises_the_validation_error(monkeypatch):
+    with pytest.raises(ValidationError):
+        parse_quiz_question('{"question": "VLAN"}}')
+    with pytest.raises(ValidationError):
+        parse_quiz_question(dict(QUIZ, options=[]))
+
+    monkeypatch.setattr(smartq_app, "OUTPUT_REPAIR", False)
+    text = orjson.dumps(QUIZ).decode()
+    with pytest.raises(ValidationError):
+        parse_quiz_question(text[: text.index("経路")])
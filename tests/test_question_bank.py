@@ -0,0 +1,80 @@
+import orjson
+import pytest
+from pydantic import BaseModel
+
+from smartq.question_bank import QuestionBank
+
+
+class Question(BaseModel):
+    id: str
+    question: str
+
+
+def write_bank(path, rows, partial=b""):
+    with open(path, "wb") as f:
+        for topic, question_id in rows:
+            f.write(orjson.dumps({"topic": topic, "id": question_id, "question": f"{topic} {question_id}"}) + b"\n")
+        f.write(partial)
+
+
+@pytest.fixture
+def bank_path(tmp_path):
+    path = tmp_path / "bank.jsonl"
+    write_bank(path, [("VLAN", "v1"), ("ACL", "a1"), ("VLAN", "v2"), ("Routing and Switching", "r1")])
+    return str(path)
+
+
+def test_index_records_line_offsets_per_topic(bank_path):
+    bank = QuestionBank(Question, bank_path)
+    try:
+        assert bank.get_stats()["index"] == "built"
+        assert bank.size == 4
+        assert bank.has_topic("vlan") and bank.has_topic(" routing  and switching ")
+        assert not bank.has_topic("OSPF")
+        assert {bank.sample("VLAN").id for _ in range(50)} == {"v1", "v2"}
+        assert bank.sample("ACL").question == "ACL a1"
+        assert bank.sample("OSPF") is None
+    finally:
+        bank.close()
+
+
+def test_saved_index_is_reused_until_the_file_changes(bank_path):
+    QuestionBank(Question, bank_path).close()
+    bank = QuestionBank(Question, bank_path)
+    assert bank.get_stats()["index"] == "loaded"
+    assert bank.size == 4
+    bank.close()
+
+    write_bank(bank_path, [("VLAN", "v1")])
+    bank = QuestionBank(Question, bank_path)
+    assert bank.get_stats()["index"] == "built"
+    assert bank.size == 1
+    bank.close()
+
+
+def test_partial_last_line_is_not_indexed(tmp_path):
+    path = tmp_path / "bank.jsonl"
+    write_bank(path, [("VLAN", "v1")], partial=b'{"topic": "VLAN", "id": "v2", "quest')
+    bank = QuestionBank(Question, str(path))
+    try:
+        assert bank.size == 1
+        assert bank.sample("VLAN").id == "v1"
+    finally:
+        bank.close()
+
+
+def test_sample_avoids_excluded_questions(bank_path):
+    bank = QuestionBank(Question, bank_path)
+    try:
+        assert all(bank.sample("VLAN", exclude={"v1"}, attempts=64).id == "v2" for _ in range(20))
+        # すべて除外されている場合は出題済みの問題を返す
+        assert bank.sample("VLAN", exclude={"v1", "v2"}) is not None
+        assert bank.get_stats()["repeats"] == 1
+    finally:
+        bank.close()
+
+
+def test_bank_without_path_is_disabled():
+    bank = QuestionBank(Question)
+    assert not bank.enabled
+    assert bank.sample("VLAN") is None
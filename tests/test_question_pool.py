@@ -0,0 +1,87 @@
+import asyncio
+import itertools
+from types import SimpleNamespace
+
+import pytest
+from pydantic import BaseModel
+
+from smartq.question_pool import QuestionPool
+
+pytestmark = pytest.mark.anyio
+
+
+class Question(BaseModel):
+    id: str
+
+
+def spec(topic="VLAN", system_prompt="", knowledge_base=None):
+    return SimpleNamespace(topic=topic, system_prompt=system_prompt, knowledge_base=knowledge_base)
+
+
+def counting_generate():
+    serial = itertools.count(1)
+
+    async def generate(request):
+        return Question(id=f"{request.topic}-{next(serial)}")
+
+    return generate
+
+
+async def refilled(pool):
+    while pool.get_stats()["refilling"]:
+        await asyncio.sleep(0)
+
+
+async def test_first_take_misses_and_refills_to_the_target():
+    pool = QuestionPool(counting_generate(), target_size=3, low_watermark=1)
+    try:
+        assert pool.take(spec()) is None
+        await refilled(pool)
+        assert pool.get_stats()["questions"] == 3
+
+        assert [pool.take(spec()).id for _ in range(2)] == ["VLAN-1", "VLAN-2"]
+        # 低水位に達したため、目標数まで補充される
+        await refilled(pool)
+        stats = pool.get_stats()
+        assert (stats["hits"], stats["misses"], stats["refilled"], stats["questions"]) == (2, 1, 5, 3)
+    finally:
+        await pool.close()
+
+
+async def test_profiles_are_kept_separately_and_evicted_oldest_first():
+    pool = QuestionPool(counting_generate(), target_size=1, max_profiles=2)
+    try:
+        for topic in ("VLAN", "ACL"):
+            pool.take(spec(topic))
+            await refilled(pool)
+        assert pool.take(spec("ACL")).id.startswith("ACL")
+
+        pool.take(spec("OSPF"))
+        stats = pool.get_stats()
+        assert (stats["profiles"], stats["evictions"]) == (2, 1)
+        assert pool.take(spec("VLAN")) is None
+    finally:
+        await pool.close()
+
+
+async def test_refill_stops_after_consecutive_failures():
+    calls = []
+
+    async def failing(request):
+        calls.append(request.topic)
+        raise RuntimeError("Ollama is down")
+
+    pool = QuestionPool(failing, target_size=2, retry_delay=0, max_consecutive_failures=2)
+    try:
+        assert pool.take(spec()) is None
+        await refilled(pool)
+        assert len(calls) == 2
+        assert pool.get_stats()["refill_failures"] == 2
+    finally:
+        await pool.close()
+
+
+async def test_disabled_pool_never_generates():
+    pool = QuestionPool(counting_generate(), target_size=0)
+    assert pool.take(spec()) is None
+    assert pool.get_stats()["refilled"] == 0
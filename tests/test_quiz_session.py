@@ -0,0 +1,64 @@
+import asyncio
+
+import pytest
+
+from smartq.quiz_session import QuizSession, QuizSessionStats
+
+pytestmark = pytest.mark.anyio
+
+
+class Request:
+    def __init__(self, topic):
+        self.topic = topic
+        self.system_prompt = "prompt"
+        self.knowledge_base = None
+
+
+def make_session(prefetch, discarded):
+    return QuizSession(
+        websocket=None,
+        parse_generate=lambda payload: Request(payload["topic"]),
+        serve=None,
+        prefetch=prefetch,
+        record=None,
+        evaluate=None,
+        error_payload=None,
+        stats=QuizSessionStats(),
+        discard=lambda request, question: discarded.append((request.topic, question)),
+    )
+
+
+async def test_generated_but_unused_speculation_is_discarded():
+    discarded = []
+
+    async def prefetch(request):
+        return f"next {request.topic}"
+
+    session = make_session(prefetch, discarded)
+    session._start_speculation(("VLAN",), Request("VLAN"))
+    await asyncio.sleep(0)
+    # 別のトピックが要求されたため、生成済みの問題は出題しない
+    assert await session._take_speculation(("ACL",)) is None
+
+    assert discarded == [("VLAN", "next VLAN")]
+    assert session.stats.speculative["discarded"] == 1
+
+
+async def test_cancelled_or_used_speculation_is_not_discarded():
+    discarded = []
+    release = asyncio.Event()
+
+    async def prefetch(request):
+        await release.wait()
+        return f"next {request.topic}"
+
+    session = make_session(prefetch, discarded)
+    session._start_speculation(("VLAN",), Request("VLAN"))
+    session._discard_speculation()
+
+    session._start_speculation(("VLAN",), Request("VLAN"))
+    release.set()
+    assert await session._take_speculation(("VLAN",)) == "next VLAN"
+
+    assert discarded == []
+    assert session.stats.speculative == {"ready": 0, "pending": 1, "failed": 0, "discarded": 1}
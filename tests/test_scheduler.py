@@ -0,0 +1,140 @@
+import asyncio
+import time
+
+import pytest
+
+from ollama.scheduler import ConcurrencyLimit, OllamaOverloadedError, OllamaScheduler, Priority
+
+pytestmark = pytest.mark.anyio
+
+
+class DummyClient:
+    model_name = "test-model"
+
+
+async def hold_slot(scheduler, priority, started, release, order, name):
+    async with scheduler.slot(priority):
+        order.append(name)
+        started.set()
+        await release.wait()
+
+
+async def wait_for_queue(scheduler, depth):
+    while scheduler.get_stats()["queue_depth"] < depth:
+        await asyncio.sleep(0)
+
+
+async def test_waiters_are_admitted_in_priority_order():
+    scheduler = OllamaScheduler(DummyClient(), max_concurrency=1, max_queue=8)
+    order = []
+    release = asyncio.Event()
+    first = asyncio.Event()
+    holder = asyncio.create_task(hold_slot(scheduler, Priority.GENERATE, first, release, order, "holder"))
+    await first.wait()
+
+    async def run(priority, name):
+        async with scheduler.slot(priority):
+            order.append(name)
+
+    waiters = [
+        asyncio.create_task(run(Priority.BACKGROUND, "background")),
+        asyncio.create_task(run(Priority.GENERATE, "generate")),
+        asyncio.create_task(run(Priority.EVALUATE, "evaluate")),
+    ]
+    await wait_for_queue(scheduler, 3)
+    release.set()
+    await asyncio.gather(holder, *waiters)
+
+    assert order == ["holder", "evaluate", "generate", "background"]
+    stats = scheduler.get_stats()
+    assert stats["active"] == 0
+    assert stats["admitted"] == {"evaluate": 1, "generate": 2, "background": 1}
+
+
+async def test_full_queue_displaces_lower_priority_waiter():
+    scheduler = OllamaScheduler(DummyClient(), max_concurrency=1, max_queue=1)
+    order = []
+    release = asyncio.Event()
+    first = asyncio.Event()
+    holder = asyncio.create_task(hold_slot(scheduler, Priority.GENERATE, first, release, order, "holder"))
+    await first.wait()
+
+    async def run(priority, name):
+        async with scheduler.slot(priority):
+            order.append(name)
+
+    background = asyncio.create_task(run(Priority.BACKGROUND, "background"))
+    await wait_for_queue(scheduler, 1)
+    evaluate = asyncio.create_task(run(Priority.EVALUATE, "evaluate"))
+    with pytest.raises(OllamaOverloadedError):
+        await background
+    release.set()
+    await asyncio.gather(holder, evaluate)
+
+    assert order == ["holder", "evaluate"]
+    assert scheduler.get_stats()["rejected"]["background"] == 1
+
+
+async def test_full_queue_rejects_with_retry_after():
+    scheduler = OllamaScheduler(DummyClient(), max_concurrency=1, max_queue=1)
+    order = []
+    release = asyncio.Event()
+    first = asyncio.Event()
+    holder = asyncio.create_task(hold_slot(scheduler, Priority.GENERATE, first, release, order, "holder"))
+    await first.wait()
+    queued = asyncio.create_task(hold_slot(scheduler, Priority.GENERATE, asyncio.Event(), release, order, "queued"))
+    await wait_for_queue(scheduler, 1)
+
+    with pytest.raises(OllamaOverloadedError) as excinfo:
+        async with scheduler.slot(Priority.GENERATE):
+            pass
+    assert isinstance(excinfo.value.retry_after, int)
+    assert excinfo.value.retry_after >= 1
+
+    release.set()
+    await asyncio.gather(holder, queued)
+    assert scheduler.get_stats()["rejected"]["generate"] == 1
+
+
+async def test_deadline_shorter_than_max_wait_rejects():
+    scheduler = OllamaScheduler(DummyClient(), max_concurrency=1, max_queue=4, max_wait=60)
+    release = asyncio.Event()
+    first = asyncio.Event()
+    holder = asyncio.create_task(hold_slot(scheduler, Priority.GENERATE, first, release, [], "holder"))
+    await first.wait()
+
+    deadline = time.monotonic() + 0.05
+    with pytest.raises(OllamaOverloadedError):
+        async with scheduler.slot(Priority.GENERATE, deadline=deadline):
+            pass
+    release.set()
+    await holder
+
+
+async def test_shared_limit_caps_concurrency_across_schedulers():
+    limit = ConcurrencyLimit(2)
+    schedulers = [OllamaScheduler(DummyClient(), limit=limit) for _ in range(2)]
+    peak = 0
+    order = []
+
+    async def run(scheduler, priority, name):
+        nonlocal peak
+        async with scheduler.slot(priority):
+            peak = max(peak, limit.active)
+            order.append(name)
+            await asyncio.sleep(0.01)
+
+    tasks = [
+        asyncio.create_task(run(schedulers[0], Priority.GENERATE, "a1")),
+        asyncio.create_task(run(schedulers[1], Priority.GENERATE, "b1")),
+    ]
+    await asyncio.sleep(0)
+    tasks += [
+        asyncio.create_task(run(schedulers[0], Priority.BACKGROUND, "a-background")),
+        asyncio.create_task(run(schedulers[1], Priority.EVALUATE, "b-evaluate")),
+    ]
+    await asyncio.gather(*tasks)
+
+    assert peak == 2
+    assert order == ["a1", "b1", "b-evaluate", "a-background"]
+    assert limit.active == 0
@@ -0,0 +1,56 @@
+import re
+
+import pytest
+
+from smartq.static_assets import parse_accept_encoding, select_encoding
+
+pytestmark = pytest.mark.anyio
+
+BOTH = {"identity", "gzip", "br"}
+
+
+def choose(header, available=BOTH):
+    return select_encoding(parse_accept_encoding(header), available)
+
+
+def test_encoding_is_chosen_by_q_value():
+    assert choose("gzip;q=1, br;q=0.5") == "gzip"
+    assert choose("gzip;q=0.5, br") == "br"
+    # q 値が同じ場合は ENCODINGS の順
+    assert choose("gzip, br") == "br"
+    assert choose("gzip, br", {"identity", "gzip"}) == "gzip"
+
+
+def test_wildcard_and_identity_preferences():
+    assert choose("") == "identity"
+    assert choose("br;q=0, *") == "gzip"
+    assert choose("gzip;q=0.5, identity") == "identity"
+    assert choose("gzip;q=0") == "identity"
+
+
+async def test_index_page_links_fingerprinted_assets(app_client):
+    response = await app_client.get("/")
+    assert response.status_code == 200
+    url = re.search(r'src="(/static/script\.[0-9a-f]+\.js)"', response.text).group(1)
+
+    script = await app_client.get(url, headers={"Accept-Encoding": "gzip"})
+    assert script.status_code == 200
+    assert script.headers["content-encoding"] == "gzip"
+    assert script.headers["cache-control"].endswith("immutable")
+
+
+async def test_matching_etag_is_not_modified(app_client):
+    first = await app_client.get("/static/script.js", headers={"Accept-Encoding": "identity"})
+    etag = first.headers["etag"]
+    second = await app_client.get(
+        "/static/script.js", headers={"Accept-Encoding": "identity", "If-None-Match": etag}
+    )
+    assert second.status_code == 304
+    assert second.content == b""
+
+    # エンコーディングが異なれば ETag も異なる
+    gzipped = await app_client.get(
+        "/static/script.js", headers={"Accept-Encoding": "gzip", "If-None-Match": etag}
+    )
+    assert gzipped.status_code == 200
+    assert gzipped.headers["etag"] != etag
@@ -0,0 +1,89 @@
+import asyncio
+
+import httpx
+import orjson
+import pytest
+
+import app as smartq_app
+from ollama.backend_pool import OllamaBackendPool
+from ollama.ollama_client import OllamaClient, parse_keep_alive
+from smartq.fake_ollama import FakeOllamaConfig, create_app
+
+pytestmark = pytest.mark.anyio
+
+
+def recording_client(bodies):
+    """送信した /api/generate の本文を記録し、固定の応答を返すHTTPクライアント"""
+
+    def handler(request):
+        bodies.append(orjson.loads(request.content))
+        return httpx.Response(200, json={"response": "{}", "done": True, "load_duration": 0})
+
+    return httpx.AsyncClient(transport=httpx.MockTransport(handler))
+
+
+def test_keep_alive_setting_is_parsed():
+    assert parse_keep_alive("") is None
+    assert parse_keep_alive(" 30m ") == "30m"
+    assert parse_keep_alive("600") == 600
+    assert parse_keep_alive("-1") == -1
+
+
+async def test_keep_alive_is_sent_with_every_request():
+    bodies = []
+    async with recording_client(bodies) as http_client:
+        client = OllamaClient(http_client=http_client, keep_alive="30m")
+        await client.generate_text("VLAN")
+        await client.load_model()
+        await OllamaClient(http_client=http_client).generate_text("VLAN")
+
+    assert [body.get("keep_alive") for body in bodies] == ["30m", "30m", None]
+    # ウォームアップは空のプロンプトで読み込みだけを行う
+    assert bodies[1]["prompt"] == ""
+
+
+async def test_warm_up_loads_the_model_once_at_start():
+    fake = create_app(FakeOllamaConfig(load_seconds=0.05, seed=1))
+    async with httpx.AsyncClient(transport=httpx.ASGITransport(app=fake)) as http_client:
+        pool = OllamaBackendPool(["http://fake"], http_client=http_client, health_interval=0)
+        await pool.start(warm_up=True)
+        try:
+            await asyncio.gather(*pool._warm_tasks)
+            backend = pool.get_pool_stats()["backends"][0]
+            assert backend["warm_ups"] == 1
+            assert backend["last_load_seconds"] >= 0.05
+
+            # 最近使われたバックエンドは読み込み直さない
+            await pool.warm_up(idle_for=60)
+            assert pool.get_pool_stats()["backends"][0]["warm_ups"] == 1
+        finally:
+            await pool.close()
+
+
+def test_quiz_prompts_share_the_static_prefix():
+    prompts = [
+        smartq_app.build_quiz_prompt(
+            smartq_app.GenerateQuizRequest(topic=topic, system_prompt="ネットワークの問題"), None
+        )
+        for topic in ("VLAN", "OSPF")
+    ]
+    prefix = smartq_app.QUIZ_PROMPT_PREFIX + smartq_app.QUIZ_PROMPT_FORMAT
+    assert all(prompt.startswith(prefix) for prompt in prompts)
+    # リクエストごとの値はプロンプトの末尾に置く
+    assert prompts[0].rstrip().endswith("VLAN")
+
+
+async def test_metrics_expose_ollama_response_stats(app_client):
+    response = await app_client.post(
+        "/api/generate", json={"topic": "VLAN", "system_prompt": "ネットワークの問題を作成してください。"}
+    )
+    assert response.status_code == 200
+
+    response = await app_client.get("/metrics")
+    assert response.status_code == 200
+    assert response.headers["content-type"].startswith("text/plain; version=0.0.4")
+    model = smartq_app.OLLAMA_GENERATE_MODEL
+    for name in ("prompt_tokens", "completion_tokens", "load_seconds", "total_seconds"):
+        assert f"# TYPE smartq_ollama_{name} histogram" in response.text
+        assert f'smartq_ollama_{name}_count{{model="{model}"}}' in response.text
+    assert 'smartq_http_request_duration_seconds_count{method="POST",endpoint="/api/generate",status="200"}' in response.text
@@ -0,0 +1,63 @@
+import logging
+import time
+
+import pytest
+
+import app as smartq_app
+from smartq import shared_state
+from smartq.shared_state import SharedState, SQLiteSharedState, WorkerSync
+
+
+def test_limits_are_split_across_workers(monkeypatch):
+    monkeypatch.setattr(smartq_app, "APP_WORKERS", 4)
+    assert smartq_app.per_worker(16) == 4
+    assert smartq_app.per_worker(0) == 0
+    # ワーカー数より小さい上限も各ワーカーに1を割り当てる
+    assert smartq_app.per_worker(2) == 1
+
+
+def test_oversubscribed_limits_are_reported(monkeypatch, caplog):
+    monkeypatch.setattr(smartq_app, "APP_WORKERS", 4)
+    monkeypatch.setattr(smartq_app, "OLLAMA_MAX_CONCURRENCY", 2)
+    monkeypatch.setattr(smartq_app, "OLLAMA_MAX_QUEUE", 16)
+    monkeypatch.setattr(smartq_app, "QUESTION_POOL_SIZE", 0)
+    smartq_app.logger.addHandler(caplog.handler)
+    try:
+        smartq_app.warn_oversubscribed_limits()
+    finally:
+        smartq_app.logger.removeHandler(caplog.handler)
+
+    # ログの設定によってはルートロガーにも伝播するため、同じ記録が2回届くことがある
+    warnings = {
+        (record.setting, record.total) for record in caplog.records if record.levelno == logging.WARNING
+    }
+    assert warnings == {("OLLAMA_MAX_CONCURRENCY", 4)}
+
+
+def test_shared_state_requires_every_operation():
+    class Incomplete(SharedState):
+        async def get(self, namespace, key):
+            return None
+
+    with pytest.raises(TypeError):
+        Incomplete()
+
+
+@pytest.mark.anyio
+async def test_stopped_workers_are_not_live(tmp_path, monkeypatch):
+    path = str(tmp_path / "shared.db")
+    stopped = WorkerSync(SQLiteSharedState(path), "stopped", lambda: {"metrics": {}}, interval=1.0)
+    current = WorkerSync(SQLiteSharedState(path), "current", lambda: {"metrics": {}}, interval=1.0)
+    try:
+        await stopped.sync()
+        await current.sync()
+        assert set(current.others(live_only=True)) == {"stopped"}
+
+        # 同期間隔の3倍を過ぎても更新のないワーカーは稼働中とみなさない
+        now = time.time()
+        monkeypatch.setattr(shared_state.time, "time", lambda: now + 10)
+        assert current.others(live_only=True) == {}
+        assert set(current.others()) == {"stopped"}
+    finally:
+        stopped.shared.close()
+        current.shared.close()